@@ -0,0 +1,46 @@
+"""Benchmark of filter_valid_files with a large split file.
+
+Usage: python benchmark_filter_valid_files.py [num_files]
+"""
+
+import random
+import sys
+import time
+
+from terratorch.datasets.utils import filter_valid_files
+
+
+def naive_filter(files, valid_files):
+    """Loop over the split entries for every file, as filter_valid_files used to do."""
+
+    def matches(file_name):
+        base_name = file_name.rsplit("/", 1)[-1]
+        return any(valid_file in base_name for valid_file in valid_files)
+
+    return sorted(filter(matches, files))
+
+
+def main(num_files: int = 100_000):
+    random.seed(0)
+    files = [f"/data/images/tile_{i:07d}_2023_merged.tif" for i in range(num_files)]
+    valid_files = [f"tile_{i:07d}" for i in random.sample(range(num_files), num_files // 2)]
+
+    start = time.perf_counter()
+    filtered = filter_valid_files(files, valid_files=valid_files, ignore_extensions=True)
+    print(f"filter_valid_files, substring ({num_files} files): {time.perf_counter() - start:.2f}s")
+
+    start = time.perf_counter()
+    filter_valid_files(files, valid_files=[f.rsplit("/", 1)[-1] for f in files], allow_substring=False)
+    print(f"filter_valid_files, exact ({num_files} files): {time.perf_counter() - start:.2f}s")
+
+    # The naive loop is quadratic, only run it on a subset
+    subset = min(num_files, 5_000)
+    start = time.perf_counter()
+    expected = naive_filter(files[:subset], valid_files)
+    elapsed = time.perf_counter() - start
+    print(f"naive loop, substring ({subset} files): {elapsed:.2f}s, ~{elapsed * num_files / subset:.0f}s extrapolated")
+    assert expected == [f for f in filtered if f in set(files[:subset])]
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
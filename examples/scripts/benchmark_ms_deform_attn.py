@@ -0,0 +1,63 @@
+"""CPU benchmark of the PyTorch multi-scale deformable attention used by the ViT-Adapter without the CUDA extension.
+
+Usage: python benchmark_ms_deform_attn.py [image_size]
+"""
+
+import sys
+import time
+
+import torch
+import torch.nn.functional as F  # noqa: N812
+
+from terratorch.models.backbones.detr_ops.functions import ms_deform_attn_core_pytorch
+
+
+def stacked_ms_deform_attn(value, value_spatial_shapes, sampling_locations, attention_weights):
+    """Reference implementation of Deformable DETR, stacking the samples of all levels before the reduction."""
+    N_, S_, M_, D_ = value.shape  # noqa: N806
+    _, Lq_, M_, L_, P_, _ = sampling_locations.shape  # noqa: N806
+    value_list = value.split([H_ * W_ for H_, W_ in value_spatial_shapes], dim=1)
+    sampling_grids = 2 * sampling_locations - 1
+    sampling_value_list = []
+    for lid_, (H_, W_) in enumerate(value_spatial_shapes):  # noqa: N806
+        value_l_ = value_list[lid_].flatten(2).transpose(1, 2).reshape(N_ * M_, D_, H_, W_)
+        sampling_grid_l_ = sampling_grids[:, :, :, lid_].transpose(1, 2).flatten(0, 1)
+        sampling_value_list.append(
+            F.grid_sample(value_l_, sampling_grid_l_, mode="bilinear", padding_mode="zeros", align_corners=False)
+        )
+    attention_weights = attention_weights.transpose(1, 2).reshape(N_ * M_, 1, Lq_, L_ * P_)
+    output = (torch.stack(sampling_value_list, dim=-2).flatten(-2) * attention_weights).sum(-1).view(N_, M_ * D_, Lq_)
+    return output.transpose(1, 2).contiguous()
+
+
+def timeit(func, *args, repeats=10):
+    func(*args)
+    start = time.perf_counter()
+    for _ in range(repeats):
+        func(*args)
+    return (time.perf_counter() - start) / repeats
+
+
+def main(image_size: int = 224):
+    # Shapes of the injector/extractor of a ViT-Adapter on a ViT-B (embed_dim 768, 6 heads, 4 points)
+    torch.manual_seed(0)
+    batch_size, num_heads, head_dim, num_points = 2, 6, 128, 4
+    spatial_shapes = [(image_size // 4, image_size // 4), (image_size // 8, image_size // 8),
+                      (image_size // 16, image_size // 16)]
+    num_values = sum(h * w for h, w in spatial_shapes)
+    value = torch.randn(batch_size, num_values, num_heads, head_dim)
+    sampling_locations = torch.rand(batch_size, num_values, num_heads, len(spatial_shapes), num_points, 2)
+    attention_weights = torch.rand(batch_size, num_values, num_heads, len(spatial_shapes), num_points).softmax(-1)
+
+    expected = stacked_ms_deform_attn(value, spatial_shapes, sampling_locations, attention_weights)
+    output = ms_deform_attn_core_pytorch(value, spatial_shapes, sampling_locations, attention_weights)
+    assert torch.allclose(output, expected, atol=1e-4)
+
+    with torch.no_grad():
+        args = (value, spatial_shapes, sampling_locations, attention_weights)
+        print(f"stacked levels ({image_size}px): {timeit(stacked_ms_deform_attn, *args) * 1000:.1f}ms")
+        print(f"ms_deform_attn_core_pytorch ({image_size}px): {timeit(ms_deform_attn_core_pytorch, *args) * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 224)
@@ -3,8 +3,10 @@
 """Command-line interface to TerraTorch."""
 
 from terratorch.cli_tools import build_lightning_cli
+from terratorch.datasets.chip_cache import cache_main
+from terratorch.datasets.shard_dataset import shards_main
+from terratorch.models.weights_cache import cached_hf_hub_download, weights_main
 import sys
-from huggingface_hub import hf_hub_download
 import logging
 
 try:
@@ -18,7 +20,7 @@ except ImportError:
 
 def main():
     if len(sys.argv) == 1:
-        print('usage: terratorch [-h] [-c CONFIG] [--print_config[=flags]] {fit,validate,test,predict,compute_statistics,init,iterate} ...')
+        print('usage: terratorch [-h] [-c CONFIG] [--print_config[=flags]] {fit,validate,test,predict,compute_statistics,init,iterate,weights,cache,shards} ...')
         exit(0)
     if len(sys.argv) >= 2 and sys.argv[1] == "iterate":
         # if user runs "terratorch iterate" and terratorch-iterate has not been installed
@@ -100,11 +102,17 @@ def main():
         ]
 
         for config in files_to_download:
-            file_path = hf_hub_download(
+            file_path = cached_hf_hub_download(
                 repo_id=config['repo_id'],
                 filename=config.get('filename', '') or 'config.yaml',
             )
             logger.info(f"File downloaded to: {file_path}")
+    elif sys.argv[1] == "weights":
+        weights_main(sys.argv[2:])
+    elif sys.argv[1] == "cache":
+        cache_main(sys.argv[2:])
+    elif sys.argv[1] == "shards":
+        shards_main(sys.argv[2:])
     else:
         _ = build_lightning_cli()
 
@@ -9,7 +9,10 @@ import shutil
 import sys
 import glob
 import tempfile
+import threading
 import warnings
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
 from copy import deepcopy
 from datetime import timedelta
 from pathlib import Path
@@ -40,7 +43,7 @@ from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 import terratorch.datamodules
-from terratorch.utils import compute_mask_statistics, compute_statistics
+from terratorch.utils import accumulate_statistics, image_statistics, mask_statistics
 import terratorch.tasks  # noqa: F401
 from terratorch.datamodules import (  # noqa: F401
     GenericNonGeoClassificationDataModule,
@@ -134,12 +137,74 @@ def add_default_checkpointing_config(config):
 
     return config 
 
+class _InputMetadataCache:
+    """LRU cache of the metadata and nodata masks of the input files, so that each input is only read once, even when
+    several outputs (e.g. predictions and probabilities) are saved for it. Bounded by the size of the masks in bytes,
+    since their size depends on the inputs. Shared by the writer threads of `CustomWriter`.
+
+    Args:
+        max_bytes (int): Maximum size of the cached masks in bytes.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries: OrderedDict[str, tuple[dict, np.ndarray]] = OrderedDict()
+        self._file_locks: dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _get(self, input_file_name):
+        with self._lock:
+            if input_file_name in self._entries:
+                self._entries.move_to_end(input_file_name)
+                return self._entries[input_file_name]
+            return None
+
+    def __call__(self, input_file_name):
+        entry = self._get(input_file_name)
+        if entry is not None:
+            return entry
+        with self._lock:
+            file_lock = self._file_locks.setdefault(input_file_name, threading.Lock())
+
+        # Outputs of the same input written by other threads wait for the first read
+        with file_lock:
+            entry = self._get(input_file_name)
+            if entry is not None:
+                return entry
+            try:
+                data, metadata = open_tiff(input_file_name)
+                mask = np.max(data == metadata["nodata"], axis=0)
+                with self._lock:
+                    self._entries[input_file_name] = (metadata, mask)
+                    self.nbytes += mask.nbytes
+                    while self.nbytes > self.max_bytes and len(self._entries) > 1:
+                        _, (_, evicted) = self._entries.popitem(last=False)
+                        self.nbytes -= evicted.nbytes
+            finally:
+                with self._lock:
+                    self._file_locks.pop(input_file_name, None)
+        return metadata, mask
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def cache_clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+_input_metadata = _InputMetadataCache(max_bytes=256 * 2**20)
+
+
 def save_prediction(prediction, input_file_name, out_dir, dtype:str="int16",
                     suffix="pred"):
-    mask, metadata = open_tiff(input_file_name)
-    mask = np.where(mask == metadata["nodata"], 1, 0)
-    mask = np.max(mask, axis=0)
-    result = np.where(mask == 1, -1, prediction.detach().cpu())
+    metadata, mask = _input_metadata(input_file_name)
+    metadata = metadata.copy()
+    if isinstance(prediction, torch.Tensor):
+        prediction = prediction.detach().cpu()
+    result = np.where(mask, -1, prediction)
 
     ##### Save file to disk
     metadata["count"] = 1
@@ -153,6 +218,95 @@ def save_prediction(prediction, input_file_name, out_dir, dtype:str="int16",
     write_tiff(result, os.path.join(out_dir, out_file_name), metadata)
 
 
+def predict_to_files(
+    model: LightningModule,
+    datamodule: LightningDataModule,
+    output_dir: str | Path,
+    dtype: str = "int16",
+    device: torch.device | str = "cpu",
+) -> list[str]:
+    """Out-of-core prediction of the predict files of a generic pixel-wise datamodule.
+
+    Each input file is read and predicted window by window with `tiled_inference_to_file`, using the
+    `tiled_inference_parameters` of the task, so that scenes larger than the memory can be predicted. The band
+    selection, scaling and nan replacement of the predict dataset and the normalization of the datamodule are applied
+    to the windows. Like `CustomWriter`, the prediction of `<name>.tif` is written to `<name>_pred.tif` and pixels
+    where the input is nodata are set to -1.
+
+    Args:
+        model (LightningModule): A `SemanticSegmentationTask` (whose class predictions are written) or a
+            `PixelwiseRegressionTask`.
+        datamodule (LightningDataModule): Datamodule whose predict dataset exposes its `image_files`.
+        output_dir (str | Path): Directory where the predictions are written.
+        dtype (str): Data type of the output files. Defaults to "int16".
+        device (torch.device | str): Device to run the inference on. Defaults to "cpu".
+
+    Returns:
+        list[str]: The paths of the output files.
+    """
+    from terratorch.tasks.tiled_inference import tiled_inference_to_file
+
+    inference_parameters = getattr(model, "tiled_inference_parameters", None)
+    if inference_parameters is None:
+        msg = "Out-of-core prediction requires the `tiled_inference_parameters` of the task."
+        raise ValueError(msg)
+    if isinstance(model, SemanticSegmentationTask):
+        out_channels = model.hparams["model_args"]["num_classes"]
+        postprocess = lambda y: y.argmax(dim=1, keepdim=True)  # noqa: E731
+    elif isinstance(model, PixelwiseRegressionTask):
+        out_channels = 1
+        postprocess = None
+    else:
+        msg = f"Out-of-core prediction is not supported for {type(model).__name__}."
+        raise ValueError(msg)
+
+    datamodule.setup("predict")
+    dataset = datamodule.predict_dataset
+    if not isinstance(getattr(dataset, "image_files", None), list) or getattr(dataset, "expand_temporal_dimension", False):
+        msg = f"Out-of-core prediction is not supported for {type(dataset).__name__}."
+        raise ValueError(msg)
+    filter_indices = getattr(dataset, "filter_indices", None)
+    bands = [i + 1 for i in filter_indices] if filter_indices else None
+    constant_scale = getattr(dataset, "constant_scale", 1)
+    no_data_replace = getattr(dataset, "no_data_replace", None)
+    aug = getattr(datamodule, "predict_aug", None) or getattr(datamodule, "aug", None)
+
+    def preprocess(x: torch.Tensor) -> torch.Tensor:
+        if no_data_replace is not None:
+            x = torch.nan_to_num(x, nan=no_data_replace)
+        if constant_scale != 1:
+            x = x * constant_scale
+        return aug({"image": x})["image"] if aug is not None else x
+
+    def model_forward(x, **kwargs):
+        return model(x, **kwargs).output
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = model.to(device).eval()
+    output_files = []
+    for input_file in dataset.image_files:
+        file_name_no_ext = os.path.splitext(os.path.basename(input_file))[0]
+        output_file = os.path.join(output_dir, f"{file_name_no_ext}_pred.tif")
+        logger.info(f"Saving output to {output_file} ...")
+        output_files.append(
+            tiled_inference_to_file(
+                model_forward,
+                input_file,
+                output_file,
+                out_channels,
+                inference_parameters,
+                preprocess=preprocess,
+                postprocess=postprocess,
+                bands=bands,
+                device=device,
+                dtype=dtype,
+                nodata=-1,
+                compress="lzw",
+            )
+        )
+    return output_files
+
+
 def import_custom_modules(custom_modules_path: str | Path | None = None) -> None:
 
     if custom_modules_path:
@@ -178,18 +332,36 @@ def import_custom_modules(custom_modules_path: str | Path | None = None) -> None
         logger.debug("No custom module is being used.")
 
 class CustomWriter(BasePredictionWriter):
-    """Callback class to write geospatial data to file."""
+    """Callback class to write geospatial data to file.
+
+    Args:
+        output_dir (str | None): Directory where the predictions are written. Defaults to None, which uses the
+            `predict_output_dir` attribute of the trainer.
+        write_interval (str): When to write, "batch" or "epoch". Defaults to "epoch".
+        num_workers (int): Number of threads writing files in the background, so that prediction does not wait for
+            the disk. Defaults to 0, which writes synchronously.
+        max_pending (int | None): Maximum number of files waiting to be written. Once reached, prediction blocks until
+            a file is written. Defaults to None, which uses 4 * num_workers.
+    """
 
-    def __init__(self, output_dir: str | None = None, write_interval: str = "epoch"):
+    def __init__(
+        self,
+        output_dir: str | None = None,
+        write_interval: str = "epoch",
+        num_workers: int = 0,
+        max_pending: int | None = None,
+    ):
 
         super().__init__(write_interval)
 
         self.output_dir = output_dir
+        self.num_workers = num_workers
+        self.max_pending = max_pending or 4 * num_workers
+        self._executor = None
+        self._pending = None
+        self._futures: list[Future] = []
 
-    def write_on_batch_end(self, trainer, pl_module, prediction, batch_indices, batch, batch_idx, dataloader_idx):  # noqa: ARG002
-        # this will create N (num processes) files in `output_dir` each containing
-        # the predictions of it's respective rank
-
+    def _get_output_dir(self, trainer):
         # by default take self.output_dir. If None, look for one in trainer
         if self.output_dir is None:
             try:
@@ -204,9 +376,52 @@ class CustomWriter(BasePredictionWriter):
         if not os.path.exists(output_dir):
             os.makedirs(output_dir, exist_ok=True)
 
+        return output_dir
+
+    def _submit(self, fn, *args, **kwargs):
+        if self.num_workers <= 0:
+            fn(*args, **kwargs)
+            return
+
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="CustomWriter")
+            self._pending = threading.BoundedSemaphore(self.max_pending)
+
+        # back-pressure: wait for a free slot before queueing more data
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(fn, *args, **kwargs)
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _: self._pending.release())
+        self._futures.append(future)
+        # surface errors early and drop finished futures
+        self._check_futures(wait=False)
+
+    def _check_futures(self, wait: bool):
+        futures, self._futures = self._futures, []
+        for future in futures:
+            if wait or future.done():
+                future.result()
+            else:
+                self._futures.append(future)
+
+    def _save_predictions(self, pred_batch, filename_batch, output_dir, dtype, suffix="pred"):
+        # copy to host memory before handing the batch over to the writer threads
+        pred_batch = pred_batch.detach().cpu()
+        for prediction, file_name in zip(torch.unbind(pred_batch, dim=0), filename_batch, strict=False):
+            self._submit(save_prediction, prediction, file_name, output_dir, dtype=dtype, suffix=suffix)
+
+    def write_on_batch_end(self, trainer, pl_module, prediction, batch_indices, batch, batch_idx, dataloader_idx):  # noqa: ARG002
+        # this will create N (num processes) files in `output_dir` each containing
+        # the predictions of it's respective rank
+
+        output_dir = self._get_output_dir(trainer)
+
         if isinstance(prediction, torch.Tensor):
             filename_batch = ''.join(random.choices(string.ascii_letters + string.digits, k=8))
-            torch.save(prediction, os.path.join(output_dir, f"{filename_batch}.pt"))
+            self._submit(torch.save, prediction.detach().cpu(), os.path.join(output_dir, f"{filename_batch}.pt"))
 
         elif isinstance(prediction, tuple):
 
@@ -216,10 +431,7 @@ class CustomWriter(BasePredictionWriter):
             if isinstance(pred_batch_, tuple):
 
                 pred_batch, suffix = pred_batch_
-
-                for prediction, file_name in zip(torch.unbind(pred_batch, dim=0), filename_batch, strict=False):
-                    save_prediction(prediction, file_name, output_dir,
-                                    dtype=trainer.out_dtype, suffix=suffix)
+                self._save_predictions(pred_batch, filename_batch, output_dir, trainer.out_dtype, suffix=suffix)
 
             # If we are outputting more than one kind of variable, as
             # (predictions, probabilities), for segmentation
@@ -227,10 +439,7 @@ class CustomWriter(BasePredictionWriter):
 
                 for pred in pred_batch_:
                     pred_batch, suffix = pred
-
-                    for p, file_name in zip(torch.unbind(pred_batch, dim=0), filename_batch, strict=False):
-                        save_prediction(p, file_name, output_dir,
-                                        dtype=trainer.out_dtype, suffix=suffix)
+                    self._save_predictions(pred_batch, filename_batch, output_dir, trainer.out_dtype, suffix=suffix)
 
         else:
             raise TypeError(f"Unknown type for prediction {type(prediction)}")
@@ -239,23 +448,20 @@ class CustomWriter(BasePredictionWriter):
         # this will create N (num processes) files in `output_dir` each containing
         # the predictions of it's respective rank
 
-        # by default take self.output_dir. If None, look for one in trainer
-        if self.output_dir is None:
-            try:
-                output_dir = trainer.predict_output_dir
-            except AttributeError as err:
-                msg = "Output directory must be passed to CustomWriter constructor or the `predict_output_dir`\
-                attribute must be present in the trainer."
-                raise Exception(msg) from err
-        else:
-            output_dir = self.output_dir
-
-        if not os.path.exists(output_dir):
-            os.makedirs(output_dir, exist_ok=True)
+        output_dir = self._get_output_dir(trainer)
 
         for pred_batch, filename_batch in predictions:
-            for prediction, file_name in zip(torch.unbind(pred_batch, dim=0), filename_batch, strict=False):
-                save_prediction(prediction, file_name, output_dir, dtype=trainer.out_dtype)
+            self._save_predictions(pred_batch, filename_batch, output_dir, trainer.out_dtype)
+
+    def on_predict_end(self, trainer, pl_module):  # noqa: ARG002
+        # wait for all pending writes and raise any error that happened in the writer threads
+        try:
+            self._check_futures(wait=True)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+            _input_metadata.cache_clear()
 
 
 def clean_config_for_deployment_and_dump(config: dict[str, Any]):
@@ -449,9 +655,31 @@ class MyLightningCLI(LightningCLI):
         else:
             super().run()
 
+    def predict(self, model, datamodule=None, ckpt_path=None, **kwargs):
+        config = self.config.predict
+        if not config.get("predict_out_of_core"):
+            return self.trainer.predict(model, datamodule=datamodule, ckpt_path=ckpt_path, **kwargs)
+
+        if config.predict_output_dir is None:
+            msg = "Out-of-core prediction requires --predict_output_dir."
+            raise ValueError(msg)
+        if ckpt_path is not None:
+            checkpoint = torch.load(ckpt_path, map_location="cpu", weights_only=False)
+            model.load_state_dict(checkpoint.get("state_dict", checkpoint))
+        return predict_to_files(
+            model,
+            datamodule,
+            config.predict_output_dir,
+            dtype=config.out_dtype,
+            device=self.trainer.strategy.root_device,
+        )
+
     def add_arguments_to_parser(self, parser: LightningArgumentParser) -> None:
         parser.add_argument("--predict_output_dir", default=None)
         parser.add_argument("--out_dtype", default="int16")
+        parser.add_argument("--predict_out_of_core", type=bool, default=False,
+                            help="Predict each input file window by window with the tiled inference parameters of "
+                                 "the task and write the predictions directly to --predict_output_dir.")
         parser.add_argument("--deploy_config_file", type=bool, default=True)
         parser.add_argument("--custom_modules_path", type=str, default=None)
 
@@ -536,7 +764,7 @@ def build_lightning_cli(
         save_config_kwargs={"overwrite": True},
         args=args,
         # save only state_dict as well as full state. Only state_dict will be used for exporting the model
-        trainer_defaults={"callbacks": [CustomWriter(write_interval="batch")]},
+        trainer_defaults={"callbacks": [CustomWriter(write_interval="batch", num_workers=4)]},
         run=run,
         trainer_class=MyTrainer,
     )
@@ -685,17 +913,30 @@ class LightningInferenceModel:
 
 
 class MyTrainer(Trainer):
-    def compute_statistics(self, datamodule: LightningDataModule, **kwargs) -> None:
+    def compute_statistics(
+        self,
+        datamodule: LightningDataModule,
+        nodata: float | None = None,
+        percentiles: list[float] | None = None,
+        **kwargs,
+    ) -> None:
         """
         Compute the dataset statistics for the training dataset.
 
         This method will compute the mean and standard deviation of the image data and the count and percentage of each
         unique value in the masks in case these are int and the mean and standard deviation of the mask values in case
-        these are floats. The statistics are computed using the entire training dataset and are printed to the logger.
+        these are floats. The statistics are computed using the entire training dataset, in a single pass, and are
+        printed to the logger.
 
         Please note that this method assumes that there is only one train dataloader in the datamodule. The train
         transforms are removed before computing the statistics to ensure that the statistics are computed on the raw
         data without any augmentation and randomization.
+
+        Args:
+            datamodule (LightningDataModule): Datamodule providing the training data.
+            nodata (float | None): Image value ignored when computing the statistics. Defaults to None.
+            percentiles (list[float] | None): Percentiles (between 0 and 100) of each band to be estimated as well.
+                Defaults to None.
         """
         # remove train transforms, this may not work for all datamodules
         if hasattr(datamodule, "train_transform"):
@@ -714,10 +955,14 @@ class MyTrainer(Trainer):
             pin_memory=original_dataloader.pin_memory,
             drop_last=False,
         )
-        image_stats = compute_statistics(new_dataloader)
+        include_mask = "mask" in original_dataloader.dataset[0]
+        moments, sketch, mask_stats = accumulate_statistics(
+            new_dataloader, nodata=nodata, percentiles=percentiles, include_mask=include_mask
+        )
+        image_stats = image_statistics(moments, sketch, percentiles)
         logger.info("Image statistics:")
         logger.info(yaml.dump(image_stats))
-        if "mask" in datamodule.train_dataloader().dataset[0]:
-            mask_stats = compute_mask_statistics(new_dataloader)
+        if include_mask:
+            mask_stats = mask_statistics(mask_stats)
             logger.info("Mask statistics:")
             logger.info(yaml.dump(mask_stats))
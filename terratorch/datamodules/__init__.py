@@ -42,6 +42,7 @@ from terratorch.datamodules.sen1floods11 import Sen1Floods11NonGeoDataModule
 from terratorch.datamodules.sen4agrinet import Sen4AgriNetDataModule
 from terratorch.datamodules.torchgeo_data_module import TorchGeoDataModule, TorchNonGeoDataModule
 from terratorch.datamodules.generic_multimodal_data_module import GenericMultiModalDataModule
+from terratorch.datamodules.shard_data_module import ShardDataModule
 
 
 # miscellaneous datamodules
@@ -93,6 +94,7 @@ __all__ = (
     "PASTISDataModule",
     "Sen4AgriNetDataModule",
     "GenericMultiModalDataModule",
+    "ShardDataModule",
 )
 
 if wxc_present:
@@ -1,5 +1,10 @@
 import glob
 import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cached_property
+
+import numpy as np
 import torch
 import xarray as xr
 from torch.utils.data import DataLoader, Dataset
@@ -55,10 +60,18 @@ class ERA5Dataset(Dataset):
     This is a custom Dataset class for loading ERA5 climate data into tensors,
     used for the Gravity Wave Flux downstream application.
 
+    The time index is resolved to a file and a local timestep once, and the
+    samples are read from the NetCDF/zarr chunks of that timestep without dask.
+    Each sample is read with a single slice of the features and copied once into
+    the output tensor in the order theta, pressure, u, v. The samples of a batch
+    are read in parallel. When the timesteps are accessed sequentially, the
+    timesteps of the next request are read ahead on background threads.
+
     Attributes:
         data_path: Path to the directory containing the NetCDF files.
         file_glob_pattern: Pattern to match the NetCDF files.
-        ds: The xarray Dataset containing concatenated NetCDF data.
+        files: Sorted NetCDF files, concatenated along the time dimension.
+        ds: The xarray Dataset containing concatenated NetCDF data, opened with dask on first access.
         sur_static: Tensor representing static surface variables like sine and cosine of latitudes and longitudes.
     """
 
@@ -66,30 +79,58 @@ class ERA5Dataset(Dataset):
         self,
         data_path: str = "data/uvtp122", 
         file_glob_pattern: str = "inputfeatures_u_v_theta_uw_vw_era5_training_data_hourly_*.nc",  # or "wxc_input_u_v_t_p_*.nc", or "era5_uvtp_uw_vw_uv_*.nc"
+        prefetch: int = 2,
+        num_read_threads: int = 4,
     ):
         """Initializes the ERA5Dataset class by loading NetCDF files.
 
         Args:
             data_path: The directory containing the NetCDF files.
             file_glob_pattern: The file pattern to match NetCDF files.
+            prefetch: Number of timesteps read ahead on background threads when
+                the timesteps are accessed sequentially. Defaults to 2.
+            num_read_threads: Number of threads reading the timesteps of a batch
+                and the prefetched timesteps. Defaults to 4.
         Raises:
-            ValueError: If no NetCDF files matching the pattern are found.
+            ValueError: If no NetCDF files matching the pattern are found or the
+                features do not have 3 + 4 * levels channels.
         """
 
-        nc_files: list[str] = glob.glob(
+        nc_files: list[str] = sorted(glob.glob(
             pathname=os.path.join(data_path, file_glob_pattern)
-        )
+        ))
 
         if len(nc_files) == 0:
             raise ValueError(f"No finetuning NetCDF files found at {data_path}")
 
-        self.ds: xr.Dataset = xr.open_mfdataset(
-            paths=nc_files, chunks={"time": 1}, combine="nested", concat_dim="time"
-        )
-
-        # Calculate static surface variables (latitude and longitude in radians)
-        latitudes = self.ds.lat.data / 360 * 2.0 * torch.pi
-        longitudes = self.ds.lon.data / 360 * 2.0 * torch.pi
+        self.data_path = data_path
+        self.file_glob_pattern = file_glob_pattern
+        self.files = nc_files
+        self.prefetch = prefetch
+        self.num_read_threads = num_read_threads
+
+        # Resolve the time index to (file, local timestep) once
+        num_timesteps = []
+        for file in nc_files:
+            with xr.open_dataset(file, cache=False) as ds:
+                num_timesteps.append(ds.sizes["time"])
+                if file == nc_files[0]:
+                    num_features = ds.sizes["idim"]
+                    grid_shape = ds["features"].shape[2:]
+                    latitudes = ds.lat.values / 360 * 2.0 * torch.pi
+                    longitudes = ds.lon.values / 360 * 2.0 * torch.pi
+        self._offsets = np.cumsum([0, *num_timesteps])
+
+        # The features are the surface variables followed by u, v, theta and
+        # pressure at all levels, the input is reordered to theta, pressure, u, v
+        levels, surface = divmod(num_features - 3, 4)
+        if surface != 0 or levels <= 0:
+            raise ValueError(
+                f"Expected 3 + 4 * levels features, got {num_features} in {nc_files[0]}"
+            )
+        self.levels = levels
+        self._blocks = [(i * levels, block * levels) for i, block in enumerate([2, 3, 0, 1])]
+        self._shape = (4 * levels, *grid_shape)
 
         # Create a meshgrid of latitudes and longitudes
         latitudes, longitudes = torch.meshgrid(
@@ -99,6 +140,35 @@ class ERA5Dataset(Dataset):
         self.sur_static = torch.stack(
             [torch.sin(latitudes), torch.cos(longitudes), torch.sin(longitudes)], axis=0
         )
+        self._init_reader()
+
+    def _init_reader(self) -> None:
+        # Open files and threads are not shared with forked or spawned workers
+        self._pid = os.getpid()
+        self._open_files: dict[int, xr.Dataset] = {}
+        self._executor: ThreadPoolExecutor | None = None
+        self._pending: dict[int, Future] = {}
+        self._last_first: int | None = None
+        self._last_shift: int | None = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        for key in ["_open_files", "_executor", "_pending", "_lock"]:
+            state.pop(key)
+        state.pop("ds", None)
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._init_reader()
+
+    @cached_property
+    def ds(self) -> xr.Dataset:
+        """The concatenated files as a dask-backed xarray Dataset."""
+        return xr.open_mfdataset(
+            paths=self.files, chunks={"time": 1}, combine="nested", concat_dim="time"
+        )
 
     def __len__(self) -> int:
         """Returns the total number of timesteps in the dataset.
@@ -106,14 +176,67 @@ class ERA5Dataset(Dataset):
         Returns:
             int: The number of timesteps (length of the time dimension).
         """
-        return len(self.ds.time)
+        return int(self._offsets[-1])
+
+    def _file(self, file_index: int) -> xr.Dataset:
+        with self._lock:
+            if file_index not in self._open_files:
+                self._open_files[file_index] = xr.open_dataset(self.files[file_index], cache=False)
+            return self._open_files[file_index]
+
+    def _read(self, index: int) -> dict[str, torch.Tensor]:
+        file_index = int(np.searchsorted(self._offsets, index, side="right")) - 1
+        ds = self._file(file_index)
+        timestep = index - int(self._offsets[file_index])
+
+        # One read of the contiguous levels of the timestep
+        features = torch.from_numpy(ds.variables["features"][timestep, 3:].values)
+        tensor_x = torch.empty(self._shape, dtype=features.dtype)
+        for start, source in self._blocks:
+            tensor_x[start : start + self.levels] = features[source : source + self.levels]
+        tensor_y = torch.from_numpy(np.ascontiguousarray(ds.variables["output"][timestep].values))
+
+        return {
+            "x": tensor_x.unsqueeze(dim=0),
+            "y": tensor_x,
+            "target": tensor_y,
+            "lead_time": torch.zeros(1),  # Placeholder for lead time
+        }
+
+    def _reader(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.num_read_threads, thread_name_prefix="era5")
+        return self._executor
+
+    def _schedule(self, indices: list[int]) -> list[Future]:
+        reader = self._reader()
+        futures = []
+        for index in indices:
+            if index not in self._pending:
+                self._pending[index] = reader.submit(self._read, index)
+            futures.append(self._pending.pop(index))
+
+        # Read ahead only for sequential access, when the last requests were shifted by the same number of
+        # timesteps (e.g. the batches of a dataloader worker without shuffling). The next requests are expected to
+        # keep this shift, shuffled indices are not read ahead.
+        shift = indices[0] - self._last_first if self._last_first is not None else None
+        sequential = shift is not None and shift > 0 and shift == self._last_shift
+        self._last_first, self._last_shift = indices[0], shift
+        ahead = []
+        if sequential:
+            ahead = [i + shift * step for step in range(1, self.prefetch + 1) for i in indices]
+            ahead = [i for i in dict.fromkeys(ahead) if i < len(self)][: self.prefetch]
+        for index in list(self._pending):
+            if index not in ahead:
+                self._pending.pop(index).cancel()
+        for index in ahead:
+            if index not in self._pending:
+                self._pending[index] = reader.submit(self._read, index)
+        return futures
 
     def __getitem__(self, index: int = 0) -> dict[str, torch.Tensor]:
         """Get a tensor of shape (Time, Channels, Height, Width).
 
-        Depending on the number of levels in the dataset (defined by `idim`),
-        it calls the appropriate function to load the ERA5 data for a given index.
-
         Args:
             index: Index to select the timestep. Defaults to 0.
 
@@ -125,13 +248,24 @@ class ERA5Dataset(Dataset):
                 - "lead_time": Tensor containing lead time information.
                 - "static": Static surface tensor.
         """
-
-        if len(self.ds.idim) == 491:  # 122 levels, wxc_input_*.nc
-            batch = get_era5_uvtp122(ds=self.ds, index=index)
-
-        batch["static"] = self.sur_static
-
-        return batch
+        return self.__getitems__([index])[0]
+
+    def __getitems__(self, indices: list[int]) -> list[dict[str, torch.Tensor]]:
+        """Get the samples of a batch, reading the timesteps in parallel."""
+        indices = [int(index) + len(self) if index < 0 else int(index) for index in indices]
+        for index in indices:
+            if not 0 <= index < len(self):
+                raise IndexError(f"Index {index} out of range for {len(self)} timesteps")
+        if self._pid != os.getpid():
+            self._init_reader()
+
+        if self.prefetch == 0 and len(indices) == 1:
+            batches = [self._read(indices[0])]
+        else:
+            batches = [future.result() for future in self._schedule(indices)]
+        for batch in batches:
+            batch["static"] = self.sur_static
+        return batches
 
 
 class ERA5DataModule(pl.LightningDataModule):
@@ -144,6 +278,8 @@ class ERA5DataModule(pl.LightningDataModule):
         file_glob_pattern: Pattern to match NetCDF files.
         batch_size: Size of each mini-batch.
         num_workers: Number of subprocesses for data loading.   
+        prefetch: Number of timesteps each dataset reads ahead.
+        num_read_threads: Number of threads reading the timesteps.
     """
 
     def __init__(
@@ -153,6 +289,8 @@ class ERA5DataModule(pl.LightningDataModule):
         file_glob_pattern: str = "wxc_input_u_v_t_p_output_theta_uw_vw_*.nc",
         batch_size: int = 16,
         num_data_workers: int = 8,
+        prefetch: int = 2,
+        num_read_threads: int = 4,
     ):
         """Initializes the ERA5DataModule with the specified settings.
 
@@ -162,6 +300,11 @@ class ERA5DataModule(pl.LightningDataModule):
             file_glob_pattern: Glob pattern to match NetCDF files.
             batch_size: Size of mini-batches. Defaults to 16.
             num_data_workers: Number of workers for data loading.
+            prefetch: Number of timesteps read ahead on background threads
+                by each dataloader worker, for the validation and prediction
+                data, which are not shuffled. Defaults to 2.
+            num_read_threads: Number of threads reading the timesteps of a
+                batch and the prefetched timesteps. Defaults to 4.
         """
         super().__init__()
         self.train_data_path = train_data_path
@@ -170,6 +313,7 @@ class ERA5DataModule(pl.LightningDataModule):
 
         self.batch_size: int = batch_size
         self.num_workers: int = num_data_workers
+        self.reader_kwargs = {"prefetch": prefetch, "num_read_threads": num_read_threads}
 
     def prepare_data(self):
         pass
@@ -177,17 +321,21 @@ class ERA5DataModule(pl.LightningDataModule):
     def setup(self, stage: str | None = None) -> tuple[Dataset, Dataset]:
         device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
         if stage == "fit":
+            # The training samples are shuffled, reading ahead would read the wrong timesteps
             self.dataset_train = ERA5Dataset(
-                data_path=self.train_data_path, file_glob_pattern=self.file_glob_pattern
+                data_path=self.train_data_path, file_glob_pattern=self.file_glob_pattern,
+                **{**self.reader_kwargs, "prefetch": 0},
             )
             #self.dataset_train = self.dataset_train.to(device)
             self.dataset_val = ERA5Dataset(
-                data_path=self.valid_data_path, file_glob_pattern=self.file_glob_pattern
+                data_path=self.valid_data_path, file_glob_pattern=self.file_glob_pattern,
+                **self.reader_kwargs,
             )
             #self.dataset_val = self.dataset_val.to(device)
         elif stage == "predict":
             self.dataset_predict = ERA5Dataset(
-                data_path=self.valid_data_path, file_glob_pattern=self.file_glob_pattern
+                data_path=self.valid_data_path, file_glob_pattern=self.file_glob_pattern,
+                **self.reader_kwargs,
             )
             #self.dataset_predict = self.dataset_predict.to(device)
 
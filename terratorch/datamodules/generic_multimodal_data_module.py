@@ -20,7 +20,7 @@ from terratorch.datasets import (GenericMultimodalDataset, GenericMultimodalSegm
 from terratorch.datamodules.generic_pixel_wise_data_module import Normalize
 from terratorch.io.file import load_from_file_or_attribute
 
-from .utils import check_dataset_stackability, check_dataset_stackability_dict
+from .utils import BatchAugmentation, CachedNormalize, stackable_dataloader_kwargs
 
 logger = logging.getLogger("terratorch")
 
@@ -75,9 +75,9 @@ def wrap_in_compose_is_list(transform_list, image_modalities=None, non_image_mod
     return A.Compose(transform_list, is_check_shapes=False, additional_targets=additional_targets) \
         if isinstance(transform_list, Iterable) else transform_list
 
-class MultimodalNormalize(Callable):
-    def __init__(self, means, stds):
-        super().__init__()
+class MultimodalNormalize(CachedNormalize):
+    def __init__(self, means, stds, **kwargs):
+        super().__init__(**kwargs)
         self.means = means
         self.stds = stds
 
@@ -88,34 +88,26 @@ class MultimodalNormalize(Callable):
             image = batch["image"][m]
             if len(image.shape) == 5:
                 # B, C, T, H, W
-                means = torch.tensor(self.means[m], device=image.device).view(1, -1, 1, 1, 1)
-                stds = torch.tensor(self.stds[m], device=image.device).view(1, -1, 1, 1, 1)
+                shape = (1, -1, 1, 1, 1)
             elif len(image.shape) == 4:
                 # B, C, H, W
-                means = torch.tensor(self.means[m], device=image.device).view(1, -1, 1, 1)
-                stds = torch.tensor(self.stds[m], device=image.device).view(1, -1, 1, 1)
+                shape = (1, -1, 1, 1)
             elif len(self.means[m]) == 1:
                 # B, (T,) H, W
-                means = torch.tensor(self.means[m], device=image.device)
-                stds = torch.tensor(self.stds[m], device=image.device)
+                shape = (-1,)
             elif len(image.shape) == 3:  # No batch dim
                 # C, H, W
-                means = torch.tensor(self.means[m], device=image.device).view(-1, 1, 1)
-                stds = torch.tensor(self.stds[m], device=image.device).view(-1, 1, 1)
-
-            elif len(image.shape) == 2:
-                means = torch.tensor(self.means[m], device=image.device)
-                stds = torch.tensor(self.stds[m], device=image.device)
-
-            elif len(image.shape) == 1:
-                means = torch.tensor(self.means[m], device=image.device)
-                stds = torch.tensor(self.stds[m], device=image.device)
-
+                shape = (-1, 1, 1)
+            elif len(image.shape) in (1, 2):
+                shape = (-1,)
             else:
                 msg = (f"Expected batch with 5 or 4 dimensions (B, C, (T,) H, W), sample with 3 dimensions (C, H, W) "
                        f"or a single channel, but got {len(image.shape)}")
                 raise Exception(msg)
-            batch["image"][m] = (image - means) / stds
+            means, inv_stds = self._get_constants(
+                m, image, lambda: (torch.tensor(self.means[m]).view(shape), torch.tensor(self.stds[m]).view(shape))
+            )
+            batch["image"][m] = self._normalize(image, means, inv_stds)
         return batch
 
 
@@ -211,6 +203,11 @@ class GenericMultiModalDataModule(NonGeoDataModule):
         channel_position: int = -3,
         concat_bands: bool = False,
         check_stackability: bool = True,
+        stackability_fallback: str = "bucket",
+        stackability_num_samples: int | None = None,
+        file_index_cache: str | Path | None = None,
+        cache_dir: str | Path | None = None,
+        batch_augmentation: dict | None = None,
         **kwargs: Any,
     ) -> None:
         """Constructor
@@ -319,6 +316,22 @@ class GenericMultiModalDataModule(NonGeoDataModule):
                 that it can be processed by single-modal models. Concatenate in the order of provided modalities.
                 Works with image modalities only. Does not work with allow_missing_modalities. Defaults to False.
             check_stackability (bool): Check if all the files in the dataset has the same size and can be stacked.
+                The sizes are read from the file headers, without loading the data.
+            stackability_fallback (str): How to batch the samples if they can't be stacked. "bucket" groups samples
+                of the same size into batches, "pad" pads the samples of each batch to the same size and
+                "batch_size_1" sets the batch size to 1. "bucket" is replaced by "pad" when sampling modalities.
+                Defaults to "bucket".
+            stackability_num_samples (int | None): Only check the sizes of this many randomly chosen samples.
+                Defaults to None, which checks all of them.
+            file_index_cache (str | Path | None): Json file in which the listings of the data directories are cached,
+                so that the splits and later runs do not need to scan them again. Defaults to None.
+            cache_dir (str | Path | None): Directory of a chip cache for the train, val and test datasets. The samples
+                are preprocessed once and read from memory-mapped shards afterwards. Build it ahead of training with
+                `terratorch cache build`. Defaults to None.
+            batch_augmentation (dict | None): Arguments of a `BatchAugmentation` applied to the training batches
+                after they are transferred to the device, e.g. {"horizontal_flip": 0.5, "rot90": 0.5}. The same
+                geometric transformation is applied to all image modalities and the mask, `band_noise_std` can be set
+                per modality. The images are normalized first. Defaults to None.
         """
 
         if task == "segmentation":
@@ -357,6 +370,8 @@ class GenericMultiModalDataModule(NonGeoDataModule):
         self.val_split = val_split
         self.test_split = test_split
         self.allow_substring_file_names = allow_substring_file_names
+        self.file_index_cache = file_index_cache
+        self.cache_dir = cache_dir
         self.constant_scale = constant_scale
         self.no_data_replace = no_data_replace
         self.no_label_replace = no_label_replace
@@ -376,9 +391,9 @@ class GenericMultiModalDataModule(NonGeoDataModule):
         self.reduce_zero_label = reduce_zero_label
         self.channel_position = channel_position
         self.concat_bands = concat_bands
-        if not concat_bands and check_stackability:
-            logger.debug(f"Cannot check stackability if bands are not concatenated.")
         self.check_stackability = check_stackability
+        self.stackability_fallback = stackability_fallback
+        self.stackability_num_samples = stackability_num_samples
 
         if isinstance(train_transform, dict):
             self.train_transform = {m: wrap_in_compose_is_list(train_transform[m]) if m in train_transform else None
@@ -427,6 +442,13 @@ class GenericMultiModalDataModule(NonGeoDataModule):
 
             self.aug = MultimodalNormalize(means, stds)
 
+        if batch_augmentation is not None:
+            self.train_aug = BatchAugmentation(
+                normalize=self.aug,
+                mask_pad_value=-1 if no_label_replace is None else no_label_replace,
+                **batch_augmentation,
+            )
+
         self.data_with_sample_dim = data_with_sample_dim
 
         self.collate_fn = collate_chunk_dicts if data_with_sample_dim else collate_samples
@@ -442,6 +464,8 @@ class GenericMultiModalDataModule(NonGeoDataModule):
                 label_data_root=self.train_label_data_root,
                 split=self.train_split,
                 allow_substring_file_names=self.allow_substring_file_names,
+                file_index_cache=self.file_index_cache,
+                cache_dir=self.cache_dir,
                 dataset_bands=self.dataset_bands,
                 output_bands=self.output_bands,
                 constant_scale=self.constant_scale,
@@ -467,6 +491,8 @@ class GenericMultiModalDataModule(NonGeoDataModule):
                 label_data_root=self.val_label_data_root,
                 split=self.val_split,
                 allow_substring_file_names=self.allow_substring_file_names,
+                file_index_cache=self.file_index_cache,
+                cache_dir=self.cache_dir,
                 dataset_bands=self.dataset_bands,
                 output_bands=self.output_bands,
                 constant_scale=self.constant_scale,
@@ -492,6 +518,8 @@ class GenericMultiModalDataModule(NonGeoDataModule):
                 label_data_root=self.test_label_data_root,
                 split=self.test_split,
                 allow_substring_file_names=self.allow_substring_file_names,
+                file_index_cache=self.file_index_cache,
+                cache_dir=self.cache_dir,
                 dataset_bands=self.dataset_bands,
                 output_bands=self.output_bands,
                 constant_scale=self.constant_scale,
@@ -513,6 +541,7 @@ class GenericMultiModalDataModule(NonGeoDataModule):
                 data_root=self.predict_root,
                 num_classes=self.num_classes,
                 allow_substring_file_names=self.allow_substring_file_names,
+                file_index_cache=self.file_index_cache,
                 dataset_bands=self.predict_dataset_bands,
                 output_bands=self.predict_output_bands,
                 constant_scale=self.constant_scale,
@@ -546,12 +575,31 @@ class GenericMultiModalDataModule(NonGeoDataModule):
         dataset = self._valid_attribute(f"{split}_dataset", "dataset")
         batch_size = self._valid_attribute(f"{split}_batch_size", "batch_size")
 
+        collate_fn = self.collate_fn
         if self.check_stackability:
             logger.info(f'Checking dataset stackability for {split} split')
-            if self.concat_bands:
-                batch_size = check_dataset_stackability(dataset, batch_size)
-            else:
-                batch_size = check_dataset_stackability_dict(dataset, batch_size)
+            fallback = self.stackability_fallback
+            if self.sample_num_modalities and fallback == "bucket":
+                fallback = "pad"
+            batch_kwargs = stackable_dataloader_kwargs(
+                dataset,
+                batch_size,
+                shuffle=split == "train",
+                drop_last=split == "train" and self.drop_last,
+                collate_fn=self.collate_fn,
+                fallback=fallback,
+                mask_pad_value=-1 if self.no_label_replace is None else self.no_label_replace,
+                num_samples=self.stackability_num_samples,
+            )
+            collate_fn = batch_kwargs["collate_fn"]
+            if "batch_sampler" in batch_kwargs:
+                return DataLoader(
+                    dataset=dataset,
+                    num_workers=self.num_workers,
+                    pin_memory=self.pin_memory,
+                    **batch_kwargs,
+                )
+            batch_size = batch_kwargs["batch_size"]
 
         if self.sample_num_modalities:
             # Custom batch sampler for sampling modalities per batch
@@ -572,6 +620,6 @@ class GenericMultiModalDataModule(NonGeoDataModule):
             dataset=dataset,
             batch_sampler=batch_sampler,
             num_workers=self.num_workers,
-            collate_fn=self.collate_fn,
+            collate_fn=collate_fn,
             pin_memory=self.pin_memory,
         )
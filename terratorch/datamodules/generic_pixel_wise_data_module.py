@@ -22,7 +22,7 @@ from terratorch.datamodules.utils import wrap_in_compose_is_list
 from terratorch.datasets import GenericNonGeoPixelwiseRegressionDataset, GenericNonGeoSegmentationDataset, HLSBands
 from terratorch.io.file import load_from_file_or_attribute
 
-from .utils import check_dataset_stackability
+from .utils import BatchAugmentation, CachedNormalize, stackable_dataloader_kwargs
 
 logger = logging.getLogger("terratorch")
 
@@ -44,9 +44,9 @@ def wrap_in_compose_is_list(transform_list):
 #     return batch
 
 
-class Normalize(Callable):
-    def __init__(self, means, stds):
-        super().__init__()
+class Normalize(CachedNormalize):
+    def __init__(self, means, stds, **kwargs):
+        super().__init__(**kwargs)
         self.means = means
         self.stds = stds
 
@@ -58,16 +58,15 @@ class Normalize(Callable):
         # batch["image"] = img
         # return batch
         image = batch["image"]
-        if len(image.shape) == 5:
-            means = torch.tensor(self.means, device=image.device).view(1, -1, 1, 1, 1)
-            stds = torch.tensor(self.stds, device=image.device).view(1, -1, 1, 1, 1)
-        elif len(image.shape) == 4:
-            means = torch.tensor(self.means, device=image.device).view(1, -1, 1, 1)
-            stds = torch.tensor(self.stds, device=image.device).view(1, -1, 1, 1)
-        else:
+        if len(image.shape) not in (4, 5):
             msg = f"Expected batch to have 5 or 4 dimensions, but got {len(image.shape)}"
             raise Exception(msg)
-        batch["image"] = (image - means) / stds
+        # B, C, (T,) H, W
+        shape = (1, -1) + (1,) * (len(image.shape) - 2)
+        means, inv_stds = self._get_constants(
+            None, image, lambda: (torch.tensor(self.means).view(shape), torch.tensor(self.stds).view(shape))
+        )
+        batch["image"] = self._normalize(image, means, inv_stds)
         return batch
 
 
@@ -114,6 +113,11 @@ class GenericNonGeoSegmentationDataModule(NonGeoDataModule):
         drop_last: bool = True,
         pin_memory: bool = False,
         check_stackability: bool = True,
+        stackability_fallback: str = "bucket",
+        stackability_num_samples: int | None = None,
+        load_with_xarray: bool = False,
+        cache_dir: str | Path | None = None,
+        batch_augmentation: dict | None = None,
         **kwargs: Any,
     ) -> None:
         """Constructor
@@ -178,6 +182,20 @@ class GenericNonGeoSegmentationDataModule(NonGeoDataModule):
             pin_memory (bool): If ``True``, the data loader will copy Tensors
             into device/CUDA pinned memory before returning them. Defaults to False.
             check_stackability (bool): Check if all the files in the dataset has the same size and can be stacked.
+                The sizes are read from the file headers, without loading the data.
+            stackability_fallback (str): How to batch the samples if they can't be stacked. "bucket" groups samples
+                of the same size into batches, "pad" pads the samples of each batch to the same size and
+                "batch_size_1" sets the batch size to 1. Defaults to "bucket".
+            stackability_num_samples (int | None): Only check the sizes of this many randomly chosen samples.
+                Defaults to None, which checks all of them.
+            load_with_xarray (bool): Load the files with rioxarray instead of reading them directly with rasterio.
+                Defaults to False.
+            cache_dir (str | Path | None): Directory of a chip cache for the train, val and test datasets. The samples
+                are preprocessed once and read from memory-mapped shards afterwards. Build it ahead of training with
+                `terratorch cache build`. Defaults to None.
+            batch_augmentation (dict | None): Arguments of a `BatchAugmentation` applied to the training batches
+                after they are transferred to the device, e.g. {"horizontal_flip": 0.5, "rot90": 0.5}. The images are
+                normalized first. Defaults to None.
         """
         super().__init__(GenericNonGeoSegmentationDataset, batch_size, num_workers, **kwargs)
         self.num_classes = num_classes
@@ -209,6 +227,8 @@ class GenericNonGeoSegmentationDataModule(NonGeoDataModule):
         self.rgb_indices = rgb_indices
         self.expand_temporal_dimension = expand_temporal_dimension
         self.reduce_zero_label = reduce_zero_label
+        self.load_with_xarray = load_with_xarray
+        self.cache_dir = cache_dir
 
         self.train_transform = wrap_in_compose_is_list(train_transform)
         self.val_transform = wrap_in_compose_is_list(val_transform)
@@ -222,11 +242,19 @@ class GenericNonGeoSegmentationDataModule(NonGeoDataModule):
         stds = load_from_file_or_attribute(stds)
 
         self.aug = Normalize(means, stds)
+        if batch_augmentation is not None:
+            self.train_aug = BatchAugmentation(
+                normalize=self.aug,
+                mask_pad_value=-1 if no_label_replace is None else no_label_replace,
+                **batch_augmentation,
+            )
 
         # self.aug = Normalize(means, stds)
         # self.collate_fn = collate_fn_list_dicts
 
         self.check_stackability = check_stackability
+        self.stackability_fallback = stackability_fallback
+        self.stackability_num_samples = stackability_num_samples
         
     def setup(self, stage: str) -> None:
         if stage in ["fit"]:
@@ -248,6 +276,8 @@ class GenericNonGeoSegmentationDataModule(NonGeoDataModule):
                 no_label_replace=self.no_label_replace,
                 expand_temporal_dimension=self.expand_temporal_dimension,
                 reduce_zero_label=self.reduce_zero_label,
+                load_with_xarray=self.load_with_xarray,
+                cache_dir=self.cache_dir,
             )
         if stage in ["fit", "validate"]:
             self.val_dataset = self.dataset_class(
@@ -268,6 +298,8 @@ class GenericNonGeoSegmentationDataModule(NonGeoDataModule):
                 no_label_replace=self.no_label_replace,
                 expand_temporal_dimension=self.expand_temporal_dimension,
                 reduce_zero_label=self.reduce_zero_label,
+                load_with_xarray=self.load_with_xarray,
+                cache_dir=self.cache_dir,
             )
         if stage in ["test"]:
             self.test_dataset = self.dataset_class(
@@ -288,6 +320,8 @@ class GenericNonGeoSegmentationDataModule(NonGeoDataModule):
                 no_label_replace=self.no_label_replace,
                 expand_temporal_dimension=self.expand_temporal_dimension,
                 reduce_zero_label=self.reduce_zero_label,
+                load_with_xarray=self.load_with_xarray,
+                cache_dir=self.cache_dir,
             )
         if stage in ["predict"] and self.predict_root:
             self.predict_dataset = self.dataset_class(
@@ -304,6 +338,7 @@ class GenericNonGeoSegmentationDataModule(NonGeoDataModule):
                 no_label_replace=self.no_label_replace,
                 expand_temporal_dimension=self.expand_temporal_dimension,
                 reduce_zero_label=self.reduce_zero_label,
+                load_with_xarray=self.load_with_xarray,
             )
 
     def _dataloader_factory(self, split: str) -> DataLoader[dict[str, Tensor]]:
@@ -322,18 +357,27 @@ class GenericNonGeoSegmentationDataModule(NonGeoDataModule):
         dataset = self._valid_attribute(f"{split}_dataset", "dataset")
         batch_size = self._valid_attribute(f"{split}_batch_size", "batch_size")
 
+        batch_kwargs = {
+            "batch_size": batch_size,
+            "shuffle": split == "train",
+            "collate_fn": self.collate_fn,
+            "drop_last": split == "train" and self.drop_last,
+        }
         if self.check_stackability:
             logger.info(f"Checking stackability for {split} split.")
-            batch_size = check_dataset_stackability(dataset, batch_size)
+            batch_kwargs = stackable_dataloader_kwargs(
+                dataset,
+                **batch_kwargs,
+                fallback=self.stackability_fallback,
+                mask_pad_value=-1 if self.no_label_replace is None else self.no_label_replace,
+                num_samples=self.stackability_num_samples,
+            )
 
         return DataLoader(
             dataset=dataset,
-            batch_size=batch_size,
-            shuffle=split == "train",
             num_workers=self.num_workers,
-            collate_fn=self.collate_fn,
-            drop_last=split == "train" and self.drop_last,
             pin_memory=self.pin_memory,
+            **batch_kwargs,
         )
 
 
@@ -379,6 +423,11 @@ class GenericNonGeoPixelwiseRegressionDataModule(NonGeoDataModule):
         drop_last: bool = True,
         pin_memory: bool = False,
         check_stackability: bool = True,
+        stackability_fallback: str = "bucket",
+        stackability_num_samples: int | None = None,
+        load_with_xarray: bool = False,
+        cache_dir: str | Path | None = None,
+        batch_augmentation: dict | None = None,
         **kwargs: Any,
     ) -> None:
         """Constructor
@@ -442,6 +491,21 @@ class GenericNonGeoPixelwiseRegressionDataModule(NonGeoDataModule):
             pin_memory (bool): If ``True``, the data loader will copy Tensors
             into device/CUDA pinned memory before returning them. Defaults to False.
             check_stackability (bool): Check if all the files in the dataset has the same size and can be stacked.
+                The sizes are read from the file headers, without loading the data.
+            stackability_fallback (str): How to batch the samples if they can't be stacked. "bucket" groups samples
+                of the same size into batches, "pad" pads the samples of each batch to the same size and
+                "batch_size_1" sets the batch size to 1. Defaults to "bucket".
+            stackability_num_samples (int | None): Only check the sizes of this many randomly chosen samples.
+                Defaults to None, which checks all of them.
+            load_with_xarray (bool): Load the files with rioxarray instead of reading them directly with rasterio.
+                Defaults to False.
+            cache_dir (str | Path | None): Directory of a chip cache for the train, val and test datasets. The samples
+                are preprocessed once and read from memory-mapped shards afterwards. Build it ahead of training with
+                `terratorch cache build`. Defaults to None.
+            batch_augmentation (dict | None): Arguments of a `BatchAugmentation` applied to the training batches
+                after they are transferred to the device, e.g. {"horizontal_flip": 0.5, "rot90": 0.5}. The images are
+                normalized first. With scale_jitter, the targets are padded with no_label_replace, which must be set.
+                Defaults to None.
         """
         super().__init__(GenericNonGeoPixelwiseRegressionDataset, batch_size, num_workers, **kwargs)
         self.img_grep = img_grep
@@ -459,6 +523,8 @@ class GenericNonGeoPixelwiseRegressionDataModule(NonGeoDataModule):
         self.pin_memory = pin_memory
         self.expand_temporal_dimension = expand_temporal_dimension
         self.reduce_zero_label = reduce_zero_label
+        self.load_with_xarray = load_with_xarray
+        self.cache_dir = cache_dir
 
         self.train_label_data_root = train_label_data_root
         self.val_label_data_root = val_label_data_root
@@ -480,6 +546,16 @@ class GenericNonGeoPixelwiseRegressionDataModule(NonGeoDataModule):
         stds = load_from_file_or_attribute(stds)
 
         self.aug = Normalize(means, stds)
+        if batch_augmentation is not None:
+            if batch_augmentation.get("scale_jitter") is not None and no_label_replace is None:
+                msg = ("scale_jitter pads the regression targets, set no_label_replace to the ignore_index of the task "
+                       "to ignore the padded pixels in the loss.")
+                raise ValueError(msg)
+            self.train_aug = BatchAugmentation(
+                normalize=self.aug,
+                mask_pad_value=-1 if no_label_replace is None else no_label_replace,
+                **batch_augmentation,
+            )
         self.no_data_replace = no_data_replace
         self.no_label_replace = no_label_replace
 
@@ -488,6 +564,8 @@ class GenericNonGeoPixelwiseRegressionDataModule(NonGeoDataModule):
         self.test_transform = wrap_in_compose_is_list(test_transform)
 
         self.check_stackability = check_stackability
+        self.stackability_fallback = stackability_fallback
+        self.stackability_num_samples = stackability_num_samples
 
     def setup(self, stage: str) -> None:
         if stage in ["fit"]:
@@ -508,6 +586,8 @@ class GenericNonGeoPixelwiseRegressionDataModule(NonGeoDataModule):
                 no_label_replace=self.no_label_replace,
                 expand_temporal_dimension=self.expand_temporal_dimension,
                 reduce_zero_label=self.reduce_zero_label,
+                load_with_xarray=self.load_with_xarray,
+                cache_dir=self.cache_dir,
             )
         if stage in ["fit", "validate"]:
             self.val_dataset = self.dataset_class(
@@ -527,6 +607,8 @@ class GenericNonGeoPixelwiseRegressionDataModule(NonGeoDataModule):
                 no_label_replace=self.no_label_replace,
                 expand_temporal_dimension=self.expand_temporal_dimension,
                 reduce_zero_label=self.reduce_zero_label,
+                load_with_xarray=self.load_with_xarray,
+                cache_dir=self.cache_dir,
             )
         if stage in ["test"]:
             self.test_dataset = self.dataset_class(
@@ -546,6 +628,8 @@ class GenericNonGeoPixelwiseRegressionDataModule(NonGeoDataModule):
                 no_label_replace=self.no_label_replace,
                 expand_temporal_dimension=self.expand_temporal_dimension,
                 reduce_zero_label=self.reduce_zero_label,
+                load_with_xarray=self.load_with_xarray,
+                cache_dir=self.cache_dir,
             )
 
         if stage in ["predict"] and self.predict_root:
@@ -561,6 +645,7 @@ class GenericNonGeoPixelwiseRegressionDataModule(NonGeoDataModule):
                 no_label_replace=self.no_label_replace,
                 expand_temporal_dimension=self.expand_temporal_dimension,
                 reduce_zero_label=self.reduce_zero_label,
+                load_with_xarray=self.load_with_xarray,
             )
        
     def _dataloader_factory(self, split: str) -> DataLoader[dict[str, Tensor]]:
@@ -579,16 +664,25 @@ class GenericNonGeoPixelwiseRegressionDataModule(NonGeoDataModule):
         dataset = self._valid_attribute(f"{split}_dataset", "dataset")
         batch_size = self._valid_attribute(f"{split}_batch_size", "batch_size")
 
+        batch_kwargs = {
+            "batch_size": batch_size,
+            "shuffle": split == "train",
+            "collate_fn": self.collate_fn,
+            "drop_last": split == "train" and self.drop_last,
+        }
         if self.check_stackability:
             logger.info("Checking stackability.")
-            batch_size = check_dataset_stackability(dataset, batch_size)
+            batch_kwargs = stackable_dataloader_kwargs(
+                dataset,
+                **batch_kwargs,
+                fallback=self.stackability_fallback,
+                mask_pad_value=-1 if self.no_label_replace is None else self.no_label_replace,
+                num_samples=self.stackability_num_samples,
+            )
 
         return DataLoader(
             dataset=dataset,
-            batch_size=batch_size,
-            shuffle=split == "train",
             num_workers=self.num_workers,
-            collate_fn=self.collate_fn,
-            drop_last=split == "train" and self.drop_last,
             pin_memory=self.pin_memory,
+            **batch_kwargs,
         )
@@ -22,7 +22,7 @@ from terratorch.datasets import (
 )
 from terratorch.io.file import load_from_file_or_attribute
 
-from .utils import check_dataset_stackability
+from .utils import CachedNormalize, stackable_dataloader_kwargs
 
 logger = logging.getLogger("terratorch")
 
@@ -30,24 +30,22 @@ def wrap_in_compose_is_list(transform_list):
     # set check shapes to false because of the multitemporal case
     return A.Compose(transform_list, is_check_shapes=False) if isinstance(transform_list, Iterable) else transform_list
 
-class Normalize(Callable):
-    def __init__(self, means, stds):
-        super().__init__()
+class Normalize(CachedNormalize):
+    def __init__(self, means, stds, **kwargs):
+        super().__init__(**kwargs)
         self.means = means
         self.stds = stds
 
     def __call__(self, batch):
         image = batch["image"]
-        if len(image.shape) == 5:
-            means = torch.tensor(self.means, device=image.device).view(1, -1, 1, 1, 1)
-            stds = torch.tensor(self.stds, device=image.device).view(1, -1, 1, 1, 1)
-        elif len(image.shape) == 4:
-            means = torch.tensor(self.means, device=image.device).view(1, -1, 1, 1)
-            stds = torch.tensor(self.stds, device=image.device).view(1, -1, 1, 1)
-        else:
+        if len(image.shape) not in (4, 5):
             msg = f"Expected batch to have 5 or 4 dimensions, but got {len(image.shape)}"
             raise Exception(msg)
-        batch["image"] = (image - means) / stds
+        shape = (1, -1) + (1,) * (len(image.shape) - 2)
+        means, inv_stds = self._get_constants(
+            None, image, lambda: (torch.tensor(self.means).view(shape), torch.tensor(self.stds).view(shape))
+        )
+        batch["image"] = self._normalize(image, means, inv_stds)
         return batch
 
 
@@ -85,6 +83,8 @@ class GenericNonGeoClassificationDataModule(NonGeoDataModule):
         no_data_replace: float = 0,
         drop_last: bool = True,
         check_stackability: bool = True,
+        stackability_fallback: str = "bucket",
+        stackability_num_samples: int | None = None,
         **kwargs: Any,
     ) -> None:
         """Constructor
@@ -134,6 +134,12 @@ class GenericNonGeoClassificationDataModule(NonGeoDataModule):
                 Defaults to False.
             drop_last (bool): Drop the last batch if it is not complete. Defaults to True.
             check_stackability (bool): Check if all the files in the dataset has the same size and can be stacked.
+                The sizes are read from the file headers, without loading the data.
+            stackability_fallback (str): How to batch the samples if they can't be stacked. "bucket" groups samples
+                of the same size into batches, "pad" pads the samples of each batch to the same size and
+                "batch_size_1" sets the batch size to 1. Defaults to "bucket".
+            stackability_num_samples (int | None): Only check the sizes of this many randomly chosen samples.
+                Defaults to None, which checks all of them.
         """
         super().__init__(GenericNonGeoClassificationDataset, batch_size, num_workers, **kwargs)
         self.num_classes = num_classes
@@ -174,6 +180,8 @@ class GenericNonGeoClassificationDataModule(NonGeoDataModule):
         # self.collate_fn = collate_fn_list_dicts
 
         self.check_stackability = check_stackability
+        self.stackability_fallback = stackability_fallback
+        self.stackability_num_samples = stackability_num_samples
 
     def setup(self, stage: str) -> None:
         if stage in ["fit"]:
@@ -250,15 +258,23 @@ class GenericNonGeoClassificationDataModule(NonGeoDataModule):
         dataset = self._valid_attribute(f"{split}_dataset", "dataset")
         batch_size = self._valid_attribute(f"{split}_batch_size", "batch_size")
 
+        batch_kwargs = {
+            "batch_size": batch_size,
+            "shuffle": split == "train",
+            "collate_fn": self.collate_fn,
+            "drop_last": split == "train" and self.drop_last,
+        }
         if self.check_stackability:
             logger.info("Checking stackability.")
-            batch_size = check_dataset_stackability(dataset, batch_size)
+            batch_kwargs = stackable_dataloader_kwargs(
+                dataset,
+                **batch_kwargs,
+                fallback=self.stackability_fallback,
+                num_samples=self.stackability_num_samples,
+            )
 
         return DataLoader(
             dataset=dataset,
-            batch_size=batch_size,
-            shuffle=split == "train",
             num_workers=self.num_workers,
-            collate_fn=self.collate_fn,
-            drop_last=split == "train" and self.drop_last,
+            **batch_kwargs,
         )
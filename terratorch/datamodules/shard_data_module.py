@@ -0,0 +1,127 @@
+# Copyright contributors to the Terratorch project
+
+"""Datamodule streaming samples from tar shards (see `terratorch.datasets.shard_dataset`)."""
+
+import logging
+from typing import Any
+
+import albumentations as A
+from torch import Tensor
+from torch.utils.data import DataLoader
+from torchgeo.datamodules import NonGeoDataModule
+
+from terratorch.datamodules.generic_multimodal_data_module import MultimodalNormalize
+from terratorch.datamodules.generic_pixel_wise_data_module import Normalize
+from terratorch.datamodules.utils import BatchAugmentation, wrap_in_compose_is_list
+from terratorch.datasets.shard_dataset import ShardDataLoader, ShardDataset
+from terratorch.io.file import load_from_file_or_attribute
+
+logger = logging.getLogger("terratorch")
+
+
+class ShardDataModule(NonGeoDataModule):
+    """Datamodule for the tar shards written by `terratorch shards write`, e.g. from an object store.
+
+    The shards of each split were written from a generic pixel-wise or multimodal dataset and the samples are
+    returned in the same format. The position in the training epoch is saved in the checkpoints.
+    """
+
+    def __init__(
+        self,
+        batch_size: int,
+        num_workers: int,
+        train_url: str,
+        val_url: str,
+        test_url: str,
+        means: list[float] | dict[str, list[float]] | str,
+        stds: list[float] | dict[str, list[float]] | str,
+        train_transform: A.Compose | None | list[A.BasicTransform] = None,
+        val_transform: A.Compose | None | list[A.BasicTransform] = None,
+        test_transform: A.Compose | None | list[A.BasicTransform] = None,
+        shuffle_buffer: int = 1000,
+        prefetch_shards: int = 2,
+        storage_options: dict | None = None,
+        no_label_replace: float | None = None,
+        pin_memory: bool = False,
+        batch_augmentation: dict | None = None,
+        **kwargs: Any,
+    ) -> None:
+        """Constructor
+
+        Args:
+            batch_size (int): Number of samples per batch.
+            num_workers (int): Number of dataloader workers. Each worker reads its own shards.
+            train_url (str): Directory or fsspec URL (e.g. s3://bucket/train) of the training shards.
+            val_url (str): Directory or fsspec URL of the validation shards.
+            test_url (str): Directory or fsspec URL of the test shards.
+            means (list[float] | dict[str, list[float]] | str): Means of the bands, per modality for multimodal
+                shards.
+            stds (list[float] | dict[str, list[float]] | str): Standard deviations of the bands, per modality for
+                multimodal shards.
+            train_transform (Albumentations.Compose | None): Albumentations transform to be applied to the train
+                samples. Defaults to None, which simply applies ToTensorV2().
+            val_transform (Albumentations.Compose | None): Albumentations transform to be applied to the validation
+                samples. Defaults to None, which simply applies ToTensorV2().
+            test_transform (Albumentations.Compose | None): Albumentations transform to be applied to the test
+                samples. Defaults to None, which simply applies ToTensorV2().
+            shuffle_buffer (int): Number of samples the training samples are drawn from. Defaults to 1000.
+            prefetch_shards (int): Number of shards each worker reads ahead. Defaults to 2.
+            storage_options (dict | None): Options of the fsspec filesystem, e.g. {"endpoint_url": ...} for an S3
+                compatible object store. Defaults to None.
+            no_label_replace (float | None): Mask value of padded pixels of the batch augmentation, required with
+                scale_jitter. Defaults to None.
+            pin_memory (bool): If ``True``, the data loader will copy Tensors into device/CUDA pinned memory before
+                returning them. Defaults to False.
+            batch_augmentation (dict | None): Arguments of a `BatchAugmentation` applied to the training batches
+                after they are transferred to the device. Defaults to None.
+        """
+        super().__init__(ShardDataset, batch_size, num_workers, **kwargs)
+        self.train_url = train_url
+        self.val_url = val_url
+        self.test_url = test_url
+        self.train_transform = wrap_in_compose_is_list(train_transform)
+        self.val_transform = wrap_in_compose_is_list(val_transform)
+        self.test_transform = wrap_in_compose_is_list(test_transform)
+        self.shuffle_buffer = shuffle_buffer
+        self.prefetch_shards = prefetch_shards
+        self.storage_options = storage_options
+        self.pin_memory = pin_memory
+
+        if isinstance(means, dict):
+            means = {m: load_from_file_or_attribute(v) for m, v in means.items()}
+            stds = {m: load_from_file_or_attribute(v) for m, v in stds.items()}
+            self.aug = MultimodalNormalize(means, stds)
+        else:
+            self.aug = Normalize(load_from_file_or_attribute(means), load_from_file_or_attribute(stds))
+        if batch_augmentation is not None:
+            if batch_augmentation.get("scale_jitter") is not None and no_label_replace is None:
+                # The masks can be class labels or regression targets, there is no safe default
+                msg = "scale_jitter pads the masks, set no_label_replace to the ignore_index of the task."
+                raise ValueError(msg)
+            self.train_aug = BatchAugmentation(
+                normalize=self.aug,
+                mask_pad_value=-1 if no_label_replace is None else no_label_replace,
+                **batch_augmentation,
+            )
+
+    def setup(self, stage: str) -> None:
+        kwargs = {"prefetch_shards": self.prefetch_shards, "storage_options": self.storage_options}
+        if stage in ["fit"]:
+            self.train_dataset = ShardDataset(
+                self.train_url, transform=self.train_transform, shuffle_buffer=self.shuffle_buffer, **kwargs
+            )
+        if stage in ["fit", "validate"]:
+            self.val_dataset = ShardDataset(self.val_url, transform=self.val_transform, shuffle=False, **kwargs)
+        if stage in ["test"]:
+            self.test_dataset = ShardDataset(self.test_url, transform=self.test_transform, shuffle=False, **kwargs)
+
+    def _dataloader_factory(self, split: str) -> DataLoader[dict[str, Tensor]]:
+        dataset = self._valid_attribute(f"{split}_dataset", "dataset")
+        batch_size = self._valid_attribute(f"{split}_batch_size", "batch_size")
+        return ShardDataLoader(
+            dataset,
+            batch_size=batch_size,
+            num_workers=self.num_workers,
+            pin_memory=self.pin_memory,
+            collate_fn=self.collate_fn,
+        )
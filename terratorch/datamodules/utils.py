@@ -1,49 +1,338 @@
 # Copyright contributors to the Terratorch project
 
+import hashlib
+import logging
+import math
 import re
-from collections.abc import Callable, Iterable
+from collections import Counter
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+from typing import Any
 
 import albumentations as A
 import numpy as np
+import rasterio
 import torch
+from lightning.pytorch import LightningDataModule
+from torch.utils.data import BatchSampler, RandomSampler, Sampler, SequentialSampler, default_collate
+
+logger = logging.getLogger("terratorch")
 
 
 def wrap_in_compose_is_list(transform_list):
     # set check shapes to false because of the multitemporal case
     return A.Compose(transform_list, is_check_shapes=False) if isinstance(transform_list, Iterable) else transform_list
 
-def check_dataset_stackability(dataset, batch_size) -> bool:
+def read_file_shape(path) -> tuple[int, ...] | None:
+    """Read the shape of the data stored in a file from its header, without decoding the data.
+
+    Supports rasterio readable files, .npy and zarr files as well as in-memory arrays. Returns None if the shape
+    cannot be determined.
+    """
+    try:
+        if isinstance(path, np.ndarray):
+            return path.shape
+        path = str(path)
+        if path.endswith(".npy"):
+            return np.load(path, mmap_mode="r").shape
+        if path.endswith(".zarr") or path.endswith(".zarr.zip"):
+            import xarray as xr
+
+            data = xr.open_zarr(path)
+            return data[list(data.data_vars)[0]].shape
+        with rasterio.open(path) as src:
+            return (src.count, src.height, src.width)
+    except Exception:  # noqa: BLE001
+        return None
+
+
+def _sample_files(dataset) -> list[dict] | None:
+    """Files of each sample of a generic dataset, per modality. None if the dataset does not expose its files."""
+    samples = getattr(dataset, "samples", None)
+    if isinstance(samples, list) and all(isinstance(s, dict) for s in samples):
+        return samples
+    if isinstance(samples, list) and all(isinstance(s, tuple) for s in samples):
+        # ImageFolder style (path, target) samples
+        return [{"image": s[0]} for s in samples]
+    if isinstance(getattr(dataset, "image_files", None), list):
+        return [{"image": f} for f in dataset.image_files]
+    return None
+
+
+_SHAPES_CACHE: dict[str, list | None] = {}
+
+
+def get_sample_shapes(dataset, num_samples: int | None = None) -> tuple[list[int], list[tuple]] | None:
+    """Get the shapes of the samples of a dataset from the file headers.
+
+    Results are cached and keyed by the list of files, so repeated calls for the same split are free.
+
+    Args:
+        dataset: Dataset exposing its files through `samples` or `image_files`.
+        num_samples (int | None): Only read the headers of this many randomly chosen samples. Defaults to None,
+            which reads all of them.
+
+    Returns:
+        tuple[list[int], list[tuple]] | None: The indices of the checked samples and the shapes of all their files, or
+            None if the shapes could not be read from the headers.
+    """
+    files = _sample_files(dataset)
+    if files is None:
+        return None
+    indices = list(range(len(files)))
+    if num_samples is not None and num_samples < len(files):
+        indices = sorted(np.random.default_rng(0).choice(len(files), num_samples, replace=False).tolist())
+
+    key = hashlib.sha1(repr([files[i] for i in indices]).encode()).hexdigest()
+    if key not in _SHAPES_CACHE:
+        shapes = []
+        for i in indices:
+            sample_shapes = tuple((m, read_file_shape(f)) for m, f in sorted(files[i].items()))
+            if any(shape is None for _, shape in sample_shapes):
+                shapes = None
+                break
+            shapes.append(sample_shapes)
+        _SHAPES_CACHE[key] = shapes
+
+    shapes = _SHAPES_CACHE[key]
+    return None if shapes is None else (indices, shapes)
+
+
+def _item_shapes(item) -> tuple:
+    image = item["image"]
+    if isinstance(image, dict):
+        return tuple((m, tuple(v.shape)) for m, v in sorted(image.items()))
+    return tuple(image.shape)
+
+
+def is_dataset_stackable(dataset, num_samples: int | None = None) -> bool:
+    """Check whether all samples of a dataset have the same shape and can be stacked into batches.
+
+    Shapes are read from the file headers when possible. If these differ, one sample per distinct file shape is
+    loaded, since the transforms (e.g. crops) may still produce samples of equal shape. Datasets not exposing
+    their files are checked by loading every sample.
+    """
+    header_shapes = get_sample_shapes(dataset, num_samples)
+    if header_shapes is None:
+        return len({_item_shapes(item) for item in dataset}) <= 1
+
+    indices, shapes = header_shapes
+    if len(set(shapes)) <= 1:
+        return True
+    representatives = {}
+    for index, shape in zip(indices, shapes, strict=True):
+        representatives.setdefault(shape, index)
+    return len({_item_shapes(dataset[index]) for index in representatives.values()}) <= 1
+
 
-    shapes = np.array([item["image"].shape for item in dataset])
+def check_dataset_stackability(dataset, batch_size, num_samples: int | None = None) -> int:
 
-    if np.array_equal(shapes.max(0), shapes.min(0)):
+    if is_dataset_stackable(dataset, num_samples):
         return batch_size
     else:
-        print("The batch samples can't be stacked, since they don't have the same dimensions. Setting batch_size=1.")
+        logger.warning("The batch samples can't be stacked, since they don't have the same dimensions. Setting batch_size=1.")
         return 1
 
 
-def check_dataset_stackability_dict(dataset, batch_size) -> bool:
+def check_dataset_stackability_dict(dataset, batch_size, num_samples: int | None = None) -> int:
     """Check stackability with item['image'] being a dict."""
-    shapes = {}
-    for item in dataset:
-        for mod, value in item["image"].items():
-            if mod in shapes:
-                shapes[mod].append(value.shape)
+    return check_dataset_stackability(dataset, batch_size, num_samples)
+
+
+class ShapeBucketBatchSampler(BatchSampler):
+    """Batch sampler grouping samples with the same shape, so that batches of samples with different sizes can be
+    stacked without padding.
+
+    The indices yielded by `sampler` are put into one bucket per shape and a batch is yielded when its bucket is full,
+    so the order (e.g. shuffling) and the selection (e.g. the indices of a distributed rank) of the sampler are kept.
+    Like `BatchSampler`, it can be rebuilt with another sampler as ``cls(sampler, batch_size=..., drop_last=...)``,
+    which Lightning does to inject a distributed sampler.
+
+    Args:
+        sampler (Sampler | Iterable): Sampler of the sample indices.
+        batch_size (int): Batch size.
+        drop_last (bool): Whether to drop the last incomplete batch of each bucket.
+        shapes (list | None): Shape of each sample of the dataset. Defaults to None, which reads the shapes from the
+            file headers of the dataset of the sampler.
+    """
+
+    def __init__(self, sampler: Sampler | Iterable, batch_size: int, drop_last: bool, shapes: list | None = None):  # noqa: FBT001
+        super().__init__(sampler, batch_size, drop_last)
+        if shapes is None:
+            dataset = getattr(sampler, "dataset", getattr(sampler, "data_source", None))
+            header_shapes = None if dataset is None else get_sample_shapes(dataset)
+            if header_shapes is None:
+                msg = "Cannot read the sample shapes from the dataset of the sampler, pass the shapes explicitly."
+                raise ValueError(msg)
+            shapes = header_shapes[1]
+        self.shapes = shapes
+
+    def __iter__(self) -> Iterator[list[int]]:
+        buckets: dict[Any, list[int]] = {}
+        for index in self.sampler:
+            bucket = buckets.setdefault(self.shapes[index], [])
+            bucket.append(index)
+            if len(bucket) == self.batch_size:
+                yield bucket
+                buckets[self.shapes[index]] = []
+        if not self.drop_last:
+            yield from (bucket for bucket in buckets.values() if bucket)
+
+    def __len__(self) -> int:
+        if len(self.sampler) == len(self.shapes):
+            # Samplers over the whole dataset yield every index once
+            counts = Counter(self.shapes)
+        else:
+            counts = Counter(self.shapes[index] for index in self.sampler)
+        if self.drop_last:
+            return sum(count // self.batch_size for count in counts.values())
+        return sum(math.ceil(count / self.batch_size) for count in counts.values())
+
+
+def _pad_to(tensor: torch.Tensor, height: int, width: int, value: float) -> torch.Tensor:
+    return torch.nn.functional.pad(tensor, (0, width - tensor.shape[-1], 0, height - tensor.shape[-2]), value=value)
+
+
+class PadCollate:
+    """Collate function padding the spatial dimensions of images and masks to the largest sample in the batch.
+
+    Args:
+        image_pad_value (float): Value used to pad images. Defaults to 0.
+        mask_pad_value (float): Value used to pad masks, usually the ignore index. Defaults to -1.
+        collate_fn (Callable | None): Collate function applied after padding. Defaults to None, which uses the
+            default collate function of torch.
+    """
+
+    def __init__(self, image_pad_value: float = 0, mask_pad_value: float = -1, collate_fn: Callable | None = None):
+        self.image_pad_value = image_pad_value
+        self.mask_pad_value = mask_pad_value
+        self.collate_fn = collate_fn or default_collate
+
+    def _pad(self, tensors: list, value: float) -> list:
+        if not all(isinstance(t, torch.Tensor) and t.ndim >= 2 for t in tensors):  # noqa: PLR2004
+            return tensors
+        height = max(t.shape[-2] for t in tensors)
+        width = max(t.shape[-1] for t in tensors)
+        return [_pad_to(t, height, width, value) for t in tensors]
+
+    def __call__(self, batch: list[dict]) -> dict:
+        batch = [dict(item) for item in batch]
+        for key, value in (("image", self.image_pad_value), ("mask", self.mask_pad_value)):
+            if key not in batch[0]:
+                continue
+            if isinstance(batch[0][key], dict):
+                for m in batch[0][key]:
+                    padded = self._pad([item[key][m] for item in batch], value)
+                    for item, tensor in zip(batch, padded, strict=True):
+                        item[key] = {**item[key], m: tensor}
             else:
-                shapes[mod] = [value.shape]
+                padded = self._pad([item[key] for item in batch], value)
+                for item, tensor in zip(batch, padded, strict=True):
+                    item[key] = tensor
+        return self.collate_fn(batch)
 
-    if all(np.array_equal(np.max(s, 0), np.min(s, 0)) for s in shapes.values()):
-        return batch_size
-    else:
-        print(
-            "The batch samples can't be stacked, since they don't have the same dimensions. Setting batch_size=1.")
-        return 1
 
+def stackable_dataloader_kwargs(
+    dataset,
+    batch_size: int,
+    shuffle: bool,  # noqa: FBT001
+    drop_last: bool,  # noqa: FBT001
+    collate_fn: Callable | None = None,
+    fallback: str = "bucket",
+    mask_pad_value: float = -1,
+    num_samples: int | None = None,
+) -> dict[str, Any]:
+    """Batching arguments for a DataLoader, depending on whether the samples of the dataset can be stacked.
+
+    Args:
+        dataset: The dataset.
+        batch_size (int): Batch size.
+        shuffle (bool): Whether to shuffle the samples.
+        drop_last (bool): Whether to drop the last incomplete batch.
+        collate_fn (Callable | None): Collate function of the datamodule. Defaults to None.
+        fallback (str): What to do if the samples cannot be stacked. "bucket" groups samples of equal shape into
+            batches, "pad" pads the samples of a batch to the same size and "batch_size_1" uses a batch size of 1.
+            Defaults to "bucket".
+        mask_pad_value (float): Value used to pad masks with the "pad" fallback. Defaults to -1.
+        num_samples (int | None): Number of samples whose shapes are checked. Defaults to None, which checks all.
 
-class NormalizeWithTimesteps(Callable):
-    def __init__(self, means, stds):
+    Returns:
+        dict[str, Any]: Keyword arguments for the DataLoader.
+    """
+    default_kwargs = {"batch_size": batch_size, "shuffle": shuffle, "drop_last": drop_last, "collate_fn": collate_fn}
+    if is_dataset_stackable(dataset, num_samples):
+        return default_kwargs
+
+    if fallback == "bucket":
+        header_shapes = get_sample_shapes(dataset)
+        if header_shapes is not None:
+            logger.warning("The samples can't be stacked, since they don't have the same dimensions. "
+                           "Grouping samples with the same dimensions into batches.")
+            sampler = RandomSampler(dataset) if shuffle else SequentialSampler(dataset)
+            batch_sampler = ShapeBucketBatchSampler(sampler, batch_size, drop_last, shapes=header_shapes[1])
+            return {"batch_sampler": batch_sampler, "collate_fn": collate_fn}
+        logger.warning("Cannot read the sample shapes from the file headers to build shape buckets. Padding instead.")
+        fallback = "pad"
+
+    if fallback == "pad":
+        logger.warning("The samples can't be stacked, since they don't have the same dimensions. "
+                       "Padding the samples of each batch to the same size.")
+        return {**default_kwargs, "collate_fn": PadCollate(mask_pad_value=mask_pad_value, collate_fn=collate_fn)}
+
+    if fallback == "batch_size_1":
+        logger.warning("The samples can't be stacked, since they don't have the same dimensions. Setting batch_size=1.")
+        return {**default_kwargs, "batch_size": 1}
+
+    msg = f"Unknown stackability fallback {fallback}. Choose one of bucket, pad or batch_size_1."
+    raise ValueError(msg)
+
+
+class CachedNormalize(Callable):
+    """Base class of the batch normalizations.
+
+    The means and reciprocal stds are converted into broadcastable tensors once per device, dtype and number of
+    dimensions of the images and reused for all batches. Images are normalized in place if they are not views of other
+    tensors, integer images (e.g. uint16) are converted to `dtype` in the same step.
+
+    Args:
+        in_place (bool): Normalize the images in place if possible. Defaults to True.
+        dtype (torch.dtype): Dtype of normalized integer images. Defaults to torch.float32.
+    """
+
+    def __init__(self, in_place: bool = True, dtype: torch.dtype = torch.float32):
         super().__init__()
+        self.in_place = in_place
+        self.dtype = dtype
+        self._constants: dict[tuple, tuple[torch.Tensor, torch.Tensor]] = {}
+
+    def __getstate__(self) -> dict:
+        # The cached tensors can be on an accelerator
+        return {**self.__dict__, "_constants": {}}
+
+    def _get_constants(
+        self, key: Any, image: torch.Tensor, build: Callable[[], tuple[torch.Tensor, torch.Tensor]]
+    ) -> tuple[torch.Tensor, torch.Tensor]:
+        dtype = image.dtype if image.is_floating_point() else self.dtype
+        cache_key = (key, image.device, dtype, image.ndim)
+        if cache_key not in self._constants:
+            means, stds = build()
+            means = means.to(device=image.device, dtype=dtype)
+            inv_stds = (1 / stds.double()).to(device=image.device, dtype=dtype)
+            self._constants[cache_key] = (means, inv_stds)
+        return self._constants[cache_key]
+
+    def _normalize(self, image: torch.Tensor, means: torch.Tensor, inv_stds: torch.Tensor) -> torch.Tensor:
+        if not image.is_floating_point():
+            # The conversion creates the output tensor, which is then normalized in place
+            image = image.to(means.dtype)
+        elif not self.in_place or image.requires_grad or image._is_view():
+            image = image.clone()
+        return image.sub_(means).mul_(inv_stds)
+
+
+class NormalizeWithTimesteps(CachedNormalize):
+    def __init__(self, means, stds, **kwargs):
+        super().__init__(**kwargs)
         self.means = means  # (C, T)
         self.stds = stds    # (C, T)
 
@@ -51,16 +340,198 @@ class NormalizeWithTimesteps(Callable):
         image = batch["image"]
 
         if len(image.shape) == 5:  # (B, T, C, H, W)
-            means = torch.tensor(self.means, device=image.device).transpose(0, 1).reshape(1, image.shape[1], image.shape[2], 1, 1)
-            stds = torch.tensor(self.stds, device=image.device).transpose(0, 1).reshape(1, image.shape[1], image.shape[2], 1, 1)
+            def build():
+                return tuple(torch.tensor(v).transpose(0, 1).reshape(1, image.shape[1], image.shape[2], 1, 1)
+                             for v in (self.means, self.stds))
 
         elif len(image.shape) == 4:  # (B, C, H, W)
-            means = torch.tensor(self.means, device=image.device).mean(dim=1).view(1, image.shape[1], 1, 1)
-            stds = torch.tensor(self.stds, device=image.device).mean(dim=1).view(1, image.shape[1], 1, 1)
+            def build():
+                return tuple(torch.tensor(v).mean(dim=1).view(1, image.shape[1], 1, 1) for v in (self.means, self.stds))
 
         else:
             msg = f"Expected batch to have 5 or 4 dimensions, but got {len(image.shape)}"
             raise Exception(msg)
 
-        batch["image"] = (image - means) / stds
+        batch["image"] = self._normalize(image, *self._get_constants(None, image, build))
+        return batch
+
+
+class BatchAugmentation:
+    """Augmentation of collated batches on the device they were transferred to.
+
+    The image (a tensor or a dict of modalities) and the masks get the same geometric transformation per sample.
+    Tensors with less than four dimensions in the image dict (non-image modalities) are not modified. The batch is
+    first normalized by `normalize`, the band noise is added to the normalized images.
+
+    Args:
+        normalize (Callable | None): Normalization applied to the batch before the augmentation, e.g. the `aug` of the
+            datamodule. Defaults to None.
+        horizontal_flip (float): Probability of flipping a sample horizontally. Defaults to 0.
+        vertical_flip (float): Probability of flipping a sample vertically. Defaults to 0.
+        rot90 (float): Probability of rotating a sample by 90, 180 or 270 degrees. Requires square samples.
+            Defaults to 0.
+        crop_size (int | list[int] | None): Size (height, width) of random crops. Defaults to None, which does not crop.
+        scale_jitter (list[float] | None): Range of a random zoom factor per sample, e.g. [0.8, 1.2]. The sample size
+            is kept, zooming out pads the images with 0 and the masks with `mask_pad_value`. Defaults to None.
+        band_noise_std (float | list[float] | dict[str, float | list[float]]): Standard deviation of the gaussian noise
+            added to each band of the normalized images, per modality if the images are a dict. Defaults to 0.
+        mask_pad_value (float): Mask value of pixels outside of the sample after zooming out. Defaults to -1.
+        mask_keys (list[str]): Keys of the masks in the batch. Defaults to ["mask"].
+    """
+
+    def __init__(
+        self,
+        normalize: Callable | None = None,
+        horizontal_flip: float = 0,
+        vertical_flip: float = 0,
+        rot90: float = 0,
+        crop_size: int | list[int] | None = None,
+        scale_jitter: list[float] | None = None,
+        band_noise_std: float | list[float] | dict[str, float | list[float]] = 0,
+        mask_pad_value: float = -1,
+        mask_keys: list[str] | None = None,
+    ):
+        self.normalize = normalize
+        self.horizontal_flip = horizontal_flip
+        self.vertical_flip = vertical_flip
+        self.rot90 = rot90
+        self.crop_size = (crop_size, crop_size) if isinstance(crop_size, int) else crop_size
+        if scale_jitter is not None and len(scale_jitter) != 2:  # noqa: PLR2004
+            msg = f"scale_jitter must be a range [min, max], got {scale_jitter}"
+            raise ValueError(msg)
+        self.scale_jitter = scale_jitter
+        self.band_noise_std = band_noise_std
+        self.mask_pad_value = mask_pad_value
+        self.mask_keys = mask_keys or ["mask"]
+
+    def _spatial_tensors(self, batch: dict) -> list[tuple[dict, str, bool]]:
+        # (container, key, is_mask) of all tensors that are transformed
+        tensors = []
+        image = batch["image"]
+        if isinstance(image, dict):
+            tensors += [(image, m, False) for m, v in image.items() if isinstance(v, torch.Tensor) and v.ndim >= 4]  # noqa: PLR2004
+        else:
+            tensors.append((batch, "image", False))
+        tensors += [(batch, key, True) for key in self.mask_keys if isinstance(batch.get(key), torch.Tensor)]
+        return tensors
+
+    @staticmethod
+    def _apply_to_samples(tensor: torch.Tensor, selected: torch.Tensor, fn: Callable) -> torch.Tensor:
+        if not selected.any():
+            return tensor
+        tensor = tensor.clone()
+        index = selected.nonzero().squeeze(1).to(tensor.device)
+        tensor[index] = fn(tensor[index])
+        return tensor
+
+    def _scale(self, tensor: torch.Tensor, scales: torch.Tensor, is_mask: bool) -> torch.Tensor:  # noqa: FBT001
+        shape = tensor.shape
+        flat = tensor.reshape(shape[0], -1, *shape[-2:])
+        dtype = flat.dtype
+        flat = flat.float()
+        # Zooming by a factor s samples the center 1/s of the sample
+        theta = torch.zeros(shape[0], 2, 3, device=tensor.device)
+        theta[:, 0, 0] = theta[:, 1, 1] = 1 / scales.to(tensor.device)
+        grid = torch.nn.functional.affine_grid(theta, list(flat.shape), align_corners=False)
+        if is_mask:
+            # Masks are sampled with nearest neighbors and padded with mask_pad_value
+            scaled = torch.nn.functional.grid_sample(flat - self.mask_pad_value, grid, mode="nearest",
+                                                     padding_mode="zeros", align_corners=False) + self.mask_pad_value
+        else:
+            scaled = torch.nn.functional.grid_sample(flat, grid, mode="bilinear", padding_mode="zeros",
+                                                     align_corners=False)
+        return scaled.to(dtype).reshape(shape)
+
+    def _crop(self, tensor: torch.Tensor, top: torch.Tensor, left: torch.Tensor) -> torch.Tensor:
+        height, width = self.crop_size
+        return torch.stack([tensor[i, ..., t : t + height, l : l + width]
+                            for i, (t, l) in enumerate(zip(top.tolist(), left.tolist(), strict=True))])
+
+    def _noise_std(self, name: str | None) -> float | list[float]:
+        if isinstance(self.band_noise_std, dict):
+            return self.band_noise_std.get(name, 0)
+        return self.band_noise_std
+
+    def _add_noise(self, tensor: torch.Tensor, std: float | list[float]) -> torch.Tensor:
+        if not tensor.is_floating_point() or (not isinstance(std, list) and std == 0):
+            return tensor
+        std = torch.as_tensor(std, dtype=tensor.dtype, device=tensor.device)
+        if std.ndim == 1:
+            # One value per band, the bands are the second dimension (B, C, (T,) H, W)
+            std = std.view(1, -1, *[1] * (tensor.ndim - 2))
+        return tensor + torch.randn_like(tensor) * std
+
+    def __call__(self, batch: dict) -> dict:
+        if self.normalize is not None:
+            batch = self.normalize(batch)
+        batch = dict(batch)
+        if isinstance(batch["image"], dict):
+            batch["image"] = dict(batch["image"])
+        tensors = self._spatial_tensors(batch)
+        if not tensors:
+            return batch
+        reference = tensors[0][0][tensors[0][1]]
+        batch_size = reference.shape[0]
+        height, width = reference.shape[-2:]
+
+        if (self.scale_jitter is not None or self.crop_size is not None) and any(
+            container[key].shape[-2:] != (height, width) for container, key, _ in tensors
+        ):
+            msg = "Random crops and scale jitter require images and masks with the same height and width."
+            raise ValueError(msg)
+
+        if self.scale_jitter is not None:
+            low, high = self.scale_jitter
+            scales = torch.rand(batch_size) * (high - low) + low
+            for container, key, is_mask in tensors:
+                container[key] = self._scale(container[key], scales, is_mask)
+
+        if self.crop_size is not None:
+            if self.crop_size[0] > height or self.crop_size[1] > width:
+                msg = f"crop_size {self.crop_size} is larger than the samples ({height}, {width})."
+                raise ValueError(msg)
+            top = torch.randint(0, height - self.crop_size[0] + 1, (batch_size,))
+            left = torch.randint(0, width - self.crop_size[1] + 1, (batch_size,))
+            for container, key, _ in tensors:
+                container[key] = self._crop(container[key], top, left)
+
+        horizontal = torch.rand(batch_size) < self.horizontal_flip
+        vertical = torch.rand(batch_size) < self.vertical_flip
+        rotate = torch.rand(batch_size) < self.rot90
+        rotations = torch.randint(1, 4, (batch_size,))
+        if rotate.any() and any(container[key].shape[-2] != container[key].shape[-1] for container, key, _ in tensors):
+            msg = "rot90 requires samples with the same height and width."
+            raise ValueError(msg)
+        for container, key, _ in tensors:
+            tensor = self._apply_to_samples(container[key], horizontal, lambda x: x.flip(-1))
+            tensor = self._apply_to_samples(tensor, vertical, lambda x: x.flip(-2))
+            for k in range(1, 4):
+                tensor = self._apply_to_samples(tensor, rotate & (rotations == k),
+                                                lambda x, k=k: torch.rot90(x, k, dims=(-2, -1)))
+            container[key] = tensor
+
+        for container, key, is_mask in tensors:
+            if not is_mask:
+                container[key] = self._add_noise(container[key], self._noise_std(key if container is not batch else None))
         return batch
+
+
+def datamodule_from_config(config_path: str | Path, **init_args: Any) -> LightningDataModule:
+    """Instantiate the datamodule of a config file (the `data` section), without the model and trainer.
+
+    Args:
+        config_path (str | Path): Config file, e.g. the one used with `terratorch fit`.
+        **init_args: Arguments overriding the `init_args` of the datamodule.
+
+    Returns:
+        LightningDataModule: The datamodule.
+    """
+    import yaml
+    from jsonargparse import ArgumentParser
+
+    with open(config_path) as f:
+        data_config = yaml.safe_load(f)["data"]
+    data_config.setdefault("init_args", {}).update(init_args)
+    parser = ArgumentParser()
+    parser.add_subclass_arguments(LightningDataModule, "data")
+    return parser.instantiate_classes(parser.parse_object({"data": data_config})).data
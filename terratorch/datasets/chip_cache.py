@@ -0,0 +1,256 @@
+# Copyright contributors to the Terratorch project
+
+"""Memory-mapped cache of preprocessed chips.
+
+Decoding compressed GeoTIFF or zarr chips, selecting bands, scaling and replacing nodata values is deterministic, the
+generic datasets can therefore store their samples before augmentation in a chip cache (``cache_dir=``) and read them
+back as memory-mapped slices in later epochs and experiments.
+
+Each dataset split is stored in its own directory, named after the dataset class and a fingerprint of the files and
+preprocessing arguments. Each modality (e.g. ``image`` and ``mask``) is stored in flat ``.npy`` shards and
+``index.json`` holds the shard, offset and shape of every chip. Changing the files or the arguments creates a new
+entry, files that are modified in place are not detected, delete the cache directory in this case.
+
+The cache is built the first time a dataset is created with ``cache_dir``, or ahead of training with
+``terratorch cache build --config <config.yaml>``.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+from collections.abc import Callable
+from pathlib import Path
+from typing import Any
+
+import numpy as np
+
+logger = logging.getLogger("terratorch")
+
+INDEX_FILE = "index.json"
+CACHE_VERSION = 1
+
+
+def _fingerprint_default(obj: Any) -> Any:
+    # Arrays (e.g. tabular samples) are fingerprinted by their content, str() truncates large arrays
+    if isinstance(obj, np.ndarray):
+        if obj.dtype.kind == "O":
+            return obj.tolist()
+        content = hashlib.sha256(np.ascontiguousarray(obj).tobytes()).hexdigest()
+        return {"shape": list(obj.shape), "dtype": str(obj.dtype), "sha256": content}
+    if isinstance(obj, np.generic):
+        return obj.item()
+    return str(obj)
+
+
+def chip_cache_path(cache_dir: str | Path, name: str, config: Any) -> Path:
+    """Directory of the cache entry of a dataset split.
+
+    Args:
+        cache_dir (str | Path): Cache directory.
+        name (str): Name of the dataset, usually the class name.
+        config (Any): Json serializable files and preprocessing arguments of the split.
+
+    Returns:
+        Path: Directory of the entry.
+    """
+    fingerprint = hashlib.sha256(json.dumps(config, sort_keys=True, default=_fingerprint_default).encode()).hexdigest()
+    return Path(cache_dir) / f"{name}-{fingerprint[:16]}"
+
+
+class ChipCache:
+    """Read access to a cache entry built by `build_chip_cache`.
+
+    The shards are opened lazily (and again in each dataloader worker) with copy-on-write memory maps, chips are
+    returned as views of the shards without reading or copying the data.
+
+    Args:
+        path (str | Path): Directory of the entry.
+    """
+
+    def __init__(self, path: str | Path):
+        self.path = Path(path)
+        with open(self.path / INDEX_FILE) as f:
+            index = json.load(f)
+        if index.get("version") != CACHE_VERSION:
+            msg = f"Chip cache {self.path} has version {index.get('version')}, expected {CACHE_VERSION}."
+            raise ValueError(msg)
+        self.num_samples = index["num_samples"]
+        self.modalities = index["modalities"]
+        self._shards: dict[tuple[str, int], np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.num_samples
+
+    def __getstate__(self) -> dict:
+        # Memory maps are opened again in the dataloader workers
+        return {**self.__dict__, "_shards": {}}
+
+    def _shard(self, modality: str, shard: int) -> np.ndarray:
+        if (modality, shard) not in self._shards:
+            file = self.path / self.modalities[modality]["shards"][shard]
+            self._shards[modality, shard] = np.load(file, mmap_mode="c")
+        return self._shards[modality, shard]
+
+    def get(self, index: int, modality: str) -> np.ndarray | None:
+        """Chip of a sample, or None if the modality is not cached for this sample."""
+        if modality not in self.modalities:
+            return None
+        entry = self.modalities[modality]["chips"][index]
+        if entry is None:
+            return None
+        shard, offset, shape = entry
+        return self._shard(modality, shard)[offset : offset + int(np.prod(shape))].reshape(shape)
+
+
+class _ShardWriter:
+    def __init__(self, directory: Path, modality: str, shard_size: int):
+        self.directory = directory
+        self.modality = modality
+        self.shard_size = shard_size
+        self.shards: list[str] = []
+        self.chips: list[list | None] = []
+        self._buffer: list[np.ndarray] = []
+        self._buffer_size = 0
+        self._offset = 0
+
+    def add(self, data: np.ndarray | None) -> None:
+        if data is None:
+            self.chips.append(None)
+            return
+        data = np.asarray(data)
+        if self._buffer and (data.dtype != self._buffer[0].dtype or self._buffer_size + data.nbytes > self.shard_size):
+            # Each shard holds chips of one dtype
+            self.flush()
+        self.chips.append([len(self.shards), self._offset, list(data.shape)])
+        self._buffer.append(data.ravel())
+        self._buffer_size += data.nbytes
+        self._offset += data.size
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        name = f"{self.modality}-{len(self.shards):05d}.npy"
+        np.save(self.directory / name, np.concatenate(self._buffer))
+        self.shards.append(name)
+        self._buffer = []
+        self._buffer_size = 0
+        self._offset = 0
+
+
+def build_chip_cache(
+    path: str | Path,
+    load_sample: Callable[[int], dict[str, np.ndarray | None]],
+    num_samples: int,
+    shard_size: int = 2**30,
+) -> ChipCache:
+    """Preprocess all samples of a dataset split and store them in a cache entry.
+
+    The entry is written to a temporary directory and moved to `path` when it is complete, so that concurrent builds
+    (e.g. one per rank) do not read incomplete entries.
+
+    Args:
+        path (str | Path): Directory of the entry, see `chip_cache_path`.
+        load_sample (Callable[[int], dict[str, np.ndarray | None]]): Function returning the preprocessed arrays of a
+            sample by modality. Modalities that are None or not numeric are not cached.
+        num_samples (int): Number of samples.
+        shard_size (int): Maximum size of the shards in bytes. Defaults to 1 GiB.
+
+    Returns:
+        ChipCache: The cache entry.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(prefix=f".{path.name}-", dir=path.parent))
+    writers: dict[str, _ShardWriter] = {}
+    try:
+        for index in range(num_samples):
+            sample = load_sample(index)
+            for modality, data in sample.items():
+                if modality not in writers:
+                    writers[modality] = _ShardWriter(tmp_dir, modality, shard_size)
+                    writers[modality].chips = [None] * index
+                if data is not None and not (isinstance(data, np.ndarray) and data.dtype.kind in "biuf"):
+                    data = None
+                writers[modality].add(data)
+            for modality, writer in writers.items():
+                if modality not in sample:
+                    writer.add(None)
+
+        for writer in writers.values():
+            writer.flush()
+        index = {
+            "version": CACHE_VERSION,
+            "num_samples": num_samples,
+            "modalities": {m: {"shards": w.shards, "chips": w.chips} for m, w in writers.items()},
+        }
+        with open(tmp_dir / INDEX_FILE, "w") as f:
+            json.dump(index, f)
+        try:
+            os.rename(tmp_dir, path)
+        except OSError:
+            if not (path / INDEX_FILE).exists():
+                raise
+            # Another process built the entry in the meantime
+            shutil.rmtree(tmp_dir)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    logger.info(f"Built the chip cache {path} with {num_samples} samples.")
+    return ChipCache(path)
+
+
+def open_chip_cache(
+    path: str | Path, load_sample: Callable[[int], dict[str, np.ndarray | None]], num_samples: int
+) -> ChipCache:
+    """Open a cache entry, building it first if it does not exist.
+
+    Args:
+        path (str | Path): Directory of the entry, see `chip_cache_path`.
+        load_sample (Callable[[int], dict[str, np.ndarray | None]]): Function returning the preprocessed arrays of a
+            sample by modality.
+        num_samples (int): Number of samples.
+
+    Returns:
+        ChipCache: The cache entry.
+    """
+    if (Path(path) / INDEX_FILE).exists():
+        cache = ChipCache(path)
+        if len(cache) == num_samples:
+            return cache
+        msg = f"Chip cache {path} has {len(cache)} samples, but the dataset has {num_samples}."
+        raise ValueError(msg)
+    logger.info(f"Building the chip cache {path}, this preprocesses all {num_samples} samples once.")
+    return build_chip_cache(path, load_sample, num_samples)
+
+
+def cache_main(argv: list[str] | None = None) -> None:
+    """Entry point of `terratorch cache`."""
+    parser = argparse.ArgumentParser(prog="terratorch cache", description="Manage the chip cache of the datasets.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Preprocess the dataset splits of a config into the cache.")
+    build_parser.add_argument("-c", "--config", required=True, help="Config file with a data section.")
+    build_parser.add_argument("--cache_dir", help="Cache directory. Defaults to the cache_dir of the datamodule.")
+    build_parser.add_argument("--stages", nargs="+", default=["fit", "test"], help="Stages to set up the datamodule for.")
+    args = parser.parse_args(argv)
+
+    if args.command == "build":
+        from terratorch.datamodules.utils import datamodule_from_config
+
+        overrides = {"cache_dir": args.cache_dir} if args.cache_dir is not None else {}
+        datamodule = datamodule_from_config(args.config, **overrides)
+        if getattr(datamodule, "cache_dir", None) is None:
+            msg = f"{type(datamodule).__name__} has no cache_dir, set it in the config or with --cache_dir."
+            raise ValueError(msg)
+
+        for stage in args.stages:
+            # The datasets build their cache entries when they are created
+            datamodule.setup(stage)
+        for split in ["train", "val", "test"]:
+            dataset = getattr(datamodule, f"{split}_dataset", None)
+            chip_cache = getattr(dataset, "chip_cache", None)
+            if chip_cache is not None:
+                print(f"{split}: {chip_cache.path} ({len(chip_cache)} samples)")
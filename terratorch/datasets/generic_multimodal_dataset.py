@@ -3,7 +3,6 @@
 
 """Module containing generic dataset classes"""
 
-import glob
 import logging
 import warnings
 import os
@@ -24,7 +23,14 @@ from matplotlib.figure import Figure
 from matplotlib.patches import Rectangle
 from torchgeo.datasets import NonGeoDataset
 
-from terratorch.datasets.utils import HLSBands, default_transform, filter_valid_files, generate_bands_intervals
+from terratorch.datasets.chip_cache import ChipCache, chip_cache_path, open_chip_cache
+from terratorch.datasets.utils import (
+    FileIndex,
+    HLSBands,
+    default_transform,
+    filter_valid_files,
+    generate_bands_intervals,
+)
 from terratorch.datasets.transforms import MultimodalTransforms
 
 logger = logging.getLogger("terratorch")
@@ -92,6 +98,8 @@ class GenericMultimodalDataset(NonGeoDataset, ABC):
         scalar_label: bool = False,
         data_with_sample_dim: bool = False,
         concat_bands: bool = False,
+        file_index_cache: str | Path | None = None,
+        cache_dir: str | Path | None = None,
         *args,
         **kwargs,
     ) -> None:
@@ -151,6 +159,12 @@ class GenericMultimodalDataset(NonGeoDataset, ABC):
             concat_bands (bool): Concatenate all image modalities along the band dimension into a single "image", so
                 that it can be processed by single-modal models. Concatenate in the order of provided modalities.
                 Works with image modalities only. Does not work with allow_missing_modalities. Defaults to False.
+            file_index_cache (str | Path, optional): Json file in which the listings of the data directories are
+                cached, so that later instantiations do not need to scan them. Listings are refreshed when the
+                directory is modified. Directories are listed once per process even without cache. Defaults to None.
+            cache_dir (str | Path, optional): Directory of a chip cache. The samples are preprocessed once (before the
+                transform) and read from memory-mapped shards afterwards, see `terratorch.datasets.chip_cache`.
+                Defaults to None.
         """
         super().__init__()
 
@@ -201,10 +215,10 @@ class GenericMultimodalDataset(NonGeoDataset, ABC):
         else:
             image_files = {}
             for m, m_paths in data_root.items():
-                image_files[m] = sorted(glob.glob(os.path.join(m_paths, image_grep[m])))
+                image_files[m] = FileIndex(m_paths, file_index_cache).glob(image_grep[m])
 
             if label_data_root is not None:
-                image_files["mask"] = sorted(glob.glob(os.path.join(label_data_root, label_grep)))
+                image_files["mask"] = FileIndex(label_data_root, file_index_cache).glob(label_grep)
 
             if allow_substring_file_names:
                 # Remove file extensions
@@ -239,6 +253,13 @@ class GenericMultimodalDataset(NonGeoDataset, ABC):
                     warnings.warn(f"Keys expected in table index (first column) for labels (file: {label_data_root}). "
                                   f"The keys {valid_files[:3] + ['...']} are not in the index.")
 
+        # List each directory once instead of globbing it for every sample
+        if allow_substring_file_names:
+            file_indices = {m: FileIndex(m_path, file_index_cache) for m, m_path in data_root.items()
+                            if not isinstance(m_path, pd.DataFrame)}
+            if label_data_root is not None and not isinstance(label_data_root, pd.DataFrame):
+                label_index = FileIndex(label_data_root, file_index_cache)
+
         # Iterate over all files in split
         for file in valid_files:
             sample = {}
@@ -249,7 +270,7 @@ class GenericMultimodalDataset(NonGeoDataset, ABC):
                     sample[m] = m_path.loc[file].values
                 elif allow_substring_file_names:
                     # Substring match with image_grep
-                    m_files = glob.glob(os.path.join(m_path, file + image_grep[m]))
+                    m_files = file_indices[m].glob(file + image_grep[m])
                     if m_files:
                         sample[m] = m_files[0]
                 else:
@@ -264,7 +285,7 @@ class GenericMultimodalDataset(NonGeoDataset, ABC):
                     sample["mask"] = label_data_root.loc[file].values
                 elif allow_substring_file_names:
                     # Substring match with label_grep
-                    l_files = glob.glob(os.path.join(label_data_root, file + label_grep))
+                    l_files = label_index.glob(file + label_grep)
                     if l_files:
                         sample["mask"] = l_files[0]
                 else:
@@ -329,6 +350,8 @@ class GenericMultimodalDataset(NonGeoDataset, ABC):
 
         warnings.filterwarnings("ignore", category=rasterio.errors.NotGeoreferencedWarning)
 
+        self.chip_cache = self._open_chip_cache(cache_dir) if cache_dir is not None else None
+
     def __len__(self) -> int:
         return len(self.samples)
 
@@ -343,37 +366,11 @@ class GenericMultimodalDataset(NonGeoDataset, ABC):
             sample = self.samples[index]
 
         for modality, file in sample.items():
-            data = self._load_file(
-                file,
-                nan_replace=self.no_label_replace if modality == "mask" else self.no_data_replace,
-                modality=modality,
-            )
-
-            # Expand temporal dim
-            if modality in self.filter_indices and self.expand_temporal_dimension:
-                data = rearrange(
-                    data, "(channels time) h w -> channels time h w", channels=len(self.dataset_bands[modality])
-                )
-
-            if modality == "mask" and len(data.shape) == 3 and len(data) == 1:
-                # tasks expect image masks without channel dim
-                data = data[0]
-
-            if modality in self.image_modalities and len(data.shape) >= 3 and self.channel_position:
-                # to channels last (required by albumentations)
-                data = np.moveaxis(data, self.channel_position, -1)
-
-            if modality in self.filter_indices:
-                data = data[..., self.filter_indices[modality]]
-
-            if modality in self.constant_scale:
-                data = data.astype(np.float32) * self.constant_scale[modality]
-
+            data = self.chip_cache.get(index, modality) if self.chip_cache is not None else None
+            if data is None:
+                data = self._load_modality(modality, file)
             output[modality] = data
 
-        if self.reduce_zero_label:
-            output["mask"] -= 1
-
         if self.scalar_label:
             output["label"] = output.pop("mask")
 
@@ -392,6 +389,57 @@ class GenericMultimodalDataset(NonGeoDataset, ABC):
 
         return output
 
+    def _load_sample(self, index: int) -> dict[str, np.ndarray]:
+        return {modality: self._load_modality(modality, file) for modality, file in self.samples[index].items()}
+
+    def _load_modality(self, modality: str, file: str | np.ndarray) -> np.ndarray:
+        data = self._load_file(
+            file,
+            nan_replace=self.no_label_replace if modality == "mask" else self.no_data_replace,
+            modality=modality,
+        )
+
+        # Expand temporal dim
+        if modality in self.filter_indices and self.expand_temporal_dimension:
+            data = rearrange(
+                data, "(channels time) h w -> channels time h w", channels=len(self.dataset_bands[modality])
+            )
+
+        if modality == "mask" and len(data.shape) == 3 and len(data) == 1:
+            # tasks expect image masks without channel dim
+            data = data[0]
+
+        if modality in self.image_modalities and len(data.shape) >= 3 and self.channel_position:
+            # to channels last (required by albumentations)
+            data = np.moveaxis(data, self.channel_position, -1)
+
+        if modality in self.filter_indices:
+            data = data[..., self.filter_indices[modality]]
+
+        if modality in self.constant_scale:
+            data = data.astype(np.float32) * self.constant_scale[modality]
+
+        if modality == "mask" and self.reduce_zero_label:
+            data = data - 1
+
+        return data
+
+    def _open_chip_cache(self, cache_dir: str | Path) -> ChipCache:
+        config = {
+            "samples": self.samples,
+            "image_modalities": self.image_modalities,
+            "dataset_bands": self.dataset_bands,
+            "filter_indices": self.filter_indices,
+            "constant_scale": self.constant_scale,
+            "no_data_replace": self.no_data_replace,
+            "no_label_replace": self.no_label_replace,
+            "expand_temporal_dimension": self.expand_temporal_dimension,
+            "reduce_zero_label": self.reduce_zero_label,
+            "channel_position": self.channel_position,
+        }
+        path = chip_cache_path(cache_dir, type(self).__name__, config)
+        return open_chip_cache(path, self._load_sample, len(self))
+
     def _load_file(self, path, nan_replace: int | float | None = None, modality: str | None = None) -> xr.DataArray:
         if isinstance(path, np.ndarray):
             # data was loaded from table and is saved in memory
@@ -21,7 +21,14 @@ from matplotlib.patches import Rectangle
 from torch import Tensor
 from torchgeo.datasets import NonGeoDataset
 
-from terratorch.datasets.utils import HLSBands, default_transform, filter_valid_files, generate_bands_intervals
+from terratorch.datasets.chip_cache import ChipCache, chip_cache_path, open_chip_cache
+from terratorch.datasets.utils import (
+    HLSBands,
+    default_transform,
+    filter_valid_files,
+    generate_bands_intervals,
+    read_raster,
+)
 
 
 class GenericPixelWiseDataset(NonGeoDataset, ABC):
@@ -48,6 +55,8 @@ class GenericPixelWiseDataset(NonGeoDataset, ABC):
         no_label_replace: int | None = None,
         expand_temporal_dimension: bool = False,
         reduce_zero_label: bool = False,
+        load_with_xarray: bool = False,
+        cache_dir: str | Path | None = None,
     ) -> None:
         """Constructor
 
@@ -83,6 +92,12 @@ class GenericPixelWiseDataset(NonGeoDataset, ABC):
                 Defaults to False.
             reduce_zero_label (bool): Subtract 1 from all labels. Useful when labels start from 1 instead of the
                 expected 0. Defaults to False.
+            load_with_xarray (bool): Load the files with rioxarray instead of reading them directly with rasterio.
+                Slower, but gives access to the coordinates. Always True when `_load_file` is overridden. Defaults
+                to False.
+            cache_dir (str | Path | None): Directory of a chip cache. The samples are preprocessed once (before the
+                transform) and read from memory-mapped shards afterwards, see `terratorch.datasets.chip_cache`.
+                Defaults to None.
         """
         super().__init__()
 
@@ -96,6 +111,8 @@ class GenericPixelWiseDataset(NonGeoDataset, ABC):
         self.segmentation_mask_files = sorted(glob.glob(os.path.join(label_data_root, label_grep)))
         self.reduce_zero_label = reduce_zero_label
         self.expand_temporal_dimension = expand_temporal_dimension
+        # Subclasses overriding `_load_file` keep reading their files with it
+        self.load_with_xarray = load_with_xarray or type(self)._load_file is not GenericPixelWiseDataset._load_file
 
         if self.expand_temporal_dimension and output_bands is None:
             msg = "Please provide output_bands when expand_temporal_dimension is True"
@@ -138,6 +155,7 @@ class GenericPixelWiseDataset(NonGeoDataset, ABC):
 
         # If no transform is given, apply only to transform to torch tensor
         self.transform = transform if transform else default_transform
+        self.chip_cache = self._open_chip_cache(cache_dir) if cache_dir is not None else None
         # self.transform = transform if transform else ToTensorV2()
 
         import warnings
@@ -150,29 +168,58 @@ class GenericPixelWiseDataset(NonGeoDataset, ABC):
         return len(self.image_files)
 
     def __getitem__(self, index: int) -> dict[str, Any]:
-        image = self._load_file(self.image_files[index], nan_replace=self.no_data_replace).to_numpy()
+        if self.chip_cache is not None:
+            output = {"image": self.chip_cache.get(index, "image"), "mask": self.chip_cache.get(index, "mask")}
+        else:
+            output = self._load_sample(index)
+        if self.transform:
+            output = self.transform(**output)
+        output["filename"] = self.image_files[index]
+
+        return output
+
+    def _load_sample(self, index: int) -> dict[str, np.ndarray]:
+        if self.load_with_xarray:
+            image = self._load_file(self.image_files[index], nan_replace=self.no_data_replace).to_numpy()
+            mask = self._load_file(self.segmentation_mask_files[index], nan_replace=self.no_label_replace).to_numpy()
+        else:
+            # Only the output bands are read, unless they are filtered after expanding the temporal dimension
+            indexes = None if self.expand_temporal_dimension else self.filter_indices or None
+            image = read_raster(self.image_files[index], indexes=indexes, nan_replace=self.no_data_replace)
+            mask = read_raster(self.segmentation_mask_files[index], indexes=[0], nan_replace=self.no_label_replace)
         # to channels last
         if self.expand_temporal_dimension:
             image = rearrange(image, "(channels time) h w -> channels time h w", channels=len(self.output_bands))
         image = np.moveaxis(image, 0, -1)
 
-        if self.filter_indices:
+        if self.filter_indices and (self.load_with_xarray or self.expand_temporal_dimension):
             image = image[..., self.filter_indices]
+        image = image.astype(np.float32, copy=False)
+        if self.constant_scale != 1:
+            image *= self.constant_scale
         output = {
-            "image": image.astype(np.float32) * self.constant_scale,
-            "mask": self._load_file(self.segmentation_mask_files[index], nan_replace=self.no_label_replace).to_numpy()[
-                0
-            ],
+            "image": image,
+            "mask": mask[0],
         }
 
         if self.reduce_zero_label:
             output["mask"] -= 1
-        if self.transform:
-            output = self.transform(**output)
-        output["filename"] = self.image_files[index]
-
         return output
 
+    def _open_chip_cache(self, cache_dir: str | Path) -> ChipCache:
+        config = {
+            "files": list(zip(self.image_files, self.segmentation_mask_files, strict=False)),
+            "filter_indices": self.filter_indices,
+            "constant_scale": self.constant_scale,
+            "no_data_replace": self.no_data_replace,
+            "no_label_replace": self.no_label_replace,
+            "expand_temporal_dimension": self.expand_temporal_dimension,
+            "reduce_zero_label": self.reduce_zero_label,
+            "load_with_xarray": self.load_with_xarray,
+        }
+        path = chip_cache_path(cache_dir, type(self).__name__, config)
+        return open_chip_cache(path, self._load_sample, len(self))
+
     def _load_file(self, path, nan_replace: int | float | None = None) -> xr.DataArray:
         data = rioxarray.open_rasterio(path, masked=True)
         if nan_replace is not None:
@@ -203,6 +250,8 @@ class GenericNonGeoSegmentationDataset(GenericPixelWiseDataset):
         no_label_replace: int | None = None,
         expand_temporal_dimension: bool = False,
         reduce_zero_label: bool = False,
+        load_with_xarray: bool = False,
+        cache_dir: str | Path | None = None,
     ) -> None:
         """Constructor
 
@@ -240,6 +289,12 @@ class GenericNonGeoSegmentationDataset(GenericPixelWiseDataset):
                 Defaults to False.
             reduce_zero_label (bool): Subtract 1 from all labels. Useful when labels start from 1 instead of the
                 expected 0. Defaults to False.
+            load_with_xarray (bool): Load the files with rioxarray instead of reading them directly with rasterio.
+                Slower, but gives access to the coordinates. Always True when `_load_file` is overridden. Defaults
+                to False.
+            cache_dir (str | Path | None): Directory of a chip cache. The samples are preprocessed once (before the
+                transform) and read from memory-mapped shards afterwards, see `terratorch.datasets.chip_cache`.
+                Defaults to None.
         """
         super().__init__(
             data_root,
@@ -258,6 +313,8 @@ class GenericNonGeoSegmentationDataset(GenericPixelWiseDataset):
             no_label_replace=no_label_replace,
             expand_temporal_dimension=expand_temporal_dimension,
             reduce_zero_label=reduce_zero_label,
+            load_with_xarray=load_with_xarray,
+            cache_dir=cache_dir,
         )
         self.num_classes = num_classes
         self.class_names = class_names
@@ -373,6 +430,8 @@ class GenericNonGeoPixelwiseRegressionDataset(GenericPixelWiseDataset):
         no_label_replace: int | None = None,
         expand_temporal_dimension: bool = False,
         reduce_zero_label: bool = False,
+        load_with_xarray: bool = False,
+        cache_dir: str | Path | None = None,
     ) -> None:
         """Constructor
 
@@ -408,6 +467,12 @@ class GenericNonGeoPixelwiseRegressionDataset(GenericPixelWiseDataset):
                 Defaults to False.
             reduce_zero_label (bool): Subtract 1 from all labels. Useful when labels start from 1 instead of the
                 expected 0. Defaults to False.
+            load_with_xarray (bool): Load the files with rioxarray instead of reading them directly with rasterio.
+                Slower, but gives access to the coordinates. Always True when `_load_file` is overridden. Defaults
+                to False.
+            cache_dir (str | Path | None): Directory of a chip cache. The samples are preprocessed once (before the
+                transform) and read from memory-mapped shards afterwards, see `terratorch.datasets.chip_cache`.
+                Defaults to None.
         """
         super().__init__(
             data_root,
@@ -426,6 +491,8 @@ class GenericNonGeoPixelwiseRegressionDataset(GenericPixelWiseDataset):
             no_label_replace=no_label_replace,
             expand_temporal_dimension=expand_temporal_dimension,
             reduce_zero_label=reduce_zero_label,
+            load_with_xarray=load_with_xarray,
+            cache_dir=cache_dir,
         )
 
     def __getitem__(self, index: int) -> dict[str, Any]:
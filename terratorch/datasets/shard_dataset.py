@@ -0,0 +1,405 @@
+# Copyright contributors to the Terratorch project
+
+"""Streaming of preprocessed samples from tar shards.
+
+`write_shards` stores the samples of a generic pixel-wise or multimodal dataset before augmentation in tar shards
+(WebDataset layout: one ``<key>.<modality>.npy`` member per array and a ``<key>.json`` member with the file names) and
+a ``shards.json`` manifest. `ShardDataset` streams them from a local directory or any fsspec URL (e.g.
+``s3://bucket/train``, which requires s3fs), so that training does not need a POSIX directory that can be listed.
+
+The samples of the shuffled shards are split between the ranks and dataloader workers and read ahead of time in a
+background thread. Use `ShardDataLoader` to save and restore the position in the epoch with the Lightning checkpoints.
+Shards are written with ``terratorch shards write --config <config.yaml> --output_dir <dir>``.
+"""
+
+import argparse
+import io
+import json
+import logging
+import math
+import queue
+import random
+import tarfile
+import threading
+from collections import deque
+from collections.abc import Callable, Iterator
+from pathlib import Path
+from typing import Any
+
+import albumentations as A
+import fsspec
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.utils.data import DataLoader, IterableDataset, get_worker_info
+
+from terratorch.datasets.generic_multimodal_dataset import GenericMultimodalDataset, MultimodalToTensor
+from terratorch.datasets.transforms import MultimodalTransforms
+from terratorch.datasets.utils import default_transform
+
+logger = logging.getLogger("terratorch")
+
+MANIFEST_FILE = "shards.json"
+
+
+def _sample_filename(dataset: Any, index: int) -> Any:
+    if isinstance(dataset, GenericMultimodalDataset):
+        # Tabular data is stored in the samples as arrays
+        return {m: f for m, f in dataset.samples[index].items() if isinstance(f, str)}
+    return dataset.image_files[index]
+
+
+def write_shards(dataset: Any, output_dir: str | Path, samples_per_shard: int = 1000) -> dict:
+    """Write the preprocessed samples of a generic dataset into tar shards.
+
+    Args:
+        dataset (GenericPixelWiseDataset | GenericMultimodalDataset): Dataset to write. The samples are stored before
+            the transform, which is applied by `ShardDataset`.
+        output_dir (str | Path): Directory or fsspec URL of the shards.
+        samples_per_shard (int): Number of samples per shard. Defaults to 1000.
+
+    Returns:
+        dict: The manifest of the shards.
+    """
+    multimodal = isinstance(dataset, GenericMultimodalDataset)
+    mask_dtype = None
+    if len(dataset) and (not multimodal or "mask" in dataset.samples[0]):
+        # The datasets cast the masks after the transform (e.g. to long for segmentation)
+        sample = dataset[0]
+        mask = sample.get("label" if multimodal and dataset.scalar_label else "mask")
+        mask_dtype = str(mask.dtype).removeprefix("torch.") if isinstance(mask, torch.Tensor) else None
+    manifest = {
+        "format": "multimodal" if multimodal else "pixel_wise",
+        "num_samples": len(dataset),
+        "mask_dtype": mask_dtype,
+        "shards": [],
+    }
+    if multimodal:
+        manifest.update(
+            image_modalities=dataset.image_modalities,
+            non_image_modalities=[m for m in dataset.non_image_modalities if m != "label"],
+            scalar_label=dataset.scalar_label,
+            concat_bands=dataset.concat_bands,
+        )
+
+    fs, root = fsspec.core.url_to_fs(str(output_dir))
+    fs.makedirs(root, exist_ok=True)
+    for shard, start in enumerate(range(0, len(dataset), samples_per_shard)):
+        indices = range(start, min(start + samples_per_shard, len(dataset)))
+        name = f"shard-{shard:06d}.tar"
+        with fs.open(f"{root}/{name}", "wb") as f, tarfile.open(fileobj=f, mode="w") as tar:
+            for index in indices:
+                key = f"{index:09d}"
+                members = {f"{key}.{m}.npy": _to_npy(data) for m, data in dataset._load_sample(index).items()}
+                members[f"{key}.json"] = json.dumps({"filename": _sample_filename(dataset, index)}).encode()
+                for member_name, data in members.items():
+                    info = tarfile.TarInfo(member_name)
+                    info.size = len(data)
+                    tar.addfile(info, io.BytesIO(data))
+        manifest["shards"].append({"name": name, "num_samples": len(indices)})
+        logger.info(f"Wrote {name} with {len(indices)} samples.")
+
+    with fs.open(f"{root}/{MANIFEST_FILE}", "w") as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def _to_npy(data: np.ndarray) -> bytes:
+    buffer = io.BytesIO()
+    np.save(buffer, np.ascontiguousarray(data), allow_pickle=False)
+    return buffer.getvalue()
+
+
+def _read_shard(url: str, storage_options: dict) -> list[tuple[str, dict]]:
+    # Shards are read completely into memory, object stores are much faster with one large request
+    with fsspec.open(url, "rb", **storage_options) as f:
+        data = f.read()
+    samples: dict[str, dict] = {}
+    with tarfile.open(fileobj=io.BytesIO(data), mode="r") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, _, suffix = member.name.partition(".")
+            samples.setdefault(key, {})[suffix] = tar.extractfile(member).read()
+    return list(samples.items())
+
+
+class ShardDataset(IterableDataset):
+    """Iterable dataset streaming the samples written by `write_shards`.
+
+    The shard order and the samples (within a buffer of `shuffle_buffer` samples) are shuffled per epoch. Each rank
+    gets `num_samples // world_size` samples, so that all ranks run the same number of steps, the remaining samples
+    of the epoch are dropped. The samples of a rank are split evenly between its dataloader workers, each worker reads
+    a contiguous range of the shards. Shards at the boundary of two ranges are read by both workers, so write many
+    more shards than `num_workers * world_size`.
+
+    Args:
+        url (str | Path): Directory or fsspec URL of the shards, with the `shards.json` manifest.
+        transform (A.Compose | dict | Callable | None): Transform applied to the samples, like the `transform` of the
+            dataset the shards were written from. Defaults to None, which converts the arrays to tensors.
+        shuffle (bool): Shuffle the shards and samples. Defaults to True.
+        shuffle_buffer (int): Number of samples the samples are drawn from when shuffling. Defaults to 1000.
+        prefetch_shards (int): Number of shards read ahead in a background thread. Defaults to 2.
+        seed (int): Seed of the shuffling, combined with the epoch. Defaults to 0.
+        storage_options (dict | None): Options of the fsspec filesystem, e.g. the endpoint of an S3 compatible
+            object store. Defaults to None.
+    """
+
+    def __init__(
+        self,
+        url: str | Path,
+        transform: A.Compose | dict | Callable | None = None,
+        shuffle: bool = True,
+        shuffle_buffer: int = 1000,
+        prefetch_shards: int = 2,
+        seed: int = 0,
+        storage_options: dict | None = None,
+    ):
+        super().__init__()
+        self.url = str(url).rstrip("/")
+        self.storage_options = storage_options or {}
+        with fsspec.open(f"{self.url}/{MANIFEST_FILE}", "r", **self.storage_options) as f:
+            self.manifest = json.load(f)
+        self.shards = self.manifest["shards"]
+        self.multimodal = self.manifest["format"] == "multimodal"
+        self.shuffle = shuffle
+        self.shuffle_buffer = shuffle_buffer
+        self.prefetch_shards = prefetch_shards
+        self.seed = seed
+        self.epoch = 0
+        # Samples of each worker to skip when resuming in the middle of an epoch
+        self._skip: dict[int, int] = {}
+
+        if not self.multimodal:
+            self.transform = transform or default_transform
+        else:
+            modalities = self.manifest["image_modalities"] + self.manifest["non_image_modalities"]
+            non_image_modalities = self.manifest["non_image_modalities"]
+            if self.manifest["scalar_label"]:
+                non_image_modalities = [*non_image_modalities, "label"]
+            if isinstance(transform, A.Compose):
+                self.transform = MultimodalTransforms(transform, non_image_modalities=non_image_modalities)
+            elif isinstance(transform, dict):
+                transform = {m: transform.get(m, default_transform) for m in modalities}
+                self.transform = MultimodalTransforms(transform, shared=False)
+            else:
+                self.transform = transform or MultimodalToTensor(modalities)
+
+    def __len__(self) -> int:
+        # Number of samples of this rank
+        return self.manifest["num_samples"] // self._rank_info()[1]
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    @staticmethod
+    def _rank_info() -> tuple[int, int]:
+        if dist.is_available() and dist.is_initialized():
+            return dist.get_rank(), dist.get_world_size()
+        return 0, 1
+
+    def worker_num_samples(self, num_workers: int) -> list[int]:
+        """Number of samples of each dataloader worker of this rank.
+
+        Args:
+            num_workers (int): Number of dataloader workers, at least 1.
+
+        Returns:
+            list[int]: Number of samples by worker id.
+        """
+        num_samples = len(self)
+        return [(w + 1) * num_samples // num_workers - w * num_samples // num_workers for w in range(num_workers)]
+
+    def _worker_shards(self) -> tuple[int, list[tuple[dict, int, int]]]:
+        # (shard, start, stop) of the sample ranges read by this worker
+        rank, _ = self._rank_info()
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+
+        shards = list(self.shards)
+        if self.shuffle:
+            # Same order on all ranks and workers
+            random.Random(self.seed + self.epoch).shuffle(shards)
+        counts = self.worker_num_samples(num_workers)
+        start = rank * len(self) + sum(counts[:worker_id])
+        stop = start + counts[worker_id]
+
+        ranges = []
+        offset = 0
+        for shard in shards:
+            shard_start, offset = offset, offset + shard["num_samples"]
+            if offset > start and shard_start < stop:
+                ranges.append((shard, max(start - shard_start, 0), min(stop, offset) - shard_start))
+        return worker_id, ranges
+
+    def _prefetch(self, shards: list[tuple[dict, int, int]]) -> Iterator[list[tuple[str, dict]]]:
+        shard_queue: queue.Queue = queue.Queue(maxsize=max(self.prefetch_shards, 1))
+        stop = threading.Event()
+
+        def read():
+            try:
+                for shard, first, last in shards:
+                    samples = _read_shard(f"{self.url}/{shard['name']}", self.storage_options)[first:last]
+                    while not stop.is_set():
+                        try:
+                            shard_queue.put(samples, timeout=0.1)
+                            break
+                        except queue.Full:
+                            continue
+                    if stop.is_set():
+                        return
+                shard_queue.put(None)
+            except BaseException as e:  # noqa: BLE001
+                shard_queue.put(e)
+
+        thread = threading.Thread(target=read, daemon=True)
+        thread.start()
+        try:
+            while (samples := shard_queue.get()) is not None:
+                if isinstance(samples, BaseException):
+                    raise samples
+                yield samples
+        finally:
+            stop.set()
+
+    def _samples(self, shards: list[tuple[dict, int, int]], rng: random.Random) -> Iterator[tuple[str, dict]]:
+        buffer: deque | list = [] if self.shuffle else deque()
+        for samples in self._prefetch(shards):
+            for sample in samples:
+                buffer.append(sample)
+                if len(buffer) >= max(self.shuffle_buffer, 1):
+                    yield self._pop(buffer, rng)
+        while buffer:
+            yield self._pop(buffer, rng)
+
+    def _pop(self, buffer: deque | list, rng: random.Random) -> tuple[str, dict]:
+        if not self.shuffle:
+            return buffer.popleft()
+        index = rng.randrange(len(buffer))
+        buffer[index], buffer[-1] = buffer[-1], buffer[index]
+        return buffer.pop()
+
+    def _decode(self, members: dict) -> dict[str, Any]:
+        output = {
+            name.removesuffix(".npy"): np.load(io.BytesIO(data), allow_pickle=False)
+            for name, data in members.items()
+            if name.endswith(".npy")
+        }
+        filename = json.loads(members["json"])["filename"] if "json" in members else None
+
+        if not self.multimodal:
+            output = self.transform(**output)
+        else:
+            if self.manifest["scalar_label"] and "mask" in output:
+                output["label"] = output.pop("mask")
+            output = self.transform(output)
+            if self.manifest["concat_bands"]:
+                data = [output.pop(m) for m in self.manifest["image_modalities"] if m in output]
+                output["image"] = torch.cat(data, dim=0)
+            else:
+                modalities = self.manifest["image_modalities"] + self.manifest["non_image_modalities"]
+                output["image"] = {m: output.pop(m) for m in modalities if m in output}
+
+        mask_key = "label" if self.multimodal and self.manifest["scalar_label"] else "mask"
+        if self.manifest["mask_dtype"] is not None and isinstance(output.get(mask_key), torch.Tensor):
+            output[mask_key] = output[mask_key].to(getattr(torch, self.manifest["mask_dtype"]))
+        output["filename"] = filename
+        return output
+
+    def __iter__(self) -> Iterator[dict[str, Any]]:
+        worker_id, shards = self._worker_shards()
+        rng = random.Random(f"{self.seed}-{self.epoch}-{worker_id}-{shards[0][0]['name'] if shards else ''}")
+        skip = self._skip.get(worker_id, 0)
+        for _key, members in self._samples(shards, rng):
+            if skip:
+                # Samples consumed before resuming are drawn from the buffer but not decoded
+                skip -= 1
+                continue
+            yield self._decode(members)
+
+    def load_iteration_state(self, epoch: int, skip: dict[int, int] | None = None) -> None:
+        """Continue an epoch, skipping the samples each dataloader worker already yielded.
+
+        Args:
+            epoch (int): Epoch to continue.
+            skip (dict[int, int] | None): Number of samples to skip by worker id. Defaults to None.
+        """
+        self.epoch = epoch
+        self._skip = skip or {}
+
+
+class ShardDataLoader(DataLoader):
+    """DataLoader of a `ShardDataset` with a resumable iteration state.
+
+    It sets the epoch of the dataset at the start of each iteration and counts the batches it returned.
+    `state_dict` and `load_state_dict` are called by Lightning when saving and restoring checkpoints. The batches of
+    an iterable dataset are returned by the workers in turn, skipping the workers that have no batches left. The
+    number of samples of each worker is known, so the number of samples each worker yielded follows from the number
+    of batches. The dataset is passed to the workers at the start of each epoch, so `persistent_workers` is not
+    supported.
+    """
+
+    def __init__(self, dataset: ShardDataset, *args: Any, **kwargs: Any):
+        super().__init__(dataset, *args, **kwargs)
+        self._epoch = 0
+        self._num_batches = 0
+        self._resume: dict | None = None
+
+    def __iter__(self) -> Iterator:
+        if self._resume is not None:
+            state, self._resume = self._resume, None
+            self._epoch, self._num_batches = state["epoch"], state["num_batches"]
+        else:
+            self._num_batches = 0
+        self.dataset.load_iteration_state(self._epoch, self._skipped_samples(self._num_batches))
+        for batch in super().__iter__():
+            self._num_batches += 1
+            yield batch
+        self._epoch += 1
+        self._num_batches = 0
+
+    def _skipped_samples(self, num_batches: int) -> dict[int, int]:
+        batch_size = self.batch_size or 1
+        counts = self.dataset.worker_num_samples(max(self.num_workers, 1))
+        worker_batches = [c // batch_size if self.drop_last else math.ceil(c / batch_size) for c in counts]
+        consumed = [0] * len(counts)
+        for _ in range(num_batches):
+            # Next worker in turn with batches left
+            worker = min(range(len(counts)), key=lambda w: (consumed[w], w) if consumed[w] < worker_batches[w]
+                         else (math.inf, w))
+            if consumed[worker] >= worker_batches[worker]:
+                break
+            consumed[worker] += 1
+        return {w: min(consumed[w] * batch_size, counts[w]) for w in range(len(counts))}
+
+    def state_dict(self) -> dict:
+        return {"epoch": self._epoch, "num_batches": self._num_batches}
+
+    def load_state_dict(self, state_dict: dict) -> None:
+        self._resume = dict(state_dict)
+
+
+def shards_main(argv: list[str] | None = None) -> None:
+    """Entry point of `terratorch shards`."""
+    parser = argparse.ArgumentParser(prog="terratorch shards", description="Write datasets into tar shards.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    write_parser = subparsers.add_parser("write", help="Write the dataset splits of a config into tar shards.")
+    write_parser.add_argument("-c", "--config", required=True, help="Config file with a data section.")
+    write_parser.add_argument("--output_dir", required=True, help="Directory or fsspec URL of the shards.")
+    write_parser.add_argument("--samples_per_shard", type=int, default=1000, help="Number of samples per shard.")
+    write_parser.add_argument("--stages", nargs="+", default=["fit", "test"], help="Stages to set up the datamodule for.")
+    args = parser.parse_args(argv)
+
+    if args.command == "write":
+        from terratorch.datamodules.utils import datamodule_from_config
+
+        datamodule = datamodule_from_config(args.config)
+        for stage in args.stages:
+            datamodule.setup(stage)
+        for split in ["train", "val", "test"]:
+            dataset = getattr(datamodule, f"{split}_dataset", None)
+            if dataset is None:
+                continue
+            output_dir = f"{str(args.output_dir).rstrip('/')}/{split}"
+            manifest = write_shards(dataset, output_dir, samples_per_shard=args.samples_per_shard)
+            print(f"{split}: {output_dir} ({manifest['num_samples']} samples, {len(manifest['shards'])} shards)")
@@ -1,6 +1,11 @@
 # Copyright contributors to the Terratorch project
 
+import bisect
+import fnmatch
+import glob
+import json
 import os
+import re
 from collections.abc import Iterator, Sequence
 from enum import Enum
 from functools import partial
@@ -126,27 +131,155 @@ def filter_valid_files(
         valid_files = [os.path.splitext(sub)[0] for sub in valid_files]
     filter_function = partial(
         _split_filter_function,
-        valid_files=valid_files,
+        valid_files=_ValidFileMatcher(valid_files),
         ignore_extensions=ignore_extensions,
         allow_substring=allow_substring,
     )
-    # TODO fix this
     filtered = filter(filter_function, files)
 
     return sorted(filtered)
 
 
-def _split_filter_function(file_name, valid_files: list[str], ignore_extensions=False, allow_substring=True):
+class _ValidFileMatcher:
+    """Set of valid file names, answering exact (`in`) and substring (`any_in`) queries without looping over them.
+
+    Substring queries hash every substring of the file name whose length is one of the lengths of the valid names,
+    which costs O(len(name) * number of distinct lengths) instead of O(number of valid names).
+    """
+
+    def __init__(self, valid_files: list[str]):
+        self.valid_files = set(valid_files)
+        self.lengths = sorted({len(f) for f in self.valid_files})
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.valid_files
+
+    def any_in(self, name: str) -> bool:
+        for length in self.lengths:
+            if length > len(name):
+                break
+            for start in range(len(name) - length + 1):
+                if name[start : start + length] in self.valid_files:
+                    return True
+        return False
+
+
+def _split_filter_function(
+    file_name, valid_files: list[str] | _ValidFileMatcher, ignore_extensions=False, allow_substring=True
+):
     base_name = os.path.basename(file_name)
     if ignore_extensions:
         base_name = os.path.splitext(base_name)[0]
+    if not isinstance(valid_files, _ValidFileMatcher):
+        valid_files = _ValidFileMatcher(valid_files)
     if not allow_substring:
         return base_name in valid_files
+    return valid_files.any_in(base_name)
+
+
+def read_raster(
+    path, indexes: list[int] | None = None, dtype: str | np.dtype = np.float32, nan_replace: float | None = None
+) -> np.ndarray:
+    """Read a raster with rasterio directly into an array of the target dtype.
+
+    Values equal to the nodata value of the file and nan values are replaced by `nan_replace`, or set to nan if it is
+    None, like `rioxarray.open_rasterio(path, masked=True).fillna(nan_replace)` but without the xarray object and the
+    float64 copies.
+
+    Args:
+        path (str | Path): Path to the raster.
+        indexes (list[int] | None): Zero-based indices of the bands to read. Defaults to None, which reads all bands.
+        dtype (str | np.dtype): Dtype of the returned array. Must be a float dtype if nan_replace is None.
+            Defaults to float32.
+        nan_replace (float | None): Value replacing nodata. Defaults to None.
+
+    Returns:
+        np.ndarray: Array of shape (bands, height, width).
+    """
+    import rasterio
+
+    with rasterio.open(path) as src:
+        band_indexes = [i + 1 for i in indexes] if indexes is not None else list(range(1, src.count + 1))
+        data = np.empty((len(band_indexes), src.height, src.width), dtype=dtype)
+        src.read(band_indexes, out=data)
+        nodata = src.nodata
+        is_float_source = np.issubdtype(np.dtype(src.dtypes[0]), np.floating)
+
+    if nodata is None and not is_float_source:
+        return data
+    invalid = np.zeros(data.shape, dtype=bool)
+    if nodata is not None and not np.isnan(nodata):
+        invalid |= data == np.asarray(nodata).astype(data.dtype)
+    if np.issubdtype(data.dtype, np.floating):
+        invalid |= np.isnan(data)
+    data[invalid] = np.nan if nan_replace is None else nan_replace
+    return data
+
+
+class FileIndex:
+    """Sorted listing of a directory, used to match many file patterns against it without scanning it every time.
+
+    Listings are cached in memory and, if `cache_file` is given, in a json file, so that other splits and later runs
+    can skip the scan. A cached listing is invalidated when the modification time of the directory changes.
 
-    for valid_file in valid_files:
-        if valid_file in base_name:
-            return True
-    return False
+    Args:
+        directory (str | Path): Directory to index.
+        cache_file (str | Path | None): Json file used to persist the listings. Defaults to None.
+    """
+
+    _listings: dict[str, tuple[int, list[str]]] = {}
+
+    def __init__(self, directory, cache_file=None):
+        self.directory = str(directory)
+        self.names = self._list(cache_file)
+
+    def _list(self, cache_file) -> list[str]:
+        try:
+            mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return []
+        key = os.path.abspath(self.directory)
+        cached = self._listings.get(key)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        persisted = {}
+        if cache_file is not None and os.path.isfile(cache_file):
+            with open(cache_file) as f:
+                persisted = json.load(f)
+        if persisted.get(key, {}).get("mtime") == mtime:
+            names = persisted[key]["names"]
+        else:
+            names = sorted(entry.name for entry in os.scandir(self.directory))
+            if cache_file is not None:
+                persisted[key] = {"mtime": mtime, "names": names}
+                tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+                with open(tmp_file, "w") as f:
+                    json.dump(persisted, f)
+                os.replace(tmp_file, cache_file)
+
+        self._listings[key] = (mtime, names)
+        return names
+
+    def glob(self, pattern: str) -> list[str]:
+        """Equivalent of `sorted(glob.glob(os.path.join(directory, pattern)))`, using the index.
+
+        Only the names sharing the literal prefix of the pattern are matched, found by bisection.
+        """
+        if "/" in pattern or os.sep in pattern:
+            return sorted(glob.glob(os.path.join(self.directory, pattern)))
+        prefix = re.split(r"[*?\[]", pattern, maxsplit=1)[0]
+        start = bisect.bisect_left(self.names, prefix)
+        matches = []
+        for name in self.names[start:]:
+            if not name.startswith(prefix):
+                break
+            # glob ignores hidden files unless the pattern explicitly starts with a dot
+            if name.startswith(".") and not pattern.startswith("."):
+                continue
+            if fnmatch.fnmatch(name, pattern):
+                matches.append(os.path.join(self.directory, name))
+        return matches
 
 
 def to_tensor(d, transpose=True):
@@ -0,0 +1,131 @@
+# Copyright contributors to the Terratorch project
+
+"""Memory-mapped checkpoint loading for the backbone builders.
+
+Loading a checkpoint with ``torch.load`` and ``load_state_dict`` keeps the random initialization of the model and a
+full copy of the checkpoint in memory at the same time. Instead, the builders memory-map the checkpoint, construct the
+model with its parameters on the ``meta`` device and assign the checkpoint tensors to the model (``assign=True``), so
+the weights are only read from disk once they are used.
+"""
+
+import logging
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from itertools import chain
+from pathlib import Path
+
+import torch
+from torch import nn
+from torch.nn.modules.module import _IncompatibleKeys
+
+logger = logging.getLogger("terratorch")
+
+
+def load_state_dict_file(path: str | Path, map_location: str | torch.device = "cpu") -> dict:
+    """Load a checkpoint file without reading it into memory.
+
+    ``.safetensors`` files are loaded with safetensors, other files with ``torch.load(mmap=True)``. Checkpoints saved
+    in the legacy (non-zip) format of ``torch.save`` cannot be memory-mapped and are read as usual.
+
+    Args:
+        path (str | Path): Path to the checkpoint file.
+        map_location (str | torch.device): Device of the loaded tensors. Defaults to "cpu".
+
+    Returns:
+        dict: The checkpoint, tensors are backed by the memory-mapped file.
+    """
+    if str(path).endswith(".safetensors"):
+        from safetensors.torch import load_file
+
+        return load_file(path, device=str(map_location))
+    try:
+        return torch.load(path, map_location=map_location, weights_only=True, mmap=True)
+    except RuntimeError as e:
+        if "mmap" not in str(e):
+            raise
+        logger.debug(f"Cannot memory-map {path} (legacy torch.save format), loading it into memory.")
+        return torch.load(path, map_location=map_location, weights_only=True)
+
+
+@contextmanager
+def init_empty_weights() -> Iterator[None]:
+    """Context manager that creates the parameters of new modules on the ``meta`` device.
+
+    Buffers stay on the CPU because they are often computed in ``__init__`` (e.g. sin-cos position embeddings) and
+    are not always part of the checkpoint.
+    """
+    register_parameter = nn.Module.register_parameter
+
+    def register_empty_parameter(module: nn.Module, name: str, param: nn.Parameter | None):
+        register_parameter(module, name, param)
+        if param is not None and not param.is_meta:
+            module._parameters[name] = nn.Parameter(param.to("meta"), requires_grad=param.requires_grad)
+
+    nn.Module.register_parameter = register_empty_parameter
+    try:
+        yield
+    finally:
+        nn.Module.register_parameter = register_parameter
+
+
+def _has_meta_tensors(model: nn.Module) -> bool:
+    return any(t.is_meta for t in chain(model.parameters(), model.buffers()))
+
+
+def _has_shared_parameters(model: nn.Module) -> bool:
+    # Assigning the checkpoint tensors would untie shared parameters
+    return len(list(model.named_parameters(remove_duplicate=False))) != len(list(model.parameters()))
+
+
+def _cast_state_dict(state_dict: dict, model: nn.Module) -> dict:
+    # assign=True keeps the dtype of the checkpoint tensors, cast them to the dtype of the model
+    model_state_dict = model.state_dict()
+    return {
+        k: v.to(model_state_dict[k].dtype)
+        if k in model_state_dict and v.is_floating_point() and v.dtype != model_state_dict[k].dtype
+        else v
+        for k, v in state_dict.items()
+    }
+
+
+def build_model_from_state_dict(
+    model_fn: Callable[[], nn.Module],
+    state_dict: dict,
+    filter_fn: Callable[[dict, nn.Module], dict] | None = None,
+    strict: bool = True,
+) -> tuple[nn.Module, _IncompatibleKeys]:
+    """Build a model and load a state dict into it without initializing the weights.
+
+    The model is built with its parameters on the ``meta`` device and the (memory-mapped) tensors of the state dict are
+    assigned to it. If weights are missing in the state dict, or the filter takes values from the initialization of the
+    model (e.g. patch embedding weights of new bands), the model is built again with its regular initialization.
+
+    Args:
+        model_fn (Callable[[], nn.Module]): Function building the model.
+        state_dict (dict): State dict, e.g. loaded with `load_state_dict_file`. It is not modified.
+        filter_fn (Callable[[dict, nn.Module], dict], optional): Function adapting the state dict to the model, e.g.
+            renaming keys or selecting the patch embedding weights of the bands. It gets the state dict and the model.
+        strict (bool): Passed to `load_state_dict`. Defaults to True.
+
+    Returns:
+        tuple[nn.Module, _IncompatibleKeys]: The model and the missing and unexpected keys of the state dict.
+    """
+    with init_empty_weights():
+        model = model_fn()
+    # The filters may add, rename or delete keys, they get a shallow copy to keep the checkpoint untouched
+    state_dict = filter_fn(dict(state_dict), model) if filter_fn is not None else state_dict
+    if not _has_shared_parameters(model):
+        loaded_keys = model.load_state_dict(_cast_state_dict(state_dict, model), strict=strict, assign=True)
+        if not _has_meta_tensors(model):
+            return model, loaded_keys
+
+    logger.debug("Not all weights are in the state dict, building the model with initialized weights.")
+    model = model_fn()
+    # Tensors the filter took from the model are replaced by their initialization
+    initial_state_dict = model.state_dict()
+    state_dict = {k: initial_state_dict[k] if v.is_meta else v for k, v in state_dict.items()}
+    if _has_shared_parameters(model):
+        loaded_keys = model.load_state_dict(state_dict, strict=strict)
+    else:
+        loaded_keys = model.load_state_dict(_cast_state_dict(state_dict, model), strict=strict, assign=True)
+    return model, loaded_keys
@@ -35,6 +35,9 @@ class Embedder(nn.Module):
         vpt: bool = False,
         vpt_n_tokens: int | None = None,
         vpt_dropout: float = 0.0,
+        fused_attn: bool | None = None,
+        grad_checkpointing: bool = False,
+        checkpoint_every_n_blocks: int = 1,
         **kwargs,
     ):
         super().__init__()
@@ -59,6 +62,9 @@ class Embedder(nn.Module):
                 vpt=vpt,
                 vpt_n_tokens=vpt_n_tokens,
                 vpt_dropout=vpt_dropout,
+                fused_attn=fused_attn,
+                grad_checkpointing=grad_checkpointing,
+                checkpoint_every_n_blocks=checkpoint_every_n_blocks,
             )
         )
 
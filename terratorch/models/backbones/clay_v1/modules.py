@@ -8,6 +8,7 @@ from torch import nn, Tensor
 from timm.layers import use_fused_attn
 
 from terratorch.models.backbones.clay_v1.utils import posemb_sincos_1d, posemb_sincos_2d_with_gsd
+from terratorch.models.utils import apply_block, checkpoint_filter
 
 os.environ["TORCH_CUDNN_V8_API_DISABLED"] = "1"
 
@@ -41,11 +42,12 @@ class FeedForward(nn.Module):
 
 
 class Attention(nn.Module):
-    def __init__(self, dim, heads=8, dim_head=64):
+    def __init__(self, dim, heads=8, dim_head=64, fused_attn: bool | None = None):
         super().__init__()
         inner_dim = dim_head * heads
         self.heads = heads
         self.scale = dim_head ** -0.5
+        self.fused_attn = use_fused_attn() if fused_attn is None else fused_attn
         self.norm = nn.LayerNorm(dim)
 
         self.attend = nn.Softmax(dim=-1)
@@ -59,7 +61,7 @@ class Attention(nn.Module):
         qkv = self.to_qkv(x).chunk(3, dim=-1)
         q, k, v = map(lambda t: rearrange(t, "b n (h d) -> b h n d", h=self.heads), qkv)
 
-        if use_fused_attn():
+        if self.fused_attn:
             out = F.scaled_dot_product_attention(q, k, v)
         else:
             dots = torch.matmul(q, k.transpose(-1, -2)) * self.scale
@@ -71,9 +73,12 @@ class Attention(nn.Module):
 
 
 class Transformer(nn.Module):
-    def __init__(self, dim, depth, heads, dim_head, mlp_dim, vpt: bool = False, vpt_n_tokens: int | None = None, vpt_dropout: float = 0.0):
+    def __init__(self, dim, depth, heads, dim_head, mlp_dim, vpt: bool = False, vpt_n_tokens: int | None = None, vpt_dropout: float = 0.0,
+                 fused_attn: bool | None = None, grad_checkpointing: bool = False, checkpoint_every_n_blocks: int = 1):
         super().__init__()
         self.norm = nn.LayerNorm(dim)
+        self.grad_checkpointing = grad_checkpointing
+        self.checkpoint_every_n_blocks = checkpoint_every_n_blocks
         self.layers = nn.ModuleList([])
         self.vpt = vpt
         self.vpt_n_tokens = vpt_n_tokens
@@ -93,7 +98,7 @@ class Transformer(nn.Module):
                 nn.init.uniform_(emb, -val, val)
         for _ in range(depth):
             self.layers.append(nn.ModuleList([
-                Attention(dim, heads=heads, dim_head=dim_head),
+                Attention(dim, heads=heads, dim_head=dim_head, fused_attn=fused_attn),
                 FeedForward(dim, mlp_dim)
             ]))
 
@@ -110,16 +115,17 @@ class Transformer(nn.Module):
                 ),
                 dim=1,
             )  # (batch_size, cls_token + n_prompt + n_patches, hidden_dim)
-            x = attn(x) + x
-            x = ff(x) + x
+            checkpoint = checkpoint_filter(idx, self.grad_checkpointing, self.checkpoint_every_n_blocks)
+            x = apply_block(attn, x, checkpoint=checkpoint) + x
+            x = apply_block(ff, x, checkpoint=checkpoint) + x
             if self.vpt:
                 x = torch.cat(
                     (x[:, :1, :], x[:, (1 + self.vpt_n_tokens) :, :]),
                     dim=1,
                 )  # (batch_size, cls_token + n_patches, hidden_dim)
-            out.append(x.clone())
+            out.append(x)
         x = self.norm(x)
-        out[-1] = x.clone()
+        out[-1] = x
         return out
 
 
@@ -137,6 +143,9 @@ class Encoder(nn.Module):
         vpt: bool = False,
         vpt_n_tokens: int | None = None,
         vpt_dropout: float = 0.0,
+        fused_attn: bool | None = None,
+        grad_checkpointing: bool = False,
+        checkpoint_every_n_blocks: int = 1,
     ):
         super().__init__()
         self.mask_ratio = mask_ratio
@@ -162,6 +171,9 @@ class Encoder(nn.Module):
             vpt=vpt,
             vpt_n_tokens=vpt_n_tokens,
             vpt_dropout=vpt_dropout,
+            fused_attn=fused_attn,
+            grad_checkpointing=grad_checkpointing,
+            checkpoint_every_n_blocks=checkpoint_every_n_blocks,
         )
 
     def to_patch_embed(self, cube, waves):
@@ -337,6 +349,9 @@ class EmbeddingEncoder(Encoder):
         vpt: bool = False,
         vpt_n_tokens: int | None = None,
         vpt_dropout: float = 0.0,
+        fused_attn: bool | None = None,
+        grad_checkpointing: bool = False,
+        checkpoint_every_n_blocks: int = 1,
     ):
         super().__init__(
             mask_ratio=0.0,
@@ -350,6 +365,9 @@ class EmbeddingEncoder(Encoder):
             vpt=vpt,
             vpt_n_tokens=vpt_n_tokens,
             vpt_dropout=vpt_dropout,
+            fused_attn=fused_attn,
+            grad_checkpointing=grad_checkpointing,
+            checkpoint_every_n_blocks=checkpoint_every_n_blocks,
         )
         self.img_size = img_size
 
@@ -6,6 +6,10 @@
 # Modified from https://github.com/chengdazhi/Deformable-Convolution-V2-PyTorch/tree/pytorch_1.0.0
 # ------------------------------------------------------------------------------------------------
 
-from terratorch.models.backbones.detr_ops.functions.ms_deform_attn_func import MSDeformAttnFunction
+from terratorch.models.backbones.detr_ops.functions.ms_deform_attn_func import (
+    MSDeformAttnFunction,
+    ms_deform_attn,
+    ms_deform_attn_core_pytorch,
+)
 
-__all__ = ["MSDeformAttnFunction"]
+__all__ = ["MSDeformAttnFunction", "ms_deform_attn", "ms_deform_attn_core_pytorch"]
@@ -16,15 +16,9 @@ from torch.autograd.function import once_differentiable
 
 try:
     import MultiScaleDeformableAttention as MSDA  # noqa: N817
-except ImportError as err:
-    msg = (
-        "Failed to import MultiScaleDeformableAttention. "
-        "Please make sure that the MultiScaleDeformableAttention is installed. "
-        "You can install it with:\n"
-        'pip install "MultiScaleDeformableAttention @ git+https://github.com/fundamentalvision/Deformable-DETR.git#subdirectory=models/ops"\n'
-        "This only works with CUDA."
-    )
-    raise ImportError(msg) from err
+except ImportError:
+    # Without the CUDA extension, ms_deform_attn falls back to the PyTorch implementation
+    MSDA = None
 
 
 class MSDeformAttnFunction(Function):
@@ -39,6 +33,15 @@ class MSDeformAttnFunction(Function):
         attention_weights: torch.Tensor,
         im2col_step: int,
     ) -> torch.Tensor:
+        if MSDA is None:
+            msg = (
+                "Failed to import MultiScaleDeformableAttention. "
+                "Please make sure that the MultiScaleDeformableAttention is installed. "
+                "You can install it with:\n"
+                'pip install "MultiScaleDeformableAttention @ git+https://github.com/fundamentalvision/Deformable-DETR.git#subdirectory=models/ops"\n'
+                "This only works with CUDA."
+            )
+            raise ImportError(msg)
         ctx.im2col_step = im2col_step
         output: torch.Tensor = MSDA.ms_deform_attn_forward(
             value,
@@ -85,32 +88,67 @@ class MSDeformAttnFunction(Function):
 
 def ms_deform_attn_core_pytorch(
     value: torch.Tensor,
-    value_spatial_shapes: list[list[int]],
+    value_spatial_shapes: torch.Tensor | list[list[int]],
     sampling_locations: torch.Tensor,
     attention_weights: torch.Tensor,
 ) -> torch.Tensor:
-    # for debug and test only,
-    # need to use cuda version instead
+    """Multi-scale deformable attention in pure PyTorch, sampling each level with F.grid_sample.
+
+    Matches the CUDA kernel of MultiScaleDeformableAttention and runs on any device.
+
+    Args:
+        value (torch.Tensor): (N, sum_l H_l * W_l, M, D)
+        value_spatial_shapes (torch.Tensor | list[list[int]]): (L, 2), [(H_0, W_0), ..., (H_{L-1}, W_{L-1})]
+        sampling_locations (torch.Tensor): (N, Lq, M, L, P, 2), normalized to [0, 1]
+        attention_weights (torch.Tensor): (N, Lq, M, L, P)
+
+    Returns:
+        torch.Tensor: (N, Lq, M * D)
+    """
+    if isinstance(value_spatial_shapes, torch.Tensor):
+        value_spatial_shapes = value_spatial_shapes.tolist()
     N_, S_, M_, D_ = value.shape  # noqa: N806
     _, Lq_, M_, L_, P_, _ = sampling_locations.shape  # noqa: N806
     value_list = value.split([H_ * W_ for H_, W_ in value_spatial_shapes], dim=1)  # type: ignore
-    sampling_grids = 2 * sampling_locations - 1
-    sampling_value_list = []
+    # N_, Lq_, M_, L_, P_, 2 -> L_, N_*M_, Lq_, P_, 2
+    sampling_grids = (2 * sampling_locations - 1).permute(3, 0, 2, 1, 4, 5).flatten(1, 2)
+    # N_, Lq_, M_, L_, P_ -> L_, N_*M_, 1, Lq_, P_
+    attention_weights = attention_weights.permute(3, 0, 2, 1, 4).reshape(L_, N_ * M_, 1, Lq_, P_)
+    output = None
     for lid_, (H_, W_) in enumerate(value_spatial_shapes):  # noqa: N806
         # N_, H_*W_, M_, D_ -> N_, H_*W_, M_*D_ -> N_, M_*D_, H_*W_ -> N_*M_, D_, H_, W_
         value_l_ = value_list[lid_].flatten(2).transpose(1, 2).reshape(N_ * M_, D_, H_, W_)
-        # N_, Lq_, M_, P_, 2 -> N_, M_, Lq_, P_, 2 -> N_*M_, Lq_, P_, 2
-        sampling_grid_l_ = sampling_grids[:, :, :, lid_].transpose(1, 2).flatten(0, 1)
         # N_*M_, D_, Lq_, P_
         sampling_value_l_ = F.grid_sample(
             value_l_,
-            sampling_grid_l_,
+            sampling_grids[lid_],
             mode="bilinear",
             padding_mode="zeros",
             align_corners=False,
         )
-        sampling_value_list.append(sampling_value_l_)
-    # (N_, Lq_, M_, L_, P_) -> (N_, M_, Lq_, L_, P_) -> (N_, M_, 1, Lq_, L_*P_)
-    attention_weights = attention_weights.transpose(1, 2).reshape(N_ * M_, 1, Lq_, L_ * P_)
-    output = (torch.stack(sampling_value_list, dim=-2).flatten(-2) * attention_weights).sum(-1).view(N_, M_ * D_, Lq_)
-    return output.transpose(1, 2).contiguous()
+        # Reduce the points of each level right away instead of stacking the samples of all levels
+        output_l_ = (sampling_value_l_ * attention_weights[lid_]).sum(-1)
+        output = output_l_ if output is None else output + output_l_
+    return output.view(N_, M_ * D_, Lq_).transpose(1, 2).contiguous()
+
+
+def ms_deform_attn(
+    value: torch.Tensor,
+    value_spatial_shapes: torch.Tensor,
+    value_level_start_index: torch.Tensor,
+    sampling_locations: torch.Tensor,
+    attention_weights: torch.Tensor,
+    im2col_step: int,
+) -> torch.Tensor:
+    """Multi-scale deformable attention with the CUDA extension if it is installed and the inputs are on a GPU, and
+    with ms_deform_attn_core_pytorch otherwise."""
+    if MSDA is not None and value.is_cuda:
+        return MSDeformAttnFunction.apply(  # type: ignore
+            value,
+            value_spatial_shapes,
+            value_level_start_index,
+            sampling_locations,
+            attention_weights,
+            im2col_step,
+        )
+    return ms_deform_attn_core_pytorch(value, value_spatial_shapes, sampling_locations, attention_weights)
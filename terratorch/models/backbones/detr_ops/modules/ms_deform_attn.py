@@ -16,7 +16,7 @@ import torch.nn.functional as F  # noqa: N812
 from torch import nn
 from torch.nn.init import constant_, xavier_uniform_
 
-from terratorch.models.backbones.detr_ops.functions import MSDeformAttnFunction
+from terratorch.models.backbones.detr_ops.functions import ms_deform_attn
 
 
 def _is_power_of_2(n: Any) -> bool:
@@ -143,7 +143,7 @@ class MSDeformAttn(nn.Module):
         else:
             msg = f"Last dim of reference_points must be 2 or 4, but get {reference_points.shape[-1]} instead."
             raise ValueError(msg)
-        output: torch.Tensor = MSDeformAttnFunction.apply(  # type: ignore
+        output = ms_deform_attn(
             value,
             input_spatial_shapes,
             input_level_start_index,
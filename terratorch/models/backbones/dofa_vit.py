@@ -4,12 +4,12 @@ import torchgeo.models.dofa as dofa
 import logging
 from collections.abc import Callable
 from functools import partial
-import huggingface_hub
 import torch.nn as nn
 from typing import List
-import huggingface_hub
 from torchvision.models._api import Weights, WeightsEnum
+from terratorch.models.utils import apply_block, checkpoint_filter
 from terratorch.registry import TERRATORCH_BACKBONE_REGISTRY
+from terratorch.models.weights_cache import cached_hf_url_download, load_weights_state_dict
 import pdb
 
 waves_list= {
@@ -49,16 +49,21 @@ class DOFAEncoderWrapper(nn.Module):
             Forward pass for embeddings with specified indices.
     """
 
-    def __init__(self, dofa_model, wavelengths, weights=None, out_indices=None) -> None:
+    def __init__(self, dofa_model, wavelengths, weights=None, out_indices=None, grad_checkpointing: bool = False,
+                 checkpoint_every_n_blocks: int = 1) -> None:
         """
         Args:
             dofa_model (DOFA): The decoder module to be wrapped.
             weights ()
+            grad_checkpointing (bool): Recompute the activations of the transformer blocks in the backward pass.
+            checkpoint_every_n_blocks (int): Only every n-th transformer block is checkpointed.
         """
         super().__init__()
         self.dofa_model = dofa_model
         self.weights = weights
         self.wavelengths = wavelengths
+        self.grad_checkpointing = grad_checkpointing
+        self.checkpoint_every_n_blocks = checkpoint_every_n_blocks
 
         self.out_indices = out_indices if out_indices else [-1]
         self.out_channels = [self.dofa_model.patch_embed.embed_dim] * len(self.out_indices)
@@ -78,7 +83,9 @@ class DOFAEncoderWrapper(nn.Module):
         outs = []
         # apply Transformer blocks
         for i, block in enumerate(self.dofa_model.blocks):
-            x = block(x)
+            x = apply_block(
+                block, x, checkpoint=checkpoint_filter(i, self.grad_checkpointing, self.checkpoint_every_n_blocks)
+            )
             if i in self.out_indices:
                 outs.append(x)
             elif (i == (len(self.dofa_model.blocks)-1)) & (-1 in self.out_indices):
@@ -94,53 +101,55 @@ def get_wavelenghts(model_bands):
     
 
 @TERRATORCH_BACKBONE_REGISTRY.register
-def dofa_small_patch16_224(model_bands, input_size = 224, pretrained = False, ckpt_data: str | None = None,  weights: Weights | None = None, out_indices: list | None = None, **kwargs):
+def dofa_small_patch16_224(model_bands, input_size = 224, pretrained = False, ckpt_data: str | None = None,  weights: Weights | None = None, out_indices: list | None = None,
+        grad_checkpointing: bool = False, checkpoint_every_n_blocks: int = 1, **kwargs):
     model = dofa.dofa_small_patch16_224(**kwargs)
     input_size = kwargs["img_size"] if "img_size" in kwargs else 224
     if pretrained:
         model = load_dofa_weights(model, ckpt_data, weights, input_size)
     wavelengths = get_wavelenghts(model_bands)
     
-    return DOFAEncoderWrapper(model, wavelengths, weights, out_indices)
+    return DOFAEncoderWrapper(model, wavelengths, weights, out_indices, grad_checkpointing, checkpoint_every_n_blocks)
 
 @TERRATORCH_BACKBONE_REGISTRY.register
-def dofa_base_patch16_224(model_bands, pretrained = False, ckpt_data: str | None = None,  weights: Weights | None = dofa.DOFABase16_Weights.DOFA_MAE, out_indices: list | None = None, **kwargs):
+def dofa_base_patch16_224(model_bands, pretrained = False, ckpt_data: str | None = None,  weights: Weights | None = dofa.DOFABase16_Weights.DOFA_MAE, out_indices: list | None = None,
+        grad_checkpointing: bool = False, checkpoint_every_n_blocks: int = 1, **kwargs):
     model = dofa.dofa_base_patch16_224(**kwargs)
     input_size = kwargs["img_size"] if "img_size" in kwargs else 224
     if pretrained:
         model = load_dofa_weights(model, ckpt_data, weights, input_size)
     wavelengths = get_wavelenghts(model_bands)
     
-    return DOFAEncoderWrapper(model, wavelengths, weights, out_indices)
+    return DOFAEncoderWrapper(model, wavelengths, weights, out_indices, grad_checkpointing, checkpoint_every_n_blocks)
 
 @TERRATORCH_BACKBONE_REGISTRY.register
-def dofa_large_patch16_224(model_bands, pretrained = False, ckpt_data: str | None = None,  weights: Weights | None = dofa.DOFALarge16_Weights.DOFA_MAE, out_indices: list | None = None, **kwargs):
+def dofa_large_patch16_224(model_bands, pretrained = False, ckpt_data: str | None = None,  weights: Weights | None = dofa.DOFALarge16_Weights.DOFA_MAE, out_indices: list | None = None,
+        grad_checkpointing: bool = False, checkpoint_every_n_blocks: int = 1, **kwargs):
     model = dofa.dofa_large_patch16_224(**kwargs)
     input_size = kwargs["img_size"] if "img_size" in kwargs else 224
     if pretrained:
         model = load_dofa_weights(model, ckpt_data, weights, input_size)
     wavelengths = get_wavelenghts(model_bands)
     
-    return DOFAEncoderWrapper(model, wavelengths, weights, out_indices)
+    return DOFAEncoderWrapper(model, wavelengths, weights, out_indices, grad_checkpointing, checkpoint_every_n_blocks)
 
 @TERRATORCH_BACKBONE_REGISTRY.register
-def dofa_huge_patch16_224(model_bands, pretrained = False, ckpt_data: str | None = None,  weights: Weights | None = None, out_indices: list | None = None, **kwargs):
+def dofa_huge_patch16_224(model_bands, pretrained = False, ckpt_data: str | None = None,  weights: Weights | None = None, out_indices: list | None = None,
+        grad_checkpointing: bool = False, checkpoint_every_n_blocks: int = 1, **kwargs):
     model = dofa.dofa_huge_patch16_224(**kwargs)
     input_size = kwargs["img_size"] if "img_size" in kwargs else 224
     if pretrained:
         model = load_dofa_weights(model, ckpt_data, weights, input_size)
     wavelengths = get_wavelenghts(model_bands)
     
-    return DOFAEncoderWrapper(model, wavelengths, weights, out_indices)
+    return DOFAEncoderWrapper(model, wavelengths, weights, out_indices, grad_checkpointing, checkpoint_every_n_blocks)
 
 def load_dofa_weights(model: nn.Module, ckpt_data: str | None = None,  weights: Weights | None = None, input_size = 224) -> nn.Module:
     state_dict = model.state_dict()
     print("Loading weights")
     if ckpt_data is not None:
         if ckpt_data.find("https://hf.co/") > -1:
-            repo_id = ckpt_data.split("/resolve/")[0].replace("https://hf.co/", '')
-            filename = ckpt_data.split("/")[-1]
-            ckpt_data = huggingface_hub.hf_hub_download(repo_id=repo_id, filename=filename)
+            ckpt_data = cached_hf_url_download(ckpt_data)
         checkpoint_model = torch.load(ckpt_data, map_location="cpu", weights_only=True)
 
         for k in ["head.weight", "head.bias"]:
@@ -165,7 +174,7 @@ def load_dofa_weights(model: nn.Module, ckpt_data: str | None = None,  weights:
     else:
         if weights is not None:
             
-            checkpoint_model = weights.get_state_dict(progress=True)
+            checkpoint_model = load_weights_state_dict(weights)
             allowed_missing_keys =  {'fc_norm.weight', 'fc_norm.bias', 'head.weight', 'head.bias'}
             if input_size != 224:
                 if (
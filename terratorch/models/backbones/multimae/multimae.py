@@ -47,6 +47,8 @@ class MultiMAE(nn.Module):
     :param attn_drop_rate: Attention matrix drop rate
     :param drop_path_rate: DropPath drop rate
     :param norm_layer: Type of normalization layer
+    :param fused_attn: If True, computes attention with the fused F.scaled_dot_product_attention, if False with
+    explicit matrix products. Defaults to timm's use_fused_attn().
     :param fp32_output_adapters: List of task identifiers to force output adapters to
     run with mixed precision turned off for stability reasons.
     """
@@ -68,6 +70,7 @@ class MultiMAE(nn.Module):
         attn_drop_rate: float = 0.0,
         drop_path_rate: float = 0.0,
         norm_layer: nn.Module = default_norm_layer,
+        fused_attn: bool | None = None,
         fp32_output_adapters: list[str] | None = None,
         num_input_tokens: int = 128,
         merge_method: str = None,
@@ -115,6 +118,7 @@ class MultiMAE(nn.Module):
                 attn_drop=attn_drop_rate,
                 drop_path=dpr[i],
                 norm_layer=norm_layer,
+                fused_attn=fused_attn,
             )
             for i in range(depth)
         )
@@ -432,6 +436,8 @@ class MultiViT(MultiMAE):
     :param attn_drop_rate: Attention matrix drop rate
     :param drop_path_rate: DropPath drop rate
     :param norm_layer: Type of normalization layer
+    :param fused_attn: If True, computes attention with the fused F.scaled_dot_product_attention, if False with
+    explicit matrix products. Defaults to timm's use_fused_attn().
     """
 
     def process_input(self, x):
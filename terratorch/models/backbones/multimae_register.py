@@ -5,13 +5,14 @@ import logging
 import torch
 import numpy as np
 from functools import partial
-from huggingface_hub import hf_hub_download
 
 from terratorch.datasets.utils import Modalities
+from terratorch.models.backbones.checkpoint_loading import build_model_from_state_dict, load_state_dict_file
 from terratorch.models.backbones.multimae.multimae import MultiMAE, MultiViT
 from terratorch.models.backbones.multimae.criterion import MaskedMSELoss, MaskedCrossEntropyLoss
 from terratorch.models.backbones.multimae.input_adapters import PatchedInputAdapter, SemSegInputAdapter
 from terratorch.models.backbones.multimae.output_adapters import SpatialOutputAdapter, ConvNeXtAdapter
+from terratorch.models.weights_cache import cached_hf_hub_download, register_pretrained_weights
 from terratorch.registry import TERRATORCH_BACKBONE_REGISTRY, TERRATORCH_FULL_MODEL_REGISTRY
 
 logger = logging.getLogger(__name__)
@@ -36,6 +37,7 @@ multimae_cfgs = {
 }
 
 pretrained_weights = {}
+register_pretrained_weights(pretrained_weights)
 
 # TODO: Add pretrained models
 # PRETRAINED_BANDS: list[HLSBands | int] = [
@@ -275,28 +277,30 @@ def _create_multimae(
 
     model_class = MultiViT if encoder_only else MultiMAE
 
-    model = model_class(**model_args, merging_method=merging_method)
-
     if pretrained:
         if ckpt_path is not None:
             # Load model from checkpoint
-            state_dict = torch.load(ckpt_path, map_location="cpu", weights_only=True)
+            state_dict = load_state_dict_file(ckpt_path)
         else:
             assert variant in pretrained_weights, (f"No pre-trained model found for variant {variant} "
                                                    f"(pretrained models: {pretrained_weights.keys()})")
 
-            state_dict_file = hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
-                                              filename=pretrained_weights[variant]['hf_hub_filename'])
-            state_dict = torch.load(state_dict_file, map_location="cpu", weights_only=True)
+            state_dict_file = cached_hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
+                                                     filename=pretrained_weights[variant]['hf_hub_filename'])
+            state_dict = load_state_dict_file(state_dict_file)
 
         # TODO: add manual filtering of keys for strict weight loading
-        loaded_keys = model.load_state_dict(state_dict, strict=False)
+        model, loaded_keys = build_model_from_state_dict(
+            lambda: model_class(**model_args, merging_method=merging_method), state_dict, strict=False
+        )
         if loaded_keys.missing_keys:
             logger.warning(f"Missing keys in ckpt_path {ckpt_path}: {loaded_keys.missing_keys}")
         if loaded_keys.unexpected_keys:
             logger.warning(f"Missing keys in ckpt_path {ckpt_path}: {loaded_keys.missing_keys}")
-    elif ckpt_path is not None:
-        logger.warning(f"ckpt_path is provided but pretrained is set to False, ignoring ckpt_path {ckpt_path}.")
+    else:
+        model = model_class(**model_args, merging_method=merging_method)
+        if ckpt_path is not None:
+            logger.warning(f"ckpt_path is provided but pretrained is set to False, ignoring ckpt_path {ckpt_path}.")
 
     model.prepare_features_for_image_model = PrepareMultimodalFeaturesForDecoder(
         modalities=list(model.input_adapters.keys()),
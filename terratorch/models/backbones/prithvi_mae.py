@@ -28,6 +28,8 @@ from timm.models.vision_transformer import Block
 from functools import reduce
 from operator import mul
 
+from terratorch.models.utils import PosEmbedCache, apply_block, checkpoint_filter, resolve_out_indices
+
 logger = logging.getLogger(__name__)
 
 
@@ -152,7 +154,7 @@ def _interpolate_pos_encoding(
         # Re-compute pos embedding to handle changed num_frames
         new_grid_size = (t_patches, *grid_size[1:])
         new_pos_embed = get_3d_sincos_pos_embed(pos_embed.shape[-1], new_grid_size, add_cls_token=True)
-        new_pos_embed = torch.from_numpy(new_pos_embed).float().unsqueeze(0)
+        new_pos_embed = torch.from_numpy(new_pos_embed).to(pos_embed).unsqueeze(0)
     else:
         new_grid_size = grid_size
         new_pos_embed = pos_embed
@@ -293,6 +295,9 @@ class PrithviViT(nn.Module):
         vpt: bool = False,
         vpt_n_tokens: int | None = None,
         vpt_dropout: float = 0,
+        out_indices: list[int] | None = None,
+        grad_checkpointing: bool = False,
+        checkpoint_every_n_blocks: int = 1,
         **kwargs,
     ):
         super().__init__()
@@ -311,7 +316,9 @@ class PrithviViT(nn.Module):
             in_chans=in_chans,
             embed_dim=embed_dim,
         )
-        self.out_channels = [embed_dim * self.patch_embed.grid_size[0]] * depth
+        # Only the outputs of these blocks are kept in forward_features
+        self.out_indices = out_indices if out_indices is not None else list(range(depth))
+        self.out_channels = [embed_dim * self.patch_embed.grid_size[0]] * len(resolve_out_indices(out_indices, depth))
 
         # Optional temporal and location embedding
         coords_encoding = coords_encoding or []
@@ -325,6 +332,7 @@ class PrithviViT(nn.Module):
 
         self.cls_token = nn.Parameter(torch.zeros(1, 1, embed_dim))
         self.register_buffer("pos_embed", torch.zeros(1, self.patch_embed.num_patches + 1, embed_dim))
+        self._pos_embed_cache = PosEmbedCache()
 
         # Transformer layers
         self.blocks = []
@@ -334,6 +342,9 @@ class PrithviViT(nn.Module):
         self.blocks = nn.ModuleList(self.blocks)
 
         self.norm = norm_layer(embed_dim)
+        # Recompute the activations of the blocks in the backward pass to save memory
+        self.grad_checkpointing = grad_checkpointing
+        self.checkpoint_every_n_blocks = checkpoint_every_n_blocks
 
         self.vpt = vpt
         self.vpt_n_tokens = vpt_n_tokens
@@ -406,13 +417,13 @@ class PrithviViT(nn.Module):
 
     def interpolate_pos_encoding(self, sample_shape: tuple[int, int, int]):
 
-        pos_embed = _interpolate_pos_encoding(
+        pos_embed = self._pos_embed_cache.get(self.pos_embed, tuple(sample_shape), lambda: _interpolate_pos_encoding(
             pos_embed=self.pos_embed,
             grid_size=self.patch_embed.grid_size,
             patch_size=self.patch_embed.patch_size,
             shape=sample_shape,
             embed_dim=self.embed_dim,
-        )
+        ))
         return pos_embed
 
     def forward(
@@ -461,7 +472,9 @@ class PrithviViT(nn.Module):
                     ),
                     dim=1,
                 )  # (batch_size, cls_token + n_prompt + n_patches, hidden_dim)
-            x = block(x)
+            x = apply_block(
+                block, x, checkpoint=checkpoint_filter(idx, self.grad_checkpointing, self.checkpoint_every_n_blocks)
+            )
             if self.vpt:
                 x = torch.cat(
                     (x[:, :1, :], x[:, (1 + self.vpt_n_tokens) :, :]),
@@ -504,7 +517,8 @@ class PrithviViT(nn.Module):
 
         # apply Transformer blocks
         bs = x.shape[0]
-        out = []
+        out = {}
+        out_indices = resolve_out_indices(self.out_indices, len(self.blocks))
         for idx, block in enumerate(self.blocks):
             if self.vpt:
                 x = torch.cat(
@@ -515,17 +529,23 @@ class PrithviViT(nn.Module):
                     ),
                     dim=1,
                 )  # (batch_size, cls_token + n_prompt + n_patches, hidden_dim)
-            x = block(x)
+            x = apply_block(
+                block, x, checkpoint=checkpoint_filter(idx, self.grad_checkpointing, self.checkpoint_every_n_blocks)
+            )
             if self.vpt:
                 x = torch.cat(
                     (x[:, :1, :], x[:, (1 + self.vpt_n_tokens) :, :]),
                     dim=1,
                 )
-            out.append(x.clone())
+            if idx == len(self.blocks) - 1:
+                x = self.norm(x)
+            if idx in out_indices:
+                out[idx] = x
+            if idx == max(out_indices):
+                # Later blocks do not contribute to the outputs
+                break
 
-        x = self.norm(x)
-        out[-1] = x
-        return out
+        return [out[idx] for idx in out_indices]
 
     def prepare_features_for_image_model(self, features: list[torch.Tensor]) -> list[torch.Tensor]:
         out = []
@@ -588,6 +608,7 @@ class MAEDecoder(nn.Module):
         self.mask_token = nn.Parameter(torch.zeros(1, 1, decoder_embed_dim))
 
         self.register_buffer("decoder_pos_embed", torch.zeros(1, num_patches + 1, decoder_embed_dim))
+        self._pos_embed_cache = PosEmbedCache()
 
         self.decoder_blocks = nn.ModuleList(
             [Block(decoder_embed_dim, num_heads, mlp_ratio, qkv_bias=True, norm_layer=norm_layer) for _ in range(depth)]
@@ -613,12 +634,14 @@ class MAEDecoder(nn.Module):
 
     def interpolate_pos_encoding(self, sample_shape: tuple[int, int, int]):
 
-        pos_embed = _interpolate_pos_encoding(
-            pos_embed=self.decoder_pos_embed,
-            grid_size=self.grid_size,
-            patch_size=self.patch_size,
-            shape=sample_shape,
-            embed_dim=self.decoder_embed_dim,
+        pos_embed = self._pos_embed_cache.get(
+            self.decoder_pos_embed, tuple(sample_shape), lambda: _interpolate_pos_encoding(
+                pos_embed=self.decoder_pos_embed,
+                grid_size=self.grid_size,
+                patch_size=self.patch_size,
+                shape=sample_shape,
+                embed_dim=self.decoder_embed_dim,
+            )
         )
 
         return pos_embed
@@ -4,16 +4,16 @@ import warnings
 from collections.abc import Callable
 
 import torch
-from huggingface_hub import hf_hub_download
 from torch import Tensor, nn
 
 from terratorch.datasets import HLSBands
 from terratorch.datasets.utils import generate_bands_intervals
+from terratorch.models.backbones.checkpoint_loading import build_model_from_state_dict, load_state_dict_file
 from terratorch.models.backbones.prithvi_mae import PrithviViT, PrithviMAE
 from terratorch.models.backbones.prithvi_vit_adapter import PrithviViTAdapter
 from terratorch.models.backbones.select_patch_embed_weights import select_patch_embed_weights
+from terratorch.models.weights_cache import cached_hf_hub_download, is_offline, register_pretrained_weights
 from terratorch.registry import TERRATORCH_BACKBONE_REGISTRY, TERRATORCH_FULL_MODEL_REGISTRY
-from huggingface_hub import hf_hub_download
 
 
 logger = logging.getLogger(__name__)
@@ -100,6 +100,7 @@ pretrained_weights = {
         "hf_hub_filename": "Prithvi_EO_V2_600M_TL.pt",
     },
 }
+register_pretrained_weights(pretrained_weights)
 
 prithvi_adapter_cfgs = {
     "prithvi_eo_v1_100": {
@@ -313,15 +314,16 @@ def _create_prithvi(
         prithvi_model_class = PrithviMAE
         checkpoint_filter_wrapper_fn = checkpoint_filter_fn_mae
 
-    model = prithvi_model_class(**model_args)
+    def checkpoint_filter(state_dict: dict, model: nn.Module) -> dict:
+        return checkpoint_filter_wrapper_fn(state_dict, model, pretrained_bands, model_bands)
 
     if pretrained:
         if ckpt_path is not None:
             # Load model from checkpoint
-            state_dict = torch.load(ckpt_path, map_location="cpu", weights_only=True)
-            state_dict = checkpoint_filter_wrapper_fn(state_dict, model, pretrained_bands, model_bands)
-
-            loaded_keys = model.load_state_dict(state_dict, strict=False)
+            state_dict = load_state_dict_file(ckpt_path)
+            model, loaded_keys = build_model_from_state_dict(
+                lambda: prithvi_model_class(**model_args), state_dict, checkpoint_filter, strict=False
+            )
             if loaded_keys.missing_keys:
                 logger.warning(f"Missing keys in ckpt_path {ckpt_path}: {loaded_keys.missing_keys}")
             if loaded_keys.unexpected_keys:
@@ -332,21 +334,25 @@ def _create_prithvi(
             )
 
             try:
-                # Download config.json to count model downloads
-                _ = hf_hub_download(repo_id=pretrained_weights[variant]["hf_hub_id"], filename="config.json")
+                if not is_offline():
+                    # Download config.json to count model downloads
+                    _ = cached_hf_hub_download(repo_id=pretrained_weights[variant]["hf_hub_id"], filename="config.json")
                 # Load model from Hugging Face
-                pretrained_path = hf_hub_download(
+                pretrained_path = cached_hf_hub_download(
                     repo_id=pretrained_weights[variant]["hf_hub_id"],
                     filename=pretrained_weights[variant]["hf_hub_filename"],
                 )
-                state_dict = torch.load(pretrained_path, map_location="cpu", weights_only=True)
-                state_dict = checkpoint_filter_wrapper_fn(state_dict, model, pretrained_bands, model_bands)
-                model.load_state_dict(state_dict, strict=True)
+                state_dict = load_state_dict_file(pretrained_path)
+                model, _ = build_model_from_state_dict(
+                    lambda: prithvi_model_class(**model_args), state_dict, checkpoint_filter, strict=True
+                )
             except RuntimeError as e:
                 logger.error(f"Failed to load the pre-trained weights for {variant}.")
                 raise e
-    elif ckpt_path is not None:
-        logger.warning(f"ckpt_path is provided but pretrained is set to False, ignoring ckpt_path {ckpt_path}.")
+    else:
+        model = prithvi_model_class(**model_args)
+        if ckpt_path is not None:
+            logger.warning(f"ckpt_path is provided but pretrained is set to False, ignoring ckpt_path {ckpt_path}.")
 
     # TODO Renanme to model.bands? 
     model.model_bands = model_bands
@@ -360,15 +366,8 @@ def _create_prithvi(
         model.forward = model.forward_features
         model.out_indices = [indexes[-1] for indexes in model.interaction_indexes]
     elif encoder_only:
-        default_out_indices = list(range(len(model.blocks)))
-        out_indices = kwargs.pop("out_indices", default_out_indices)
-
-        def forward_filter_indices(*args, **kwargs):
-            features = model.forward_features(*args, **kwargs)
-            return [features[i] for i in out_indices]
-
-        model.forward = forward_filter_indices
-        model.out_indices = out_indices
+        # PrithviViT only keeps the outputs of out_indices
+        model.forward = model.forward_features
 
     return model
 
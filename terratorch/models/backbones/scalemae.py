@@ -24,7 +24,9 @@ from timm.models.vision_transformer import PatchEmbed
 from torch import nn
 
 from terratorch.datasets.utils import HLSBands
+from terratorch.models.backbones.checkpoint_loading import load_state_dict_file
 from terratorch.models.backbones.select_patch_embed_weights import select_patch_embed_weights
+from terratorch.models.utils import apply_block, checkpoint_filter, resolve_out_indices
 
 logger = logging.getLogger(__name__)
 
@@ -133,7 +135,8 @@ class VisionTransformer(timm.models.vision_transformer.VisionTransformer):
     """
 
     def __init__(
-        self, patch_size=16, in_chans=3, embed_dim=1024, out_indices=None, default_input_res=1, **kwargs
+        self, patch_size=16, in_chans=3, embed_dim=1024, out_indices=None, default_input_res=1,
+        grad_checkpointing=False, checkpoint_every_n_blocks=1, **kwargs
     ):
         """
         Args:
@@ -143,8 +146,13 @@ class VisionTransformer(timm.models.vision_transformer.VisionTransformer):
             out_indices (_type_, optional): Indices of transformer blocks to be output as features. Defaults to None.
             default_input_res (int, optional): GSD of the input. If not passed through
                 the dataset, this value will be used by default. Defaults to 1.
+            grad_checkpointing (bool, optional): Recompute the activations of the transformer blocks in the backward
+                pass to save memory. Defaults to False.
+            checkpoint_every_n_blocks (int, optional): Only every n-th block is checkpointed. Defaults to 1.
         """
         super().__init__(embed_dim=embed_dim, **kwargs)
+        self.grad_checkpointing = grad_checkpointing
+        self.checkpoint_every_n_blocks = checkpoint_every_n_blocks
 
         self.patch_embed = PatchEmbedUnSafe(
             patch_size=patch_size,
@@ -192,12 +200,18 @@ class VisionTransformer(timm.models.vision_transformer.VisionTransformer):
         x = x + pos_embed
         x = self.pos_drop(x)
 
-        output = []
-        for blk in self.blocks:
-            x = blk(x)
-            output.append(x.clone())
+        output = {}
+        out_indices = resolve_out_indices(self.out_indices, len(self.blocks))
+        for idx, blk in enumerate(self.blocks):
+            x = apply_block(
+                blk, x, checkpoint=checkpoint_filter(idx, self.grad_checkpointing, self.checkpoint_every_n_blocks)
+            )
+            if idx in out_indices:
+                output[idx] = x
+            if idx == max(out_indices):
+                break
 
-        return [output[i] for i in self.out_indices]
+        return [output[i] for i in out_indices]
 
     def prepare_features_for_image_model(self, features: list[torch.Tensor]) -> list[torch.Tensor]:
         out = []
@@ -258,7 +272,7 @@ def vit_huge_patch14(**kwargs):
     return model
 
 def load_scalemae_weights(model: nn.Module, ckpt_data: str, model_bands: list[HLSBands], input_size: int = 224) -> nn.Module:
-    checkpoint_model = torch.load(ckpt_data, map_location="cpu", weights_only=True)["model"]
+    checkpoint_model = load_state_dict_file(ckpt_data)["model"]
     state_dict = model.state_dict()
 
     for k in ["head.weight", "head.bias"]:
@@ -128,6 +128,9 @@ def select_patch_embed_weights(
 
         # only do this if the patch size and tubelet size match. If not, start with random weights
         if patch_embed_weights_are_compatible(temp_weight, patch_embed_weight):
+            if temp_weight.is_meta:
+                # Model built without initialized weights, see build_model_from_state_dict
+                temp_weight = torch.empty_like(temp_weight, device=patch_embed_weight.device)
             torch.nn.init.xavier_uniform_(temp_weight.view([temp_weight.shape[0], -1]))
             for index, band in enumerate(model_bands):
                 if band in pretrained_bands:
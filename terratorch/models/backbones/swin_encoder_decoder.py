@@ -26,6 +26,8 @@ from timm.models.vision_transformer import get_init_weights_vit
 from torch import nn
 from torch.nn import ModuleList
 
+from terratorch.models.utils import checkpoint_filter
+
 
 class FFN(nn.Module):
     """Implements feed-forward networks (FFNs) with identity connection.
@@ -865,6 +867,8 @@ class MMSegSwinTransformer(nn.Module):
         norm_layer=nn.LayerNorm,
         with_cp=False,  # noqa: FBT002
         frozen_stages=-1,
+        grad_checkpointing=False,  # noqa: FBT002
+        checkpoint_every_n_blocks=1,
     ):
         """MMSeg Swin Transformer backbone.
 
@@ -910,6 +914,9 @@ class MMSegSwinTransformer(nn.Module):
                 Default: False.
             frozen_stages (int): Stages to be frozen (stop grad and set eval mode).
                 -1 means not freezing any parameters.
+            grad_checkpointing (bool): Use checkpoint for every checkpoint_every_n_blocks-th
+                block, counted over all stages. Default: False.
+            checkpoint_every_n_blocks (int): See grad_checkpointing. Default: 1.
         """
 
         self.frozen_stages = frozen_stages
@@ -987,6 +994,8 @@ class MMSegSwinTransformer(nn.Module):
             if downsample:
                 in_chans = downsample.out_channels
         self.stages = nn.Sequential(*stages)
+        for idx, block in enumerate(block for stage in self.stages for block in stage.blocks):
+            block.with_cp = with_cp or checkpoint_filter(idx, grad_checkpointing, checkpoint_every_n_blocks)
         self.num_features = [int(embed_dim * 2**i) for i in range(self.num_layers)]
         # Add a norm layer for each output
 
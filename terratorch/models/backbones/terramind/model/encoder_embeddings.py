@@ -22,6 +22,8 @@ import torch
 import torch.nn as nn
 from einops import rearrange, repeat
 
+from terratorch.models.utils import PosEmbedCache
+
 from .tm_utils import build_1d_sincos_posemb, build_2d_sincos_posemb, pair, interpolate_pos_encoding
 
 class SequenceEncoderEmbedding(nn.Module):
@@ -182,6 +184,7 @@ class ImageTokenEncoderEmbedding(nn.Module):
         else:
             self.pos_emb = nn.Parameter(torch.zeros(1, (h_posemb * w_posemb), self.dim_tokens))
             nn.init.normal_(self.pos_emb, std=init_std)
+        self._pos_emb_cache = PosEmbedCache()
 
         self.mod_emb = nn.Parameter(torch.zeros(1, 1, self.dim_tokens))
         nn.init.normal_(self.mod_emb, std=init_std)
@@ -221,8 +224,8 @@ class ImageTokenEncoderEmbedding(nn.Module):
 
         if (input_size, input_size) != self.image_size:
             # Interpolate embedding if required
-            pos_emb = interpolate_pos_encoding(self.pos_emb.clone(), input_size, input_size,
-                                               self.patch_size, self.dim_tokens)
+            pos_emb = self._pos_emb_cache.get(self.pos_emb, (input_size, input_size), lambda: interpolate_pos_encoding(
+                self.pos_emb, input_size, input_size, self.patch_size, self.dim_tokens))
         else:
             pos_emb = self.pos_emb
 
@@ -291,6 +294,7 @@ class ImageEncoderEmbedding(nn.Module):
         else:
             self.pos_emb = nn.Parameter(torch.zeros(1, (h_posemb * w_posemb), self.dim_tokens))
             nn.init.normal_(self.pos_emb, std=init_std)
+        self._pos_emb_cache = PosEmbedCache()
 
         self.mod_emb = nn.Parameter(torch.zeros(1, 1, self.dim_tokens))
         nn.init.normal_(self.mod_emb, std=init_std)
@@ -331,7 +335,8 @@ class ImageEncoderEmbedding(nn.Module):
 
         if (H, W) != self.image_size:
             # Interpolate embedding if required
-            pos_emb = interpolate_pos_encoding(self.pos_emb.clone(), H, W, self.patch_size, self.dim_tokens)
+            pos_emb = self._pos_emb_cache.get(self.pos_emb, (H, W), lambda: interpolate_pos_encoding(
+                self.pos_emb, H, W, self.patch_size, self.dim_tokens))
         else:
             pos_emb = self.pos_emb
 
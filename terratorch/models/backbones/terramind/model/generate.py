@@ -145,12 +145,29 @@ def linear_temp_schedule(temp, token_schedule):
         min=1e-9)
 
 
+def copy_mod_dict(mod_dict):
+    # Copies the modality dicts but shares their tensors. Generation steps and the empty_*_modality functions replace
+    # tensors instead of writing into them, so the tensors of the input mod dict are never modified.
+    return {mod: dict(d) for mod, d in mod_dict.items()}
+
+def _same_tensors(a, b):
+    """Whether two dicts of tensors have the same keys and tensors of the same content."""
+    if a.keys() != b.keys():
+        return False
+    for k, v in a.items():
+        w = b[k]
+        if v is w:
+            continue
+        if v.shape != w.shape or v.dtype != w.dtype or v.device != w.device or not torch.equal(v, w):
+            return False
+    return True
+
 def empty_img_modality(mod_dict, key):
     # Input mask
-    mod_dict[key]['input_mask'][:] = True
+    mod_dict[key]['input_mask'] = torch.ones_like(mod_dict[key]['input_mask'])
     
     # Target Mask
-    mod_dict[key]['target_mask'][:] = False
+    mod_dict[key]['target_mask'] = torch.zeros_like(mod_dict[key]['target_mask'])
     
     return mod_dict
 
@@ -160,13 +177,13 @@ def empty_seq_modality(mod_dict, key, s1_id=5):
     # Input tensor
     # Input is [S_1], target is [S_1] ...... [S_2]
     # (so [S_1] [S_1] ..... [S_2] when combined)
-    mod_dict[key]['tensor'][:] = 0
+    mod_dict[key]['tensor'] = torch.zeros_like(mod_dict[key]['tensor'])
     mod_dict[key]['tensor'][:,[0,1]] = s1_id # s1_id is id of the first sentinel token ([S_1])
     mod_dict[key]['tensor'][:,-1] = s1_id + 1
 
     # Input mask
     # Set first token to input (i.e. 0), rest to target (i.e. 1)
-    mod_dict[key]['input_mask'][:] = True
+    mod_dict[key]['input_mask'] = torch.ones_like(mod_dict[key]['input_mask'])
     mod_dict[key]['input_mask'][:,0] = False
     
     # Target Mask
@@ -175,7 +192,7 @@ def empty_seq_modality(mod_dict, key, s1_id=5):
     # Decoder attn mask
     # WARNING: Not needed / used in GenerationSampler, where causal mask is enforced
     # First token is input, not part of target
-    mod_dict[key]['decoder_attention_mask'][:] = 1
+    mod_dict[key]['decoder_attention_mask'] = torch.ones_like(mod_dict[key]['decoder_attention_mask'])
     mod_dict[key]['decoder_attention_mask'][:, 0] = 0
 
     return mod_dict
@@ -193,7 +210,7 @@ def empty_seq_emb_modality(mod_dict, key):
     mod_dict[key]['target_mask'] = torch.ones_like(mod_dict[key]['target_mask'])
     
     # Decoder attn mask
-    mod_dict[key]['decoder_attention_mask'][:] = False
+    mod_dict[key]['decoder_attention_mask'] = torch.zeros_like(mod_dict[key]['decoder_attention_mask'])
     
     return mod_dict
     
@@ -438,6 +455,8 @@ class GenerationSampler(nn.Module):
     def __init__(self, model):
         super().__init__()
         self.model = model
+        # Encoder embeddings of unchanged input modalities, only kept during a generate call
+        self._embedding_cache = None
 
 
     def top_k_top_p_filtering(self, logits, top_k=0.0, top_p=0.0):
@@ -515,6 +534,35 @@ class GenerationSampler(nn.Module):
                 return self.sample_tokens(logits, num_select, temperature, top_k, top_p, return_all_samples)
 
 
+    def embed_encoder_inputs(self, mod_dict):
+        """Applies the encoder embeddings to all input modalities. During a generate call, the embeddings of modalities
+        whose tensors did not change since a previous step (e.g. the conditioning modalities) are reused.
+        """
+        if self._embedding_cache is None:
+            return {mod: self.model.encoder_embeddings[mod](d)
+                    for mod, d in mod_dict.items()
+                    if mod in self.model.encoder_embeddings}
+
+        encoder_mod_dict = {}
+        for mod, d in mod_dict.items():
+            if mod not in self.model.encoder_embeddings:
+                continue
+            # Entries match tensors with the same content. The empty_*_modality helpers allocate new masks at every
+            # step, so the unconditional inputs are never the same tensor objects.
+            tensors = {k: v for k, v in d.items() if torch.is_tensor(v)}
+            entries = self._embedding_cache[mod]
+            index = next((i for i, entry in enumerate(entries) if _same_tensors(entry[0], tensors)), None)
+            if index is None:
+                # Embed a copy, so that the cached outputs are not overwritten by the decoder embeddings
+                entry = (tensors, self.model.encoder_embeddings[mod](dict(d)))
+            else:
+                entry = entries.pop(index)
+            # Keep the two most recently used entries per modality, for the conditional and unconditional passes of
+            # guided steps
+            entries[:] = [*entries[-1:], entry]
+            encoder_mod_dict[mod] = entry[1]
+        return encoder_mod_dict
+
     def forward_mask_encoder_generation(self, encoder_mod_dict):
         """Modification of forward_mask_encoder adapted for generation, with support for batching
         """
@@ -738,9 +786,7 @@ class GenerationSampler(nn.Module):
 
     def forward_enc_dec_maskgit_batched(self, mod_dict, target_mod, seed=None):
         # Encoder
-        encoder_mod_dict = {mod: self.model.encoder_embeddings[mod](d)
-                            for mod, d in mod_dict.items()
-                            if mod in self.model.encoder_embeddings}
+        encoder_mod_dict = self.embed_encoder_inputs(mod_dict)
         encoder_tokens, encoder_emb, encoder_mask, encoder_mod_mask = self.forward_mask_encoder_generation(encoder_mod_dict)
         x = encoder_tokens + encoder_emb
         x = self.model.forward_encoder(x, encoder_mask)
@@ -780,7 +826,7 @@ class GenerationSampler(nn.Module):
         logits_cond, _ = self.forward_enc_dec_maskgit_batched(mod_dict, target_mod, seed=seed)
 
         ### 2 - Second pass, without conditioning
-        mod_dict_uncond = copy.deepcopy(mod_dict)
+        mod_dict_uncond = copy_mod_dict(mod_dict)
         for mod in conditioning:
             if self.model.modality_info[mod]['type'] in ['seq', 'seq_token']:
                 mod_dict_uncond = empty_seq_modality(mod_dict_uncond, mod)
@@ -805,6 +851,7 @@ class GenerationSampler(nn.Module):
         # We rely on gather / scatter for batched operations
         top_pos = torch.gather(mod_pos, -1, top_indices) # (B, num_select)
         if write_all_predictions:
+            mod_dict[target_mod]['tensor'] = mod_dict[target_mod]['tensor'].clone()
             mod_dict[target_mod]['tensor'][:, mod_pos] = all_samples
         else:
             mod_dict[target_mod]['tensor'] = torch.scatter(mod_dict[target_mod]['tensor'], -1, top_pos, top_samples)
@@ -855,9 +902,7 @@ class GenerationSampler(nn.Module):
 
     def forward_enc_dec_roar_batched(self, mod_dict, target_mod, num_select, seed=None):
         # Encoder
-        encoder_mod_dict = {mod: self.model.encoder_embeddings[mod](d)
-                            for mod, d in mod_dict.items()
-                            if mod in self.model.encoder_embeddings}
+        encoder_mod_dict = self.embed_encoder_inputs(mod_dict)
         encoder_tokens, encoder_emb, encoder_mask, encoder_mod_mask = self.forward_mask_encoder_generation(encoder_mod_dict)
         x = encoder_tokens + encoder_emb
         x = self.model.forward_encoder(x, encoder_mask)
@@ -899,7 +944,7 @@ class GenerationSampler(nn.Module):
         logits_cond, _ = self.forward_enc_dec_roar_batched(mod_dict, target_mod, num_select, seed=seed)
 
         ### 2 - Second pass, without conditioning
-        mod_dict_uncond = copy.deepcopy(mod_dict)
+        mod_dict_uncond = copy_mod_dict(mod_dict)
         for mod in conditioning:
             if self.model.modality_info[mod]['type'] in ['seq', 'seq_token']:
                 mod_dict_uncond = empty_seq_modality(mod_dict_uncond, mod)
@@ -958,13 +1003,21 @@ class GenerationSampler(nn.Module):
         
         return uncond_dict, cond_dicts
 
+    def _autoregressive_decoder_inputs(self, out, i, batch_size):
+        # The first iteration runs the decoder on all start tokens with a causal mask. With the key / value cache,
+        # later iterations only process the last sampled token, which attends to all previous tokens.
+        if i > 0:
+            return out[:, -1:], None
+        cur_len = out.shape[1]
+        causal_mask = torch.ones((cur_len, cur_len), dtype=torch.bool, device=out.device).triu(1)
+        causal_mask = repeat(causal_mask, "n1 n2 -> b n1 n2", b=batch_size)
+        return out, causal_mask
+
     def autoregressive_step_batched(self, mod_dict, target_mod, temperature, top_k: float | int, top_p: float,
                                     use_eos=True, eos_token=None, start_tokens=None, text_tokenizer=None, seed=None):
 
         # Encoder
-        encoder_mod_dict = {mod: self.model.encoder_embeddings[mod](d)
-                            for mod, d in mod_dict.items()
-                            if mod in self.model.encoder_embeddings}
+        encoder_mod_dict = self.embed_encoder_inputs(mod_dict)
         encoder_tokens, encoder_emb, encoder_mask, encoder_mod_mask = self.forward_mask_encoder_generation(encoder_mod_dict)
         x = encoder_tokens + encoder_emb
         x = self.model.forward_encoder(x, encoder_mask) # B, N, D
@@ -998,17 +1051,19 @@ class GenerationSampler(nn.Module):
         seq_len = y_emb.shape[1]
 
         # Auto-regressive decoding and sampling
+        # Self-attention keys / values of past tokens and cross-attention keys / values of the context are cached,
+        # so that each iteration only runs the decoder on the newly sampled token
+        cache = self.model.init_decoder_cache()
         for i in range(seq_len):
             cur_len = out.shape[1]
+            new_tokens, causal_mask = self._autoregressive_decoder_inputs(out, i, B)
+            num_new = new_tokens.shape[1]
             # Convert ids into word embeddings and add corresponding posembs + modemb
-            y = self.model.decoder_embeddings[target_mod].token_emb(out) + y_emb[:, :cur_len]
-            # Build causal mask
-            causal_mask = torch.ones((cur_len, cur_len), dtype=torch.bool, device=y.device).triu(1)
-            causal_mask = repeat(causal_mask, "n1 n2 -> b n1 n2", b=B)
+            y = self.model.decoder_embeddings[target_mod].token_emb(new_tokens) + y_emb[:, cur_len - num_new:cur_len]
             
-            y = self.model.forward_decoder(y, context, encoder_mask, causal_mask)
-            logits = self.model.forward_logits(y, decoder_mod_dict, decoder_mod_mask[:, :cur_len])[target_mod]
-            logits = rearrange(logits, "(b n) d -> b n d", b=B, n=cur_len)
+            y = self.model.forward_decoder(y, context, encoder_mask, causal_mask, cache=cache)
+            logits = self.model.forward_logits(y, decoder_mod_dict, decoder_mod_mask[:, cur_len - num_new:cur_len])[target_mod]
+            logits = rearrange(logits, "(b n) d -> b n d", b=B, n=num_new)
             last_logits = logits[:, -1]
 
             # Sample token for the newly generated logit
@@ -1034,9 +1089,7 @@ class GenerationSampler(nn.Module):
          ### 1 - Encoder forward pass, with conditioning
         
         # Encoder
-        encoder_mod_dict = {mod: self.model.encoder_embeddings[mod](d)
-                            for mod, d in mod_dict.items()
-                            if mod in self.model.encoder_embeddings}
+        encoder_mod_dict = self.embed_encoder_inputs(mod_dict)
         encoder_tokens, encoder_emb, encoder_mask_cond, encoder_mod_mask = self.forward_mask_encoder_generation(encoder_mod_dict)
         x = encoder_tokens + encoder_emb
         x = self.model.forward_encoder(x, encoder_mask_cond) # B, N, D
@@ -1054,7 +1107,7 @@ class GenerationSampler(nn.Module):
 
         ### 2 - Encoder forward pass, without conditioning
 
-        mod_dict_uncond = copy.deepcopy(mod_dict)
+        mod_dict_uncond = copy_mod_dict(mod_dict)
         for mod in conditioning:
             if self.model.modality_info[mod]['type'] in ['seq', 'seq_token']:
                 mod_dict_uncond = empty_seq_modality(mod_dict_uncond, mod)
@@ -1064,9 +1117,7 @@ class GenerationSampler(nn.Module):
                 mod_dict_uncond = empty_img_modality(mod_dict_uncond, mod)
 
         # Encoder
-        encoder_mod_dict = {mod: self.model.encoder_embeddings[mod](d)
-                            for mod, d in mod_dict_uncond.items()
-                            if mod in self.model.encoder_embeddings}
+        encoder_mod_dict = self.embed_encoder_inputs(mod_dict_uncond)
         encoder_tokens, encoder_emb, encoder_mask_uncond, encoder_mod_mask = self.forward_mask_encoder_generation(encoder_mod_dict)
         x = encoder_tokens + encoder_emb
         x = self.model.forward_encoder(x, encoder_mask_uncond) # B, N, D
@@ -1096,24 +1147,26 @@ class GenerationSampler(nn.Module):
         seq_len = y_emb.shape[1]
 
         ### 3 -  Auto-regressive decoding and sampling
+        # Both passes keep their own key / value cache, see autoregressive_step_batched
+        cache_cond = self.model.init_decoder_cache()
+        cache_uncond = self.model.init_decoder_cache()
         for i in range(seq_len):
             cur_len = out.shape[1]
+            new_tokens, causal_mask = self._autoregressive_decoder_inputs(out, i, B)
+            num_new = new_tokens.shape[1]
             # Convert ids into word embeddings and add corresponding posembs + modemb
-            y = self.model.decoder_embeddings[target_mod].token_emb(out) + y_emb[:, :cur_len]
-            # Build causal mask
-            causal_mask = torch.ones((cur_len, cur_len), dtype=torch.bool, device=y.device).triu(1)
-            causal_mask = repeat(causal_mask, "n1 n2 -> b n1 n2", b=B)
+            y = self.model.decoder_embeddings[target_mod].token_emb(new_tokens) + y_emb[:, cur_len - num_new:cur_len]
             
             ### 3a - Decoder forward pass, with conditioning
-            y_cond = self.model.forward_decoder(y, context_cond, encoder_mask_cond, causal_mask)
-            logits_cond = self.model.forward_logits(y_cond, decoder_mod_dict_cond, decoder_mod_mask_cond[:, :cur_len])[target_mod]
-            logits_cond = rearrange(logits_cond, "(b n) d -> b n d", b=B, n=cur_len)
+            y_cond = self.model.forward_decoder(y, context_cond, encoder_mask_cond, causal_mask, cache=cache_cond)
+            logits_cond = self.model.forward_logits(y_cond, decoder_mod_dict_cond, decoder_mod_mask_cond[:, cur_len - num_new:cur_len])[target_mod]
+            logits_cond = rearrange(logits_cond, "(b n) d -> b n d", b=B, n=num_new)
             last_logits_cond = logits_cond[:, -1]
 
             ### 3b - Decoder forward pass, without conditioning
-            y_uncond = self.model.forward_decoder(y, context_uncond, encoder_mask_uncond, causal_mask)
-            logits_uncond = self.model.forward_logits(y_uncond, decoder_mod_dict_uncond, decoder_mod_mask_uncond[:, :cur_len])[target_mod]
-            logits_uncond = rearrange(logits_uncond, "(b n) d -> b n d", b=B, n=cur_len)
+            y_uncond = self.model.forward_decoder(y, context_uncond, encoder_mask_uncond, causal_mask, cache=cache_uncond)
+            logits_uncond = self.model.forward_logits(y_uncond, decoder_mod_dict_uncond, decoder_mod_mask_uncond[:, cur_len - num_new:cur_len])[target_mod]
+            logits_uncond = rearrange(logits_uncond, "(b n) d -> b n d", b=B, n=num_new)
             last_logits_uncond = logits_uncond[:, -1]
 
             ### 3c - Classifier-free guidance
@@ -1152,57 +1205,60 @@ class GenerationSampler(nn.Module):
         """
 
         # Input embedding -> tokenizes the modalities - Many are placeholder for now
-        mod_dict = copy.deepcopy(mod_dict)
-
-        for step, schedule_step_info in tqdm(enumerate(schedule), disable=not verbose):
-            target_mod = schedule_step_info['target_domain']
-            temp = schedule_step_info['temperature']
-            cfg_scale = schedule_step_info.get('cfg_scale', 1.0)
-            cfg_conditioning = schedule_step_info.get('cfg_cond_domains', [])
-            seed_i = seed + step if seed is not None else None
+        mod_dict = copy_mod_dict(mod_dict)
+        self._embedding_cache = defaultdict(list)
+        try:
+            for step, schedule_step_info in tqdm(enumerate(schedule), disable=not verbose):
+                target_mod = schedule_step_info['target_domain']
+                temp = schedule_step_info['temperature']
+                cfg_scale = schedule_step_info.get('cfg_scale', 1.0)
+                cfg_conditioning = schedule_step_info.get('cfg_cond_domains', [])
+                seed_i = seed + step if seed is not None else None
             
-            if self.model.modality_info[target_mod]['type'] == 'img':
-                scheme = schedule_step_info['scheme']
-                num_select = num_tokens or schedule_step_info['num_tokens']
-
-                if scheme.lower() == 'maskgit':
-                    if cfg_scale == 1.0 or len(cfg_conditioning) == 0:
-                        mod_dict = self.maskgit_step_batched(
-                            mod_dict, target_mod, num_select, temperature=temp, 
-                            top_k=top_k, top_p=top_p, seed=seed_i
-                        )
+                if self.model.modality_info[target_mod]['type'] == 'img':
+                    scheme = schedule_step_info['scheme']
+                    num_select = num_tokens or schedule_step_info['num_tokens']
+
+                    if scheme.lower() == 'maskgit':
+                        if cfg_scale == 1.0 or len(cfg_conditioning) == 0:
+                            mod_dict = self.maskgit_step_batched(
+                                mod_dict, target_mod, num_select, temperature=temp, 
+                                top_k=top_k, top_p=top_p, seed=seed_i
+                            )
+                        else:
+                            mod_dict = self.guided_maskgit_step_batched(
+                                mod_dict, target_mod, num_select, temperature=temp, top_k=top_k, top_p=top_p,
+                                conditioning=cfg_conditioning, guidance_scale=cfg_scale, seed=seed_i
+                            )
+                    elif scheme.lower() == 'roar':
+                        if cfg_scale == 1.0 or len(cfg_conditioning) == 0:
+                            mod_dict = self.roar_step_batched(
+                                mod_dict, target_mod, num_select, temperature=temp, 
+                                top_k=top_k, top_p=top_p, seed=seed_i
+                            )
+                        else:
+                            mod_dict = self.guided_roar_step_batched(
+                                mod_dict, target_mod, num_select, temperature=temp, top_k=top_k, top_p=top_p, 
+                                conditioning=cfg_conditioning, guidance_scale=cfg_scale, seed=seed_i
+                            )
                     else:
-                        mod_dict = self.guided_maskgit_step_batched(
-                            mod_dict, target_mod, num_select, temperature=temp, top_k=top_k, top_p=top_p,
-                            conditioning=cfg_conditioning, guidance_scale=cfg_scale, seed=seed_i
-                        )
-                elif scheme.lower() == 'roar':
+                        raise ValueError("Invalid sampling scheme")
+                elif self.model.modality_info[target_mod]['type'] in ['seq', 'seq_token']:
                     if cfg_scale == 1.0 or len(cfg_conditioning) == 0:
-                        mod_dict = self.roar_step_batched(
-                            mod_dict, target_mod, num_select, temperature=temp, 
-                            top_k=top_k, top_p=top_p, seed=seed_i
+                        mod_dict = self.autoregressive_step_batched(
+                            mod_dict, target_mod, temperature=temp, top_k=top_k, top_p=top_p,
+                            text_tokenizer=text_tokenizer, seed=seed_i
                         )
                     else:
-                        mod_dict = self.guided_roar_step_batched(
-                            mod_dict, target_mod, num_select, temperature=temp, top_k=top_k, top_p=top_p, 
-                            conditioning=cfg_conditioning, guidance_scale=cfg_scale, seed=seed_i
+                        mod_dict = self.guided_autoregressive_step_batched(
+                            mod_dict, target_mod, temperature=temp, top_k=top_k, top_p=top_p,
+                            text_tokenizer=text_tokenizer, conditioning=cfg_conditioning, 
+                            guidance_scale=cfg_scale, seed=seed_i
                         )
                 else:
-                    raise ValueError("Invalid sampling scheme")
-            elif self.model.modality_info[target_mod]['type'] in ['seq', 'seq_token']:
-                if cfg_scale == 1.0 or len(cfg_conditioning) == 0:
-                    mod_dict = self.autoregressive_step_batched(
-                        mod_dict, target_mod, temperature=temp, top_k=top_k, top_p=top_p,
-                        text_tokenizer=text_tokenizer, seed=seed_i
-                    )
-                else:
-                    mod_dict = self.guided_autoregressive_step_batched(
-                        mod_dict, target_mod, temperature=temp, top_k=top_k, top_p=top_p,
-                        text_tokenizer=text_tokenizer, conditioning=cfg_conditioning, 
-                        guidance_scale=cfg_scale, seed=seed_i
-                    )
-            else:
-                raise ValueError("Invalid schedule")
+                    raise ValueError("Invalid schedule")
+        finally:
+            self._embedding_cache = None
 
         return mod_dict
 
@@ -1222,7 +1278,7 @@ class GenerationSampler(nn.Module):
         """
 
         # Input embedding -> tokenizes the modalities - Many are placeholder for now
-        mod_dict = copy.deepcopy(mod_dict)
+        mod_dict = copy_mod_dict(mod_dict)
 
         for step, schedule_step_info in tqdm(enumerate(schedule), disable=not verbose):
             target_mod = schedule_step_info['target_domain']
@@ -1230,7 +1286,7 @@ class GenerationSampler(nn.Module):
             cfg_scale = schedule_step_info.get('cfg_scale', 1.0)
             cfg_conditioning = schedule_step_info.get('cfg_cond_domains', [])
             seed_i = seed + step if seed is not None else None
-            
+        
             if self.model.modality_info[target_mod]['type'] == 'img':
                 scheme = schedule_step_info['scheme']
                 num_select = schedule_step_info['num_tokens']    
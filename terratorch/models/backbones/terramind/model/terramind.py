@@ -52,6 +52,8 @@ class TerraMind(nn.Module):
         norm_layer: Normalization layer to be used.
         gated_mlp: If True, make the feedforward gated (e.g., SwiGLU).
         qk_norm: If True, applies normalization to queries and keys (QKNorm).
+        fused_attn: If True, computes attention with the fused F.scaled_dot_product_attention, if False with explicit
+            matrix products. Defaults to timm's use_fused_attn().
         decoder_causal_mask: If True, decoder will use a causal mask for all tokens.
         decoder_sep_mask: If True, decoder attention is restricted to within each modality only.
         num_register_tokens: Number of register tokens.
@@ -76,6 +78,7 @@ class TerraMind(nn.Module):
                  norm_layer: partial | nn.Module = partial(LayerNorm, eps=1e-6),
                  gated_mlp: bool = False, # Make the feedforward gated for e.g. SwiGLU
                  qk_norm: bool = False,
+                 fused_attn: bool | None = None,
                  decoder_causal_mask: bool = False,
                  decoder_sep_mask: bool = True,
                  num_register_tokens: int = 0,
@@ -117,7 +120,8 @@ class TerraMind(nn.Module):
 
         self.encoder = nn.ModuleList([
             Block(dim=dim, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, proj_bias=proj_bias, mlp_bias=mlp_bias,
-                 drop_path=dpr_encoder[i], act_layer=act_layer, norm_layer=norm_layer, gated_mlp=gated_mlp, qk_norm=qk_norm)
+                 drop_path=dpr_encoder[i], act_layer=act_layer, norm_layer=norm_layer, gated_mlp=gated_mlp, qk_norm=qk_norm,
+                 fused_attn=fused_attn)
             for i in range(encoder_depth)
         ])
         self.encoder_norm = norm_layer(dim)
@@ -134,7 +138,8 @@ class TerraMind(nn.Module):
 
         self.decoder = nn.ModuleList([
             DecoderBlock(dim=dim, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, proj_bias=proj_bias, mlp_bias=mlp_bias, 
-                         drop_path=dpr_decoder[i], act_layer=act_layer, norm_layer=norm_layer, gated_mlp=gated_mlp, qk_norm=qk_norm)
+                         drop_path=dpr_decoder[i], act_layer=act_layer, norm_layer=norm_layer, gated_mlp=gated_mlp, qk_norm=qk_norm,
+                         fused_attn=fused_attn)
             for i in range(decoder_depth)
         ])
         self.decoder_norm = norm_layer(dim)
@@ -478,7 +483,8 @@ class TerraMind(nn.Module):
                         y: torch.Tensor, 
                         context: torch.Tensor, 
                         encoder_mask: torch.Tensor, 
-                        decoder_attention_mask: torch.Tensor) -> torch.Tensor:
+                        decoder_attention_mask: torch.Tensor,
+                        cache: list[dict] | None = None) -> torch.Tensor:
         """Forward pass for the decoder.
 
         Args:
@@ -486,18 +492,26 @@ class TerraMind(nn.Module):
             context (torch.Tensor): Context for the decoder (i.e. encoder output). Shape (B, N, D).
             encoder_mask (torch.Tensor): Encoder mask indicating which tokens are valid (set to 0 for valid tokens, 1 otherwise). Shape (B, 1, N).
             decoder_attention_mask (torch.Tensor): Decoder attention mask. Shape (B, M, M).
+            cache (list[dict], optional): Per-layer key/value caches for incremental decoding, see `init_decoder_cache`.
+                When given, y only contains the tokens following the ones of previous calls and decoder_attention_mask
+                covers the attention of these new tokens to all tokens. Defaults to None.
 
         Returns:
             torch.Tensor: Decoder output. Shape (B, M, D).
         """
 
-        for blk in self.decoder:
-            y = blk(y, context, sa_mask=decoder_attention_mask, xa_mask=encoder_mask)
+        for i, blk in enumerate(self.decoder):
+            y = blk(y, context, sa_mask=decoder_attention_mask, xa_mask=encoder_mask,
+                    cache=cache[i] if cache is not None else None)
 
         y = self.decoder_norm(y)
 
         return y
 
+    def init_decoder_cache(self) -> list[dict]:
+        """Creates empty per-layer key/value caches for `forward_decoder`. A cache is only valid for a single context."""
+        return [{} for _ in self.decoder]
+
     def forward_logits(self, 
                        y: torch.Tensor, 
                        decoder_mod_dict: dict[str, dict[str, torch.Tensor]], 
@@ -183,6 +183,11 @@ class TerraMindGeneration(nn.Module):
         temps (list, float): Sampling temperatures for each TiM modality. Defaults to 1.0.
         top_p (float): Top-p sampling threshold for TiM modalities. Ignored if set to 0.0. Defaults to 0.8.
         top_k (int): Top-k sampling threshold for TiM modalities. Ignored if set to 0. Defaults to 0.
+        timesteps (int): Number of diffusion steps used to decode the generated tokens. Defaults to 50.
+        fast_decode (bool): Decode the generated tokens with a single deterministic step instead of the diffusion
+            loop. Gives coarse reconstructions at a fraction of the cost. Defaults to False.
+        decode_cache_size (int): Number of decoded outputs cached per tokenizer, so that repeated token maps are not
+            decoded again. Defaults to 0 (disabled).
         merge_method (str, optional): Specify how the output is merged for further processing. One of 'mean', 'max',
             'concat', 'dict', or None. 'mean', 'max', and 'concat' are dropping all sequence modality tokens, split all
             image modality tokens and reduce the by applying the appropriate method. 'dict' splits all tokens into a
@@ -204,6 +209,8 @@ class TerraMindGeneration(nn.Module):
         norm_layer (nn.Module): Normalization layer.
         gated_mlp (bool): If True, makes the feedforward gated (e.g., for SwiGLU)
         qk_norm (bool): If True, normalizes the query and keys (as in ViT-22B)
+        fused_attn (bool, optional): If True, computes attention with the fused F.scaled_dot_product_attention, if
+            False with explicit matrix products. Defaults to timm's use_fused_attn().
         use_act_checkpoint (bool): If True, use activation checkpointing.
         encoder_norm (bool): If True, adds a norm layer after the last encoder block.
     """
@@ -219,6 +226,8 @@ class TerraMindGeneration(nn.Module):
             top_p: float = 0.8,
             top_k: int = 0,
             timesteps: int = 50,
+            fast_decode: bool = False,
+            decode_cache_size: int = 0,
             patch_size: int = 16,
             dim: int = 768,
             encoder_depth: int = 12,
@@ -232,6 +241,7 @@ class TerraMindGeneration(nn.Module):
             norm_layer: partial | nn.Module = partial(LayerNorm, eps=1e-6),
             gated_mlp: bool = False,
             qk_norm: bool = False,
+            fused_attn: bool | None = None,
             standardize: bool = False,
             offset: dict[str, float] | None = None,
             pretraining_mean: dict[str, list] | None = None,
@@ -262,6 +272,7 @@ class TerraMindGeneration(nn.Module):
         self.top_p = top_p
         self.top_k = top_k
         self.timesteps = timesteps
+        self.fast_decode = fast_decode
         self.decoding_steps = decoding_steps
         self.temps = temps
 
@@ -310,6 +321,7 @@ class TerraMindGeneration(nn.Module):
             norm_layer=norm_layer,
             gated_mlp=gated_mlp,
             qk_norm=qk_norm,
+            fused_attn=fused_attn,
         )
 
         self.sampler = GenerationSampler(mae_model)
@@ -317,6 +329,9 @@ class TerraMindGeneration(nn.Module):
         self.tokenizer = build_tokenizer(input_modalities=list(self.encoder_embeddings.keys()),
                                          output_modalities=list(self.decoder_embeddings.keys()),
                                          pretrained=pretrained)
+        for tok in self.tokenizer.values():
+            if hasattr(tok, "decode_cache_size"):
+                tok.decode_cache_size = decode_cache_size
 
     def to(self, device):
         super().to(device)
@@ -334,6 +349,7 @@ class TerraMindGeneration(nn.Module):
             offset: dict[str, float] | None = None,
             timesteps: int = None,
             verbose: bool = False,
+            fast_decode: bool | None = None,
             **kwargs
     ) -> dict[str, torch.Tensor]:
         """
@@ -451,6 +467,7 @@ class TerraMindGeneration(nn.Module):
 
         # TODO Vary timesteps based on codebook diversity
         timesteps = timesteps or self.timesteps
+        fast_decode = self.fast_decode if fast_decode is None else fast_decode
         out = {}
         for mod in self.output_modalities:
             tok = out_dict[mod]['tensor']
@@ -462,7 +479,8 @@ class TerraMindGeneration(nn.Module):
                 tok,
                 image_size=image_size,
                 timesteps=timesteps,
-                verbose=verbose
+                verbose=verbose,
+                fast=fast_decode,
             )
 
         if standardize:
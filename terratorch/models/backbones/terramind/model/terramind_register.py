@@ -21,8 +21,9 @@ from .terramind_vit import TerraMindViT
 from .terramind_tim import TerraMindTiM
 from .terramind_generation import TerraMindGeneration
 from .tm_utils import LayerNorm
+from terratorch.models.backbones.checkpoint_loading import build_model_from_state_dict, load_state_dict_file
+from terratorch.models.weights_cache import cached_hf_hub_download, register_pretrained_weights
 from terratorch.registry import TERRATORCH_BACKBONE_REGISTRY, TERRATORCH_FULL_MODEL_REGISTRY
-from huggingface_hub import hf_hub_download
 
 logger = logging.getLogger('terramind')
 
@@ -54,6 +55,7 @@ pretrained_weights = {
             "hf_hub_filename": "TerraMind_v1_large.pt",
         },
     }
+register_pretrained_weights(pretrained_weights)
 
 PRETRAINED_BANDS = {
     'untok_sen2l2a@224': [
@@ -273,12 +275,10 @@ def build_terrammind_vit(
         pretrained_bands: dict[str, list] | None = None,
         **kwargs):
 
-    model = TerraMindViT(**kwargs)
-
     if ckpt_path is not None:
         # Load model from checkpoint
-        state_dict = torch.load(ckpt_path, map_location="cpu", weights_only=True)
-        loaded_keys = model.load_state_dict(state_dict, strict=False)
+        state_dict = load_state_dict_file(ckpt_path)
+        model, loaded_keys = build_model_from_state_dict(lambda: TerraMindViT(**kwargs), state_dict, strict=False)
         if loaded_keys.missing_keys:
             logger.warning(f"Missing keys in ckpt_path {ckpt_path}: {loaded_keys.missing_keys}")
         if loaded_keys.unexpected_keys:
@@ -286,11 +286,13 @@ def build_terrammind_vit(
 
     elif pretrained:
         # Load model from Hugging Face
-        state_dict_file = hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
-                                          filename=pretrained_weights[variant]['hf_hub_filename'])
-        state_dict = torch.load(state_dict_file, map_location="cpu", weights_only=True)
-        state_dict = checkpoint_filter_fn(state_dict, model)
-        model.load_state_dict(state_dict, strict=True)
+        state_dict_file = cached_hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
+                                                 filename=pretrained_weights[variant]['hf_hub_filename'])
+        state_dict = load_state_dict_file(state_dict_file)
+        model, _ = build_model_from_state_dict(lambda: TerraMindViT(**kwargs), state_dict, checkpoint_filter_fn,
+                                               strict=True)
+    else:
+        model = TerraMindViT(**kwargs)
 
     if bands is not None:
         model = select_modality_patch_embed_weights(model, bands, pretrained_bands)
@@ -304,12 +306,10 @@ def build_terrammind_mae(
         ckpt_path: str | None = None,
         **kwargs):
 
-    model = TerraMind(**kwargs)
-
     if ckpt_path is not None:
         # Load model from checkpoint
-        state_dict = torch.load(ckpt_path, map_location="cpu", weights_only=True)
-        loaded_keys = model.load_state_dict(state_dict, strict=False)
+        state_dict = load_state_dict_file(ckpt_path)
+        model, loaded_keys = build_model_from_state_dict(lambda: TerraMind(**kwargs), state_dict, strict=False)
         if loaded_keys.missing_keys:
             logger.warning(f"Missing keys in ckpt_path {ckpt_path}: {loaded_keys.missing_keys}")
         if loaded_keys.unexpected_keys:
@@ -317,11 +317,13 @@ def build_terrammind_mae(
 
     elif pretrained:
         # Load model from Hugging Face
-        state_dict_file = hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
-                                          filename=pretrained_weights[variant]['hf_hub_filename'])
-        state_dict = torch.load(state_dict_file, map_location="cpu", weights_only=True)
-        state_dict = checkpoint_filter_fn(state_dict, model)
-        model.load_state_dict(state_dict, strict=True)
+        state_dict_file = cached_hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
+                                                 filename=pretrained_weights[variant]['hf_hub_filename'])
+        state_dict = load_state_dict_file(state_dict_file)
+        model, _ = build_model_from_state_dict(lambda: TerraMind(**kwargs), state_dict, checkpoint_filter_fn,
+                                               strict=True)
+    else:
+        model = TerraMind(**kwargs)
 
     return model
 
@@ -334,12 +336,10 @@ def build_terrammind_tim(
         pretrained_bands: dict[str, list] | None = None,
         **kwargs):
 
-    model = TerraMindTiM(**kwargs)
-
     if ckpt_path is not None:
         # Load model from checkpoint
-        state_dict = torch.load(ckpt_path, map_location="cpu", weights_only=True)
-        loaded_keys = model.load_state_dict(state_dict, strict=False)
+        state_dict = load_state_dict_file(ckpt_path)
+        model, loaded_keys = build_model_from_state_dict(lambda: TerraMindTiM(**kwargs), state_dict, strict=False)
         if loaded_keys.missing_keys:
             logger.warning(f"Missing keys in ckpt_path {ckpt_path}: {loaded_keys.missing_keys}")
         if loaded_keys.unexpected_keys:
@@ -347,11 +347,13 @@ def build_terrammind_tim(
 
     elif pretrained:
         # Load model from Hugging Face
-        state_dict_file = hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
-                                          filename=pretrained_weights[variant]['hf_hub_filename'])
-        state_dict = torch.load(state_dict_file, map_location="cpu", weights_only=True)
-        state_dict = checkpoint_filter_fn_tim(state_dict, model)
-        model.load_state_dict(state_dict, strict=True)
+        state_dict_file = cached_hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
+                                                 filename=pretrained_weights[variant]['hf_hub_filename'])
+        state_dict = load_state_dict_file(state_dict_file)
+        model, _ = build_model_from_state_dict(lambda: TerraMindTiM(**kwargs), state_dict, checkpoint_filter_fn_tim,
+                                               strict=True)
+    else:
+        model = TerraMindTiM(**kwargs)
 
     if bands is not None:
         raise NotImplementedError('Bands cannot be adapted because the MAE model for TiM is not trained.')
@@ -371,7 +373,7 @@ def build_terrammind_generate(
 
     if ckpt_path is not None:
         # Load model from checkpoint
-        state_dict = torch.load(ckpt_path, map_location="cpu", weights_only=True)
+        state_dict = load_state_dict_file(ckpt_path)
         loaded_keys = model.load_state_dict(state_dict, strict=False)
         if loaded_keys.missing_keys:
             logger.warning(f"Missing keys in ckpt_path {ckpt_path}: {loaded_keys.missing_keys}")
@@ -380,9 +382,9 @@ def build_terrammind_generate(
 
     elif pretrained:
         # Load model from Hugging Face
-        state_dict_file = hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
-                                          filename=pretrained_weights[variant]['hf_hub_filename'])
-        state_dict = torch.load(state_dict_file, map_location="cpu", weights_only=True)
+        state_dict_file = cached_hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
+                                                 filename=pretrained_weights[variant]['hf_hub_filename'])
+        state_dict = load_state_dict_file(state_dict_file)
         state_dict = checkpoint_filter_fn_generate(state_dict, model)
         model.load_state_dict(state_dict, strict=True)
 
@@ -20,6 +20,8 @@ from torch import nn
 from functools import partial
 
 from .encoder_embeddings import ImageEncoderEmbedding, ImageTokenEncoderEmbedding
+from terratorch.models.utils import apply_block, checkpoint_filter, resolve_out_indices
+
 from .tm_utils import Block, LayerNorm
 from .generate import GenerationSampler, build_chained_generation_schedules
 from .terramind import TerraMind
@@ -196,8 +198,14 @@ class TerraMindTiM(nn.Module):
         norm_layer (nn.Module): Normalization layer.
         gated_mlp (bool): If True, makes the feedforward gated (e.g., for SwiGLU)
         qk_norm (bool): If True, normalizes the query and keys (as in ViT-22B)
-        use_act_checkpoint (bool): If True, use activation checkpointing.
+        fused_attn (bool, optional): If True, computes attention with the fused F.scaled_dot_product_attention, if
+            False with explicit matrix products. Defaults to timm's use_fused_attn().
         encoder_norm (bool): If True, adds a norm layer after the last encoder block.
+        out_indices (list[int], optional): Indices of the encoder blocks whose outputs are returned. Defaults to all
+            blocks.
+        grad_checkpointing (bool): If True, recomputes the activations of the encoder blocks in the backward pass to
+            save memory.
+        checkpoint_every_n_blocks (int): Only every n-th encoder block is checkpointed.
     """
 
     def __init__(
@@ -228,7 +236,11 @@ class TerraMindTiM(nn.Module):
             norm_layer: partial | nn.Module = partial(LayerNorm, eps=1e-6),
             gated_mlp: bool = False,  # Make the feedforward gated for e.g. SwiGLU
             qk_norm: bool = False,
+            fused_attn: bool | None = None,
             encoder_norm: bool = True,
+            out_indices: list[int] | None = None,
+            grad_checkpointing: bool = False,
+            checkpoint_every_n_blocks: int = 1,
     ):
         super().__init__()
 
@@ -286,6 +298,7 @@ class TerraMindTiM(nn.Module):
             norm_layer=norm_layer,
             gated_mlp=gated_mlp,
             qk_norm=qk_norm,
+            fused_attn=fused_attn,
         )
         # No fine-tuning of the mae model
         mae_model = mae_model.requires_grad_(False)
@@ -324,17 +337,21 @@ class TerraMindTiM(nn.Module):
         self.encoder = nn.ModuleList([
             Block(dim=dim, num_heads=num_heads, mlp_ratio=mlp_ratio, qkv_bias=qkv_bias, proj_bias=proj_bias,
                   mlp_bias=mlp_bias, drop_path=dpr[i], drop=drop_rate, attn_drop=attn_drop_rate, act_layer=act_layer,
-                  norm_layer=norm_layer, gated_mlp=gated_mlp, qk_norm=qk_norm)
+                  norm_layer=norm_layer, gated_mlp=gated_mlp, qk_norm=qk_norm, fused_attn=fused_attn)
             for i in range(encoder_depth)
         ])
 
         # Needed for terratorch decoders
+        self.out_indices = out_indices if out_indices is not None else list(range(encoder_depth))
+        num_outputs = len(resolve_out_indices(out_indices, encoder_depth))
         if merge_method == 'concat':
-            self.out_channels = [dim * len(self.image_modalities) for i in range(encoder_depth)]
+            self.out_channels = [dim * len(self.image_modalities) for i in range(num_outputs)]
         else:
-            self.out_channels = [dim for i in range(encoder_depth)]
+            self.out_channels = [dim for i in range(num_outputs)]
 
         self.encoder_norm = norm_layer(dim) if encoder_norm else nn.Identity()
+        self.grad_checkpointing = grad_checkpointing
+        self.checkpoint_every_n_blocks = checkpoint_every_n_blocks
 
         # Weight init
         self.init_weights()
@@ -483,12 +500,20 @@ class TerraMindTiM(nn.Module):
         # Concatenate along token dim
         x = torch.cat(x, dim=1)  # Shape: (B, N, D)
 
-        out = []
-        for block in self.encoder:
-            x = block(x)
-            out.append(x.clone())
-
-        out[-1] = self.encoder_norm(x)  # Shape: (B, N, D)
+        out = {}
+        out_indices = resolve_out_indices(self.out_indices, len(self.encoder))
+        for idx, block in enumerate(self.encoder):
+            x = apply_block(
+                block, x, checkpoint=checkpoint_filter(idx, self.grad_checkpointing, self.checkpoint_every_n_blocks)
+            )
+            if idx == len(self.encoder) - 1:
+                x = self.encoder_norm(x)  # Shape: (B, N, D)
+            if idx in out_indices:
+                out[idx] = x
+            if idx == max(out_indices):
+                # Later blocks do not contribute to the outputs
+                break
+        out = [out[idx] for idx in out_indices]
 
         def _unstack_image_modalities(x):
             x = torch.split(x, num_tokens, dim=1)  # Split tokens by modality
@@ -22,6 +22,7 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from einops import rearrange
+from timm.layers import use_fused_attn
 
 
 def pair(t):
@@ -31,6 +32,38 @@ def softmax1(tensor):
     # See https://www.evanmiller.org/attention-is-off-by-one.html
     return F.pad(tensor, (0,1)).softmax(dim=-1)[...,:-1]
 
+def scaled_dot_product_attention(q, k, v, mask=None, scale=None, allow_zero_attn=False, dropout_p=0.):
+    """Fused counterpart of the explicit attention of the modules below, based on F.scaled_dot_product_attention.
+
+    Args:
+        q (torch.Tensor): Queries. Shape (B, H, N, D).
+        k (torch.Tensor): Keys. Shape (B, H, M, D).
+        v (torch.Tensor): Values. Shape (B, H, M, D).
+        mask (torch.Tensor, optional): Boolean mask, set to 1 for keys that are not attended to. Shape (B, N, M) or (B, 1, M).
+        scale (float, optional): Scale of the attention logits. Defaults to D ** -0.5.
+        allow_zero_attn (bool): If True, adds a zero logit to the softmax (see softmax1) with an extra zero key and value.
+        dropout_p (float): Attention dropout probability.
+    """
+    if mask is None:
+        attn_mask = None
+    else:
+        # Boolean masks avoid an additive mask of the lowest value, which overflows to -inf in half precision. In the
+        # explicit attention, fully masked rows attend uniformly to all keys (or to the zero key with softmax1), they
+        # attend to all keys here and their output is replaced by the mean of the values below.
+        fully_masked = mask.all(dim=-1, keepdim=True).unsqueeze(1)
+        attn_mask = ~mask.unsqueeze(1) | fully_masked # Unsqueeze attention mask for multi-head
+    if allow_zero_attn:
+        k = F.pad(k, (0, 0, 0, 1))
+        v = F.pad(v, (0, 0, 0, 1))
+        if attn_mask is not None:
+            # The zero key is always attended to, fully masked rows attend only to it
+            attn_mask = torch.cat([attn_mask & ~fully_masked, attn_mask.new_ones(*attn_mask.shape[:-1], 1)], dim=-1)
+    x = F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, dropout_p=dropout_p, scale=scale)
+    if attn_mask is not None and not allow_zero_attn:
+        # Without any keys, the explicit attention returns zeros
+        x = torch.where(fully_masked, v.sum(dim=-2, keepdim=True) / max(v.shape[-2], 1), x)
+    return x
+
 def build_1d_sincos_posemb(max_len, embed_dim=1024, temperature=10000.):
     """Sine-cosine positional embeddings from MoCo-v3, adapted back to 1d
 
@@ -146,48 +179,68 @@ class GatedMlp(nn.Module):
         return x
 
 
+def _append_to_kv_cache(cache, k, v):
+    """Appends the keys and values of new tokens to a self-attention cache and returns the keys and values of all tokens."""
+    if cache:
+        k = torch.cat([cache['k'], k], dim=2)
+        v = torch.cat([cache['v'], v], dim=2)
+    cache['k'], cache['v'] = k, v
+    return k, v
+
+
 class Attention(nn.Module):
-    def __init__(self, dim, num_heads=8, qkv_bias=False, proj_bias=True, attn_drop=0., proj_drop=0., allow_zero_attn=False):
+    def __init__(self, dim, num_heads=8, qkv_bias=False, proj_bias=True, attn_drop=0., proj_drop=0., allow_zero_attn=False,
+                 fused_attn=None):
         super().__init__()
         self.num_heads = num_heads
         head_dim = dim // num_heads
         self.scale = head_dim ** -0.5
         self.allow_zero_attn = allow_zero_attn
+        self.fused_attn = use_fused_attn() if fused_attn is None else fused_attn
 
         self.qkv = nn.Linear(dim, dim * 3, bias=qkv_bias)
         self.attn_drop = nn.Dropout(attn_drop)
         self.proj = nn.Linear(dim, dim, bias=proj_bias)
         self.proj_drop = nn.Dropout(proj_drop)
 
-    def forward(self, x, mask=None):
+    def forward(self, x, mask=None, cache=None):
         B, N, C = x.shape
         qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv.unbind(0)   # make torchscript happy (cannot use tensor as tuple)
+        if cache is not None:
+            k, v = _append_to_kv_cache(cache, k, v)
 
-        attn = (q @ k.transpose(-2, -1)) * self.scale
+        if self.fused_attn:
+            x = scaled_dot_product_attention(q, k, v, mask, scale=self.scale, allow_zero_attn=self.allow_zero_attn,
+                                             dropout_p=self.attn_drop.p if self.training else 0.)
+        else:
+            attn = (q @ k.transpose(-2, -1)) * self.scale
 
-        if mask is not None:
-            mask = mask.unsqueeze(1) # Unsqueeze attention mask for multi-head
-            attn = attn.masked_fill(mask, -torch.finfo(attn.dtype).max)
+            if mask is not None:
+                mask = mask.unsqueeze(1) # Unsqueeze attention mask for multi-head
+                attn = attn.masked_fill(mask, -torch.finfo(attn.dtype).max)
 
-        if self.allow_zero_attn:
-            attn = softmax1(attn)
-        else:
-            attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
+            if self.allow_zero_attn:
+                attn = softmax1(attn)
+            else:
+                attn = attn.softmax(dim=-1)
+            attn = self.attn_drop(attn)
 
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+            x = attn @ v
+        x = x.transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
 
 class CrossAttention(nn.Module):
-    def __init__(self, dim, num_heads=8, qkv_bias=False, proj_bias=True, attn_drop=0., proj_drop=0., allow_zero_attn=False):
+    def __init__(self, dim, num_heads=8, qkv_bias=False, proj_bias=True, attn_drop=0., proj_drop=0., allow_zero_attn=False,
+                 fused_attn=None):
         super().__init__()
         self.num_heads = num_heads
         head_dim = dim // num_heads
         self.scale = head_dim ** -0.5
         self.allow_zero_attn = allow_zero_attn
+        self.fused_attn = use_fused_attn() if fused_attn is None else fused_attn
 
         self.q = nn.Linear(dim, dim, bias=qkv_bias)
         self.kv = nn.Linear(dim, dim * 2, bias=qkv_bias)
@@ -196,38 +249,50 @@ class CrossAttention(nn.Module):
         self.proj = nn.Linear(dim, dim, bias=proj_bias)
         self.proj_drop = nn.Dropout(proj_drop)
 
-    def forward(self, x, context, mask=None):
+    def forward(self, x, context, mask=None, cache=None):
         B, N, C = x.shape
-        _, M, _ = context.shape
 
         q = self.q(x).reshape(B, N, self.num_heads, C // self.num_heads).permute(0, 2, 1, 3)
-        kv = self.kv(context).reshape(B, M, 2, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
-        k, v = kv[0], kv[1]
-
-        attn = (q @ k.transpose(-2, -1)) * self.scale
-        if mask is not None:
-            mask = rearrange(mask, "b n m -> b 1 n m") # Unsqueeze / reshape for multi-head
-            attn = attn.masked_fill(mask, -torch.finfo(attn.dtype).max)
-        
-        if self.allow_zero_attn:
-            attn = softmax1(attn)
+        if cache:
+            k, v = cache['k'], cache['v']
         else:
-            attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
-
-        x = (attn @ v).transpose(1, 2).reshape(B, N, -1)
+            _, M, _ = context.shape
+            kv = self.kv(context).reshape(B, M, 2, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
+            k, v = kv[0], kv[1]
+            if cache is not None:
+                cache['k'], cache['v'] = k, v
+
+        if self.fused_attn:
+            x = scaled_dot_product_attention(q, k, v, mask, scale=self.scale, allow_zero_attn=self.allow_zero_attn,
+                                             dropout_p=self.attn_drop.p if self.training else 0.)
+        else:
+            attn = (q @ k.transpose(-2, -1)) * self.scale
+            if mask is not None:
+                mask = rearrange(mask, "b n m -> b 1 n m") # Unsqueeze / reshape for multi-head
+                attn = attn.masked_fill(mask, -torch.finfo(attn.dtype).max)
+        
+            if self.allow_zero_attn:
+                attn = softmax1(attn)
+            else:
+                attn = attn.softmax(dim=-1)
+            attn = self.attn_drop(attn)
+
+            x = attn @ v
+        x = x.transpose(1, 2).reshape(B, N, -1)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
 
 
 class NormAttention(nn.Module):
-    def __init__(self, dim, num_heads=8, qkv_bias=False, proj_bias=True,  norm_layer=nn.LayerNorm, attn_drop=0., proj_drop=0., allow_zero_attn=False):
+    def __init__(self, dim, num_heads=8, qkv_bias=False, proj_bias=True,  norm_layer=nn.LayerNorm, attn_drop=0., proj_drop=0., allow_zero_attn=False,
+                 fused_attn=None):
         super().__init__()
         self.num_heads = num_heads
         head_dim = dim // num_heads
         self.scale = head_dim ** -0.5
         self.allow_zero_attn = allow_zero_attn
+        self.fused_attn = use_fused_attn() if fused_attn is None else fused_attn
 
         self.qkv = nn.Linear(dim, dim * 3, bias=qkv_bias)
         self.attn_drop = nn.Dropout(attn_drop)
@@ -237,39 +302,48 @@ class NormAttention(nn.Module):
         self.q_norm = norm_layer(head_dim)
         self.k_norm = norm_layer(head_dim)
 
-    def forward(self, x, mask=None):
+    def forward(self, x, mask=None, cache=None):
         B, N, C = x.shape
         qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv.unbind(0)   # make torchscript happy (cannot use tensor as tuple)
 
         q = self.q_norm(q)
         k = self.k_norm(k)
+        if cache is not None:
+            k, v = _append_to_kv_cache(cache, k, v)
 
-        attn = (q @ k.transpose(-2, -1)) * self.scale
+        if self.fused_attn:
+            x = scaled_dot_product_attention(q, k, v, mask, scale=self.scale, allow_zero_attn=self.allow_zero_attn,
+                                             dropout_p=self.attn_drop.p if self.training else 0.)
+        else:
+            attn = (q @ k.transpose(-2, -1)) * self.scale
 
-        if mask is not None:
-            mask = mask.unsqueeze(1) # Unsqueeze for multi-head
-            attn = attn.masked_fill(mask, -torch.finfo(attn.dtype).max)
+            if mask is not None:
+                mask = mask.unsqueeze(1) # Unsqueeze for multi-head
+                attn = attn.masked_fill(mask, -torch.finfo(attn.dtype).max)
 
-        if self.allow_zero_attn:
-            attn = softmax1(attn)
-        else:
-            attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
+            if self.allow_zero_attn:
+                attn = softmax1(attn)
+            else:
+                attn = attn.softmax(dim=-1)
+            attn = self.attn_drop(attn)
 
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+            x = attn @ v
+        x = x.transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
 
 
 class NormCrossAttention(nn.Module):
-    def __init__(self, dim, num_heads=8, qkv_bias=False, proj_bias=True, norm_layer=nn.LayerNorm, attn_drop=0., proj_drop=0., allow_zero_attn=False):
+    def __init__(self, dim, num_heads=8, qkv_bias=False, proj_bias=True, norm_layer=nn.LayerNorm, attn_drop=0., proj_drop=0., allow_zero_attn=False,
+                 fused_attn=None):
         super().__init__()
         self.num_heads = num_heads
         head_dim = dim // num_heads
         self.scale = head_dim ** -0.5
         self.allow_zero_attn = allow_zero_attn
+        self.fused_attn = use_fused_attn() if fused_attn is None else fused_attn
 
         self.q = nn.Linear(dim, dim, bias=qkv_bias)
         self.kv = nn.Linear(dim, dim * 2, bias=qkv_bias)
@@ -281,29 +355,37 @@ class NormCrossAttention(nn.Module):
         self.q_norm = norm_layer(head_dim)
         self.k_norm = norm_layer(head_dim)
 
-    def forward(self, x, context, mask=None):
+    def forward(self, x, context, mask=None, cache=None):
         B, N, C = x.shape
-        _, M, _ = context.shape
 
         q = self.q(x).reshape(B, N, self.num_heads, C // self.num_heads).permute(0, 2, 1, 3)
-        kv = self.kv(context).reshape(B, M, 2, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
-        k, v = kv[0], kv[1]
-
         q = self.q_norm(q)
-        k = self.k_norm(k)
-
-        attn = (q @ k.transpose(-2, -1)) * self.scale
-        if mask is not None:
-            mask = rearrange(mask, "b n m -> b 1 n m")  # Unsqueeze / reshape for multi-head
-            attn = attn.masked_fill(mask, -torch.finfo(attn.dtype).max)
-        
-        if self.allow_zero_attn:
-            attn = softmax1(attn)
+        if cache:
+            k, v = cache['k'], cache['v']
         else:
-            attn = attn.softmax(dim=-1)
-        attn = self.attn_drop(attn)
-
-        x = (attn @ v).transpose(1, 2).reshape(B, N, -1)
+            _, M, _ = context.shape
+            kv = self.kv(context).reshape(B, M, 2, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
+            k, v = self.k_norm(kv[0]), kv[1]
+            if cache is not None:
+                cache['k'], cache['v'] = k, v
+
+        if self.fused_attn:
+            x = scaled_dot_product_attention(q, k, v, mask, scale=self.scale, allow_zero_attn=self.allow_zero_attn,
+                                             dropout_p=self.attn_drop.p if self.training else 0.)
+        else:
+            attn = (q @ k.transpose(-2, -1)) * self.scale
+            if mask is not None:
+                mask = rearrange(mask, "b n m -> b 1 n m")  # Unsqueeze / reshape for multi-head
+                attn = attn.masked_fill(mask, -torch.finfo(attn.dtype).max)
+        
+            if self.allow_zero_attn:
+                attn = softmax1(attn)
+            else:
+                attn = attn.softmax(dim=-1)
+            attn = self.attn_drop(attn)
+
+            x = attn @ v
+        x = x.transpose(1, 2).reshape(B, N, -1)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -312,14 +394,15 @@ class NormCrossAttention(nn.Module):
 class Block(nn.Module):
 
     def __init__(self, dim, num_heads, mlp_ratio=4., qkv_bias=True, proj_bias=True, mlp_bias=True, drop=0., attn_drop=0.,
-                 drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, gated_mlp=False, qk_norm=False, allow_zero_attn=False):
+                 drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, gated_mlp=False, qk_norm=False, allow_zero_attn=False,
+                 fused_attn=None):
         super().__init__()
         self.norm1 = norm_layer(dim)
 
         if not qk_norm:
-            self.attn = Attention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn)
+            self.attn = Attention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn, fused_attn=fused_attn)
         else:
-            self.attn = NormAttention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, norm_layer=norm_layer, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn)
+            self.attn = NormAttention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, norm_layer=norm_layer, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn, fused_attn=fused_attn)
         
         self.drop_path = DropPath(drop_path) if drop_path > 0. else nn.Identity()
         self.norm2 = norm_layer(dim)
@@ -338,16 +421,17 @@ class Block(nn.Module):
 
 class DecoderBlock(nn.Module):
     def __init__(self, dim, num_heads, mlp_ratio=4., qkv_bias=True, proj_bias=True, mlp_bias=True, drop=0., attn_drop=0.,
-                 drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, gated_mlp=False, qk_norm=False, allow_zero_attn=False):
+                 drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, gated_mlp=False, qk_norm=False, allow_zero_attn=False,
+                 fused_attn=None):
         super().__init__()
         self.norm1 = norm_layer(dim)
 
         if not qk_norm:
-            self.self_attn = Attention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn)
-            self.cross_attn = CrossAttention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn)
+            self.self_attn = Attention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn, fused_attn=fused_attn)
+            self.cross_attn = CrossAttention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn, fused_attn=fused_attn)
         else:
-            self.self_attn = NormAttention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, norm_layer=norm_layer, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn)
-            self.cross_attn = NormCrossAttention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, norm_layer=norm_layer, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn)
+            self.self_attn = NormAttention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, norm_layer=norm_layer, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn, fused_attn=fused_attn)
+            self.cross_attn = NormCrossAttention(dim, num_heads=num_heads, qkv_bias=qkv_bias, proj_bias=proj_bias, norm_layer=norm_layer, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn, fused_attn=fused_attn)
 
         
         self.query_norm = norm_layer(dim)
@@ -361,18 +445,31 @@ class DecoderBlock(nn.Module):
         else:
             self.mlp = GatedMlp(in_features=dim, hidden_features=mlp_hidden_dim, act_layer=act_layer, bias=mlp_bias)
 
-    def forward(self, x, context, sa_mask=None, xa_mask=None):
-        x = x + self.drop_path(self.self_attn(self.norm1(x), sa_mask))
-        x = x + self.drop_path(self.cross_attn(self.query_norm(x), self.context_norm(context), xa_mask))
+    def forward(self, x, context, sa_mask=None, xa_mask=None, cache=None):
+        """
+        Args:
+            cache (dict, optional): Key/value cache of this block for incremental decoding. The self-attention keys and
+                values of previous calls are reused, so x only needs to contain the new tokens. The cross-attention keys
+                and values are computed from the context in the first call and reused afterwards.
+        """
+        sa_cache = xa_cache = None
+        if cache is not None:
+            sa_cache = cache.setdefault('self_attn', {})
+            xa_cache = cache.setdefault('cross_attn', {})
+        x = x + self.drop_path(self.self_attn(self.norm1(x), sa_mask, cache=sa_cache))
+        # The normalized context is only needed when the cross-attention keys and values are not cached yet
+        context = None if xa_cache else self.context_norm(context)
+        x = x + self.drop_path(self.cross_attn(self.query_norm(x), context, xa_mask, cache=xa_cache))
         x = x + self.drop_path(self.mlp(self.norm2(x)))
         return x
 
 
 class CrossAttentionBlock(nn.Module):
     def __init__(self, dim, num_heads, mlp_ratio=4., qkv_bias=False, drop=0., attn_drop=0.,
-                 drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, gated_mlp=False, allow_zero_attn=False):
+                 drop_path=0., act_layer=nn.GELU, norm_layer=nn.LayerNorm, gated_mlp=False, allow_zero_attn=False,
+                 fused_attn=None):
         super().__init__()
-        self.cross_attn = CrossAttention(dim, num_heads=num_heads, qkv_bias=qkv_bias, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn)
+        self.cross_attn = CrossAttention(dim, num_heads=num_heads, qkv_bias=qkv_bias, attn_drop=attn_drop, proj_drop=drop, allow_zero_attn=allow_zero_attn, fused_attn=fused_attn)
         self.query_norm = norm_layer(dim)
         self.context_norm = norm_layer(dim)
         self.drop_path = DropPath(drop_path) if drop_path > 0. else nn.Identity()
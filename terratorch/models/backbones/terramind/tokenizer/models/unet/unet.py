@@ -719,6 +719,7 @@ class PatchedUNetCondCat(UNetModel):
                 timestep: th.Tensor | float | int,
                 encoder_hidden_states: th.Tensor = None, # Shape (B, D_C, H_C, W_C)
                 cond_mask: th.BoolTensor | None = None, # Boolen tensor of shape (B, H_C, W_C). True for masked out pixels
+                unconditional: bool | th.BoolTensor = False, # Mask out the whole condition, for all samples or per sample (B,)
                 **kwargs):
         B, C, H, W = sample.shape
         assert (H % self.P_H == 0) and (W % self.P_W == 0), f'Image sizes {H}x{W} must be divisible by patch sizes {self.P_H}x{self.P_W}'
@@ -730,6 +731,13 @@ class PatchedUNetCondCat(UNetModel):
             ph=self.P_H, pw=self.P_W, nh=N_H, nw=N_W
         )
 
+        # Mask out the whole condition of the unconditional samples (classifier-free guidance)
+        if unconditional is not False:
+            H_C, W_C = encoder_hidden_states.shape[-2:]
+            uncond_mask = th.as_tensor(unconditional, dtype=th.bool, device=sample.device)
+            uncond_mask = uncond_mask.expand(B)[:, None, None].expand(-1, H_C, W_C)
+            cond_mask = uncond_mask if cond_mask is None else cond_mask | uncond_mask
+
         # Optionally mask out conditioning
         if cond_mask is not None:
             encoder_hidden_states = torch.where(cond_mask[:,None,:,:], 0.0, encoder_hidden_states)
@@ -858,6 +858,7 @@ class UViT(ModelMixin, ConfigMixin):
         cond_mask: torch.Tensor | None = None,
         timestep_cond: torch.Tensor | None = None,
         orig_res: torch.LongTensor | tuple[int, int] | None = None,
+        unconditional: bool | torch.BoolTensor = False,
         **kwargs,
     ) -> torch.Tensor:
         """UViT forward pass.
@@ -873,6 +874,8 @@ class UViT(ModelMixin, ConfigMixin):
             timestep_cond: Optional conditioning to add to the timestep embedding.
             orig_res: The original resolution of the image to condition the diffusion on. Ignored if None.
               See SDXL https://arxiv.org/abs/2307.01952 for more details.
+            unconditional: Whether to mask out the whole condition, for all samples or per sample as a
+              boolean tensor of shape (B,). Used for the unconditional prediction of classifier-free guidance.
 
         Returns:
             Diffusion objective target image of shape (B, C, H, W).
@@ -946,6 +949,12 @@ class UViT(ModelMixin, ConfigMixin):
             sample = self.downsample_mid(sample)
         
         # 4. mid
+        if unconditional is not False:
+            # Mask out the whole condition of the unconditional samples, like the classifier-free guidance dropout
+            h_mask, w_mask = cond_mask.shape[-2:] if cond_mask is not None else condition.shape[-2:]
+            uncond_mask = torch.as_tensor(unconditional, dtype=torch.bool, device=condition.device)
+            uncond_mask = uncond_mask.expand(condition.shape[0])[:, None, None].expand(-1, h_mask, w_mask)
+            cond_mask = uncond_mask if cond_mask is None else cond_mask | uncond_mask
         sample = self.mid_block(sample, emb, condition, cond_mask)
 
         # 5. up
@@ -66,6 +66,8 @@ class PipelineCond(DiffusionPipeline):
                  verbose: bool = True,
                  scheduler_timesteps_mode: str = 'trailing',
                  orig_res: torch.LongTensor | tuple[int, int] | None = None,
+                 batched_cfg: bool = True,
+                 noise: torch.Tensor | None = None,
                  **kwargs) -> torch.Tensor:
         """The call function to the pipeline for conditional image generation.
 
@@ -84,6 +86,11 @@ class PipelineCond(DiffusionPipeline):
               `leading`. See https://arxiv.org/abs/2305.08891 for more details.
             orig_res: The original resolution of the image to condition the diffusion on. Ignored if None.
               See SDXL https://arxiv.org/abs/2307.01952 for more details.
+            batched_cfg: Whether to compute the conditional and unconditional predictions of classifier-free
+              guidance in a single forward pass over a batch of twice the size. The unconditional half is flagged
+              by passing a boolean tensor of shape [2B] as `unconditional` to the model. Only used if orig_res is
+              None, since the unconditional prediction is not conditioned on the resolution.
+            noise: Initial noise of shape [B, C, H, W]. Sampled from a gaussian if not given.
 
         Returns:
             The generated image.
@@ -95,13 +102,21 @@ class PipelineCond(DiffusionPipeline):
         # Sample gaussian noise to begin loop
         image_size = self.model.sample_size if image_size is None else image_size
         image_size = to_2tuple(image_size)
-        image = torch.randn(
-            (batch_size, self.n_channels, image_size[0], image_size[1]),
-            generator=generator,
-        )
-        image = image.to(self.model.device)
+        # Sample on the device of the generator to keep generation reproducible, which is the model device by default
+        if noise is None:
+            noise = torch.randn(
+                (batch_size, self.n_channels, image_size[0], image_size[1]),
+                generator=generator,
+                device=generator.device if generator is not None else self.model.device,
+            )
+        image = noise.to(self.model.device)
 
         do_cfg = callable(guidance_scale) or  guidance_scale > 1.0
+        if do_cfg and batched_cfg and orig_res is None:
+            cond_cfg = torch.cat([cond, cond])
+            unconditional = torch.arange(2 * batch_size, device=self.model.device) >= batch_size
+        else:
+            batched_cfg = False
 
         # Set step values
         self.scheduler.set_timesteps(timesteps, mode=scheduler_timesteps_mode)
@@ -111,10 +126,16 @@ class PipelineCond(DiffusionPipeline):
 
         for t in self.scheduler.timesteps:
             # 1. Predict noise model_output
-            model_output = self.model(image, t, cond, orig_res=orig_res, **kwargs)
-            
+            if batched_cfg:
+                model_output, model_output_uncond = self.model(
+                    torch.cat([image, image]), t, cond_cfg, unconditional=unconditional, **kwargs
+                ).chunk(2)
+            else:
+                model_output = self.model(image, t, cond, orig_res=orig_res, **kwargs)
+
             if do_cfg:
-                model_output_uncond = self.model(image, t, cond, unconditional=True, **kwargs)
+                if not batched_cfg:
+                    model_output_uncond = self.model(image, t, cond, unconditional=True, **kwargs)
 
                 if callable(guidance_scale):
                     guidance_scale_value = guidance_scale(t/self.scheduler.config.num_train_timesteps)
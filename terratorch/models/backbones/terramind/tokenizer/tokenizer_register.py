@@ -15,8 +15,9 @@ import warnings
 
 import torch
 import logging
+from terratorch.models.backbones.checkpoint_loading import build_model_from_state_dict, load_state_dict_file
+from terratorch.models.weights_cache import cached_hf_hub_download, register_pretrained_weights
 from terratorch.registry import TERRATORCH_FULL_MODEL_REGISTRY
-from huggingface_hub import hf_hub_download
 
 logger = logging.getLogger('terramind')
 
@@ -67,6 +68,7 @@ pretrained_weights = {
         "hf_hub_filename": "TerraMind_Tokenizer_NDVI.pt",
     },
 }
+register_pretrained_weights(pretrained_weights)
 
 def build_vqvae(
         model_type: str = 'divae',
@@ -81,16 +83,16 @@ def build_vqvae(
         raise import_error
 
     if model_type == 'divae':
-        model = DiVAE(**kwargs)
+        model_class = DiVAE
     elif model_type == 'vqvae':
-        model = VQVAE(**kwargs)
+        model_class = VQVAE
     else:
         raise ValueError(f'Unknown model type: {model_type}')
 
     if ckpt_path is not None:
         # Load model from checkpoint
-        state_dict = torch.load(ckpt_path, map_location="cpu", weights_only=True)
-        loaded_keys = model.load_state_dict(state_dict, strict=False)
+        state_dict = load_state_dict_file(ckpt_path)
+        model, loaded_keys = build_model_from_state_dict(lambda: model_class(**kwargs), state_dict, strict=False)
         if loaded_keys.missing_keys:
             logger.warning(f"Missing keys in ckpt_path {ckpt_path}: {loaded_keys.missing_keys}")
         if loaded_keys.unexpected_keys:
@@ -98,10 +100,12 @@ def build_vqvae(
 
     elif pretrained:
         # Load model from Hugging Face
-        state_dict_file = hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
-                                          filename=pretrained_weights[variant]['hf_hub_filename'])
-        state_dict = torch.load(state_dict_file, map_location="cpu", weights_only=True)
-        model.load_state_dict(state_dict, strict=True)
+        state_dict_file = cached_hf_hub_download(repo_id=pretrained_weights[variant]['hf_hub_id'],
+                                                 filename=pretrained_weights[variant]['hf_hub_filename'])
+        state_dict = load_state_dict_file(state_dict_file)
+        model, _ = build_model_from_state_dict(lambda: model_class(**kwargs), state_dict, strict=True)
+    else:
+        model = model_class(**kwargs)
 
     return model
 
@@ -19,8 +19,10 @@
 # Source: https://github.com/apple/ml-4m/
 
 from typing import List, Tuple, Dict, Optional, Union, Any
+from collections import OrderedDict
 from contextlib import nullcontext
 import copy
+import hashlib
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
@@ -42,7 +44,7 @@ from .scheduling import (
     PipelineCond,
 )
 
-from terratorch.models.backbones.terramind.utils import denormalize
+from terratorch.models.backbones.terramind.utils import denormalize, to_2tuple
 
 try:
     from diffusers.schedulers.scheduling_utils import SchedulerMixin
@@ -576,6 +578,9 @@ class DiVAE(VQ):
         image_size_dec: Image size for the decoder. Defaults to image_size.
           Change this when loading weights from a tokenizer decoder trained on a
           different image size.
+        decode_cache_size: Number of decoded outputs kept in an LRU cache by decode_tokens,
+          keyed by the tokens and decoding arguments. Disabled if 0. Note that cached
+          decodings are returned as is, even though diffusion decoding is stochastic.
         config: Dictionary containing the model configuration. Only used when loading
             from Huggingface Hub. Ignore otherwise.
     """
@@ -597,6 +602,7 @@ class DiVAE(VQ):
         dec_transformer_dropout: float = 0.2,
         zero_terminal_snr: bool = True,
         image_size_dec: Optional[int] = None,
+        decode_cache_size: int = 0,
         config: Optional[Dict[str, Any]] = None,
         *args,
         **kwargs,
@@ -622,6 +628,8 @@ class DiVAE(VQ):
         self.clip_sample = clip_sample
         self.thresholding = thresholding
         self.zero_terminal_snr = zero_terminal_snr
+        self.decode_cache_size = decode_cache_size
+        self._decode_cache = OrderedDict()
 
         if cls_free_guidance_dropout > 0.0:
             self.cfg_dist = torch.distributions.Bernoulli(
@@ -727,6 +735,8 @@ class DiVAE(VQ):
         verbose: bool = False,
         scheduler_timesteps_mode: str = "trailing",
         orig_res: Optional[Union[torch.LongTensor, Tuple[int, int]]] = None,
+        guidance_scale: float = 0.0,
+        fast: bool = False,
     ) -> torch.Tensor:
         """Decodes quantized latent codes back to an image.
 
@@ -741,10 +751,31 @@ class DiVAE(VQ):
               `leading`. See https://arxiv.org/abs/2305.08891 for more details.
             orig_res: The original resolution of the image to condition the diffusion on. Ignored if None.
               See SDXL https://arxiv.org/abs/2307.01952 for more details.
+            guidance_scale: The scale of the classifier-free guidance. If set to 0.0, no guidance is used.
+            fast: Skip the diffusion loop and decode with a single deterministic DDIM step from the terminal
+              timestep, which returns the decoder's prediction of the clean image. Gives a coarse reconstruction
+              for a fraction of the cost. Ignores timesteps and scheduler. The initial noise is sampled with
+              generator, or with a fixed seed if it is None.
 
         Returns:
             Decoded image tensor of shape B C H W
         """
+        noise = None
+        if fast:
+            timesteps = 1
+            scheduler_timesteps_mode = "trailing"
+            scheduler = self._get_fast_scheduler()
+            image_size = to_2tuple(image_size or self.decoder.sample_size)
+            # The decoder expects unit gaussian noise at the terminal timestep. It is sampled with a fixed seed unless
+            # a generator is given, so that fast decoding is deterministic.
+            if generator is None:
+                generator = torch.Generator(device=quant.device).manual_seed(0)
+            noise = torch.randn(
+                (quant.shape[0], self.n_channels, *image_size),
+                generator=generator,
+                device=generator.device,
+                dtype=quant.dtype,
+            ).to(quant.device)
         if scheduler is None:
             scheduler = self.noise_scheduler
         pipeline = self._get_pipeline(scheduler)
@@ -756,12 +787,60 @@ class DiVAE(VQ):
             verbose=verbose,
             scheduler_timesteps_mode=scheduler_timesteps_mode,
             orig_res=orig_res,
+            guidance_scale=guidance_scale,
+            noise=noise,
         )
         return dec
 
+    def _get_fast_scheduler(self) -> DDIMScheduler:
+        """DDIM scheduler for fast decoding, which is deterministic unlike DDPM."""
+        if isinstance(self.noise_scheduler, DDIMScheduler):
+            return self.noise_scheduler
+        return DDIMScheduler(
+            num_train_timesteps=self.num_train_timesteps,
+            thresholding=self.thresholding,
+            clip_sample=self.clip_sample,
+            beta_schedule=self.beta_schedule,
+            prediction_type=self.prediction_type,
+            zero_terminal_snr=self.zero_terminal_snr,
+        )
+
     def decode_tokens(self, tokens: torch.LongTensor, **kwargs) -> torch.Tensor:
-        """See `decode_quant` for details on the optional args."""
-        return super().decode_tokens(tokens, **kwargs)
+        """See `decode_quant` for details on the optional args.
+
+        If decode_cache_size > 0, decoded outputs are cached by tokens and arguments. Decodings
+        with an explicit generator are not cached.
+        """
+        if self.decode_cache_size <= 0 or self.training or kwargs.get("generator") is not None:
+            return super().decode_tokens(tokens, **kwargs)
+
+        key = self._decode_cache_key(tokens, **kwargs)
+        if key in self._decode_cache:
+            self._decode_cache.move_to_end(key)
+            return self._decode_cache[key].clone()
+
+        dec = super().decode_tokens(tokens, **kwargs)
+        self._decode_cache[key] = dec.detach()
+        if len(self._decode_cache) > self.decode_cache_size:
+            self._decode_cache.popitem(last=False)
+        return dec.clone()
+
+    @staticmethod
+    def _decode_cache_key(tokens: torch.LongTensor, **kwargs) -> str:
+        key = hashlib.sha1()
+        for name, value in [("tokens", tokens), *sorted(kwargs.items())]:
+            key.update(name.encode())
+            if isinstance(value, torch.Tensor):
+                # The repr of large tensors is truncated, hash their content
+                key.update(repr((tuple(value.shape), value.dtype, str(value.device))).encode())
+                key.update(value.detach().cpu().numpy().tobytes())
+            else:
+                key.update(repr(value).encode())
+        return key.hexdigest()
+
+    def clear_decode_cache(self) -> None:
+        """Empties the cache of decode_tokens."""
+        self._decode_cache.clear()
 
     def forward(
         self,
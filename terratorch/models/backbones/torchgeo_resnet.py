@@ -5,15 +5,14 @@ from torchgeo.models.resnet import ResNet, ResNet18_Weights, ResNet50_Weights, R
 import logging
 from collections.abc import Callable
 from functools import partial
-import huggingface_hub
 import torch.nn as nn
 from typing import List
-import huggingface_hub
 from torchvision.models._api import Weights, WeightsEnum
 from terratorch.datasets.utils import OpticalBands, SARBands
 from terratorch.models.backbones.select_patch_embed_weights import select_patch_embed_weights
 
 from terratorch.registry import TERRATORCH_BACKBONE_REGISTRY
+from terratorch.models.weights_cache import cached_hf_url_download, load_weights_state_dict
 import torch
 import pdb
 
@@ -796,9 +795,7 @@ def load_resnet_weights(model: nn.Module, model_bands, ckpt_data: str, weights:
     pretrained_bands = get_pretrained_bands(weights.meta["bands"]) if "bands" in weights.meta else []
     if ckpt_data is not None:
         if ckpt_data.find("https://hf.co/") > -1:
-            repo_id = ckpt_data.split("/resolve/")[0].replace("https://hf.co/", '')
-            filename = ckpt_data.split("/")[-1]
-            ckpt_data = huggingface_hub.hf_hub_download(repo_id=repo_id, filename=filename)
+            ckpt_data = cached_hf_url_download(ckpt_data)
 
         checkpoint_model = torch.load(ckpt_data, map_location="cpu", weights_only=True)
         state_dict = model.state_dict()
@@ -818,7 +815,7 @@ def load_resnet_weights(model: nn.Module, model_bands, ckpt_data: str, weights:
         logging.info(msg)
     else:
         if weights is not None:
-            checkpoint_model = weights.get_state_dict(progress=True)
+            checkpoint_model = load_weights_state_dict(weights)
             checkpoint_model = select_patch_embed_weights(checkpoint_model, model, pretrained_bands, model_bands, custom_weight_proj)
             missing_keys, unexpected_keys = model.load_state_dict(checkpoint_model, strict=False)
             assert set(missing_keys) <= {'fc.weight', 'fc.bias'}
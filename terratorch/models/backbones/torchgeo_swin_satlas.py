@@ -5,10 +5,8 @@ from torchgeo.models.swin import Swin_V2_T_Weights, Swin_V2_B_Weights
 import logging
 from collections.abc import Callable
 from functools import partial
-import huggingface_hub
 import torch.nn as nn
 from typing import List
-import huggingface_hub
 from torchvision.models._api import Weights, WeightsEnum
 from torchvision.models import swin_v2_t, swin_v2_b
 import torch
@@ -16,6 +14,7 @@ from terratorch.datasets.utils import OpticalBands, SARBands
 from terratorch.models.backbones.select_patch_embed_weights import select_patch_embed_weights
 
 from terratorch.registry import TERRATORCH_BACKBONE_REGISTRY
+from terratorch.models.weights_cache import cached_hf_url_download, load_weights_state_dict
 
 class SwinEncoderWrapper(nn.Module):
 
@@ -350,9 +349,7 @@ def load_swin_weights(model: nn.Module, model_bands, ckpt_data: str, weights: We
     
     if ckpt_data is not None:
         if ckpt_data.find("https://hf.co/") > -1:
-            repo_id = ckpt_data.split("/resolve/")[0].replace("https://hf.co/", '')
-            filename = ckpt_data.split("/")[-1]
-            ckpt_data = huggingface_hub.hf_hub_download(repo_id=repo_id, filename=filename)
+            ckpt_data = cached_hf_url_download(ckpt_data)
 
         checkpoint_model = torch.load(ckpt_data, map_location="cpu", weights_only=True)
         state_dict = model.state_dict()
@@ -372,7 +369,7 @@ def load_swin_weights(model: nn.Module, model_bands, ckpt_data: str, weights: We
         logging.info(msg)
     else:
         if weights is not None:
-            checkpoint_model = weights.get_state_dict(progress=True)
+            checkpoint_model = load_weights_state_dict(weights)
             checkpoint_model = select_patch_embed_weights(checkpoint_model, model, pretrained_bands, model_bands, custom_weight_proj)
             missing_keys, unexpected_keys = model.load_state_dict(checkpoint_model, strict=False)
             assert set(missing_keys) <= set()
@@ -5,15 +5,15 @@ from torchgeo.models.vit import ViTSmall16_Weights
 import logging
 from collections.abc import Callable
 from functools import partial
-import huggingface_hub
 import torch.nn as nn
 from typing import List
-import huggingface_hub
 from torchvision.models._api import Weights, WeightsEnum
 import torch
+from terratorch.models.backbones.checkpoint_loading import load_state_dict_file
 from terratorch.models.backbones.select_patch_embed_weights import select_patch_embed_weights
 
 from terratorch.registry import TERRATORCH_BACKBONE_REGISTRY
+from terratorch.models.weights_cache import cached_hf_url_download, load_weights_state_dict
 
 class ViTEncoderWrapper(nn.Module):
 
@@ -275,11 +275,9 @@ def load_vit_weights(model: nn.Module, model_bands, ckpt_data: str, weights: Wei
     print("Loading weights")
     if ckpt_data is not None:
         if ckpt_data.find("https://hf.co/") > -1:
-            repo_id = ckpt_data.split("/resolve/")[0].replace("https://hf.co/", '')
-            filename = ckpt_data.split("/")[-1]
-            ckpt_data = huggingface_hub.hf_hub_download(repo_id=repo_id, filename=filename)
+            ckpt_data = cached_hf_url_download(ckpt_data)
 
-        checkpoint_model = torch.load(ckpt_data, map_location="cpu", weights_only=True)
+        checkpoint_model = load_state_dict_file(ckpt_data)
         state_dict = model.state_dict()
 
         for k in ["head.weight", "head.bias"]:
@@ -297,7 +295,7 @@ def load_vit_weights(model: nn.Module, model_bands, ckpt_data: str, weights: Wei
         logging.info(msg)
     else:
         if weights is not None:
-            checkpoint_model = weights.get_state_dict(progress=True)
+            checkpoint_model = load_weights_state_dict(weights)
             checkpoint_model = remove_keys(checkpoint_model, model.state_dict())
             checkpoint_model = select_patch_embed_weights(checkpoint_model, model, pretrained_bands, model_bands, custom_weight_proj)
             missing_keys, unexpected_keys = model.load_state_dict(checkpoint_model, strict=False)
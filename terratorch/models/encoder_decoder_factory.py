@@ -110,7 +110,9 @@ class EncoderDecoderFactory(ModelFactory):
                     If an nn.Module, we expect it to expose a property `decoder.out_channels`.
                     Pixel wise tasks will be concatenated with a Conv2d for the final convolution.
                     Defaults to "FCNDecoder".
-            backbone_kwargs (dict, optional) : Arguments to be passed to instantiate the backbone.
+            backbone_kwargs (dict, optional) : Arguments to be passed to instantiate the backbone. For example,
+                `grad_checkpointing` and `checkpoint_every_n_blocks` enable activation checkpointing in the Prithvi,
+                TerraMind, Clay, ScaleMAE, DOFA and Swin backbones.
             decoder_kwargs (dict, optional) : Arguments to be passed to instantiate the decoder.
             head_kwargs (dict, optional) : Arguments to be passed to the head network. 
             num_classes (int, optional): Number of classes. None for regression tasks.
@@ -125,7 +125,8 @@ class PixelWiseModel(Model, SegmentationModel):
 
         features = prepare(features)
 
-        decoder_output = self.decoder([f.clone() for f in features])
+        # Decoders only get a shallow copy of the features, they must not modify the tensors in place
+        decoder_output = self.decoder(list(features))
         mask = self.head(decoder_output)
         if self.rescale and mask.shape[-2:] != input_size:
             mask = F.interpolate(mask, size=input_size, mode="bilinear")
@@ -134,7 +135,7 @@ class PixelWiseModel(Model, SegmentationModel):
 
         aux_outputs = {}
         for name, decoder in self.aux_heads.items():
-            aux_output = decoder([f.clone() for f in features])
+            aux_output = decoder(list(features))
             if self.rescale and aux_output.shape[-2:] != input_size:
                 aux_output = F.interpolate(aux_output, size=input_size, mode="bilinear")
             aux_output = self._check_for_single_channel_and_squeeze(aux_output)
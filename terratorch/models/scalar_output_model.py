@@ -96,12 +96,13 @@ class ScalarOutputModel(Model, SegmentationModel):
 
         features = prepare(features)
 
-        decoder_output = self.decoder([f.clone() for f in features])
+        # Decoders only get a shallow copy of the features, they must not modify the tensors in place
+        decoder_output = self.decoder(list(features))
         mask = self.head(decoder_output)
 
         aux_outputs = {}
         for name, decoder in self.aux_heads.items():
-            aux_output = decoder([f.clone() for f in features])
+            aux_output = decoder(list(features))
             aux_outputs[name] = aux_output
 
         return ModelOutput(output=mask, auxiliary_heads=aux_outputs)
@@ -14,6 +14,7 @@ from torchvision.models._api import WeightsEnum
 
 from terratorch.models.model import Model, ModelFactory, ModelOutput
 from terratorch.models.utils import extract_prefix_keys
+from terratorch.models.weights_cache import load_weights_state_dict
 from terratorch.registry import MODEL_FACTORY_REGISTRY
 
 
@@ -55,12 +56,12 @@ class TimmModelFactory(ModelFactory):
         if pretrained and pretrained is not True:
             try:
                 weights = WeightsEnum(pretrained)
-                state_dict = weights.get_state_dict(progress=True)
+                state_dict = load_weights_state_dict(weights)
             except ValueError:
                 if os.path.exists(pretrained):
                     _, state_dict = utils.extract_backbone(pretrained)
                 else:
-                    state_dict = get_weight(pretrained).get_state_dict(progress=True)
+                    state_dict = load_weights_state_dict(get_weight(pretrained))
             model = utils.load_state_dict(model, state_dict)
 
         return TimmModelWrapper(model)
@@ -1,7 +1,9 @@
 import logging
+from collections.abc import Callable
 
 from torch import nn, Tensor
 import torch 
+import torch.utils.checkpoint
 
 class DecoderNotFoundError(Exception):
     pass
@@ -53,3 +55,76 @@ def pad_images(imgs: Tensor, patch_size: int | list, padding: str) -> Tensor:
             for img in imgs  # Apply per image to avoid NotImplementedError from torch.nn.functional.pad
         ])
     return imgs
+
+
+def resolve_out_indices(out_indices: list[int] | None, depth: int) -> list[int]:
+    """Converts the indices of the blocks whose outputs a backbone returns to non-negative indices.
+
+    Args:
+        out_indices (list[int] | None): Block indices, which may be negative. None selects all blocks.
+        depth (int): Number of blocks.
+    """
+    if out_indices is None:
+        return list(range(depth))
+    resolved = []
+    for idx in out_indices:
+        if not -depth <= idx < depth:
+            msg = f"out_indices {list(out_indices)} are out of range for a model with {depth} blocks."
+            raise ValueError(msg)
+        resolved.append(idx % depth)
+    return resolved
+
+
+def checkpoint_filter(idx: int, grad_checkpointing: bool, checkpoint_every_n_blocks: int = 1) -> bool:  # noqa: FBT001
+    """Returns whether the block idx is run with activation checkpointing.
+
+    Args:
+        idx (int): Index of the block.
+        grad_checkpointing (bool): Whether activation checkpointing is enabled.
+        checkpoint_every_n_blocks (int): Only every n-th block is checkpointed. Larger values recompute less in the
+            backward pass but keep more activations in memory. Defaults to 1.
+    """
+    if checkpoint_every_n_blocks < 1:
+        msg = f"checkpoint_every_n_blocks must be at least 1, got {checkpoint_every_n_blocks}."
+        raise ValueError(msg)
+    return grad_checkpointing and idx % checkpoint_every_n_blocks == 0
+
+
+def apply_block(block: nn.Module, x: Tensor, *args, checkpoint: bool = False, **kwargs) -> Tensor:
+    """Runs block on x, recomputing its activations in the backward pass if checkpoint is True in grad mode."""
+    if checkpoint and torch.is_grad_enabled():
+        return torch.utils.checkpoint.checkpoint(block, x, *args, use_reentrant=False, **kwargs)
+    return block(x, *args, **kwargs)
+
+
+class PosEmbedCache:
+    """Cache of interpolated position embeddings, for models that are repeatedly run on the same non-default input size.
+
+    Entries are keyed by the input size, device and dtype. They are dropped when the source embeddings change, i.e. when
+    they are moved to another device or dtype, loaded from a checkpoint or updated by an optimizer. Embeddings that
+    require gradients are not cached in grad mode, as the cached tensor would keep the autograd graph of a previous step.
+    """
+
+    def __init__(self):
+        self._source = None
+        self._entries = {}
+
+    def get(self, pos_embed: Tensor, key: tuple, compute_fn: Callable[[], Tensor]) -> Tensor:
+        """Returns the cached embeddings for key, computing them with compute_fn on a miss.
+
+        Args:
+            pos_embed (Tensor): Source position embeddings that compute_fn interpolates.
+            key (tuple): Input size the embeddings are interpolated to, e.g. (t, h, w).
+            compute_fn (Callable[[], Tensor]): Function computing the interpolated embeddings.
+        """
+        if (pos_embed.requires_grad and torch.is_grad_enabled()) or pos_embed.is_inference():
+            return compute_fn()
+        # The version counter is increased by in-place updates such as load_state_dict or optimizer steps
+        source = (pos_embed.data_ptr(), pos_embed._version, pos_embed.device, pos_embed.dtype)
+        if source != self._source:
+            self._source = source
+            self._entries = {}
+        key = (*key, pos_embed.device, pos_embed.dtype)
+        if key not in self._entries:
+            self._entries[key] = compute_fn()
+        return self._entries[key]
@@ -0,0 +1,216 @@
+# Copyright contributors to the Terratorch project
+
+"""Local cache of the pre-trained weights.
+
+All pre-trained weights hosted on the Hugging Face Hub are resolved through `cached_hf_hub_download`, including the
+hf.co URLs of the torchgeo weights (see `load_weights_state_dict`). Downloaded files are stored in a content-addressed
+cache directory (``blobs/<sha256>``) and the requested files link to them (``refs/``). The checksum is computed and
+verified once when a file enters the cache, later loads only resolve the reference and do not need network access.
+
+The cache directory is ``~/.cache/terratorch/weights`` and can be changed with ``TERRATORCH_WEIGHTS_CACHE``. With
+``TERRATORCH_OFFLINE=1`` weights are only resolved from the cache (or the local Hugging Face cache), use
+``terratorch weights prefetch <name> ...`` on a machine with network access to fill it.
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+import re
+import shutil
+import tempfile
+from pathlib import Path
+
+import torch
+from huggingface_hub import hf_hub_download
+
+logger = logging.getLogger("terratorch")
+
+OFFLINE_ENV = "TERRATORCH_OFFLINE"
+CACHE_DIR_ENV = "TERRATORCH_WEIGHTS_CACHE"
+
+# Pre-trained weights by name, e.g. {"prithvi_eo_v2_300": {"hf_hub_id": ..., "hf_hub_filename": ...}}
+PRETRAINED_WEIGHTS: dict[str, dict] = {}
+
+_SHA256_PATTERN = re.compile(r"^[0-9a-f]{64}$")
+_HF_URL_PATTERN = re.compile(r"^https://(?:hf\.co|huggingface\.co)/(?P<repo_id>.+?)/resolve/(?P<revision>[^/]+)/"
+                             r"(?P<filename>.+)$")
+
+
+def register_pretrained_weights(pretrained_weights: dict[str, dict]) -> None:
+    """Make pre-trained weights available to `terratorch weights prefetch`.
+
+    Args:
+        pretrained_weights (dict[str, dict]): Weights by name, with the keys `hf_hub_id` and `hf_hub_filename`.
+    """
+    PRETRAINED_WEIGHTS.update(pretrained_weights)
+
+
+def is_offline() -> bool:
+    return os.environ.get(OFFLINE_ENV, "0").lower() in {"1", "true", "yes", "on"}
+
+
+def get_cache_dir() -> Path:
+    return Path(os.environ.get(CACHE_DIR_ENV, Path("~/.cache/terratorch/weights"))).expanduser()
+
+
+def _sha256(path: str | Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(2**20), b""):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def _ref_path(cache_dir: Path, repo_id: str, filename: str, revision: str | None) -> Path:
+    return cache_dir / "refs" / repo_id / (revision or "main") / filename
+
+
+def _add_to_cache(cache_dir: Path, ref: Path, path: str) -> Path:
+    digest = _sha256(path)
+    # Files of the Hugging Face cache are named after their sha256 if they are stored with git LFS
+    expected = Path(os.path.realpath(path)).name
+    if _SHA256_PATTERN.match(expected) and expected != digest:
+        msg = f"Checksum mismatch for {path}: expected sha256 {expected}, got {digest}."
+        raise OSError(msg)
+
+    blob = cache_dir / "blobs" / digest
+    blob.parent.mkdir(parents=True, exist_ok=True)
+    if not blob.exists():
+        fd, tmp = tempfile.mkstemp(dir=blob.parent)
+        os.close(fd)
+        os.remove(tmp)
+        try:
+            # Hard link the file of the Hugging Face cache if possible to avoid storing the weights twice
+            os.link(os.path.realpath(path), tmp)
+        except OSError:
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, blob)
+
+    # The reference keeps the file name (and extension) of the requested file
+    ref.parent.mkdir(parents=True, exist_ok=True)
+    tmp_ref = ref.with_name(ref.name + ".tmp")
+    tmp_ref.unlink(missing_ok=True)
+    try:
+        tmp_ref.symlink_to(os.path.relpath(blob, ref.parent))
+    except OSError:
+        shutil.copyfile(blob, tmp_ref)
+    os.replace(tmp_ref, ref)
+    return ref
+
+
+def cached_hf_hub_download(
+    repo_id: str, filename: str, revision: str | None = None, force_download: bool = False
+) -> str:
+    """Download a file from the Hugging Face Hub into the weight cache.
+
+    Args:
+        repo_id (str): Hugging Face repository.
+        filename (str): File in the repository.
+        revision (str, optional): Git revision. Defaults to the main branch.
+        force_download (bool): Download the file even if it is cached. Defaults to False.
+
+    Returns:
+        str: Path to the cached file.
+    """
+    cache_dir = get_cache_dir()
+    ref = _ref_path(cache_dir, repo_id, filename, revision)
+    if ref.exists() and not force_download:
+        return str(ref)
+
+    if is_offline():
+        try:
+            # Files downloaded before with huggingface_hub can still be used
+            path = hf_hub_download(repo_id=repo_id, filename=filename, revision=revision, local_files_only=True)
+        except Exception as e:
+            msg = (f"{filename} from {repo_id} is not in the weight cache {cache_dir} and {OFFLINE_ENV} is set. "
+                   f"Run `terratorch weights prefetch` on a machine with network access first.")
+            raise FileNotFoundError(msg) from e
+    else:
+        path = hf_hub_download(repo_id=repo_id, filename=filename, revision=revision, force_download=force_download)
+    return str(_add_to_cache(cache_dir, ref, path))
+
+
+def cached_hf_url_download(url: str, force_download: bool = False) -> str:
+    """Download a file from a Hugging Face URL (e.g. https://hf.co/<repo_id>/resolve/main/<filename>) into the weight
+    cache.
+
+    Args:
+        url (str): URL of the file.
+        force_download (bool): Download the file even if it is cached. Defaults to False.
+
+    Returns:
+        str: Path to the cached file.
+    """
+    match = _HF_URL_PATTERN.match(url)
+    if match is None:
+        msg = f"{url} is not a Hugging Face URL."
+        raise ValueError(msg)
+    return cached_hf_hub_download(match["repo_id"], match["filename"], revision=match["revision"],
+                                  force_download=force_download)
+
+
+def load_weights_state_dict(weights) -> dict:
+    """Load the state dict of torchvision or torchgeo `Weights`.
+
+    Weights hosted on the Hugging Face Hub are downloaded into the weight cache, other URLs are downloaded by
+    torch.hub.
+
+    Args:
+        weights (WeightsEnum): Pre-trained weights.
+
+    Returns:
+        dict: The state dict.
+    """
+    if _HF_URL_PATTERN.match(weights.url) is None:
+        return weights.get_state_dict(progress=True)
+    # Same as load_state_dict_from_url of torch.hub used by Weights.get_state_dict
+    return torch.load(cached_hf_url_download(weights.url), map_location="cpu", weights_only=False)
+
+
+def prefetch(names: list[str], force_download: bool = False) -> dict[str, str]:
+    """Download pre-trained weights into the weight cache.
+
+    Args:
+        names (list[str]): Names of pre-trained weights (e.g. prithvi_eo_v2_300 or terramind_v1_base) or Hugging Face
+            URLs.
+        force_download (bool): Download the weights even if they are cached. Defaults to False.
+
+    Returns:
+        dict[str, str]: Path to the cached file of each name.
+    """
+    # Register the pre-trained weights of all backbones
+    import terratorch.models.backbones  # noqa: F401
+
+    paths = {}
+    for name in names:
+        if name in PRETRAINED_WEIGHTS:
+            weights = PRETRAINED_WEIGHTS[name]
+            paths[name] = cached_hf_hub_download(weights["hf_hub_id"], weights["hf_hub_filename"],
+                                                 force_download=force_download)
+        elif _HF_URL_PATTERN.match(name):
+            paths[name] = cached_hf_url_download(name, force_download=force_download)
+        else:
+            msg = f"Unknown pre-trained weights {name}, available weights: {sorted(PRETRAINED_WEIGHTS)}."
+            raise ValueError(msg)
+    return paths
+
+
+def weights_main(argv: list[str] | None = None) -> None:
+    """Entry point of `terratorch weights`."""
+    parser = argparse.ArgumentParser(prog="terratorch weights", description="Manage the cache of pre-trained weights.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    prefetch_parser = subparsers.add_parser("prefetch", help="Download pre-trained weights into the cache.")
+    prefetch_parser.add_argument("names", nargs="+", help="Names of pre-trained weights or Hugging Face URLs.")
+    prefetch_parser.add_argument("--force", action="store_true", help="Download the weights again.")
+    subparsers.add_parser("list", help="List the names of the pre-trained weights.")
+    args = parser.parse_args(argv)
+
+    if args.command == "prefetch":
+        for name, path in prefetch(args.names, force_download=args.force).items():
+            print(f"{name}: {path}")
+    elif args.command == "list":
+        import terratorch.models.backbones  # noqa: F401
+
+        for name in sorted(PRETRAINED_WEIGHTS):
+            print(name)
@@ -3,12 +3,26 @@
     e.g. cropping out areas around model prediction to reduce artifacts
 
     It additionally rebatches after the fold operation to gain speed up.
+
+    Tile coordinates are computed once as index tensors. Tiles are extracted lazily, one rebatch at a time, and
+    their predictions are scattered back into the output with a single indexed accumulation per rebatch.
 """
 
-from collections.abc import Callable
+import logging
+import math
+import os
+from collections.abc import Callable, Iterator
 from dataclasses import dataclass
+from functools import lru_cache
+from pathlib import Path
+from typing import Literal
 
+import rasterio
+import rasterio.shutil
 import torch
+from rasterio.windows import Window
+
+logger = logging.getLogger("terratorch")
 
 
 @dataclass
@@ -23,6 +37,13 @@ class TiledInferenceParameters:
         delta (int): size of the border cropped from each tile. Defaults to None, which computes this automatically,
           with a minimum of 16.
         average_patches (bool): Whether to average the overlapping regions. Defaults to True.
+        batch_size (int | str): Number of tiles passed to the model at once. If "auto", the largest batch size that
+          fits in memory is probed (across calls, until an out of memory error occurs), reduced whenever an out of
+          memory error occurs and reused by later calls with the same tile shape. Defaults to 16.
+        blend (str | None): Weight window used to blend overlapping tiles, one of "gaussian", "cosine" or "linear".
+          Each tile prediction is weighted by the window and the result is normalized by the sum of the weights, which
+          hides seams with smaller overlaps. Tiles are not cropped by `delta` when blending. Requires
+          `average_patches`. Defaults to None, which weights all pixels uniformly.
     """
 
     h_crop: int
@@ -31,14 +52,320 @@ class TiledInferenceParameters:
     w_stride: int
     delta: int = None
     average_patches: bool = True
+    batch_size: int | Literal["auto"] = 16
+    blend: Literal["gaussian", "cosine", "linear"] | None = None
+
+
+@dataclass
+class TileGrid:
+    """Coordinates of all tiles of an image, in processing order.
+
+    Args:
+        rows (torch.Tensor): top row of each tile in the input image, shape (n_tiles,)
+        cols (torch.Tensor): left column of each tile in the input image, shape (n_tiles,)
+        top (torch.Tensor): first row of the tile output that is written to the prediction, shape (n_tiles,)
+        bottom (torch.Tensor): row after the last row of the tile output that is written, shape (n_tiles,)
+        left (torch.Tensor): first column of the tile output that is written, shape (n_tiles,)
+        right (torch.Tensor): column after the last column of the tile output that is written, shape (n_tiles,)
+    """
+
+    rows: torch.Tensor
+    cols: torch.Tensor
+    top: torch.Tensor
+    bottom: torch.Tensor
+    left: torch.Tensor
+    right: torch.Tensor
+
+    def __len__(self) -> int:
+        return self.rows.shape[0]
 
 
 @dataclass
-class InferenceInput:
-    batch: int
-    input_coords: tuple[slice, slice]
+class TileBatch:
+    """A rebatch of tiles, ready to be passed to the model.
+
+    Args:
+        tiles (torch.Tensor): index of each tile in the TileGrid, shape (n,)
+        batch (torch.Tensor): index of the sample in the input batch each tile was taken from, shape (n,)
+        input_data (torch.Tensor): stacked tiles, shape (n, ..., h_crop, w_crop)
+    """
+
+    tiles: torch.Tensor
+    batch: torch.Tensor
     input_data: torch.Tensor
-    output_crop: None | tuple[slice, slice]
+
+
+def get_tile_grid(
+    h_img: int, w_img: int, inference_parameters: TiledInferenceParameters, device: torch.device | None = None
+) -> TileGrid:
+    """Compute the coordinates of all tiles needed to cover an image of size (h_img, w_img).
+
+    Tiles are ordered as follows: patches near the right border, patches near the bottom border, the bottom right
+    patch and, finally, the strided grid of inner patches. Inner patches not touching the top or left border are
+    cropped by `delta` pixels on every side.
+
+    Args:
+        h_img (int): height of the image
+        w_img (int): width of the image
+        inference_parameters (TiledInferenceParameters): Parameters to be used for the process.
+        device (torch.device | None): device on which the coordinates are created.
+
+    Returns:
+        TileGrid: The coordinates of the tiles.
+    """
+    h_crop, w_crop = inference_parameters.h_crop, inference_parameters.w_crop
+    if h_crop > h_img or w_crop > w_img:
+        msg = f"Crop size ({h_crop}, {w_crop}) is larger than the image size ({h_img}, {w_img})."
+        raise ValueError(msg)
+
+    if inference_parameters.blend:
+        delta_x = 0
+        delta_y = 0
+    elif inference_parameters.delta:
+        delta_x = inference_parameters.delta
+        delta_y = inference_parameters.delta
+    else:
+        delta_x = min(16, (w_crop - inference_parameters.w_stride) // 2)
+        delta_y = min(16, (h_crop - inference_parameters.h_stride) // 2)
+
+    def arange(start: int, end: int, step: int) -> torch.Tensor:
+        return torch.arange(start, end, step, device=device, dtype=torch.long)
+
+    # Stage 1: deal with border patches
+    right_rows = arange(0, h_img - h_crop + 1, h_crop)
+    bottom_cols = arange(0, w_img - w_crop + 1, w_crop)
+    corner = torch.ones(1, device=device, dtype=torch.long)
+
+    # Stage 2: process internally with patch overlap {2*delta/w_crop}
+    inner_rows, inner_cols = torch.meshgrid(
+        arange(0, h_img - h_crop + 1, inference_parameters.h_stride),
+        arange(0, w_img - w_crop + 1, inference_parameters.w_stride),
+        indexing="ij",
+    )
+    inner_rows = inner_rows.flatten()
+    inner_cols = inner_cols.flatten()
+
+    rows = torch.cat(
+        [right_rows, torch.full_like(bottom_cols, h_img - h_crop), corner * (h_img - h_crop), inner_rows]
+    )
+    cols = torch.cat(
+        [torch.full_like(right_rows, w_img - w_crop), bottom_cols, corner * (w_img - w_crop), inner_cols]
+    )
+    n_border = right_rows.shape[0] + bottom_cols.shape[0] + 1
+    cropped = torch.cat(
+        [
+            torch.zeros(n_border, device=device, dtype=torch.long),
+            ((inner_rows != 0) & (inner_cols != 0)).long(),
+        ]
+    )
+
+    return TileGrid(
+        rows=rows,
+        cols=cols,
+        top=cropped * delta_y,
+        bottom=h_crop - cropped * delta_y,
+        left=cropped * delta_x,
+        right=w_crop - cropped * delta_x,
+    )
+
+
+class AutoBatchSize:
+    """Adaptive rebatch size for tiled inference.
+
+    The batch size starts at 1 and is doubled after every successful forward pass of a full batch until an out of
+    memory error occurs, in which case it is halved, or until it reaches `max_size`. The size is stored per tile shape,
+    dtype and device, so later calls start from it directly. Calls with fewer tiles than the batch size do not end the
+    probing, which continues in later calls until the size is bounded by the memory or by `max_size`.
+    """
+
+    max_size = 4096
+    # Largest successful size and whether it is final, by tile shape, dtype and device
+    _cache: dict[tuple, tuple[int, bool]] = {}
+
+    def __init__(self, key: tuple):
+        self.key = key
+        self.value, self.final = self._cache.get(key, (1, False))
+
+    def succeeded(self, size: int) -> None:
+        if self.final or size < self.value:
+            # Smaller batches (the last tiles of a call) do not show that the current size fits
+            return
+        self.final = size >= self.max_size
+        self._cache[self.key] = (size, self.final)
+        if not self.final:
+            self.value = min(size * 2, self.max_size)
+
+    def out_of_memory(self) -> None:
+        if self.value == 1:
+            msg = "Tiled inference ran out of memory with a batch size of 1. Try to reduce the tile sizes."
+            raise MemoryError(msg)
+        self.value //= 2
+        self.final = True
+        self._cache[self.key] = (self.value, True)
+        logger.info(f"Out of memory during tiled inference, reducing the batch size to {self.value}.")
+
+
+def extract_tiles(
+    input_batch: torch.Tensor, grid: TileGrid, start: int, end: int, h_crop: int, w_crop: int
+) -> TileBatch:
+    """Extract the tiles with flat indices in [start, end) from the input batch.
+
+    Tiles are enumerated tile-major: every sample of the input batch is processed for a tile before moving on to the
+    next tile, i.e. the flat index of sample `b` of tile `t` is `t * batch_size + b`.
+
+    Args:
+        input_batch (torch.Tensor): Input batch to be processed, shape (batch, ..., h_img, w_img)
+        grid (TileGrid): Coordinates of the tiles.
+        start (int): first flat index
+        end (int): flat index after the last one
+        h_crop (int): height of the tiles
+        w_crop (int): width of the tiles
+
+    Returns:
+        TileBatch: The extracted tiles.
+    """
+    batch_size = input_batch.shape[0]
+    device = input_batch.device
+    items = torch.arange(start, end, device=device)
+    tiles = items // batch_size
+    batch = items % batch_size
+    row_idx = grid.rows[tiles, None] + torch.arange(h_crop, device=device)
+    col_idx = grid.cols[tiles, None] + torch.arange(w_crop, device=device)
+    input_data = input_batch[batch[:, None, None], ..., row_idx[:, :, None], col_idx[:, None, :]]
+    # Advanced indexing around the ellipsis places the indexed dims first: (n, h, w, ...) -> (n, ..., h, w)
+    permutation = (0, *range(3, input_batch.ndim), 1, 2)
+    return TileBatch(tiles, batch, input_data.permute(permutation).contiguous())
+
+
+def iter_tile_predictions(
+    model_forward: Callable,
+    input_batch: torch.Tensor,
+    grid: TileGrid,
+    inference_parameters: TiledInferenceParameters,
+    **kwargs,
+) -> Iterator[tuple[TileBatch, torch.Tensor]]:
+    """Lazily extract tiles from the input batch, rebatch them and run the model on them.
+
+    Only one rebatch of tiles is materialized at a time, see `extract_tiles`. The rebatch size is taken from
+    `inference_parameters.batch_size`.
+
+    Args:
+        model_forward (Callable): Callable that return the output of the model.
+        input_batch (torch.Tensor): Input batch to be processed, shape (batch, ..., h_img, w_img)
+        grid (TileGrid): Coordinates of the tiles.
+        inference_parameters (TiledInferenceParameters): Parameters to be used for the process.
+
+    Yields:
+        tuple[TileBatch, torch.Tensor]: The next rebatch of tiles and the corresponding model output.
+    """
+    h_crop, w_crop = inference_parameters.h_crop, inference_parameters.w_crop
+    n_items = len(grid) * input_batch.shape[0]
+    if inference_parameters.batch_size == "auto":
+        tile_shape = (*input_batch.shape[1:-2], h_crop, w_crop)
+        auto_batch_size = AutoBatchSize((tile_shape, input_batch.dtype, str(input_batch.device)))
+    else:
+        auto_batch_size = None
+        process_batch_size = inference_parameters.batch_size
+
+    start = 0
+    while start < n_items:
+        if auto_batch_size is not None:
+            process_batch_size = auto_batch_size.value
+        end = min(n_items, start + process_batch_size)
+        tile_batch = extract_tiles(input_batch, grid, start, end, h_crop, w_crop)
+        try:
+            output = model_forward(tile_batch.input_data, **kwargs)
+        except (torch.OutOfMemoryError, MemoryError):
+            if auto_batch_size is None:
+                raise
+            del tile_batch
+            if input_batch.is_cuda:
+                torch.cuda.empty_cache()
+            auto_batch_size.out_of_memory()
+            continue
+        if auto_batch_size is not None:
+            auto_batch_size.succeeded(end - start)
+        start = end
+        yield tile_batch, output
+
+
+def _output_mask(grid: TileGrid, tiles: torch.Tensor, h_crop: int, w_crop: int) -> torch.Tensor:
+    """Boolean mask of the pixels of each tile output that are written to the prediction, shape (n, h, w)"""
+    ar_h = torch.arange(h_crop, device=tiles.device)
+    ar_w = torch.arange(w_crop, device=tiles.device)
+    valid_h = (ar_h >= grid.top[tiles, None]) & (ar_h < grid.bottom[tiles, None])
+    valid_w = (ar_w >= grid.left[tiles, None]) & (ar_w < grid.right[tiles, None])
+    return valid_h[:, :, None] & valid_w[:, None, :]
+
+
+def _window_1d(blend: str, size: int) -> torch.Tensor:
+    # pixel centers in (0, 1), so that no weight is exactly zero
+    x = (torch.arange(size, dtype=torch.float64) + 0.5) / size
+    if blend == "gaussian":
+        sigma = 1 / 8
+        return torch.exp(-((x - 0.5) ** 2) / (2 * sigma**2))
+    if blend == "cosine":
+        return torch.sin(math.pi * x) ** 2
+    if blend == "linear":
+        return 1 - (2 * x - 1).abs()
+    msg = f"Unknown blend mode {blend}. Choose one of gaussian, cosine or linear."
+    raise ValueError(msg)
+
+
+@lru_cache(maxsize=16)
+def blend_window(blend: str, h_crop: int, w_crop: int, device: torch.device, dtype: torch.dtype) -> torch.Tensor:
+    """Weight window of shape (h_crop, w_crop) used to blend overlapping tiles, normalized to a maximum of 1.
+
+    Windows are cached, so they are only computed once per tile size, device and dtype.
+    """
+    window = _window_1d(blend, h_crop)[:, None] * _window_1d(blend, w_crop)[None, :]
+    return (window / window.max()).to(device=device, dtype=dtype)
+
+
+def _weight_sum(grid: TileGrid, window: torch.Tensor, h_img: int, w_img: int) -> torch.Tensor:
+    """Sum of the blending weights of all tiles at each pixel, shape (h_img, w_img)."""
+    h_crop, w_crop = window.shape
+    device = grid.rows.device
+    weights = torch.zeros(h_img, w_img, device=device, dtype=window.dtype)
+    ar_h = torch.arange(h_crop, device=device)
+    ar_w = torch.arange(w_crop, device=device)
+    chunk = max(1, 2**22 // (h_crop * w_crop))
+    for start in range(0, len(grid), chunk):
+        tiles = torch.arange(start, min(len(grid), start + chunk), device=device)
+        mask = _output_mask(grid, tiles, h_crop, w_crop)
+        rows = (grid.rows[tiles, None, None] + ar_h[:, None]).expand_as(mask)
+        cols = (grid.cols[tiles, None, None] + ar_w).expand_as(mask)
+        weights.index_put_((rows[mask], cols[mask]), window.expand_as(mask)[mask], accumulate=True)
+    return weights
+
+
+def _coverage_count(grid: TileGrid, h_img: int, w_img: int) -> torch.Tensor:
+    """Number of tiles writing to each pixel, shape (h_img, w_img). Computed with a 2D difference array."""
+    device = grid.rows.device
+    y0, y1 = grid.rows + grid.top, grid.rows + grid.bottom
+    x0, x1 = grid.cols + grid.left, grid.cols + grid.right
+    diff = torch.zeros(h_img + 1, w_img + 1, device=device, dtype=torch.int32)
+    ones = torch.ones(len(grid), device=device, dtype=torch.int32)
+    diff.index_put_((y0, x0), ones, accumulate=True)
+    diff.index_put_((y0, x1), -ones, accumulate=True)
+    diff.index_put_((y1, x0), -ones, accumulate=True)
+    diff.index_put_((y1, x1), ones, accumulate=True)
+    return diff.cumsum(0, dtype=torch.int32).cumsum(1, dtype=torch.int32)[:h_img, :w_img]
+
+
+def _last_writer(grid: TileGrid, h_img: int, w_img: int, h_crop: int, w_crop: int) -> torch.Tensor:
+    """Index of the last tile writing to each pixel, shape (h_img, w_img). -1 for pixels that are not covered."""
+    device = grid.rows.device
+    owner = torch.full((h_img * w_img,), -1, device=device, dtype=torch.long)
+    ar_h = torch.arange(h_crop, device=device)
+    ar_w = torch.arange(w_crop, device=device)
+    chunk = max(1, 2**22 // (h_crop * w_crop))
+    for start in range(0, len(grid), chunk):
+        tiles = torch.arange(start, min(len(grid), start + chunk), device=device)
+        mask = _output_mask(grid, tiles, h_crop, w_crop)
+        pixels = (grid.rows[tiles, None, None] + ar_h[:, None]) * w_img + grid.cols[tiles, None, None] + ar_w
+        owner.scatter_reduce_(0, pixels[mask], tiles[:, None, None].expand_as(mask)[mask], reduce="amax")
+    return owner.view(h_img, w_img)
 
 
 def tiled_inference(
@@ -66,137 +393,232 @@ def tiled_inference(
     batch_size = shape[0]
     # omit bands and take last two dimensions
     h_img, w_img = shape[-2], shape[-1]
+    h_crop, w_crop = inference_parameters.h_crop, inference_parameters.w_crop
 
     preds = input_batch.new_zeros((batch_size, out_channels, h_img, w_img))
+    # channels last view of preds, so that a pixel can be addressed by (batch, row, col)
+    preds_view = preds.permute(0, 2, 3, 1)
 
-    # this list will contain tuples. Inside the tuples:
-    #   0. batch
-    #   1. Coordinates where this should end up in the preds
-    #   2. output/input
-    #   3. Optionally, for inputs, how to crop the output
-    # it is important this allocation follows the same order as in the original code
-
-    # Stage 1: deal with border patches
-    # Deal with patches near the right border
-
-    coordinates_and_inputs: list[InferenceInput] = []
-    for i in range(0, h_img - inference_parameters.h_crop + 1, inference_parameters.h_crop):
-        patch = input_batch[..., i : i + inference_parameters.h_crop, w_img - inference_parameters.w_crop : w_img]
-        coordinates_and_inputs += [
-            InferenceInput(
-                b,
-                (slice(i, i + inference_parameters.h_crop), slice(w_img - inference_parameters.w_crop, w_img)),
-                patch[b],
-                None,
-            )
-            for b in range(batch_size)
-        ]
+    grid = get_tile_grid(h_img, w_img, inference_parameters, device=input_batch.device)
+    preds_count = _coverage_count(grid, h_img, w_img)
+    if (preds_count == 0).sum() != 0:
+        msg = "Some pixels did not receive a classification!"
+        raise RuntimeError(msg)
+    owner = None if inference_parameters.average_patches else _last_writer(grid, h_img, w_img, h_crop, w_crop)
 
-    # Deal with patches near the bottom of the image
-    for i in range(0, w_img - inference_parameters.w_crop + 1, inference_parameters.w_crop):
-        patch = input_batch[..., h_img - inference_parameters.h_crop : h_img, i : i + inference_parameters.w_crop]
-        coordinates_and_inputs += [
-            InferenceInput(
-                b,
-                (slice(h_img - inference_parameters.h_crop, h_img), slice(i, i + inference_parameters.w_crop)),
-                patch[b],
-                None,
-            )
-            for b in range(batch_size)
-        ]
+    window = None
+    if inference_parameters.blend:
+        if not inference_parameters.average_patches:
+            msg = "Blending tiles requires `average_patches` to be True."
+            raise ValueError(msg)
+        window = blend_window(inference_parameters.blend, h_crop, w_crop, input_batch.device, preds.dtype)
 
-    # Deal with last patches at the right bottom of the image
-    patch = input_batch[..., h_img - inference_parameters.h_crop : h_img, w_img - inference_parameters.w_crop : w_img]
-    coordinates_and_inputs += [
-        InferenceInput(
-            b,
-            (slice(h_img - inference_parameters.h_crop, h_img), slice(w_img - inference_parameters.w_crop, w_img)),
-            patch[b],
-            None,
-        )
-        for b in range(batch_size)
-    ]
-
-    if inference_parameters.delta:
-        delta_x = inference_parameters.delta
-        delta_y = inference_parameters.delta
-    else:
-        delta_x = min(16, (inference_parameters.w_crop - inference_parameters.w_stride) // 2)
-        delta_y = min(16, (inference_parameters.h_crop - inference_parameters.h_stride) // 2)
-
-    # Stage 2: process internally with patch overlap {2*delta/inference_parameters.w_crop}
-    nr = h_img
-    nc = w_img
-    for row in range(0, nr - inference_parameters.h_crop + 1, inference_parameters.h_stride):
-        for col in range(0, nc - inference_parameters.w_crop + 1, inference_parameters.w_stride):
-            patch = input_batch[..., row : row + inference_parameters.h_crop, col : col + inference_parameters.w_crop]
-            if row == 0 or col == 0:
-                coordinates_and_inputs += [
-                    InferenceInput(
-                        b,
-                        (slice(row, row + inference_parameters.h_crop), slice(col, col + inference_parameters.w_crop)),
-                        patch[b],
-                        None,
-                    )
-                    for b in range(batch_size)
-                ]
-            else:
-                coordinates_and_inputs += [
-                    InferenceInput(
-                        b,
-                        (
-                            slice(row + delta_y, row + inference_parameters.h_crop - delta_y),
-                            slice(col + delta_x, col + inference_parameters.w_crop - delta_x),
-                        ),
-                        patch[b],
-                        (
-                            slice(delta_y, inference_parameters.h_crop - delta_y),
-                            slice(delta_x, inference_parameters.w_crop - delta_x),
-                        ),
-                    )
-                    for b in range(batch_size)
-                ]
+    ar_h = torch.arange(h_crop, device=input_batch.device)
+    ar_w = torch.arange(w_crop, device=input_batch.device)
 
     # NOTE: the output may be SLIGHTLY different using batched inputs because of layers such as nn.LayerNorm
     # During inference, these layers compute batch statistics that affect the output.
     # However, this should still be correct.
-    # TODO: make this configurable by user?
-    process_batch_size = 16
     with torch.no_grad():
-        preds_count = input_batch.new_zeros(batch_size, preds.shape[-2], preds.shape[-1])
-        for start in range(0, len(coordinates_and_inputs), process_batch_size):
-            end = min(len(coordinates_and_inputs), start + process_batch_size)
-            batch = coordinates_and_inputs[start:end]
-            tensor_input = torch.stack([b.input_data for b in batch], dim=0)
-            output = model_forward(tensor_input, **kwargs)
-            output = [output[i] for i in range(len(batch))]
-            for batch_input, predicted in zip(batch, output, strict=True):
-                if batch_input.output_crop is not None:
-                    predicted = predicted[..., batch_input.output_crop[0], batch_input.output_crop[1]]
-                if inference_parameters.average_patches:
-                    preds[
-                        batch_input.batch,
-                        :,
-                        batch_input.input_coords[0],
-                        batch_input.input_coords[1],
-                    ] += predicted
-                else:
-                    preds[
-                        batch_input.batch,
-                        :,
-                        batch_input.input_coords[0],
-                        batch_input.input_coords[1],
-                    ] = predicted
-
-                preds_count[
-                    batch_input.batch,
-                    batch_input.input_coords[0],
-                    batch_input.input_coords[1],
-                ] += 1
+        for tile_batch, output in iter_tile_predictions(model_forward, input_batch, grid, inference_parameters, **kwargs):
+            tiles = tile_batch.tiles
+            mask = _output_mask(grid, tiles, h_crop, w_crop)
+            rows = (grid.rows[tiles, None, None] + ar_h[:, None]).expand_as(mask)
+            cols = (grid.cols[tiles, None, None] + ar_w).expand_as(mask)
+            if owner is not None:
+                # only the last tile writing to a pixel is kept, so the indices below are unique
+                mask = mask & (owner[rows, cols] == tiles[:, None, None])
+            index = (tile_batch.batch[:, None, None].expand_as(mask)[mask], rows[mask], cols[mask])
+            # (n, c, h, w) -> (n, h, w, c) so that masking yields one row of channels per pixel, in tile order
+            values = output.permute(0, 2, 3, 1)[mask].to(preds.dtype)
+            if window is not None:
+                values *= window.expand_as(mask)[mask][:, None]
+            preds_view.index_put_(index, values, accumulate=inference_parameters.average_patches)
 
-    if (preds_count == 0).sum() != 0:
-        msg = "Some pixels did not receive a classification!"
-        raise RuntimeError(msg)
+    if window is not None:
+        return preds.div_(_weight_sum(grid, window, h_img, w_img))
     if inference_parameters.average_patches:
-        return preds / preds_count.unsqueeze(1)
+        return preds / preds_count.to(preds.dtype)
     return preds
+
+
+def tiled_inference_to_file(
+    model_forward: Callable,
+    input_path: str | Path,
+    output_path: str | Path,
+    out_channels: int,
+    inference_parameters: TiledInferenceParameters,
+    preprocess: Callable | None = None,
+    postprocess: Callable | None = None,
+    bands: list[int] | None = None,
+    device: torch.device | str = "cpu",
+    dtype: str = "float32",
+    nodata: float | None = None,
+    compress: str = "deflate",
+    block_size: int = 256,
+    cog: bool = False,  # noqa: FBT001, FBT002
+    **kwargs,
+) -> str:
+    """
+    Out-of-core version of `tiled_inference`, which reads the input raster and writes the prediction window by window.
+
+    Tiles are processed one row of tiles at a time. Input rows are read with windowed reads and finished output rows
+    are written to a tiled, compressed GeoTIFF (or COG) as soon as no remaining tile overlaps them, so the memory
+    needed is bounded by a few rows of tiles instead of the scene size.
+
+    Args:
+        model_forward (Callable): Callable that return the output of the model.
+        input_path (str | Path): Path to the input raster.
+        output_path (str | Path): Path to the output GeoTIFF.
+        out_channels (int): Number of output channels of the model.
+        inference_parameters (TiledInferenceParameters): Parameters to be used for the process.
+        preprocess (Callable | None): Applied to each input window of shape (1, bands, h_crop, width) before tiling,
+            e.g. for normalization. Defaults to None.
+        postprocess (Callable | None): Applied to each finished output window of shape (1, out_channels, h, width)
+            before writing, e.g. `lambda x: x.argmax(dim=1, keepdim=True)`. Defaults to None.
+        bands (list[int] | None): 1-based indices of the bands to read. Defaults to None, which reads all bands.
+        device (torch.device | str): Device to run the inference on. Defaults to "cpu".
+        dtype (str): Data type of the output file. Defaults to "float32".
+        nodata (float | None): If set, pixels where any input band is nodata are set to this value in the output. A
+            warning is logged if the input has no nodata value, the output is then not masked. Defaults to None.
+        compress (str): Compression of the output file. Defaults to "deflate".
+        block_size (int): Size of the internal tiles of the output file, a multiple of 16. Defaults to 256.
+        cog (bool): Whether to convert the output into a Cloud Optimized GeoTIFF. Defaults to False.
+
+    Returns:
+        str: The path of the output file.
+    """
+    h_crop, w_crop = inference_parameters.h_crop, inference_parameters.w_crop
+    output_path = str(output_path)
+
+    if postprocess is not None:
+        out_bands = postprocess(torch.zeros(1, out_channels, 1, 1, device=device)).shape[1]
+    else:
+        out_bands = out_channels
+
+    with rasterio.open(input_path) as src:
+        h_img, w_img = src.height, src.width
+        grid = get_tile_grid(h_img, w_img, inference_parameters, device=device)
+        # tiles are processed by increasing row, the original order is kept among tiles of the same row
+        order = torch.sort(grid.rows, stable=True).indices
+        grid = TileGrid(*(t[order] for t in (grid.rows, grid.cols, grid.top, grid.bottom, grid.left, grid.right)))
+
+        window = None
+        if inference_parameters.blend:
+            if not inference_parameters.average_patches:
+                msg = "Blending tiles requires `average_patches` to be True."
+                raise ValueError(msg)
+            window = blend_window(inference_parameters.blend, h_crop, w_crop, torch.device(device), torch.float32)
+
+        profile = src.meta.copy()
+        profile.update(
+            driver="GTiff",
+            count=out_bands,
+            dtype=dtype,
+            nodata=nodata,
+            tiled=True,
+            blockxsize=block_size,
+            blockysize=block_size,
+            compress=compress,
+            BIGTIFF="IF_SAFER",
+        )
+        write_path = output_path + ".tmp.tif" if cog else output_path
+        if nodata is not None and src.nodata is None:
+            logger.warning(f"{input_path} has no nodata value, the prediction is not masked with nodata={nodata}.")
+
+        # accumulation buffers for the rows [buffer_start, buffer_start + preds.shape[1])
+        buffer_start = 0
+        preds = torch.zeros(out_channels, 0, w_img, device=device)
+        weights = torch.zeros(0, w_img, device=device)
+        owner = torch.zeros(0, w_img, device=device, dtype=torch.long)
+        ar_h = torch.arange(h_crop, device=device)
+        ar_w = torch.arange(w_crop, device=device)
+
+        with rasterio.open(write_path, "w", **profile) as dst:
+
+            def flush(end: int) -> None:
+                nonlocal buffer_start, preds, weights, owner
+                n_rows = end - buffer_start
+                if n_rows <= 0:
+                    return
+                if (weights[:n_rows] == 0).any():
+                    msg = "Some pixels did not receive a classification!"
+                    raise RuntimeError(msg)
+                result = preds[:, :n_rows]
+                if inference_parameters.average_patches:
+                    result = result / weights[:n_rows]
+                result = result[None]
+                if postprocess is not None:
+                    result = postprocess(result)
+                result = result[0].cpu().numpy().astype(dtype)
+                out_window = Window(0, buffer_start, w_img, n_rows)
+                if nodata is not None and src.nodata is not None:
+                    input_nodata = (src.read(bands, window=out_window) == src.nodata).reshape(-1, n_rows, w_img)
+                    result[:, input_nodata.any(axis=0)] = nodata
+                dst.write(result, window=out_window)
+                preds, weights, owner = preds[:, n_rows:], weights[n_rows:], owner[n_rows:]
+                buffer_start = end
+
+            tile_rows = torch.unique_consecutive(grid.rows).tolist()
+            tile_starts = torch.searchsorted(grid.rows, torch.tensor(tile_rows, device=device)).tolist()
+            tile_starts.append(len(grid))
+            for i, row in enumerate(tile_rows):
+                # extend the buffers up to the last row covered by this row of tiles
+                missing = row + h_crop - buffer_start - preds.shape[1]
+                if missing > 0:
+                    preds = torch.cat([preds, preds.new_zeros(out_channels, missing, w_img)], dim=1)
+                    weights = torch.cat([weights, weights.new_zeros(missing, w_img)])
+                    owner = torch.cat([owner, owner.new_full((missing, w_img), -1)])
+
+                tiles_in_row = slice(tile_starts[i], tile_starts[i + 1])
+                local_grid = TileGrid(
+                    rows=grid.rows[tiles_in_row] - row,
+                    cols=grid.cols[tiles_in_row],
+                    top=grid.top[tiles_in_row],
+                    bottom=grid.bottom[tiles_in_row],
+                    left=grid.left[tiles_in_row],
+                    right=grid.right[tiles_in_row],
+                )
+                tile_ids = order[tiles_in_row]
+                input_window = src.read(bands, window=Window(0, row, w_img, h_crop)).reshape(-1, h_crop, w_img)
+                input_batch = torch.from_numpy(input_window).to(device).float()[None]
+                if preprocess is not None:
+                    input_batch = preprocess(input_batch)
+
+                preds_view = preds.permute(1, 2, 0)
+                with torch.no_grad():
+                    for tile_batch, output in iter_tile_predictions(
+                        model_forward, input_batch, local_grid, inference_parameters, **kwargs
+                    ):
+                        tiles = tile_batch.tiles
+                        mask = _output_mask(local_grid, tiles, h_crop, w_crop)
+                        rows = (row - buffer_start + ar_h[:, None]).expand_as(mask)
+                        cols = (local_grid.cols[tiles, None, None] + ar_w).expand_as(mask)
+                        values = output.permute(0, 2, 3, 1)[mask].float()
+                        if inference_parameters.average_patches:
+                            if window is not None:
+                                tile_weights = window.expand_as(mask)[mask]
+                                values *= tile_weights[:, None]
+                            else:
+                                tile_weights = values.new_ones(())
+                            preds_view.index_put_((rows[mask], cols[mask]), values, accumulate=True)
+                            weights.index_put_((rows[mask], cols[mask]), tile_weights, accumulate=True)
+                        else:
+                            # only the last tile (in the original order) writing to a pixel is kept
+                            ids = tile_ids[tiles, None, None].expand_as(mask)[mask]
+                            owner.view(-1).scatter_reduce_(0, rows[mask] * w_img + cols[mask], ids, reduce="amax")
+                            keep = owner[rows[mask], cols[mask]] == ids
+                            index = (rows[mask][keep], cols[mask][keep])
+                            preds_view.index_put_(index, values[keep])
+                            weights.index_put_(index, values.new_ones(()))
+
+                # rows above the next row of tiles are final. Flush them in whole output blocks.
+                if i + 1 < len(tile_rows):
+                    flush(tile_rows[i + 1] // block_size * block_size)
+                else:
+                    flush(h_img)
+
+    if cog:
+        rasterio.shutil.copy(write_path, output_path, driver="COG", compress=compress, BIGTIFF="IF_SAFER")
+        os.remove(write_path)
+    return output_path
@@ -1,5 +1,4 @@
 import math
-from collections import Counter
 
 import torch
 from torch.utils.data import DataLoader
@@ -11,29 +10,218 @@ import numpy as np
 import torch
 
 
-def compute_statistics(dataloader: DataLoader) -> dict[str, list[float]]:
-    n_bands = dataloader.dataset[0]["image"].shape[0]
-    n_data = torch.zeros([n_bands], dtype=torch.int64)
-    sum_data = torch.zeros([n_bands], dtype=torch.float64)
+class RunningMoments:
+    """Per-band count, mean and sum of squared deviations from the mean, accumulated in float64.
 
-    # First pass for mean
-    for batch in tqdm(dataloader, desc="Compute mean"):
+    Batches are reduced with a two-pass algorithm and combined with the running state using Chan's parallel update,
+    so the statistics are computed in a single pass over the data. Partial results, e.g. from different dataloader
+    workers or DDP ranks, can be combined with `merge`.
+    """
+
+    def __init__(self, n_bands: int):
+        self.count = torch.zeros(n_bands, dtype=torch.float64)
+        self.mean = torch.zeros(n_bands, dtype=torch.float64)
+        self.m2 = torch.zeros(n_bands, dtype=torch.float64)
+
+    def update(self, samples: torch.Tensor, valid: torch.Tensor | None = None) -> None:
+        """Add samples of shape (n_bands, n). Only samples where `valid` is True are considered."""
+        samples = samples.double()
+        if valid is None:
+            count = torch.full_like(self.count, samples.shape[1])
+            mean = samples.mean(dim=1)
+            m2 = ((samples - mean[:, None]) ** 2).sum(dim=1)
+        else:
+            count = valid.sum(dim=1).double()
+            mean = torch.where(valid, samples, 0).sum(dim=1) / count.clamp(min=1)
+            m2 = torch.where(valid, (samples - mean[:, None]) ** 2, 0).sum(dim=1)
+        self._combine(count, mean, m2)
+
+    def merge(self, other: "RunningMoments") -> "RunningMoments":
+        self._combine(other.count, other.mean, other.m2)
+        return self
+
+    def _combine(self, count: torch.Tensor, mean: torch.Tensor, m2: torch.Tensor) -> None:
+        total = self.count + count
+        safe_total = total.clamp(min=1)
+        delta = mean - self.mean
+        self.mean = self.mean + delta * count / safe_total
+        self.m2 = self.m2 + m2 + delta**2 * self.count * count / safe_total
+        self.count = total
+
+    @property
+    def variance(self) -> torch.Tensor:
+        return self.m2 / self.count
+
+    @property
+    def std(self) -> torch.Tensor:
+        return torch.sqrt(self.variance)
+
+
+class ClassCounts:
+    """Number of occurrences of each integer value, accumulated with `torch.bincount`. Mergeable with `merge`."""
+
+    def __init__(self):
+        self.counts: dict[int, int] = {}
+
+    def update(self, values: torch.Tensor) -> None:
+        values = values.flatten().long()
+        if values.numel() == 0:
+            return
+        # bincount only accepts non-negative values, so shift by the minimum
+        offset = int(values.min())
+        counts = torch.bincount(values - offset)
+        for value in torch.nonzero(counts).flatten().tolist():
+            self.counts[value + offset] = self.counts.get(value + offset, 0) + int(counts[value])
+
+    def merge(self, other: "ClassCounts") -> "ClassCounts":
+        for value, count in other.counts.items():
+            self.counts[value] = self.counts.get(value, 0) + count
+        return self
+
+    def total(self) -> int:
+        return sum(self.counts.values())
+
+
+class QuantileSketch:
+    """Per-band streaming quantile sketch with logarithmic buckets (DDSketch).
+
+    Quantile estimates have a relative error of at most `relative_accuracy`. Values with an absolute value smaller
+    than `min_value` are counted as zero and values are clipped to `max_value`. The sketch has a fixed number of
+    buckets, so sketches are merged by adding their counts.
+    """
+
+    def __init__(
+        self, n_bands: int, relative_accuracy: float = 0.01, min_value: float = 1e-9, max_value: float = 1e12
+    ):
+        self.n_bands = n_bands
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.min_value = min_value
+        self.min_index = math.ceil(math.log(min_value) / self.log_gamma)
+        self.n_magnitudes = math.ceil(math.log(max_value) / self.log_gamma) - self.min_index + 1
+        # buckets: negative values (largest magnitude first), zero, positive values
+        self.zero_bucket = self.n_magnitudes
+        self.n_buckets = 2 * self.n_magnitudes + 1
+        self.counts = torch.zeros(n_bands, self.n_buckets, dtype=torch.int64)
+
+    def update(self, samples: torch.Tensor, valid: torch.Tensor | None = None) -> None:
+        """Add samples of shape (n_bands, n). Only samples where `valid` is True are considered."""
+        samples = samples.double()
+        magnitude = torch.ceil(torch.log(samples.abs().clamp(min=self.min_value)) / self.log_gamma).long()
+        magnitude = (magnitude - self.min_index).clamp(0, self.n_magnitudes - 1)
+        bucket = torch.where(samples > 0, self.zero_bucket + 1 + magnitude, self.zero_bucket - 1 - magnitude)
+        bucket = torch.where(samples.abs() < self.min_value, self.zero_bucket, bucket)
+        bucket = bucket + torch.arange(self.n_bands)[:, None] * self.n_buckets
+        if valid is not None:
+            bucket = bucket[valid]
+        self.counts += torch.bincount(bucket.flatten(), minlength=self.n_bands * self.n_buckets).view(
+            self.n_bands, self.n_buckets
+        )
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        self.counts += other.counts
+        return self
+
+    def _bucket_value(self, bucket: torch.Tensor) -> torch.Tensor:
+        magnitude = (bucket - self.zero_bucket).abs() - 1 + self.min_index
+        value = 2 * self.gamma ** magnitude.double() / (self.gamma + 1)
+        return torch.sign((bucket - self.zero_bucket).double()) * value
+
+    def quantiles(self, q: list[float]) -> torch.Tensor:
+        """Estimate the quantiles q (in [0, 1]) of each band. Returns a tensor of shape (n_bands, len(q))."""
+        cumulative = self.counts.cumsum(dim=1)
+        total = cumulative[:, -1:]
+        rank = torch.tensor(q, dtype=torch.float64)[None, :] * (total - 1).double()
+        bucket = torch.searchsorted(cumulative.double(), rank, right=True)
+        return self._bucket_value(bucket)
+
+
+def _flatten_bands(imgs: torch.Tensor) -> torch.Tensor:
+    # switch batch and band dimensions and flatten
+    return imgs.transpose(0, 1).reshape(imgs.shape[1], -1)
+
+
+def _all_gather_merge(stats):
+    """Merge partial statistics from all DDP ranks, if torch.distributed is initialized."""
+    if stats is None or not (torch.distributed.is_available() and torch.distributed.is_initialized()):
+        return stats
+    gathered = [None] * torch.distributed.get_world_size()
+    torch.distributed.all_gather_object(gathered, stats)
+    merged = gathered[0]
+    for other in gathered[1:]:
+        merged.merge(other)
+    return merged
+
+
+def accumulate_statistics(
+    dataloader: DataLoader,
+    nodata: float | None = None,
+    percentiles: list[float] | None = None,
+    include_mask: bool = False,  # noqa: FBT001, FBT002
+) -> tuple[RunningMoments, QuantileSketch | None, RunningMoments | ClassCounts | None]:
+    """Accumulate image and, optionally, mask statistics in a single pass over the dataloader.
+
+    Args:
+        dataloader (DataLoader): Dataloader returning batches with an "image" and, optionally, a "mask" key.
+        nodata (float | None): Image value to be ignored. Defaults to None.
+        percentiles (list[float] | None): If set, a quantile sketch of the image bands is accumulated as well.
+            Defaults to None.
+        include_mask (bool): Whether to accumulate mask statistics. Integer masks are counted per class, float masks
+            are summarized by their moments. Defaults to False.
+
+    Returns:
+        tuple: image moments, image quantile sketch (or None) and mask statistics (or None). Under DDP, the results
+            are merged over all ranks.
+    """
+    moments = sketch = mask_stats = None
+    for batch in tqdm(dataloader, desc="Compute statistics"):
         imgs: torch.Tensor = batch["image"]
-        # switch batch and band dimensions and flatten
-        samples = imgs.transpose(0, 1).reshape(n_bands, -1).double()
-        sum_data += samples.sum(dim=1)
-        n_data += samples.shape[1]
-    mean = sum_data / n_data
+        samples = _flatten_bands(imgs)
+        if moments is None:
+            moments = RunningMoments(samples.shape[0])
+            if percentiles is not None:
+                sketch = QuantileSketch(samples.shape[0])
+        valid = None if nodata is None else samples != nodata
+        moments.update(samples, valid)
+        if sketch is not None:
+            sketch.update(samples, valid)
 
-    sum_squared = torch.zeros(n_bands, dtype=torch.float64)
-    for batch in tqdm(dataloader, desc="Compute variance"):
-        imgs = batch["image"]
-        samples = imgs.transpose(0, 1).reshape(n_bands, -1).double()
-        sum_squared += ((samples - mean.unsqueeze(1)) ** 2).sum(dim=1)
+        if include_mask:
+            masks: torch.Tensor = batch["mask"]
+            if mask_stats is None:
+                mask_stats = RunningMoments(1) if torch.is_floating_point(masks) else ClassCounts()
+            if isinstance(mask_stats, RunningMoments):
+                mask_stats.update(masks.reshape(1, -1))
+            else:
+                mask_stats.update(masks)
 
-    variance = sum_squared / n_data
-    std = torch.sqrt(variance)
-    return {"means": mean.numpy().tolist(), "stds": std.numpy().tolist()}
+    return _all_gather_merge(moments), _all_gather_merge(sketch), _all_gather_merge(mask_stats)
+
+
+def image_statistics(
+    moments: RunningMoments, sketch: QuantileSketch | None = None, percentiles: list[float] | None = None
+) -> dict[str, list[float]]:
+    stats = {"means": moments.mean.numpy().tolist(), "stds": moments.std.numpy().tolist()}
+    if sketch is not None and percentiles is not None:
+        values = sketch.quantiles([p / 100 for p in percentiles])
+        stats["percentiles"] = {p: values[:, i].numpy().tolist() for i, p in enumerate(percentiles)}
+    return stats
+
+
+def mask_statistics(
+    mask_stats: RunningMoments | ClassCounts,
+) -> dict[int, dict[str, int | float]] | dict[str, float]:
+    if isinstance(mask_stats, RunningMoments):
+        return {"mean": mask_stats.mean.item(), "std": mask_stats.std.item()}
+    total = mask_stats.total()
+    return {key: {"count": count, "percentage": count / total} for key, count in mask_stats.counts.items()}
+
+
+def compute_statistics(
+    dataloader: DataLoader, nodata: float | None = None, percentiles: list[float] | None = None
+) -> dict[str, list[float]]:
+    moments, sketch, _ = accumulate_statistics(dataloader, nodata=nodata, percentiles=percentiles)
+    return image_statistics(moments, sketch, percentiles)
 
 
 def compute_mask_statistics(dataloader: DataLoader) -> dict[int, dict[str, int | float]] | dict[str, float]:
@@ -44,35 +232,17 @@ def compute_mask_statistics(dataloader: DataLoader) -> dict[int, dict[str, int |
 
 
 def compute_int_mask_statistics(dataloader: DataLoader) -> dict[int, dict[str, int | float]]:
-    counter = Counter()
+    counts = ClassCounts()
     for batch in tqdm(dataloader, desc="Compute counts"):
-        masks: torch.Tensor = batch["mask"]
-        counter.update(masks.flatten().tolist())
-
-    stats = {}
-    for key, count in counter.items():
-        stats[key] = {"count": count, "percentage": count / counter.total()}
-    return stats
+        counts.update(batch["mask"])
+    return mask_statistics(_all_gather_merge(counts))
 
 
 def compute_float_mask_statistics(dataloader: DataLoader) -> dict[str, float]:
-    n_data = 0
-    total = 0.0
-
-    for batch in tqdm(dataloader, desc="Compute mask mean"):
-        masks: torch.Tensor = batch["mask"]
-        total += masks.sum().item()
-        n_data += masks.numel()
-    mean = total / n_data
-
-    sum_squared = 0.0
-    for batch in tqdm(dataloader, desc="Compute mask variance"):
-        masks = batch["mask"]
-        sum_squared += ((masks - mean) ** 2).sum().item()
-
-    variance = sum_squared / n_data
-    std = math.sqrt(variance)
-    return {"mean": mean, "std": std}
+    moments = RunningMoments(1)
+    for batch in tqdm(dataloader, desc="Compute mask statistics"):
+        moments.update(batch["mask"].reshape(1, -1))
+    return mask_statistics(_all_gather_merge(moments))
 
 # TODO remove it for future releases
 def remove_unexpected_prefix(state_dict):
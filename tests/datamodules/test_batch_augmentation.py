@@ -0,0 +1,145 @@
+import pytest
+import torch
+
+from terratorch.datamodules.generic_pixel_wise_data_module import Normalize
+from terratorch.datamodules.utils import BatchAugmentation
+
+
+def get_batch(batch_size=8, channels=3, size=16, temporal=None):
+    # The mask is the first band of the image, so that geometric transformations can be compared
+    shape = (batch_size, channels, temporal, size, size) if temporal else (batch_size, channels, size, size)
+    image = torch.arange(torch.Size(shape).numel(), dtype=torch.float).reshape(shape)
+    mask = image[:, 0, 0] if temporal else image[:, 0]
+    return {"image": image, "mask": mask.long()}
+
+
+def assert_same_transformation(batch, temporal=False):
+    first_band = batch["image"][:, 0, 0] if temporal else batch["image"][:, 0]
+    assert torch.equal(first_band.long(), batch["mask"])
+
+
+@pytest.mark.parametrize("temporal", [None, 2])
+def test_flips_and_rot90(temporal):
+    torch.manual_seed(0)
+    augmentation = BatchAugmentation(horizontal_flip=0.5, vertical_flip=0.5, rot90=0.5)
+    batch = get_batch(temporal=temporal)
+    augmented = augmentation(batch)
+    assert augmented["image"].shape == batch["image"].shape
+    assert_same_transformation(augmented, temporal)
+    # Some samples are transformed, the input batch is not modified
+    assert not torch.equal(augmented["image"], batch["image"])
+    assert torch.equal(batch["image"], get_batch(temporal=temporal)["image"])
+    # Each sample is one of the 8 symmetries of the input sample
+    for augmented_sample, sample in zip(augmented["image"], batch["image"], strict=True):
+        symmetries = [torch.rot90(s, k, dims=(-2, -1)) for s in (sample, sample.flip(-1)) for k in range(4)]
+        assert any(torch.equal(augmented_sample, s) for s in symmetries)
+
+
+def test_crop():
+    augmentation = BatchAugmentation(crop_size=8)
+    batch = get_batch()
+    augmented = augmentation(batch)
+    assert augmented["image"].shape == (8, 3, 8, 8)
+    assert augmented["mask"].shape == (8, 8, 8)
+    assert_same_transformation(augmented)
+
+    with pytest.raises(ValueError, match="larger than the samples"):
+        BatchAugmentation(crop_size=32)(batch)
+
+
+def test_scale_jitter():
+    augmentation = BatchAugmentation(scale_jitter=[0.5, 0.5], mask_pad_value=255)
+    batch = get_batch()
+    augmented = augmentation(batch)
+    assert augmented["image"].shape == batch["image"].shape
+    # Zooming out by 2 pads the border of the images with 0 and the masks with the pad value
+    assert (augmented["image"][..., :, :3] == 0).all()
+    assert (augmented["mask"][..., :, :3] == 255).all()
+    assert (augmented["mask"][..., 5:11, 5:11] != 255).all()
+
+    identity = BatchAugmentation(scale_jitter=[1, 1])(batch)
+    assert torch.allclose(identity["image"], batch["image"])
+    assert torch.equal(identity["mask"], batch["mask"])
+
+
+def test_band_noise_and_normalize():
+    torch.manual_seed(0)
+    normalize = Normalize(means=[1, 2, 3], stds=[2, 2, 2])
+    augmentation = BatchAugmentation(normalize=normalize, band_noise_std=[0, 0.1, 0])
+    batch = get_batch()
+    expected = normalize(get_batch())["image"]
+    augmented = augmentation(batch)
+    assert torch.equal(augmented["image"][:, [0, 2]], expected[:, [0, 2]])
+    assert 0.05 < (augmented["image"][:, 1] - expected[:, 1]).std() < 0.15
+    assert torch.equal(augmented["mask"], batch["mask"])
+
+
+def test_multimodal():
+    torch.manual_seed(0)
+    batch = get_batch()
+    batch = {
+        "image": {"S2L2A": batch["image"], "S1GRD": batch["image"][:, :2].clone(), "coords": torch.zeros(8, 2)},
+        "mask": batch["mask"],
+    }
+    augmentation = BatchAugmentation(horizontal_flip=0.5, rot90=0.5, crop_size=8, band_noise_std={"S1GRD": 0.1})
+    augmented = augmentation(batch)
+    assert augmented["image"]["S2L2A"].shape == (8, 3, 8, 8)
+    assert torch.equal(augmented["image"]["S2L2A"][:, 0].long(), augmented["mask"])
+    noise = augmented["image"]["S1GRD"] - augmented["image"]["S2L2A"][:, :2]
+    assert 0.05 < noise.std() < 0.15
+    assert torch.equal(augmented["image"]["coords"], batch["image"]["coords"])
+
+
+def test_rot90_requires_square_samples():
+    batch = {"image": torch.zeros(2, 3, 8, 16), "mask": torch.zeros(2, 8, 16)}
+    with pytest.raises(ValueError, match="same height and width"):
+        BatchAugmentation(rot90=1)(batch)
+
+
+def test_datamodule_batch_augmentation():
+    from terratorch.datamodules import GenericNonGeoSegmentationDataModule
+
+    dm = GenericNonGeoSegmentationDataModule(
+        batch_size=2,
+        num_workers=0,
+        train_data_root="train",
+        val_data_root="val",
+        test_data_root="test",
+        img_grep="*.tif",
+        label_grep="*.tif",
+        means=[0, 0, 0],
+        stds=[1, 1, 1],
+        num_classes=2,
+        no_label_replace=-1,
+        batch_augmentation={"horizontal_flip": 0.5, "crop_size": 8},
+    )
+    assert isinstance(dm.train_aug, BatchAugmentation)
+    assert dm.train_aug.normalize is dm.aug
+    assert dm.train_aug.mask_pad_value == -1
+    assert dm.train_aug.crop_size == (8, 8)
+    # Validation and test batches are only normalized
+    assert dm._valid_attribute("val_aug", "aug") is dm.aug
+
+
+def test_scale_jitter_requires_pad_value():
+    from terratorch.datamodules import GenericNonGeoPixelwiseRegressionDataModule, ShardDataModule
+
+    kwargs = {
+        "batch_size": 2,
+        "num_workers": 0,
+        "train_data_root": "train",
+        "val_data_root": "val",
+        "test_data_root": "test",
+        "means": [0, 0, 0],
+        "stds": [1, 1, 1],
+        "batch_augmentation": {"scale_jitter": [0.8, 1.2]},
+    }
+    with pytest.raises(ValueError, match="set no_label_replace"):
+        GenericNonGeoPixelwiseRegressionDataModule(**kwargs)
+    dm = GenericNonGeoPixelwiseRegressionDataModule(**kwargs, no_label_replace=-9999)
+    assert dm.train_aug.mask_pad_value == -9999
+
+    shard_kwargs = {"batch_size": 2, "num_workers": 0, "train_url": "train", "val_url": "val", "test_url": "test",
+                    "means": [0, 0, 0], "stds": [1, 1, 1], "batch_augmentation": {"scale_jitter": [0.8, 1.2]}}
+    with pytest.raises(ValueError, match="set no_label_replace"):
+        ShardDataModule(**shard_kwargs)
@@ -0,0 +1,113 @@
+import pickle
+
+import numpy as np
+import pytest
+import torch
+import xarray as xr
+
+from terratorch.datamodules.era5 import ERA5DataModule, ERA5Dataset
+
+LEVELS = 2
+
+
+def write_era5(path, num_timesteps, seed, num_features=3 + 4 * LEVELS):
+    rng = np.random.default_rng(seed)
+    xr.Dataset(
+        {
+            "features": (("time", "idim", "lat", "lon"), rng.random((num_timesteps, num_features, 4, 8), np.float32)),
+            "output": (("time", "odim", "lat", "lon"), rng.random((num_timesteps, 3, 4, 8), np.float32)),
+        },
+        coords={"lat": np.linspace(-90, 90, 4), "lon": np.linspace(0, 315, 8)},
+    ).to_netcdf(path, engine="scipy")
+
+
+@pytest.fixture
+def era5_dir(tmp_path):
+    write_era5(tmp_path / "era5_1.nc", 3, seed=1)
+    write_era5(tmp_path / "era5_2.nc", 2, seed=2)
+    return tmp_path
+
+
+def expected_sample(path, timestep):
+    with xr.open_dataset(path) as ds:
+        features = ds["features"].values[timestep]
+        target = ds["output"].values[timestep]
+    # theta, pressure, u, v
+    x = np.concatenate([features[3 + i * LEVELS : 3 + (i + 1) * LEVELS] for i in [2, 3, 0, 1]])
+    return torch.from_numpy(x), torch.from_numpy(target)
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_era5_dataset(era5_dir, prefetch):
+    dataset = ERA5Dataset(str(era5_dir), "era5_*.nc", prefetch=prefetch)
+    assert len(dataset) == 5
+    for index, (file, timestep) in enumerate([("era5_1.nc", 0), ("era5_1.nc", 1), ("era5_1.nc", 2),
+                                              ("era5_2.nc", 0), ("era5_2.nc", 1)]):
+        sample = dataset[index]
+        x, target = expected_sample(era5_dir / file, timestep)
+        assert torch.equal(sample["y"], x)
+        assert torch.equal(sample["x"], x.unsqueeze(0))
+        assert torch.equal(sample["target"], target)
+        assert sample["static"].shape == (3, 4, 8)
+        assert sample["lead_time"].shape == (1,)
+    assert torch.equal(dataset[-1]["target"], target)
+    with pytest.raises(IndexError):
+        dataset[5]
+
+
+def test_era5_dataset_prefetch(era5_dir):
+    dataset = ERA5Dataset(str(era5_dir), "era5_*.nc", prefetch=2)
+    dataset[0]
+    dataset[1]
+    # Not read ahead before the access is known to be sequential
+    assert dataset._pending == {}
+    dataset[2]
+    assert sorted(dataset._pending) == [3, 4]
+    assert torch.equal(dataset[3]["target"], expected_sample(era5_dir / "era5_2.nc", 0)[1])
+
+    # Shuffled indices are not read ahead
+    dataset[0]
+    assert dataset._pending == {}
+
+    # Batches keep their shift, e.g. the batches of a dataloader worker
+    dataset.__getitems__([0, 1])
+    dataset.__getitems__([1, 2])
+    dataset.__getitems__([2, 3])
+    assert sorted(dataset._pending) == [3, 4]
+    assert torch.equal(dataset[4]["target"], expected_sample(era5_dir / "era5_2.nc", 1)[1])
+
+    samples = dataset.__getitems__([1, 3, 0])
+    assert [sample["target"].shape for sample in samples] == [(3, 4, 8)] * 3
+    assert torch.equal(samples[1]["y"], expected_sample(era5_dir / "era5_2.nc", 0)[0])
+
+
+def test_era5_dataset_workers(era5_dir):
+    dataset = ERA5Dataset(str(era5_dir), "era5_*.nc")
+    dataset[0]
+    restored = pickle.loads(pickle.dumps(dataset))
+    assert restored._pending == {}
+    assert torch.equal(restored[1]["y"], dataset[1]["y"])
+
+    loader = torch.utils.data.DataLoader(dataset, batch_size=2, num_workers=2)
+    batches = list(loader)
+    assert [len(batch["y"]) for batch in batches] == [2, 2, 1]
+    assert torch.equal(batches[1]["target"][1], dataset[3]["target"])
+
+
+def test_era5_dataset_invalid_features(tmp_path):
+    write_era5(tmp_path / "era5_1.nc", 1, seed=1, num_features=10)
+    with pytest.raises(ValueError, match="Expected 3 \\+ 4 \\* levels features"):
+        ERA5Dataset(str(tmp_path), "era5_*.nc")
+
+
+def test_era5_datamodule(era5_dir):
+    datamodule = ERA5DataModule(str(era5_dir), str(era5_dir), "era5_*.nc", batch_size=2, num_data_workers=0,
+                                prefetch=1)
+    datamodule.setup("predict")
+    batch = next(iter(datamodule.predict_dataloader()))
+    assert batch["x"].shape == (2, 1, 4 * LEVELS, 4, 8)
+    assert datamodule.dataset_predict.prefetch == 1
+    datamodule.setup("fit")
+    # The training samples are shuffled
+    assert datamodule.dataset_train.prefetch == 0
+    assert datamodule.dataset_val.prefetch == 1
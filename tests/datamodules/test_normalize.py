@@ -0,0 +1,74 @@
+import pytest
+import torch
+
+from terratorch.datamodules.generic_multimodal_data_module import MultimodalNormalize
+from terratorch.datamodules.generic_pixel_wise_data_module import Normalize
+from terratorch.datamodules.utils import NormalizeWithTimesteps
+
+MEANS = [10.0, 20.0, 30.0]
+STDS = [2.0, 4.0, 5.0]
+
+
+def reference(image, means, stds, channel_dim=1):
+    shape = [1] * image.ndim
+    shape[channel_dim] = -1
+    return (image.float() - torch.tensor(means).view(shape)) / torch.tensor(stds).view(shape)
+
+
+@pytest.mark.parametrize("shape", [(2, 3, 8, 8), (2, 3, 4, 8, 8)])
+def test_normalize(shape):
+    normalize = Normalize(MEANS, STDS)
+    image = torch.rand(shape) * 100
+    expected = reference(image, MEANS, STDS)
+    output = normalize({"image": image})["image"]
+    assert torch.allclose(output, expected, atol=1e-6)
+    # The batch is normalized in place and the constants are reused
+    assert output.data_ptr() == image.data_ptr()
+    normalize({"image": torch.rand(shape)})
+    assert len(normalize._constants) == 1
+
+    with pytest.raises(Exception, match="5 or 4 dimensions"):
+        normalize({"image": torch.rand(3, 8, 8)})
+
+
+def test_normalize_keeps_views_and_inputs():
+    base = torch.rand(2, 3, 8, 8) * 100
+    expected = reference(base, MEANS, STDS)
+    original = base.clone()
+    output = Normalize(MEANS, STDS)({"image": base[:1]})["image"]
+    assert torch.allclose(output, expected[:1], atol=1e-6)
+    assert torch.equal(base, original)
+
+    output = Normalize(MEANS, STDS, in_place=False)({"image": base})["image"]
+    assert torch.allclose(output, expected, atol=1e-6)
+    assert torch.equal(base, original)
+
+
+def test_normalize_integer_images():
+    image = torch.randint(0, 10000, (2, 3, 8, 8), dtype=torch.int32).to(torch.uint16)
+    normalize = Normalize(MEANS, STDS)
+    output = normalize({"image": image})["image"]
+    assert output.dtype == torch.float32
+    assert torch.allclose(output, reference(image.int(), MEANS, STDS), atol=1e-4)
+
+    output = Normalize(MEANS, STDS, dtype=torch.float64)({"image": image})["image"]
+    assert output.dtype == torch.float64
+
+
+def test_multimodal_normalize():
+    normalize = MultimodalNormalize({"S2": MEANS, "DEM": [5.0]}, {"S2": STDS, "DEM": [2.0]})
+    s2, dem = torch.rand(2, 3, 8, 8) * 100, torch.rand(2, 8, 8) * 10
+    expected_s2, expected_dem = reference(s2, MEANS, STDS), (dem - 5) / 2
+    output = normalize({"image": {"S2": s2, "DEM": dem}})["image"]
+    assert torch.allclose(output["S2"], expected_s2, atol=1e-6)
+    assert torch.allclose(output["DEM"], expected_dem, atol=1e-6)
+    assert len(normalize._constants) == 2
+
+
+def test_normalize_with_timesteps():
+    means = [[1.0, 2.0], [3.0, 4.0], [5.0, 6.0]]  # (C, T)
+    stds = [[1.0, 2.0], [2.0, 4.0], [5.0, 5.0]]
+    image = torch.rand(2, 2, 3, 8, 8) * 10  # (B, T, C, H, W)
+    expected = (image - torch.tensor(means).T.reshape(1, 2, 3, 1, 1)) / torch.tensor(stds).T.reshape(1, 2, 3, 1, 1)
+    output = NormalizeWithTimesteps(means, stds)({"image": image.clone()})["image"]
+    assert torch.allclose(output, expected, atol=1e-6)
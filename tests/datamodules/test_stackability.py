@@ -0,0 +1,118 @@
+import numpy as np
+import pytest
+import torch
+
+from terratorch.datamodules.utils import (
+    PadCollate,
+    ShapeBucketBatchSampler,
+    get_sample_shapes,
+    is_dataset_stackable,
+    stackable_dataloader_kwargs,
+)
+
+
+class NpyDataset(torch.utils.data.Dataset):
+    def __init__(self, image_files, crop=None):
+        self.image_files = image_files
+        self.crop = crop
+        self.loaded = 0
+
+    def __len__(self):
+        return len(self.image_files)
+
+    def __getitem__(self, index):
+        self.loaded += 1
+        image = torch.from_numpy(np.load(self.image_files[index]))
+        if self.crop:
+            image = image[..., : self.crop, : self.crop]
+        return {"image": image, "mask": torch.zeros(image.shape[-2:], dtype=torch.long)}
+
+
+@pytest.fixture
+def npy_files(tmp_path):
+    files = []
+    for i, size in enumerate([16, 16, 24, 16, 24]):
+        path = tmp_path / f"sample_{i}.npy"
+        np.save(path, np.random.rand(3, size, size).astype(np.float32))
+        files.append(str(path))
+    return files
+
+
+def test_stackability_from_headers(npy_files):
+    dataset = NpyDataset(npy_files[:2])
+    assert is_dataset_stackable(dataset)
+    assert dataset.loaded == 0
+    _, shapes = get_sample_shapes(NpyDataset(npy_files))
+    assert [s[0][1] for s in shapes] == [(3, 16, 16), (3, 16, 16), (3, 24, 24), (3, 16, 16), (3, 24, 24)]
+
+
+def test_stackability_after_transforms(npy_files):
+    # Files differ in size, but the crop makes the samples stackable. Only one sample per file shape is loaded.
+    dataset = NpyDataset(npy_files, crop=16)
+    assert is_dataset_stackable(dataset)
+    assert dataset.loaded == 2
+    assert not is_dataset_stackable(NpyDataset(npy_files))
+
+
+def test_bucket_batch_sampler(npy_files):
+    kwargs = stackable_dataloader_kwargs(NpyDataset(npy_files), 2, shuffle=True, drop_last=False)
+    sampler = kwargs["batch_sampler"]
+    assert isinstance(sampler, ShapeBucketBatchSampler)
+    assert isinstance(sampler.sampler, torch.utils.data.RandomSampler)
+    batches = list(sampler)
+    assert len(batches) == len(sampler) == 3
+    assert sorted(i for b in batches for i in b) == list(range(5))
+    for batch in torch.utils.data.DataLoader(NpyDataset(npy_files), **kwargs):
+        assert batch["image"].shape[0] in (1, 2)
+
+    sampler = ShapeBucketBatchSampler(range(5), 2, drop_last=True, shapes=[16, 16, 24, 16, 24])
+    assert list(sampler) == [[0, 1], [2, 4]]
+    assert len(sampler) == 2
+
+
+def test_bucket_batch_sampler_with_distributed_sampler(npy_files):
+    dataset = NpyDataset(npy_files)
+    shapes = [16, 16, 24, 16, 24]
+    rank_indices = []
+    for rank in range(2):
+        sampler = torch.utils.data.DistributedSampler(dataset, num_replicas=2, rank=rank, shuffle=False)
+        # Lightning rebuilds custom batch samplers with the distributed sampler like this
+        batch_sampler = ShapeBucketBatchSampler(sampler, batch_size=2, drop_last=False)
+        batches = list(batch_sampler)
+        assert len(batches) == len(batch_sampler)
+        for batch in batches:
+            assert len({shapes[i] for i in batch}) == 1
+        rank_indices.append(sorted(i for b in batches for i in b))
+        assert rank_indices[-1] == sorted(sampler)
+    assert set(rank_indices[0]) | set(rank_indices[1]) == set(range(5))
+
+    # Through Lightning's dataloader re-instantiation
+    from lightning.pytorch.utilities.data import _update_dataloader
+
+    loader = torch.utils.data.DataLoader(dataset, **stackable_dataloader_kwargs(dataset, 2, True, False))
+    sampler = torch.utils.data.DistributedSampler(dataset, num_replicas=2, rank=1, shuffle=True)
+    rebuilt = _update_dataloader(loader, sampler)
+    assert isinstance(rebuilt.batch_sampler, ShapeBucketBatchSampler)
+    assert rebuilt.batch_sampler.sampler is sampler
+    assert sorted(i for b in rebuilt.batch_sampler for i in b) == sorted(sampler)
+    for batch in rebuilt:
+        assert batch["image"].shape[0] in (1, 2)
+
+    with pytest.raises(ValueError, match="Cannot read the sample shapes"):
+        ShapeBucketBatchSampler(range(5), batch_size=2, drop_last=False)
+
+
+def test_pad_collate(npy_files):
+    dataset = NpyDataset(npy_files)
+    kwargs = stackable_dataloader_kwargs(dataset, 5, shuffle=False, drop_last=False, fallback="pad")
+    assert isinstance(kwargs["collate_fn"], PadCollate)
+    batch = next(iter(torch.utils.data.DataLoader(dataset, **kwargs)))
+    assert batch["image"].shape == (5, 3, 24, 24)
+    assert (batch["mask"][0, 16:] == -1).all()
+
+
+def test_batch_size_1_fallback(npy_files):
+    kwargs = stackable_dataloader_kwargs(NpyDataset(npy_files), 4, False, False, fallback="batch_size_1")
+    assert kwargs["batch_size"] == 1
+    with pytest.raises(ValueError, match="Unknown stackability fallback"):
+        stackable_dataloader_kwargs(NpyDataset(npy_files), 4, False, False, fallback="drop")
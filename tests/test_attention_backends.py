@@ -0,0 +1,85 @@
+import pytest
+import torch
+
+from terratorch.models.backbones.clay_v1 import modules as clay_modules
+from terratorch.models.backbones.multimae import multimae_utils
+from terratorch.models.backbones.terramind.model import tm_utils
+
+DIM = 32
+NUM_HEADS = 4
+
+
+def get_masks(batch_size, num_queries, num_keys):
+    mask = torch.rand(batch_size, num_queries, num_keys) > 0.7
+    # A fully masked row attends uniformly to all keys in the explicit attention
+    mask[0, 0] = True
+    return {"none": None, "full": mask, "keys": mask[:, :1]}
+
+
+def assert_parity(module, *args, atol=1e-5, **kwargs):
+    module.eval()
+    module.fused_attn = False
+    with torch.no_grad():
+        expected = module(*args, **kwargs)
+        module.fused_attn = True
+        result = module(*args, **kwargs)
+    assert not result.isnan().any()
+    assert torch.allclose(result, expected, atol=atol)
+
+
+@pytest.mark.parametrize("allow_zero_attn", [False, True])
+@pytest.mark.parametrize("mask_type", ["none", "full"])
+@pytest.mark.parametrize("attention_class", [tm_utils.Attention, tm_utils.NormAttention])
+def test_terramind_self_attention_parity(attention_class, mask_type, allow_zero_attn):
+    torch.manual_seed(0)
+    x = torch.randn(2, 20, DIM)
+    mask = get_masks(2, 20, 20)[mask_type]
+    assert_parity(attention_class(DIM, NUM_HEADS, allow_zero_attn=allow_zero_attn), x, mask)
+
+
+@pytest.mark.parametrize("allow_zero_attn", [False, True])
+@pytest.mark.parametrize("mask_type", ["none", "full", "keys"])
+@pytest.mark.parametrize("attention_class", [tm_utils.CrossAttention, tm_utils.NormCrossAttention])
+def test_terramind_cross_attention_parity(attention_class, mask_type, allow_zero_attn):
+    torch.manual_seed(0)
+    x, context = torch.randn(2, 12, DIM), torch.randn(2, 20, DIM)
+    mask = get_masks(2, 12, 20)[mask_type]
+    assert_parity(attention_class(DIM, NUM_HEADS, allow_zero_attn=allow_zero_attn), x, context, mask)
+
+
+@pytest.mark.parametrize("allow_zero_attn", [False, True])
+@pytest.mark.parametrize("dtype", [torch.float16, torch.bfloat16])
+def test_terramind_half_precision_parity(dtype, allow_zero_attn):
+    # Fully masked rows must not become NaN when the logits are in half precision
+    torch.manual_seed(0)
+    x, context = torch.randn(2, 12, DIM, dtype=dtype), torch.randn(2, 20, DIM, dtype=dtype)
+    mask = get_masks(2, 12, 20)["full"]
+    module = tm_utils.CrossAttention(DIM, NUM_HEADS, allow_zero_attn=allow_zero_attn).to(dtype)
+    assert_parity(module, x, context, mask, atol=2e-2)
+
+
+def test_terramind_cross_attention_without_keys():
+    # e.g. the unconditional pass of guided generation, when all conditioning modalities are empty
+    x, context = torch.randn(2, 12, DIM), torch.randn(2, 0, DIM)
+    mask = torch.ones(2, 1, 0, dtype=torch.bool)
+    assert_parity(tm_utils.CrossAttention(DIM, NUM_HEADS), x, context, mask)
+
+
+def test_multimae_attention_parity():
+    torch.manual_seed(0)
+    x, context = torch.randn(2, 12, DIM), torch.randn(2, 20, DIM)
+    assert_parity(multimae_utils.Attention(DIM, NUM_HEADS), x)
+    assert_parity(multimae_utils.CrossAttention(DIM, NUM_HEADS), x, context)
+
+
+def test_clay_attention_parity():
+    torch.manual_seed(0)
+    assert_parity(clay_modules.Attention(DIM, heads=NUM_HEADS, dim_head=8), torch.randn(2, 20, DIM))
+
+
+@pytest.mark.parametrize("fused_attn", [None, False, True])
+def test_fused_attn_is_passed_to_blocks(fused_attn):
+    block = tm_utils.DecoderBlock(DIM, NUM_HEADS, fused_attn=fused_attn)
+    expected = tm_utils.use_fused_attn() if fused_attn is None else fused_attn
+    assert block.self_attn.fused_attn == block.cross_attn.fused_attn == expected
+    assert multimae_utils.Block(DIM, NUM_HEADS, fused_attn=fused_attn).attn.fused_attn == expected
@@ -8,6 +8,7 @@ import gc
 from terratorch.models.backbones import scalemae
 from terratorch.registry import BACKBONE_REGISTRY
 import terratorch.models.backbones.torchgeo_vit as torchgeo_vit
+from terratorch.models.backbones.terramind.model.terramind_vit import TerraMindViT
 
 NUM_CHANNELS = 6
 NUM_FRAMES = 4
@@ -120,14 +121,45 @@ def test_out_indices(model_name, input_224):
     backbone = BACKBONE_REGISTRY.build(model_name, pretrained=False, out_indices=out_indices)
     assert backbone.out_indices == out_indices
 
+    assert len(backbone.out_channels) == len(out_indices)
+
+    full_backbone = BACKBONE_REGISTRY.build(model_name, pretrained=False)
+    full_backbone.load_state_dict(backbone.state_dict())
     output = backbone(input_224)
-    full_output = backbone.forward_features(input_224)
+    full_output = full_backbone(input_224)
 
+    assert len(output) == len(out_indices)
     for filtered_index, full_index in enumerate(out_indices):
         assert torch.allclose(full_output[full_index], output[filtered_index])
     gc.collect()
 
 
+def test_out_indices_last_block_is_normalized(input_224):
+    backbone = BACKBONE_REGISTRY.build("prithvi_eo_tiny", pretrained=False, out_indices=[1, -1])
+    full_backbone = BACKBONE_REGISTRY.build("prithvi_eo_tiny", pretrained=False)
+    full_backbone.load_state_dict(backbone.state_dict())
+
+    output = backbone(input_224)
+    full_output = full_backbone(input_224)
+    assert torch.allclose(output[0], full_output[1])
+    assert torch.allclose(output[1], full_output[-1])
+    gc.collect()
+
+
+def test_terramind_out_indices():
+    kwargs = {"modalities": ["S2L2A"], "img_size": 32, "dim": 32, "encoder_depth": 4, "num_heads": 4}
+    backbone = TerraMindViT(out_indices=[1, 3], **kwargs).eval()
+    full_backbone = TerraMindViT(**kwargs).eval()
+    full_backbone.load_state_dict(backbone.state_dict())
+
+    x = torch.randn(1, 12, 32, 32)
+    output = backbone(x)
+    full_output = full_backbone(x)
+    assert len(output) == len(backbone.out_channels) == 2
+    assert torch.allclose(output[0], full_output[1])
+    assert torch.allclose(output[1], full_output[3])
+
+
 @pytest.mark.parametrize("model_name", ["vit_base_patch16", "vit_large_patch16"])
 def test_scale_mae(model_name):
     # out_indices = [2, 4, 8, 10]
@@ -153,10 +185,8 @@ def test_scale_mae_new_channels(model_name, bands):
 @pytest.mark.skipif(IN_GITHUB_ACTIONS, reason="Skip this test in GitHub Actions as deformable attn is not supported.")
 @pytest.mark.parametrize("backbone", ["prithvi_eo_v1_100", "prithvi_eo_v2_300", "prithvi_eo_v2_300_tl"])
 def test_prithvi_vit_adapter(backbone, input_224):
-    try:
-        from terratorch.models.backbones.detr_ops.modules.ms_deform_attn import MSDeformAttn
-    except ImportError:
-        pytest.skip(f'Cannot test vit_adapter due to missing deformable attn module.')
+    if not torch.cuda.is_available():
+        pytest.skip('Cannot test vit_adapter on the GPU without CUDA.')
 
     backbone = BACKBONE_REGISTRY.build(backbone, pretrained=True, vit_adapter=True)
     backbone = backbone.to("cuda")
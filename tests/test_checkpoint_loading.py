@@ -0,0 +1,155 @@
+import pytest
+import torch
+from safetensors.torch import save_file
+from torch import nn
+
+from terratorch.models.backbones.checkpoint_loading import (
+    build_model_from_state_dict,
+    init_empty_weights,
+    load_state_dict_file,
+)
+from terratorch.models.backbones.prithvi_mae import PrithviViT
+from terratorch.models.backbones.terramind.model.terramind_register import build_terrammind_vit
+from terratorch.registry import BACKBONE_REGISTRY
+
+TERRAMIND_ARGS = {"img_size": 32, "modalities": ["S2L2A"], "dim": 32, "encoder_depth": 2, "num_heads": 4}
+
+
+class CountingBuilder:
+    def __init__(self, model_class, **kwargs):
+        self.model_class = model_class
+        self.kwargs = kwargs
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.model_class(**self.kwargs)
+
+
+def get_prithvi_builder():
+    return CountingBuilder(PrithviViT, img_size=32, patch_size=8, in_chans=3, embed_dim=16, depth=2, num_heads=2)
+
+
+def assert_state_dict_equal(model, expected):
+    state_dict = model.state_dict()
+    assert state_dict.keys() == expected.keys()
+    for k, v in expected.items():
+        assert not state_dict[k].is_meta, k
+        assert torch.equal(state_dict[k], v), k
+
+
+def test_load_state_dict_file_uses_mmap(tmp_path, monkeypatch):
+    state_dict = {"weight": torch.randn(4, 3)}
+    torch.save(state_dict, tmp_path / "new.pt")
+    torch.save(state_dict, tmp_path / "legacy.pt", _use_new_zipfile_serialization=False)
+    save_file(state_dict, tmp_path / "weights.safetensors")
+
+    load = torch.load
+    calls = []
+
+    def spy_load(*args, **kwargs):
+        calls.append(kwargs.get("mmap", False))
+        return load(*args, **kwargs)
+
+    monkeypatch.setattr(torch, "load", spy_load)
+    assert torch.equal(load_state_dict_file(tmp_path / "new.pt")["weight"], state_dict["weight"])
+    assert calls == [True]
+    # Legacy checkpoints cannot be memory-mapped
+    assert torch.equal(load_state_dict_file(tmp_path / "legacy.pt")["weight"], state_dict["weight"])
+    assert calls == [True, True, False]
+    assert torch.equal(load_state_dict_file(tmp_path / "weights.safetensors")["weight"], state_dict["weight"])
+
+
+def test_init_empty_weights():
+    with init_empty_weights():
+        model = get_prithvi_builder()()
+    assert all(p.is_meta for p in model.parameters())
+    # Buffers are computed in __init__ and stay on the CPU
+    assert not model.pos_embed.is_meta
+    assert not nn.Linear(2, 2).weight.is_meta
+
+
+def test_build_model_from_state_dict():
+    expected = get_prithvi_builder()().state_dict()
+    builder = get_prithvi_builder()
+    model, loaded_keys = build_model_from_state_dict(builder, expected)
+    assert builder.calls == 1
+    assert not loaded_keys.missing_keys and not loaded_keys.unexpected_keys
+    assert_state_dict_equal(model, expected)
+    # The model uses the checkpoint tensors without copying them
+    assert model.blocks[0].attn.qkv.weight.data_ptr() == expected["blocks.0.attn.qkv.weight"].data_ptr()
+
+
+def test_build_model_from_state_dict_casts_to_model_dtype():
+    expected = get_prithvi_builder()().state_dict()
+    model, _ = build_model_from_state_dict(get_prithvi_builder(), {k: v.half() for k, v in expected.items()})
+    assert all(p.dtype == torch.float32 for p in model.parameters())
+
+
+def test_build_model_from_state_dict_initializes_missing_weights():
+    expected = get_prithvi_builder()().state_dict()
+    state_dict = {k: v for k, v in expected.items() if not k.startswith("norm.")}
+    builder = get_prithvi_builder()
+    torch.manual_seed(0)
+    model, loaded_keys = build_model_from_state_dict(builder, state_dict, strict=False)
+    assert builder.calls == 2
+    assert loaded_keys.missing_keys == ["norm.weight", "norm.bias"]
+    assert torch.equal(model.norm.weight, torch.ones(16))
+    assert torch.equal(model.blocks[1].mlp.fc1.weight, expected["blocks.1.mlp.fc1.weight"])
+
+
+def test_build_model_from_state_dict_filter_gets_copy():
+    expected = get_prithvi_builder()().state_dict()
+    state_dict = {"encoder." + k: v for k, v in expected.items()}
+
+    def remove_prefix(state_dict, model):
+        for k in list(state_dict):
+            state_dict[k.replace("encoder.", "")] = state_dict.pop(k)
+        return state_dict
+
+    model, _ = build_model_from_state_dict(get_prithvi_builder(), state_dict, remove_prefix)
+    assert_state_dict_equal(model, expected)
+    assert all(k.startswith("encoder.") for k in state_dict)
+
+
+def test_build_model_from_state_dict_keeps_shared_parameters():
+    class TiedModel(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.embed = nn.Linear(4, 4)
+            self.head = nn.Linear(4, 4)
+            self.head.weight = self.embed.weight
+
+    expected = TiedModel().state_dict()
+    model, _ = build_model_from_state_dict(TiedModel, expected)
+    assert model.head.weight is model.embed.weight
+    assert torch.equal(model.head.weight, expected["embed.weight"])
+
+
+@pytest.mark.parametrize("bands", [None, ["RED", "GREEN", "BLUE", "NIR_NARROW"], ["RED", "GREEN", "BLUE", 77]])
+def test_prithvi_from_ckpt_path(tmp_path, bands):
+    model = BACKBONE_REGISTRY.build("prithvi_eo_tiny", pretrained=False)
+    torch.save(model.state_dict(), tmp_path / "prithvi.pt")
+    kwargs = {"bands": bands} if bands is not None else {}
+
+    loaded = BACKBONE_REGISTRY.build("prithvi_eo_tiny", pretrained=True, ckpt_path=str(tmp_path / "prithvi.pt"),
+                                     **kwargs)
+    state_dict = loaded.state_dict()
+    assert not any(v.is_meta for v in state_dict.values())
+    for k, v in model.state_dict().items():
+        if "patch_embed.proj.weight" not in k:
+            assert torch.equal(state_dict[k], v), k
+    # Weights of the pre-trained bands are selected in the patch embedding
+    weight = loaded.patch_embed.proj.weight
+    assert weight.shape[1] == len(bands or loaded.pretrained_bands)
+    assert torch.equal(weight[:, 0], model.patch_embed.proj.weight[:, 2 if bands else 0])
+
+
+def test_terramind_from_ckpt_path(tmp_path):
+    model = build_terrammind_vit(**TERRAMIND_ARGS)
+    torch.save(model.state_dict(), tmp_path / "terramind.pt")
+    loaded = build_terrammind_vit(ckpt_path=str(tmp_path / "terramind.pt"), **TERRAMIND_ARGS)
+    assert_state_dict_equal(loaded, model.state_dict())
+    x = torch.randn(1, 12, 32, 32)
+    with torch.no_grad():
+        assert torch.equal(loaded(x)[-1], model(x)[-1])
@@ -0,0 +1,176 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+import yaml
+
+from terratorch.datasets import GenericMultimodalSegmentationDataset, GenericNonGeoSegmentationDataset
+from terratorch.datasets import generic_pixel_wise_dataset
+from terratorch.datasets.chip_cache import ChipCache, build_chip_cache, cache_main, chip_cache_path
+
+SEGMENTATION_IMAGE_PATH = os.path.abspath("tests/resources/inputs/segmentation_test_input.tif")
+SEGMENTATION_LABEL_PATH = os.path.abspath("tests/resources/inputs/segmentation_test_label.tif")
+
+
+@pytest.fixture
+def segmentation_root(tmp_path):
+    for directory in ["images", "labels"]:
+        (tmp_path / directory).mkdir()
+    for i in range(3):
+        os.symlink(SEGMENTATION_IMAGE_PATH, tmp_path / "images" / f"{i}_img.tif")
+        os.symlink(SEGMENTATION_LABEL_PATH, tmp_path / "labels" / f"{i}_label.tif")
+    return tmp_path
+
+
+def get_segmentation_dataset(root, **kwargs):
+    return GenericNonGeoSegmentationDataset(
+        root, num_classes=2, image_grep="images/*_img.tif", label_grep="labels/*_label.tif", constant_scale=0.5,
+        **kwargs,
+    )
+
+
+def test_build_chip_cache(tmp_path):
+    samples = [
+        {"image": np.full((2, 3), i, dtype=np.float32), "mask": np.arange(4, dtype=np.int64) + i} for i in range(5)
+    ]
+    samples[3]["mask"] = None
+    samples[4]["table"] = np.array(["not", "numeric"])
+    cache = build_chip_cache(tmp_path / "entry", samples.__getitem__, len(samples), shard_size=60)
+    assert len(cache) == 5
+    # 24 bytes per image chip, two chips per shard
+    assert cache.modalities["image"]["shards"] == ["image-00000.npy", "image-00001.npy", "image-00002.npy"]
+    for i, sample in enumerate(samples):
+        assert np.array_equal(cache.get(i, "image"), sample["image"])
+        assert isinstance(cache.get(i, "image").base, np.memmap)
+    assert np.array_equal(cache.get(2, "mask"), samples[2]["mask"])
+    assert cache.get(3, "mask") is None
+    assert cache.get(4, "table") is None
+    assert cache.get(0, "other") is None
+    # No temporary directories are left
+    assert os.listdir(tmp_path) == ["entry"]
+
+
+def test_pixel_wise_dataset_chip_cache(segmentation_root, tmp_path, monkeypatch):
+    dataset = get_segmentation_dataset(segmentation_root)
+    cached = get_segmentation_dataset(segmentation_root, cache_dir=tmp_path / "cache")
+    assert isinstance(cached.chip_cache, ChipCache)
+    for i in range(len(dataset)):
+        expected, sample = dataset[i], cached[i]
+        assert torch.equal(sample["image"], expected["image"])
+        assert torch.equal(sample["mask"], expected["mask"])
+        assert sample["filename"] == expected["filename"]
+
+    def fail(*args, **kwargs):
+        msg = "The cached samples must not read the files."
+        raise AssertionError(msg)
+
+    monkeypatch.setattr(generic_pixel_wise_dataset, "read_raster", fail)
+    reopened = get_segmentation_dataset(segmentation_root, cache_dir=tmp_path / "cache")
+    assert reopened.chip_cache.path == cached.chip_cache.path
+    assert torch.equal(reopened[1]["image"], expected["image"])
+
+    # Other preprocessing arguments use another entry
+    monkeypatch.undo()
+    other = GenericNonGeoSegmentationDataset(segmentation_root, num_classes=2, image_grep="images/*_img.tif",
+                                             label_grep="labels/*_label.tif", cache_dir=tmp_path / "cache")
+    assert other.chip_cache.path != cached.chip_cache.path
+    assert torch.equal(other[0]["image"], dataset[0]["image"] * 2)
+
+
+def test_overridden_load_file_is_used(segmentation_root, tmp_path):
+    class ShiftedDataset(GenericNonGeoSegmentationDataset):
+        def _load_file(self, path, nan_replace=None):
+            return super()._load_file(path, nan_replace=nan_replace) + 1
+
+    dataset = get_segmentation_dataset(segmentation_root)
+    shifted = ShiftedDataset(segmentation_root, num_classes=2, image_grep="images/*_img.tif",
+                             label_grep="labels/*_label.tif", constant_scale=0.5)
+    assert shifted.load_with_xarray
+    assert torch.allclose(shifted[0]["image"], dataset[0]["image"] + 0.5)
+    assert torch.equal(shifted[0]["mask"], dataset[0]["mask"] + 1)
+
+    cached = ShiftedDataset(segmentation_root, num_classes=2, image_grep="images/*_img.tif",
+                            label_grep="labels/*_label.tif", constant_scale=0.5, cache_dir=tmp_path / "cache")
+    assert torch.equal(cached[0]["image"], shifted[0]["image"])
+
+
+def test_multimodal_dataset_chip_cache(tmp_path):
+    for directory in ["s2", "s1", "labels"]:
+        (tmp_path / directory).mkdir()
+    for i in range(3):
+        np.save(tmp_path / "s2" / f"{i}.npy", np.random.rand(4, 8, 8).astype(np.float32))
+        np.save(tmp_path / "s1" / f"{i}.npy", np.random.rand(2, 8, 8).astype(np.float32))
+        np.save(tmp_path / "labels" / f"{i}.npy", np.random.randint(1, 3, (1, 8, 8)))
+
+    kwargs = {
+        "data_root": {"S2": tmp_path / "s2", "S1": tmp_path / "s1"},
+        "num_classes": 2,
+        "image_modalities": ["S2", "S1"],
+        "label_data_root": tmp_path / "labels",
+        "image_grep": {"S2": "*.npy", "S1": "*.npy"},
+        "label_grep": "*.npy",
+        "dataset_bands": {"S2": [0, 1, 2, 3]},
+        "output_bands": {"S2": [1, 3]},
+        "constant_scale": {"S1": 2.0},
+        "reduce_zero_label": True,
+    }
+    dataset = GenericMultimodalSegmentationDataset(**kwargs)
+    assert len(dataset) == 3
+    cached = GenericMultimodalSegmentationDataset(**kwargs, cache_dir=tmp_path / "cache")
+    for i in range(len(dataset)):
+        expected, sample = dataset[i], cached[i]
+        for m in ["S2", "S1"]:
+            assert torch.equal(sample["image"][m], expected["image"][m])
+        assert torch.equal(sample["mask"], expected["mask"])
+    assert cached[0]["image"]["S2"].shape == (2, 8, 8)
+    # Sampled modalities
+    assert list(cached[1, ["S1", "mask"]]["image"]) == ["S1"]
+
+
+def test_cache_build_command(segmentation_root, tmp_path, capsys):
+    config = {
+        "data": {
+            "class_path": "terratorch.datamodules.GenericNonGeoSegmentationDataModule",
+            "init_args": {
+                "batch_size": 2,
+                "num_workers": 0,
+                "num_classes": 2,
+                "train_data_root": str(segmentation_root),
+                "val_data_root": str(segmentation_root),
+                "test_data_root": str(segmentation_root),
+                "img_grep": "images/*_img.tif",
+                "label_grep": "labels/*_label.tif",
+                "means": [0] * 6,
+                "stds": [1] * 6,
+            },
+        }
+    }
+    with open(tmp_path / "config.yaml", "w") as f:
+        yaml.safe_dump(config, f)
+
+    with pytest.raises(ValueError, match="has no cache_dir"):
+        cache_main(["build", "-c", str(tmp_path / "config.yaml")])
+    cache_main(["build", "-c", str(tmp_path / "config.yaml"), "--cache_dir", str(tmp_path / "cache")])
+    output = capsys.readouterr().out
+    assert output.startswith("train: ")
+    assert "(3 samples)" in output
+    # Train, validation and test use the same files and arguments
+    assert len(os.listdir(tmp_path / "cache")) == 1
+
+
+def test_chip_cache_path_hashes_arrays(tmp_path):
+    # Large arrays only differing in the middle have the same str()
+    a = np.zeros(10000)
+    b = a.copy()
+    b[5000] = 1
+    assert str(a) == str(b)
+    assert chip_cache_path(tmp_path, "dataset", {"samples": [{"mask": a}]}) != chip_cache_path(
+        tmp_path, "dataset", {"samples": [{"mask": b}]}
+    )
+    assert chip_cache_path(tmp_path, "dataset", {"samples": [{"mask": a}]}) == chip_cache_path(
+        tmp_path, "dataset", {"samples": [{"mask": a.copy()}]}
+    )
+    assert chip_cache_path(tmp_path, "dataset", {"samples": [{"mask": a}]}) != chip_cache_path(
+        tmp_path, "dataset", {"samples": [{"mask": a.astype(np.float32)}]}
+    )
@@ -0,0 +1,116 @@
+import os
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+import rasterio
+import torch
+
+from terratorch import cli_tools
+from terratorch.cli_tools import CustomWriter
+
+INPUT_FILES = [os.path.abspath(f"tests/resources/inputs/segmentation_test_input{suffix}.tif") for suffix in
+               ["", "_1", "_2", "_3"]]
+
+
+@pytest.fixture(autouse=True)
+def clear_metadata_cache():
+    cli_tools._input_metadata.cache_clear()
+    yield
+    cli_tools._input_metadata.cache_clear()
+
+
+def write_predictions(writer, predictions):
+    trainer = SimpleNamespace(out_dtype="int16")
+    for batch_idx, prediction in enumerate(predictions):
+        writer.write_on_batch_end(trainer, None, prediction, None, None, batch_idx, 0)
+    writer.on_predict_end(trainer, None)
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_custom_writer(tmp_path, num_workers, monkeypatch):
+    reads = []
+    open_tiff = cli_tools.open_tiff
+    monkeypatch.setattr(cli_tools, "open_tiff", lambda file: reads.append(file) or open_tiff(file))
+    preds = torch.randint(0, 2, (len(INPUT_FILES), 224, 224))
+    probs = torch.rand(len(INPUT_FILES), 224, 224)
+    predictions = [([(preds[:2], "pred"), (probs[:2], "probabilities")], INPUT_FILES[:2]),
+                   (((preds[2:], "pred")), INPUT_FILES[2:])]
+    writer = CustomWriter(output_dir=str(tmp_path), write_interval="batch", num_workers=num_workers)
+    write_predictions(writer, predictions)
+    assert writer._executor is None
+    assert sorted(os.listdir(tmp_path)) == [
+        "segmentation_test_input_1_pred.tif", "segmentation_test_input_1_probabilities.tif",
+        "segmentation_test_input_2_pred.tif", "segmentation_test_input_3_pred.tif",
+        "segmentation_test_input_pred.tif", "segmentation_test_input_probabilities.tif",
+    ]
+    with rasterio.open(tmp_path / "segmentation_test_input_3_pred.tif") as src:
+        assert np.array_equal(src.read(1), preds[3].numpy())
+        assert src.nodata == -1
+    # Each input is read once for its predictions and probabilities
+    assert sorted(reads) == sorted(INPUT_FILES)
+
+
+def test_custom_writer_back_pressure():
+    release = threading.Event()
+    written = []
+
+    def slow_write(index):
+        release.wait(timeout=10)
+        written.append(index)
+
+    writer = CustomWriter(num_workers=1, max_pending=2)
+    submitted = []
+
+    def produce():
+        for index in range(4):
+            writer._submit(slow_write, index)
+            submitted.append(index)
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    producer.join(timeout=0.5)
+    # Two files are pending, the producer blocks on the third one
+    assert producer.is_alive()
+    assert submitted == [0, 1]
+    release.set()
+    producer.join(timeout=10)
+    assert submitted == [0, 1, 2, 3]
+
+    # on_predict_end waits for the pending writes
+    writer.on_predict_end(None, None)
+    assert written == [0, 1, 2, 3]
+    assert writer._executor is None
+
+
+def test_custom_writer_raises_writer_errors():
+    submitted = threading.Event()
+
+    def failing_write():
+        submitted.wait(timeout=10)
+        msg = "disk full"
+        raise OSError(msg)
+
+    writer = CustomWriter(num_workers=2)
+    writer._submit(failing_write)
+    submitted.set()
+    with pytest.raises(OSError, match="disk full"):
+        writer.on_predict_end(None, None)
+    assert writer._executor is None
+
+
+def test_input_metadata_cache_is_bounded_by_bytes(monkeypatch):
+    cache = cli_tools._InputMetadataCache(max_bytes=2 * 224 * 224)
+    for file in INPUT_FILES:
+        metadata, mask = cache(file)
+        assert mask.shape == (224, 224)
+        assert metadata["nodata"] == -9999.0
+    assert len(cache) == 2
+    assert cache.nbytes == 2 * 224 * 224
+
+    monkeypatch.setattr(cli_tools, "open_tiff", None)
+    # Cached inputs are not read again
+    assert cache(INPUT_FILES[-1])[1].shape == (224, 224)
+    cache.cache_clear()
+    assert len(cache) == cache.nbytes == 0
@@ -0,0 +1,37 @@
+import glob
+import json
+import os
+
+import pytest
+
+from terratorch.datasets.utils import FileIndex
+
+
+@pytest.fixture
+def data_dir(tmp_path):
+    names = ["a_1_img.tif", "a_1_mask.tif", "a_10_img.tif", "b_2_img.tif", "b_2_img.npy", ".a_1_img.tif", "c[1]_img.tif"]
+    for name in names:
+        (tmp_path / name).touch()
+    return tmp_path
+
+
+@pytest.mark.parametrize(
+    "pattern", ["*", "a_1*", "a_1_img.tif", "a_1*_img.tif", "b_2_img.*", "?_2*", ".a*", "x*", "c[[]1]*"]
+)
+def test_file_index_matches_glob(data_dir, pattern):
+    assert FileIndex(data_dir).glob(pattern) == sorted(glob.glob(os.path.join(data_dir, pattern)))
+
+
+def test_file_index_cache(data_dir, tmp_path_factory):
+    cache_file = tmp_path_factory.mktemp("cache") / "index.json"
+    assert len(FileIndex(data_dir, cache_file).glob("*")) == 6
+    assert str(data_dir) in json.loads(cache_file.read_text())
+
+    # A new file changes the modification time of the directory and invalidates the listing
+    (data_dir / "d_3_img.tif").touch()
+    os.utime(data_dir, ns=(0, os.stat(data_dir).st_mtime_ns + 1))
+    assert len(FileIndex(data_dir, cache_file).glob("*")) == 7
+
+
+def test_file_index_missing_directory(tmp_path):
+    assert FileIndex(tmp_path / "missing").glob("*") == []
@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+from terratorch.datasets.utils import filter_valid_files
+
+
+def reference_filter(files, valid_files, ignore_extensions, allow_substring):
+    import os
+
+    if ignore_extensions:
+        valid_files = [os.path.splitext(f)[0] for f in valid_files]
+
+    def matches(file_name):
+        base_name = os.path.basename(file_name)
+        if ignore_extensions:
+            base_name = os.path.splitext(base_name)[0]
+        if not allow_substring:
+            return base_name in valid_files
+        return any(valid_file in base_name for valid_file in valid_files)
+
+    return sorted(filter(matches, files))
+
+
+@pytest.mark.parametrize("ignore_extensions", [True, False])
+@pytest.mark.parametrize("allow_substring", [True, False])
+def test_filter_valid_files_matches_reference(ignore_extensions, allow_substring):
+    random.seed(0)
+    files = [f"/data/{random.choice('ab')}_{i}_{random.choice(['img', 'mask'])}.tif" for i in range(300)]
+    valid_files = [f"{random.choice('ab')}_{i}" for i in random.sample(range(400), 150)]
+    valid_files += ["a_1_img.tif", "b_7_mask", "7_mask.tif"]
+    random.shuffle(files)
+    result = filter_valid_files(files, valid_files, ignore_extensions=ignore_extensions, allow_substring=allow_substring)
+    assert result == reference_filter(files, valid_files, ignore_extensions, allow_substring)
+
+
+def test_filter_valid_files_without_split():
+    assert filter_valid_files(["b.tif", "a.tif"]) == ["a.tif", "b.tif"]
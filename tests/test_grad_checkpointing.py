@@ -0,0 +1,97 @@
+import pytest
+import torch
+import torch.utils.checkpoint
+
+from terratorch.models import EncoderDecoderFactory
+from terratorch.models.backbones.clay_v1.modules import Transformer
+from terratorch.models.backbones.prithvi_mae import PrithviViT
+from terratorch.models.backbones.swin_encoder_decoder import MMSegSwinTransformer
+from terratorch.models.backbones.terramind.model.terramind_vit import TerraMindViT
+from terratorch.models.utils import checkpoint_filter
+
+DEPTH = 4
+
+
+@pytest.fixture
+def checkpoint_calls(monkeypatch):
+    calls = []
+    checkpoint = torch.utils.checkpoint.checkpoint
+
+    def counting_checkpoint(*args, **kwargs):
+        calls.append(1)
+        return checkpoint(*args, **kwargs)
+
+    monkeypatch.setattr(torch.utils.checkpoint, "checkpoint", counting_checkpoint)
+    return calls
+
+
+def get_backbones(**kwargs):
+    return {
+        "prithvi": (
+            PrithviViT(img_size=32, patch_size=8, in_chans=3, embed_dim=16, depth=DEPTH, num_heads=2, **kwargs),
+            torch.randn(2, 3, 32, 32),
+        ),
+        "terramind": (
+            TerraMindViT(img_size=32, modalities=["S2L2A"], dim=32, encoder_depth=DEPTH, num_heads=4, **kwargs),
+            torch.randn(2, 12, 32, 32),
+        ),
+        "clay": (Transformer(dim=16, depth=DEPTH, heads=2, dim_head=8, mlp_dim=32, **kwargs), torch.randn(2, 10, 16)),
+    }
+
+
+def run_backward(model, x):
+    torch.manual_seed(0)
+    model.train()
+    output = model.forward_features(x) if hasattr(model, "forward_features") else model(x)
+    sum(o.sum() for o in output).backward()
+    return {name: param.grad.clone() for name, param in model.named_parameters() if param.grad is not None}
+
+
+@pytest.mark.parametrize("name", ["prithvi", "terramind", "clay"])
+@pytest.mark.parametrize("every_n", [1, 2])
+def test_grad_checkpointing_matches_gradients(name, every_n, checkpoint_calls):
+    model, x = get_backbones()[name]
+    expected = run_backward(model, x)
+    assert not checkpoint_calls
+
+    checkpointed, _ = get_backbones(grad_checkpointing=True, checkpoint_every_n_blocks=every_n)[name]
+    checkpointed.load_state_dict(model.state_dict())
+    grads = run_backward(checkpointed, x)
+    # Clay checkpoints attention and feedforward separately
+    assert len(checkpoint_calls) == DEPTH // every_n * (2 if name == "clay" else 1)
+    assert grads.keys() == expected.keys()
+    for key, grad in grads.items():
+        assert torch.allclose(grad, expected[key], atol=1e-5), key
+
+    checkpoint_calls.clear()
+    with torch.no_grad():
+        checkpointed(x)
+    assert not checkpoint_calls
+
+
+def test_checkpoint_filter():
+    assert [checkpoint_filter(i, True, 3) for i in range(5)] == [True, False, False, True, False]
+    assert not checkpoint_filter(0, False)
+    with pytest.raises(ValueError, match="checkpoint_every_n_blocks"):
+        checkpoint_filter(0, True, 0)
+
+
+def test_swin_grad_checkpointing():
+    model = MMSegSwinTransformer(embed_dim=16, depths=(2, 2), num_heads=(2, 4), strides=(4, 2), out_indices=(0, 1),
+                                 grad_checkpointing=True, checkpoint_every_n_blocks=2)
+    assert [block.with_cp for stage in model.stages for block in stage.blocks] == [True, False, True, False]
+
+
+def test_grad_checkpointing_from_factory():
+    model = EncoderDecoderFactory().build_model(
+        task="segmentation",
+        backbone="prithvi_eo_tiny",
+        backbone_pretrained=False,
+        backbone_grad_checkpointing=True,
+        backbone_checkpoint_every_n_blocks=2,
+        decoder="FCNDecoder",
+        necks=[{"name": "SelectIndices", "indices": [-1]}, {"name": "ReshapeTokensToImage"}],
+        num_classes=2,
+    )
+    assert model.encoder.grad_checkpointing
+    assert model.encoder.checkpoint_every_n_blocks == 2
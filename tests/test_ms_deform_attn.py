@@ -0,0 +1,96 @@
+import gc
+
+import pytest
+import torch
+
+from terratorch.models.backbones.detr_ops.functions import ms_deform_attn, ms_deform_attn_core_pytorch
+from terratorch.models.backbones.detr_ops.functions.ms_deform_attn_func import MSDA, MSDeformAttnFunction
+from terratorch.models.backbones.detr_ops.modules import MSDeformAttn
+from terratorch.registry import BACKBONE_REGISTRY
+
+SPATIAL_SHAPES = [(12, 16), (6, 8), (3, 4)]
+N, LQ, M, D, P = 2, 10, 4, 8, 3
+
+
+def naive_ms_deform_attn(value, spatial_shapes, sampling_locations, attention_weights):
+    """Bilinear sampling with zero padding (align_corners=False), one point at a time."""
+    output = torch.zeros(N, LQ, M, D, dtype=value.dtype)
+    start = 0
+    for lvl, (h, w) in enumerate(spatial_shapes):
+        value_l = value[:, start : start + h * w].view(N, h, w, M, D)
+        start += h * w
+        for n in range(N):
+            for q in range(LQ):
+                for m in range(M):
+                    for p in range(P):
+                        x = sampling_locations[n, q, m, lvl, p, 0] * w - 0.5
+                        y = sampling_locations[n, q, m, lvl, p, 1] * h - 0.5
+                        x0, y0 = int(torch.floor(x)), int(torch.floor(y))
+                        sample = torch.zeros(D, dtype=value.dtype)
+                        for xi, yi in [(x0, y0), (x0 + 1, y0), (x0, y0 + 1), (x0 + 1, y0 + 1)]:
+                            if 0 <= xi < w and 0 <= yi < h:
+                                weight = (1 - abs(x - xi)) * (1 - abs(y - yi))
+                                sample += weight * value_l[n, yi, xi, m]
+                        output[n, q, m] += attention_weights[n, q, m, lvl, p] * sample
+    return output.view(N, LQ, M * D)
+
+
+def get_inputs(dtype=torch.float32):
+    torch.manual_seed(0)
+    num_values = sum(h * w for h, w in SPATIAL_SHAPES)
+    value = torch.randn(N, num_values, M, D, dtype=dtype)
+    # Some locations are outside of the feature maps to check the zero padding
+    sampling_locations = torch.rand(N, LQ, M, len(SPATIAL_SHAPES), P, 2, dtype=dtype) * 1.2 - 0.1
+    attention_weights = torch.rand(N, LQ, M, len(SPATIAL_SHAPES), P, dtype=dtype)
+    attention_weights /= attention_weights.sum((-1, -2), keepdim=True)
+    spatial_shapes = torch.as_tensor(SPATIAL_SHAPES, dtype=torch.long)
+    level_start_index = torch.cat((spatial_shapes.new_zeros(1), spatial_shapes.prod(1).cumsum(0)[:-1]))
+    return value, spatial_shapes, level_start_index, sampling_locations, attention_weights
+
+
+def test_ms_deform_attn_pytorch_parity():
+    value, spatial_shapes, level_start_index, sampling_locations, attention_weights = get_inputs(torch.float64)
+    expected = naive_ms_deform_attn(value, SPATIAL_SHAPES, sampling_locations, attention_weights)
+    output = ms_deform_attn(value, spatial_shapes, level_start_index, sampling_locations, attention_weights, 64)
+    assert torch.allclose(output, expected)
+    # The spatial shapes can also be passed as a list
+    output = ms_deform_attn_core_pytorch(value, SPATIAL_SHAPES, sampling_locations, attention_weights)
+    assert torch.allclose(output, expected)
+
+
+def test_ms_deform_attn_pytorch_gradients():
+    value, spatial_shapes, _, sampling_locations, attention_weights = get_inputs(torch.float64)
+    inputs = (value[:1, ..., :2].clone(), sampling_locations[:1, :3].clone(), attention_weights[:1, :3].clone())
+    for tensor in inputs:
+        tensor.requires_grad_(True)
+
+    def func(value, sampling_locations, attention_weights):
+        return ms_deform_attn_core_pytorch(value, spatial_shapes, sampling_locations, attention_weights)
+
+    assert torch.autograd.gradcheck(func, inputs)
+
+
+@pytest.mark.skipif(MSDA is None or not torch.cuda.is_available(), reason="Requires the CUDA extension")
+def test_ms_deform_attn_cuda_parity():
+    inputs = [t.cuda() for t in get_inputs()]
+    value, spatial_shapes, level_start_index, sampling_locations, attention_weights = inputs
+    expected = MSDeformAttnFunction.apply(*inputs, 64)
+    output = ms_deform_attn_core_pytorch(value, spatial_shapes, sampling_locations, attention_weights)
+    assert torch.allclose(output, expected, atol=1e-5)
+
+
+def test_ms_deform_attn_module_on_cpu():
+    attn = MSDeformAttn(d_model=32, n_levels=len(SPATIAL_SHAPES), n_heads=4, n_points=P)
+    _, spatial_shapes, level_start_index, _, _ = get_inputs()
+    input_flatten = torch.randn(N, int(spatial_shapes.prod(1).sum()), 32)
+    reference_points = torch.rand(N, LQ, len(SPATIAL_SHAPES), 2)
+    output = attn(torch.randn(N, LQ, 32), reference_points, input_flatten, spatial_shapes, level_start_index)
+    assert output.shape == (N, LQ, 32)
+
+
+def test_prithvi_vit_adapter_on_cpu():
+    backbone = BACKBONE_REGISTRY.build("prithvi_eo_v1_100", pretrained=False, vit_adapter=True)
+    with torch.no_grad():
+        output = backbone(torch.randn(1, 6, 224, 224))
+    assert [o.shape[-1] for o in output] == [56, 28, 14, 7]
+    gc.collect()
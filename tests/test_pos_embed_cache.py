@@ -0,0 +1,85 @@
+import torch
+
+from terratorch.models.backbones.prithvi_mae import MAEDecoder, PrithviViT, _interpolate_pos_encoding
+from terratorch.models.backbones.terramind.model.encoder_embeddings import ImageEncoderEmbedding
+from terratorch.models.utils import PosEmbedCache
+
+
+def get_encoder():
+    return PrithviViT(img_size=32, patch_size=(1, 8, 8), num_frames=2, in_chans=3, embed_dim=16, depth=1, num_heads=2)
+
+
+def test_pos_embed_cache_hit_and_invalidation():
+    cache = PosEmbedCache()
+    pos_embed = torch.randn(1, 4, 8)
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return pos_embed * 2
+
+    first = cache.get(pos_embed, (1, 2, 2), compute)
+    assert cache.get(pos_embed, (1, 2, 2), compute) is first
+    cache.get(pos_embed, (1, 4, 4), compute)
+    assert len(calls) == 2
+
+    # In-place updates (optimizer steps, load_state_dict) invalidate the cache
+    pos_embed.add_(1)
+    assert torch.equal(cache.get(pos_embed, (1, 2, 2), compute), pos_embed * 2)
+    assert len(calls) == 3
+
+    # Other dtypes are separate entries
+    cache.get(pos_embed.double(), (1, 2, 2), compute)
+    assert len(calls) == 4
+
+
+def test_pos_embed_cache_skips_trainable_embeddings_in_grad_mode():
+    cache = PosEmbedCache()
+    pos_embed = torch.nn.Parameter(torch.randn(1, 4, 8))
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return pos_embed * 2
+
+    cache.get(pos_embed, (1, 2, 2), compute)
+    cache.get(pos_embed, (1, 2, 2), compute)
+    assert len(calls) == 2
+    with torch.no_grad():
+        cache.get(pos_embed, (1, 2, 2), compute)
+        cache.get(pos_embed, (1, 2, 2), compute)
+    assert len(calls) == 3
+
+
+def test_prithvi_vit_caches_interpolated_pos_embed():
+    model = get_encoder()
+    shape = (3, 48, 48)
+    expected = _interpolate_pos_encoding(model.pos_embed, model.patch_embed.grid_size, model.patch_embed.patch_size,
+                                         shape, model.embed_dim)
+
+    pos_embed = model.interpolate_pos_encoding(shape)
+    assert torch.allclose(pos_embed, expected)
+    assert model.interpolate_pos_encoding(shape) is pos_embed
+
+    model.load_state_dict(get_encoder().state_dict())
+    assert model.interpolate_pos_encoding(shape) is not pos_embed
+
+    x = torch.randn(1, 3, 3, 48, 48)
+    assert model.forward_features(x)[-1].shape == (1, 1 + 3 * 6 * 6, 16)
+
+
+def test_mae_decoder_caches_interpolated_pos_embed():
+    decoder = MAEDecoder(patch_size=(1, 8, 8), grid_size=(1, 4, 4), encoder_embed_dim=16, decoder_embed_dim=16,
+                         depth=1, num_heads=2)
+    pos_embed = decoder.interpolate_pos_encoding((1, 48, 48))
+    assert pos_embed.shape == (1, 1 + 6 * 6, 16)
+    assert decoder.interpolate_pos_encoding((1, 48, 48)) is pos_embed
+
+
+def test_terramind_embedding_caches_interpolated_pos_embed():
+    embedding = ImageEncoderEmbedding(3, 4, image_size=16)
+    embedding.init(dim_tokens=8)
+    first = embedding(torch.randn(2, 3, 32, 32))["emb"]
+    cached = embedding._pos_emb_cache.get(embedding.pos_emb, (32, 32), lambda: None)
+    assert cached is not None and cached.shape == (1, 64, 8)
+    assert torch.equal(embedding(torch.randn(2, 3, 32, 32))["emb"], first)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from terratorch.datasets.utils import read_raster
+
+rasterio = pytest.importorskip("rasterio")
+
+
+@pytest.fixture(params=[("int16", -9999), ("uint8", None), ("float32", -1.0), ("float32", None)])
+def raster(request, tmp_path):
+    dtype, nodata = request.param
+    rng = np.random.default_rng(0)
+    data = (rng.random((4, 20, 30)) * 100).astype(dtype)
+    if nodata is not None:
+        data[:, :3, :5] = nodata
+    if np.issubdtype(data.dtype, np.floating):
+        data[1, 10:12, 10:12] = np.nan
+    path = tmp_path / "raster.tif"
+    profile = {"driver": "GTiff", "width": 30, "height": 20, "count": 4, "dtype": dtype, "nodata": nodata}
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data)
+    return path, data, nodata
+
+
+@pytest.mark.parametrize("nan_replace", [None, 0, -1])
+@pytest.mark.parametrize("indexes", [None, [3, 0]])
+def test_read_raster(raster, nan_replace, indexes):
+    path, data, nodata = raster
+    # Same values as rioxarray.open_rasterio(path, masked=True).fillna(nan_replace)
+    expected = data.astype(np.float32)
+    invalid = np.isnan(expected) | (data == nodata if nodata is not None else False)
+    expected[invalid] = np.nan if nan_replace is None else nan_replace
+    if indexes is not None:
+        expected = expected[indexes]
+
+    result = read_raster(path, indexes=indexes, nan_replace=nan_replace)
+    assert result.dtype == np.float32
+    np.testing.assert_array_equal(result, expected)
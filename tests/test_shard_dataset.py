@@ -0,0 +1,197 @@
+import os
+
+import numpy as np
+import pytest
+import torch
+import yaml
+
+from terratorch.datasets import GenericMultimodalSegmentationDataset, GenericNonGeoSegmentationDataset
+from terratorch.datasets.shard_dataset import ShardDataLoader, ShardDataset, shards_main, write_shards
+
+SEGMENTATION_IMAGE_PATH = os.path.abspath("tests/resources/inputs/segmentation_test_input.tif")
+SEGMENTATION_LABEL_PATH = os.path.abspath("tests/resources/inputs/segmentation_test_label.tif")
+NUM_SAMPLES = 10
+
+
+@pytest.fixture
+def segmentation_dataset(tmp_path):
+    for directory in ["images", "labels"]:
+        (tmp_path / directory).mkdir()
+    for i in range(NUM_SAMPLES):
+        os.symlink(SEGMENTATION_IMAGE_PATH, tmp_path / "images" / f"{i}_img.tif")
+        os.symlink(SEGMENTATION_LABEL_PATH, tmp_path / "labels" / f"{i}_label.tif")
+    return GenericNonGeoSegmentationDataset(tmp_path, num_classes=2, image_grep="images/*_img.tif",
+                                            label_grep="labels/*_label.tif", constant_scale=0.5)
+
+
+@pytest.fixture
+def shards(segmentation_dataset, tmp_path):
+    write_shards(segmentation_dataset, tmp_path / "shards", samples_per_shard=3)
+    return tmp_path / "shards"
+
+
+def filenames(samples):
+    return [sample["filename"] for sample in samples]
+
+
+def test_write_and_read_shards(segmentation_dataset, shards):
+    assert sorted(os.listdir(shards)) == ["shard-000000.tar", "shard-000001.tar", "shard-000002.tar",
+                                          "shard-000003.tar", "shards.json"]
+    dataset = ShardDataset(shards, shuffle=False)
+    assert len(dataset) == NUM_SAMPLES
+    samples = list(dataset)
+    assert filenames(samples) == segmentation_dataset.image_files
+    for sample, expected in zip(samples, segmentation_dataset, strict=True):
+        assert torch.equal(sample["image"], expected["image"])
+        assert torch.equal(sample["mask"], expected["mask"])
+        assert sample["mask"].dtype == torch.long
+
+
+def test_shuffle(shards):
+    dataset = ShardDataset(shards, shuffle_buffer=4, seed=1)
+    first_epoch = filenames(dataset)
+    assert filenames(dataset) == first_epoch
+    assert sorted(first_epoch) == sorted(filenames(ShardDataset(shards, shuffle=False)))
+    dataset.set_epoch(1)
+    assert filenames(dataset) != first_epoch
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_workers_and_ranks_get_disjoint_shards(shards, num_workers, monkeypatch):
+    loader = torch.utils.data.DataLoader(ShardDataset(shards), batch_size=None, num_workers=num_workers)
+    assert sorted(filenames(loader)) == sorted(filenames(ShardDataset(shards, shuffle=False)))
+
+    monkeypatch.setattr(torch.distributed, "is_initialized", lambda: True)
+    monkeypatch.setattr(torch.distributed, "get_world_size", lambda: 2)
+    rank_samples = []
+    for rank in range(2):
+        monkeypatch.setattr(torch.distributed, "get_rank", lambda rank=rank: rank)
+        rank_samples.append(filenames(ShardDataset(shards)))
+    assert not set(rank_samples[0]) & set(rank_samples[1])
+    assert len(rank_samples[0]) + len(rank_samples[1]) == NUM_SAMPLES
+
+
+@pytest.mark.parametrize("world_size", [2, 3, 4])
+def test_ranks_get_the_same_number_of_samples(segmentation_dataset, tmp_path, monkeypatch, world_size):
+    # The last shard is partial, whole shards per rank would give the ranks different numbers of samples
+    write_shards(segmentation_dataset, tmp_path / "shards4", samples_per_shard=4)
+    monkeypatch.setattr(torch.distributed, "is_initialized", lambda: True)
+    monkeypatch.setattr(torch.distributed, "get_world_size", lambda: world_size)
+    rank_samples = []
+    for rank in range(world_size):
+        monkeypatch.setattr(torch.distributed, "get_rank", lambda rank=rank: rank)
+        for epoch in range(2):
+            dataset = ShardDataset(tmp_path / "shards4")
+            dataset.set_epoch(epoch)
+            samples = filenames(dataset)
+            assert len(samples) == len(dataset) == NUM_SAMPLES // world_size
+        rank_samples.append(samples)
+    assert len(set(sum(rank_samples, []))) == NUM_SAMPLES // world_size * world_size
+
+
+@pytest.mark.parametrize("num_workers", [0, 2])
+def test_resume_in_epoch(shards, num_workers):
+    kwargs = {"batch_size": 2, "num_workers": num_workers, "collate_fn": filenames}
+    loader = ShardDataLoader(ShardDataset(shards, shuffle_buffer=4), **kwargs)
+    list(loader)  # The second epoch is resumed
+    batches = list(loader)
+
+    interrupted = ShardDataLoader(ShardDataset(shards, shuffle_buffer=4), **kwargs)
+    list(interrupted)
+    iterator = iter(interrupted)
+    consumed = [next(iterator) for _ in range(2)]
+    state = interrupted.state_dict()
+    assert state == {"epoch": 1, "num_batches": 2}
+
+    resumed = ShardDataLoader(ShardDataset(shards, shuffle_buffer=4), **kwargs)
+    resumed.load_state_dict(state)
+    assert consumed + list(resumed) == batches
+    assert resumed.state_dict() == {"epoch": 2, "num_batches": 0}
+
+
+def test_object_store_url(segmentation_dataset):
+    # fsspec URLs are used for object stores like s3:// (e.g. MinIO)
+    write_shards(segmentation_dataset, "memory://bucket/train", samples_per_shard=4)
+    dataset = ShardDataset("memory://bucket/train", shuffle=False, prefetch_shards=1)
+    assert filenames(dataset) == segmentation_dataset.image_files
+
+
+def test_multimodal_shards(tmp_path):
+    for directory in ["s2", "s1", "labels"]:
+        (tmp_path / directory).mkdir()
+    for i in range(4):
+        np.save(tmp_path / "s2" / f"{i}.npy", np.random.rand(4, 8, 8).astype(np.float32))
+        np.save(tmp_path / "s1" / f"{i}.npy", np.random.rand(2, 8, 8).astype(np.float32))
+        np.save(tmp_path / "labels" / f"{i}.npy", np.random.randint(0, 2, (1, 8, 8)))
+    dataset = GenericMultimodalSegmentationDataset(
+        data_root={"S2": tmp_path / "s2", "S1": tmp_path / "s1"},
+        num_classes=2,
+        image_modalities=["S2", "S1"],
+        label_data_root=tmp_path / "labels",
+        image_grep={"S2": "*.npy", "S1": "*.npy"},
+        label_grep="*.npy",
+        constant_scale={},
+    )
+    write_shards(dataset, tmp_path / "shards", samples_per_shard=2)
+    samples = list(ShardDataset(tmp_path / "shards", shuffle=False))
+    for sample, expected in zip(samples, dataset, strict=True):
+        assert sample["filename"] == expected["filename"]
+        assert list(sample["image"]) == ["S2", "S1"]
+        for m in ["S2", "S1"]:
+            assert torch.equal(sample["image"][m], expected["image"][m])
+        assert torch.equal(sample["mask"], expected["mask"])
+
+
+def test_shards_write_command(segmentation_dataset, tmp_path, capsys):
+    root = os.path.dirname(os.path.dirname(segmentation_dataset.image_files[0]))
+    config = {
+        "data": {
+            "class_path": "terratorch.datamodules.GenericNonGeoSegmentationDataModule",
+            "init_args": {
+                "batch_size": 2,
+                "num_workers": 0,
+                "num_classes": 2,
+                "train_data_root": root,
+                "val_data_root": root,
+                "test_data_root": root,
+                "img_grep": "images/*_img.tif",
+                "label_grep": "labels/*_label.tif",
+                "means": [0] * 6,
+                "stds": [1] * 6,
+            },
+        }
+    }
+    with open(tmp_path / "config.yaml", "w") as f:
+        yaml.safe_dump(config, f)
+    shards_main(["write", "-c", str(tmp_path / "config.yaml"), "--output_dir", str(tmp_path / "out"),
+                 "--samples_per_shard", "5"])
+    assert capsys.readouterr().out.splitlines()[0] == f"train: {tmp_path / 'out'}/train (10 samples, 2 shards)"
+    assert sorted(os.listdir(tmp_path / "out")) == ["test", "train", "val"]
+    assert len(list(ShardDataset(tmp_path / "out" / "val"))) == NUM_SAMPLES
+
+
+def test_shard_datamodule(shards):
+    from terratorch.datamodules import ShardDataModule
+
+    datamodule = ShardDataModule(batch_size=4, num_workers=0, train_url=str(shards), val_url=str(shards),
+                                 test_url=str(shards), means=[0.0] * 10, stds=[1.0] * 10, shuffle_buffer=4)
+    datamodule.setup("fit")
+    loader = datamodule.train_dataloader()
+    assert isinstance(loader, ShardDataLoader)
+    batches = list(loader)
+    assert [len(batch["image"]) for batch in batches] == [4, 4, 2]
+    assert batches[0]["image"].shape[1:] == (10, 224, 224)
+    assert loader.state_dict() == {"epoch": 1, "num_batches": 0}
+
+
+def test_resume_after_a_worker_ran_out(shards):
+    # The 4 workers get 2, 3, 2 and 3 samples, the last batches come from workers 1 and 3 only
+    kwargs = {"batch_size": 1, "num_workers": 4, "collate_fn": filenames}
+    loader = ShardDataLoader(ShardDataset(shards, shuffle=False), **kwargs)
+    assert loader.dataset.worker_num_samples(4) == [2, 3, 2, 3]
+    batches = list(loader)
+    assert len(batches) == NUM_SAMPLES
+
+    resumed = ShardDataLoader(ShardDataset(shards, shuffle=False), **kwargs)
+    resumed.load_state_dict({"epoch": 0, "num_batches": 9})
+    assert list(resumed) == batches[9:]
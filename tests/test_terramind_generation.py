@@ -0,0 +1,106 @@
+import pytest
+import torch
+
+from terratorch.models.backbones.terramind.model.decoder_embeddings import ImageTokenDecoderEmbedding
+from terratorch.models.backbones.terramind.model.encoder_embeddings import (
+    ImageEncoderEmbedding,
+    ImageTokenEncoderEmbedding,
+)
+from terratorch.models.backbones.terramind.model.generate import GenerationSampler, build_chained_generation_schedules
+from terratorch.models.backbones.terramind.model.terramind import TerraMind
+
+BATCH_SIZE = 2
+NUM_TOKENS = 16
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    modality_info = {"img": {"id": 0, "type": "img"}, "tok_a": {"id": 1, "type": "img"}, "tok_b": {"id": 2, "type": "img"}}
+    encoder_embeddings = {
+        "img": ImageEncoderEmbedding(3, 4, image_size=16),
+        "tok_a": ImageTokenEncoderEmbedding(32, 4, image_size=16),
+        "tok_b": ImageTokenEncoderEmbedding(32, 4, image_size=16),
+    }
+    decoder_embeddings = {
+        "tok_a": ImageTokenDecoderEmbedding(32, 4, image_size=16),
+        "tok_b": ImageTokenDecoderEmbedding(32, 4, image_size=16),
+    }
+    return TerraMind(
+        encoder_embeddings, decoder_embeddings, modality_info, dim=32, encoder_depth=2, decoder_depth=2, num_heads=4
+    ).eval()
+
+
+def get_mod_dict():
+    mod_dict = {
+        "img": {
+            "tensor": torch.randn(BATCH_SIZE, 3, 16, 16),
+            "input_mask": torch.zeros(BATCH_SIZE, NUM_TOKENS, dtype=torch.bool),
+            "target_mask": torch.ones(BATCH_SIZE, NUM_TOKENS, dtype=torch.bool),
+        }
+    }
+    for mod in ["tok_a", "tok_b"]:
+        mod_dict[mod] = {
+            "tensor": torch.zeros(BATCH_SIZE, NUM_TOKENS, dtype=torch.int64),
+            "input_mask": torch.ones(BATCH_SIZE, NUM_TOKENS, dtype=torch.bool),
+            "target_mask": torch.zeros(BATCH_SIZE, NUM_TOKENS, dtype=torch.bool),
+        }
+    return mod_dict
+
+
+def test_decoder_cache_matches_full_decoding(model):
+    context = torch.randn(BATCH_SIZE, 10, 32)
+    encoder_mask = torch.zeros(BATCH_SIZE, 1, 10, dtype=torch.bool)
+    encoder_mask[..., -2:] = True
+    y = torch.randn(BATCH_SIZE, 6, 32)
+    causal_mask = torch.ones(6, 6, dtype=torch.bool).triu(1).expand(BATCH_SIZE, 6, 6)
+
+    with torch.no_grad():
+        expected = model.forward_decoder(y, context, encoder_mask, causal_mask)
+        cache = model.init_decoder_cache()
+        outputs = [model.forward_decoder(y[:, :2], context, encoder_mask, causal_mask[:, :2, :2], cache=cache)]
+        for i in range(2, 6):
+            outputs.append(model.forward_decoder(y[:, i : i + 1], context, encoder_mask, None, cache=cache))
+
+    assert torch.allclose(torch.cat(outputs, dim=1), expected, atol=1e-5)
+
+
+@pytest.mark.parametrize("scheme", ["roar", "maskgit"])
+@pytest.mark.parametrize("cfg_scale", [1.0, 2.0])
+def test_generate_reuses_conditioning_embeddings(model, scheme, cfg_scale):
+    sampler = GenerationSampler(model)
+    schedule = build_chained_generation_schedules(
+        ["img"], ["tok_a", "tok_b"], [NUM_TOKENS] * 2, [scheme] * 2, [4, 4], ["linear"] * 2, [1.0] * 2,
+        ["constant"] * 2, [cfg_scale] * 2, ["constant"] * 2, cfg_grow_conditioning=True,
+    )
+    mod_dict = get_mod_dict()
+    calls = []
+    handle = model.encoder_embeddings["img"].register_forward_hook(lambda *args: calls.append(1))
+    out = sampler.generate(mod_dict, schedule, seed=0)
+    handle.remove()
+
+    # The input dict is not modified
+    assert (mod_dict["tok_a"]["tensor"] == 0).all() and mod_dict["tok_a"]["input_mask"].all()
+    assert not out["tok_b"]["input_mask"].any()
+    # The conditioning image is embedded once, plus once for the unconditional passes of the guided steps
+    assert len(calls) == (1 if cfg_scale == 1.0 else 2)
+
+
+@pytest.mark.parametrize("scheme", ["roar", "maskgit"])
+@pytest.mark.parametrize("cfg_scale", [1.0, 2.0])
+def test_generate_with_and_without_caches(model, scheme, cfg_scale):
+    schedule = build_chained_generation_schedules(
+        ["img"], ["tok_a", "tok_b"], [NUM_TOKENS] * 2, [scheme] * 2, [4, 4], ["linear"] * 2, [1.0] * 2,
+        ["constant"] * 2, [cfg_scale] * 2, ["constant"] * 2, cfg_grow_conditioning=True,
+    )
+    mod_dict = get_mod_dict()
+    cached = GenerationSampler(model).generate(mod_dict, schedule, seed=0)
+
+    uncached_sampler = GenerationSampler(model)
+    uncached_sampler.embed_encoder_inputs = lambda mod_dict: {
+        mod: model.encoder_embeddings[mod](d) for mod, d in mod_dict.items() if mod in model.encoder_embeddings
+    }
+    uncached = uncached_sampler.generate(mod_dict, schedule, seed=0)
+
+    for mod in ["tok_a", "tok_b"]:
+        assert torch.equal(cached[mod]["tensor"], uncached[mod]["tensor"])
@@ -0,0 +1,104 @@
+import pytest
+import torch
+
+from terratorch.models.backbones.terramind.tokenizer import vqvae
+from terratorch.models.backbones.terramind.tokenizer.models import uvit
+from terratorch.models.backbones.terramind.tokenizer.scheduling import PipelineCond
+
+CODEBOOK_SIZE = 64
+
+
+def tiny_uvit(**kwargs):
+    return uvit.UViT(patch_size=2, block_out_channels=(16, 32), layers_per_block=1, mid_layers=2, mid_num_heads=2,
+                     mid_dim=32, mid_hw_posemb=4, norm_num_groups=8, **kwargs)
+
+
+@pytest.fixture
+def divae(monkeypatch):
+    monkeypatch.setattr(uvit, "uvit_tiny", tiny_uvit, raising=False)
+    torch.manual_seed(0)
+    model = vqvae.DiVAE(image_size=16, n_channels=3, enc_type="vit_s_enc", patch_size=4, codebook_size=CODEBOOK_SIZE,
+                        latent_dim=8, dec_type="uvit_tiny", sync_codebook=False)
+    return model.eval()
+
+
+@pytest.mark.parametrize("cond_type", ["concat", "xattn"])
+def test_uvit_unconditional_flag(cond_type):
+    torch.manual_seed(0)
+    decoder = tiny_uvit(sample_size=16, cond_dim=8, cond_type=cond_type).eval()
+    with torch.no_grad():
+        # Zero initialized layers (e.g. the mask token) would hide the condition
+        for parameter in decoder.mid_block.parameters():
+            parameter.add_(0.1 * torch.randn_like(parameter))
+    sample, cond, t = torch.randn(2, 3, 16, 16), torch.randn(2, 8, 4, 4), torch.tensor(10)
+    with torch.no_grad():
+        conditional = decoder(sample, t, cond)
+        masked = decoder(sample, t, cond, cond_mask=torch.ones(2, 4, 4, dtype=torch.bool))
+        unconditional = decoder(sample, t, cond, unconditional=True)
+        per_sample = decoder(sample, t, cond, unconditional=torch.tensor([False, True]))
+    assert not torch.allclose(conditional, unconditional)
+    assert torch.allclose(unconditional, masked, atol=1e-6)
+    assert torch.allclose(per_sample[0], conditional[0], atol=1e-6)
+    assert torch.allclose(per_sample[1], unconditional[1], atol=1e-6)
+
+
+def test_batched_cfg_matches_two_passes(divae):
+    pipeline = PipelineCond(divae.decoder, divae.noise_scheduler, n_channels=3)
+    quant = divae.tokens_to_embedding(torch.randint(0, CODEBOOK_SIZE, (2, 4, 4)))
+    noise = torch.randn(2, 3, 16, 16)
+    kwargs = {"timesteps": 3, "guidance_scale": 3.0, "verbose": False, "noise": noise}
+    batched = pipeline(quant, batched_cfg=True, **kwargs)
+    two_passes = pipeline(quant, batched_cfg=False, **kwargs)
+    assert torch.allclose(batched, two_passes, atol=1e-5)
+    assert not torch.allclose(batched, pipeline(quant, timesteps=3, verbose=False, noise=noise), atol=1e-5)
+
+
+def test_decode_quant_guidance_scale(divae):
+    quant = divae.tokens_to_embedding(torch.randint(0, CODEBOOK_SIZE, (2, 4, 4)))
+    unguided = divae.decode_quant(quant, timesteps=2, generator=torch.Generator().manual_seed(0))
+    guided = divae.decode_quant(quant, timesteps=2, generator=torch.Generator().manual_seed(0), guidance_scale=3.0)
+    assert guided.shape == unguided.shape == (2, 3, 16, 16)
+    assert not torch.allclose(guided, unguided)
+
+
+def test_fast_decoding(divae):
+    tokens = torch.randint(0, CODEBOOK_SIZE, (2, 4, 4))
+    decoded = divae.decode_tokens(tokens, fast=True)
+    assert decoded.shape == (2, 3, 16, 16)
+    assert torch.isfinite(decoded).all()
+    assert torch.equal(divae.decode_tokens(tokens, fast=True), decoded)
+    # The terminal timestep starts from gaussian noise, not from zeros
+    generated = divae.decode_tokens(tokens, fast=True, generator=torch.Generator().manual_seed(1))
+    assert not torch.equal(generated, decoded)
+
+
+def test_decode_cache(divae, monkeypatch):
+    divae.decode_cache_size = 2
+    decodings = []
+    decode_quant = divae.decode_quant
+    monkeypatch.setattr(divae, "decode_quant", lambda *args, **kwargs: decodings.append(1) or decode_quant(*args, **kwargs))
+    tokens = [torch.randint(0, CODEBOOK_SIZE, (1, 4, 4)) for _ in range(3)]
+
+    first = divae.decode_tokens(tokens[0], fast=True)
+    cached = divae.decode_tokens(tokens[0], fast=True)
+    assert torch.equal(cached, first)
+    assert cached is not divae._decode_cache[next(iter(divae._decode_cache))]
+    assert len(decodings) == 1
+
+    # Tensor arguments are keyed by their content, even when their repr is truncated
+    orig_res = torch.zeros(1, 2000, dtype=torch.long)
+    other_res = orig_res.clone()
+    other_res[0, 1000] = 1
+    assert repr(orig_res) == repr(other_res)
+    key = divae._decode_cache_key(tokens[0], fast=True, orig_res=orig_res)
+    assert key == divae._decode_cache_key(tokens[0], fast=True, orig_res=orig_res.clone())
+    assert key != divae._decode_cache_key(tokens[0], fast=True, orig_res=other_res)
+    assert key != divae._decode_cache_key(tokens[1], fast=True, orig_res=orig_res)
+
+    # Least recently used entries are evicted
+    divae.clear_decode_cache()
+    decodings.clear()
+    for t in [tokens[0], tokens[1], tokens[0], tokens[2], tokens[0], tokens[1]]:
+        divae.decode_tokens(t, fast=True)
+    assert len(decodings) == 4
+    assert len(divae._decode_cache) == 2
@@ -0,0 +1,311 @@
+import logging
+
+import pytest
+import torch
+
+from terratorch.tasks.tiled_inference import (
+    AutoBatchSize,
+    TiledInferenceParameters,
+    blend_window,
+    get_tile_grid,
+    tiled_inference,
+    tiled_inference_to_file,
+)
+
+OUT_CHANNELS = 3
+
+
+def reference_tiled_inference(model_forward, input_batch, out_channels, inference_parameters):
+    """Per-tile loop used before the vectorized engine, kept to check bit-exact parity."""
+    batch_size = input_batch.shape[0]
+    h_img, w_img = input_batch.shape[-2], input_batch.shape[-1]
+    h_crop, w_crop = inference_parameters.h_crop, inference_parameters.w_crop
+    preds = input_batch.new_zeros((batch_size, out_channels, h_img, w_img))
+
+    items = []
+    for i in range(0, h_img - h_crop + 1, h_crop):
+        items += [(b, (slice(i, i + h_crop), slice(w_img - w_crop, w_img)), None) for b in range(batch_size)]
+    for i in range(0, w_img - w_crop + 1, w_crop):
+        items += [(b, (slice(h_img - h_crop, h_img), slice(i, i + w_crop)), None) for b in range(batch_size)]
+    items += [(b, (slice(h_img - h_crop, h_img), slice(w_img - w_crop, w_img)), None) for b in range(batch_size)]
+
+    if inference_parameters.delta:
+        delta_x = delta_y = inference_parameters.delta
+    else:
+        delta_x = min(16, (w_crop - inference_parameters.w_stride) // 2)
+        delta_y = min(16, (h_crop - inference_parameters.h_stride) // 2)
+
+    for row in range(0, h_img - h_crop + 1, inference_parameters.h_stride):
+        for col in range(0, w_img - w_crop + 1, inference_parameters.w_stride):
+            if row == 0 or col == 0:
+                items += [(b, (slice(row, row + h_crop), slice(col, col + w_crop)), None) for b in range(batch_size)]
+            else:
+                items += [
+                    (
+                        b,
+                        (slice(row, row + h_crop), slice(col, col + w_crop)),
+                        (slice(delta_y, h_crop - delta_y), slice(delta_x, w_crop - delta_x)),
+                    )
+                    for b in range(batch_size)
+                ]
+
+    preds_count = input_batch.new_zeros(batch_size, h_img, w_img)
+    for start in range(0, len(items), 16):
+        batch = items[start : start + 16]
+        output = model_forward(torch.stack([input_batch[b, ..., rs, cs] for b, (rs, cs), _ in batch]))
+        for (b, (rs, cs), crop), predicted in zip(batch, output, strict=True):
+            if crop is not None:
+                predicted = predicted[..., crop[0], crop[1]]
+                rs = slice(rs.start + crop[0].start, rs.start + crop[0].stop)
+                cs = slice(cs.start + crop[1].start, cs.start + crop[1].stop)
+            if inference_parameters.average_patches:
+                preds[b, :, rs, cs] += predicted
+            else:
+                preds[b, :, rs, cs] = predicted
+            preds_count[b, rs, cs] += 1
+
+    if inference_parameters.average_patches:
+        return preds / preds_count.unsqueeze(1)
+    return preds
+
+
+@pytest.fixture(scope="module")
+def model_forward():
+    torch.manual_seed(0)
+    conv = torch.nn.Conv2d(4, OUT_CHANNELS, kernel_size=3, padding=1)
+
+    def forward(x):
+        # collapse a temporal dimension, if present
+        if x.ndim == 5:
+            x = x.mean(dim=2)
+        return conv(x)
+
+    return forward
+
+
+@pytest.mark.parametrize("average_patches", [True, False])
+@pytest.mark.parametrize("delta", [None, 8])
+@pytest.mark.parametrize(
+    "image_size,crop,stride", [((100, 100), (32, 32), (16, 16)), ((77, 130), (32, 48), (16, 30)), ((64, 64), (32, 32), (32, 32))]
+)
+def test_tiled_inference_matches_reference(model_forward, average_patches, delta, image_size, crop, stride):
+    params = TiledInferenceParameters(
+        h_crop=crop[0], h_stride=stride[0], w_crop=crop[1], w_stride=stride[1], delta=delta,
+        average_patches=average_patches
+    )
+    x = torch.randn(3, 4, *image_size)
+    with torch.no_grad():
+        expected = reference_tiled_inference(model_forward, x, OUT_CHANNELS, params)
+    result = tiled_inference(model_forward, x, OUT_CHANNELS, params)
+    assert result.shape == expected.shape
+    assert torch.equal(result, expected)
+
+
+def test_tiled_inference_multitemporal(model_forward):
+    params = TiledInferenceParameters(h_crop=32, h_stride=24, w_crop=32, w_stride=24)
+    x = torch.randn(2, 4, 3, 70, 90)
+    with torch.no_grad():
+        expected = reference_tiled_inference(model_forward, x, OUT_CHANNELS, params)
+    result = tiled_inference(model_forward, x, OUT_CHANNELS, params)
+    assert torch.equal(result, expected)
+
+
+def test_tile_grid_covers_image():
+    params = TiledInferenceParameters(h_crop=32, h_stride=16, w_crop=32, w_stride=16)
+    grid = get_tile_grid(100, 90, params)
+    assert ((grid.rows + 32).max() == 100) and ((grid.cols + 32).max() == 90)
+    assert (grid.top[:4] == 0).all()
+
+
+def test_tiled_inference_crop_larger_than_image(model_forward):
+    params = TiledInferenceParameters(h_crop=64, h_stride=32, w_crop=64, w_stride=32)
+    with pytest.raises(ValueError, match="larger than the image"):
+        tiled_inference(model_forward, torch.randn(1, 4, 32, 32), OUT_CHANNELS, params)
+
+
+def test_tiled_inference_batch_size(model_forward):
+    x = torch.randn(2, 4, 100, 100)
+    expected = tiled_inference(model_forward, x, OUT_CHANNELS, TiledInferenceParameters(32, 16, 32, 16))
+    batch_sizes = []
+
+    def counting_forward(x):
+        batch_sizes.append(x.shape[0])
+        return model_forward(x)
+
+    result = tiled_inference(counting_forward, x, OUT_CHANNELS, TiledInferenceParameters(32, 16, 32, 16, batch_size=5))
+    assert max(batch_sizes) == 5
+    assert torch.allclose(result, expected, atol=1e-6)
+
+
+def test_tiled_inference_auto_batch_size(model_forward):
+    x = torch.randn(2, 4, 100, 100)
+    params = TiledInferenceParameters(h_crop=32, h_stride=16, w_crop=32, w_stride=16, batch_size="auto")
+    expected = tiled_inference(model_forward, x, OUT_CHANNELS, TiledInferenceParameters(32, 16, 32, 16))
+    batch_sizes = []
+
+    def limited_forward(x):
+        if x.shape[0] > 6:
+            raise torch.OutOfMemoryError
+        batch_sizes.append(x.shape[0])
+        return model_forward(x)
+
+    result = tiled_inference(limited_forward, x, OUT_CHANNELS, params)
+    assert torch.allclose(result, expected, atol=1e-6)
+    assert max(batch_sizes) == 4
+
+    # The chosen batch size is reused without probing again
+    batch_sizes.clear()
+    tiled_inference(limited_forward, x, OUT_CHANNELS, params)
+    assert batch_sizes[0] == 4
+
+
+def test_tiled_inference_auto_batch_size_small_then_large_image(model_forward, monkeypatch):
+    monkeypatch.setattr(AutoBatchSize, "_cache", {})
+    params = TiledInferenceParameters(h_crop=32, h_stride=16, w_crop=32, w_stride=16, batch_size="auto")
+    batch_sizes = []
+
+    def limited_forward(x):
+        if x.shape[0] > 6:
+            raise torch.OutOfMemoryError
+        batch_sizes.append(x.shape[0])
+        return model_forward(x)
+
+    # A single tile does not bound the batch size of later, larger images
+    tiled_inference(limited_forward, torch.randn(1, 4, 32, 32), OUT_CHANNELS, params)
+    assert max(batch_sizes) < 4
+    assert list(AutoBatchSize._cache.values()) == [(max(batch_sizes), False)]
+    batch_sizes.clear()
+    x = torch.randn(2, 4, 100, 100)
+    result = tiled_inference(limited_forward, x, OUT_CHANNELS, params)
+    assert max(batch_sizes) == 4
+    expected = tiled_inference(model_forward, x, OUT_CHANNELS, TiledInferenceParameters(32, 16, 32, 16))
+    assert torch.allclose(result, expected, atol=1e-6)
+    assert list(AutoBatchSize._cache.values()) == [(4, True)]
+
+
+def test_auto_batch_size_max_size(monkeypatch):
+    monkeypatch.setattr(AutoBatchSize, "_cache", {})
+    monkeypatch.setattr(AutoBatchSize, "max_size", 4)
+    auto_batch_size = AutoBatchSize(("key",))
+    for size in [1, 2, 4]:
+        assert auto_batch_size.value == size
+        auto_batch_size.succeeded(size)
+    assert auto_batch_size.value == 4
+    assert AutoBatchSize._cache[("key",)] == (4, True)
+
+
+@pytest.mark.parametrize("blend", ["gaussian", "cosine", "linear"])
+def test_tiled_inference_blend(blend):
+    # A model predicting a constant must give back the same constant, whatever the weights
+    params = TiledInferenceParameters(h_crop=32, h_stride=24, w_crop=32, w_stride=24, blend=blend)
+    x = torch.randn(2, 4, 70, 90)
+    result = tiled_inference(lambda t: torch.ones(t.shape[0], OUT_CHANNELS, *t.shape[-2:]), x, OUT_CHANNELS, params)
+    assert torch.allclose(result, torch.ones_like(result))
+
+
+def test_blend_window_is_cached():
+    params = TiledInferenceParameters(h_crop=32, h_stride=24, w_crop=48, w_stride=24, blend="gaussian")
+    window = blend_window(params.blend, params.h_crop, params.w_crop, torch.device("cpu"), torch.float32)
+    assert window.shape == (32, 48)
+    assert window.min() > 0 and window.max() == 1
+    assert blend_window(params.blend, params.h_crop, params.w_crop, torch.device("cpu"), torch.float32) is window
+
+
+@pytest.fixture
+def input_tif(tmp_path):
+    rasterio = pytest.importorskip("rasterio")
+    data = torch.randn(4, 100, 130).numpy()
+    path = tmp_path / "input.tif"
+    profile = {"driver": "GTiff", "width": 130, "height": 100, "count": 4, "dtype": "float32", "nodata": -9999}
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(data)
+    return path, torch.from_numpy(data)
+
+
+@pytest.mark.parametrize("average_patches,blend", [(True, None), (False, None), (True, "gaussian")])
+@pytest.mark.parametrize("cog", [False, True])
+def test_tiled_inference_to_file(model_forward, input_tif, tmp_path, average_patches, blend, cog):
+    import rasterio
+
+    path, data = input_tif
+    params = TiledInferenceParameters(
+        h_crop=32, h_stride=16, w_crop=32, w_stride=16, average_patches=average_patches, blend=blend
+    )
+    expected = tiled_inference(model_forward, data[None], OUT_CHANNELS, params)[0]
+    output_path = tiled_inference_to_file(
+        model_forward, path, tmp_path / "output.tif", OUT_CHANNELS, params, block_size=16, cog=cog
+    )
+    with rasterio.open(output_path) as src:
+        result = torch.from_numpy(src.read())
+        assert src.profile["tiled"]
+    assert torch.allclose(result, expected, atol=1e-5)
+
+
+def test_tiled_inference_to_file_postprocess(model_forward, input_tif, tmp_path):
+    import rasterio
+
+    path, data = input_tif
+    params = TiledInferenceParameters(h_crop=32, h_stride=16, w_crop=32, w_stride=16)
+    expected = tiled_inference(model_forward, data[None], OUT_CHANNELS, params).argmax(dim=1)
+    output_path = tiled_inference_to_file(
+        model_forward, path, tmp_path / "output.tif", OUT_CHANNELS, params,
+        postprocess=lambda x: x.argmax(dim=1, keepdim=True), dtype="int16",
+    )
+    with rasterio.open(output_path) as src:
+        assert src.count == 1
+        result = torch.from_numpy(src.read().astype("int64"))
+    assert (result == expected).float().mean() > 0.999
+
+
+def test_tiled_inference_to_file_warns_without_input_nodata(model_forward, tmp_path, caplog):
+    rasterio = pytest.importorskip("rasterio")
+    path = tmp_path / "input.tif"
+    profile = {"driver": "GTiff", "width": 40, "height": 40, "count": 4, "dtype": "float32"}
+    with rasterio.open(path, "w", **profile) as dst:
+        dst.write(torch.randn(4, 40, 40).numpy())
+    params = TiledInferenceParameters(h_crop=32, h_stride=16, w_crop=32, w_stride=16)
+    with caplog.at_level(logging.WARNING, logger="terratorch"):
+        tiled_inference_to_file(model_forward, path, tmp_path / "output.tif", OUT_CHANNELS, params, nodata=-1)
+    assert "has no nodata value" in caplog.text
+
+
+class _PixelwiseModel(torch.nn.Module):
+    def __init__(self, in_channels, num_classes):
+        super().__init__()
+        self.conv = torch.nn.Conv2d(in_channels, num_classes, 1)
+
+    def forward(self, x, **kwargs):
+        from terratorch.models.model import ModelOutput
+
+        return ModelOutput(self.conv(x))
+
+
+def test_predict_to_files(input_tif, tmp_path):
+    import rasterio
+
+    from terratorch.cli_tools import predict_to_files
+    from terratorch.datamodules import GenericNonGeoSegmentationDataModule
+    from terratorch.tasks import SemanticSegmentationTask
+
+    path, data = input_tif
+    root = path.parent
+    datamodule = GenericNonGeoSegmentationDataModule(
+        batch_size=1, num_workers=0, num_classes=3, train_data_root=root, val_data_root=root, test_data_root=root,
+        predict_data_root=root, img_grep="input.tif", label_grep="input.tif", means=[0.0] * 4, stds=[2.0] * 4,
+        constant_scale=0.5,
+    )
+    params = TiledInferenceParameters(h_crop=32, h_stride=16, w_crop=32, w_stride=16)
+    task = SemanticSegmentationTask({"num_classes": 3}, model=_PixelwiseModel(4, 3))
+    with pytest.raises(ValueError, match="tiled_inference_parameters"):
+        predict_to_files(task, datamodule, tmp_path / "out")
+
+    task.tiled_inference_parameters = params
+    output_files = predict_to_files(task, datamodule, tmp_path / "out")
+    assert output_files == [str(tmp_path / "out" / "input_pred.tif")]
+    with torch.no_grad():
+        expected = tiled_inference(lambda x: task(x).output, data[None] * 0.5 / 2, 3, params).argmax(dim=1)
+    with rasterio.open(output_files[0]) as src:
+        assert src.count == 1
+        assert src.nodata == -1
+        result = torch.from_numpy(src.read().astype("int64"))
+    assert (result == expected).float().mean() > 0.999
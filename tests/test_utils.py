@@ -0,0 +1,71 @@
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from terratorch.utils import (
+    ClassCounts,
+    QuantileSketch,
+    RunningMoments,
+    compute_int_mask_statistics,
+    compute_statistics,
+)
+
+
+class DictDataset(TensorDataset):
+    def __getitem__(self, index):
+        image, mask = super().__getitem__(index)
+        return {"image": image, "mask": mask}
+
+
+@pytest.fixture
+def dataloader():
+    torch.manual_seed(0)
+    images = torch.randn(10, 3, 8, 8) * torch.tensor([1.0, 10.0, 100.0])[:, None, None] + 5
+    masks = torch.randint(-1, 4, (10, 8, 8))
+    return DataLoader(DictDataset(images, masks), batch_size=3)
+
+
+def test_compute_statistics(dataloader):
+    images = dataloader.dataset.tensors[0].transpose(0, 1).reshape(3, -1).double()
+    stats = compute_statistics(dataloader)
+    assert torch.allclose(torch.tensor(stats["means"], dtype=torch.float64), images.mean(dim=1))
+    assert torch.allclose(torch.tensor(stats["stds"], dtype=torch.float64), images.std(dim=1, unbiased=False))
+
+
+def test_compute_statistics_nodata_and_percentiles(dataloader):
+    dataloader.dataset.tensors[0][0, :, :4] = -9999
+    images = dataloader.dataset.tensors[0].transpose(0, 1).reshape(3, -1).double()
+    stats = compute_statistics(dataloader, nodata=-9999, percentiles=[2, 50, 98])
+    valid = images[images != -9999].view(3, -1)
+    assert torch.allclose(torch.tensor(stats["means"], dtype=torch.float64), valid.mean(dim=1))
+    expected = torch.quantile(valid, torch.tensor([0.02, 0.5, 0.98], dtype=torch.float64), dim=1, interpolation="lower")
+    for i, p in enumerate([2, 50, 98]):
+        assert torch.allclose(torch.tensor(stats["percentiles"][p], dtype=torch.float64), expected[i], rtol=0.011)
+
+
+def test_compute_int_mask_statistics(dataloader):
+    masks = dataloader.dataset.tensors[1]
+    stats = compute_int_mask_statistics(dataloader)
+    for value, count in zip(*torch.unique(masks, return_counts=True), strict=True):
+        assert stats[int(value)]["count"] == count
+        assert stats[int(value)]["percentage"] == pytest.approx(count / masks.numel())
+
+
+def test_partial_statistics_merge():
+    data = torch.randn(2, 1000, dtype=torch.float64) * 3 + 1
+    full, left, right = RunningMoments(2), RunningMoments(2), RunningMoments(2)
+    full.update(data)
+    left.update(data[:, :300])
+    right.update(data[:, 300:])
+    merged = left.merge(right)
+    assert torch.allclose(merged.mean, full.mean) and torch.allclose(merged.m2, full.m2)
+
+    sketch, other = QuantileSketch(2), QuantileSketch(2)
+    sketch.update(data[:, :300])
+    other.update(data[:, 300:])
+    assert sketch.merge(other).counts.sum() == data.numel()
+
+    counts, other_counts = ClassCounts(), ClassCounts()
+    counts.update(torch.tensor([0, 1, 1]))
+    other_counts.update(torch.tensor([1, 2]))
+    assert counts.merge(other_counts).counts == {0: 1, 1: 3, 2: 1}
@@ -0,0 +1,145 @@
+import hashlib
+import os
+
+import pytest
+
+from terratorch.models import weights_cache
+from terratorch.models.weights_cache import (
+    PRETRAINED_WEIGHTS,
+    cached_hf_hub_download,
+    cached_hf_url_download,
+    prefetch,
+    weights_main,
+)
+
+
+@pytest.fixture
+def hub(tmp_path, monkeypatch):
+    """Fake Hugging Face Hub storing the downloaded files like the Hugging Face cache (blobs named by sha256)."""
+    monkeypatch.setenv("TERRATORCH_WEIGHTS_CACHE", str(tmp_path / "cache"))
+    monkeypatch.delenv("TERRATORCH_OFFLINE", raising=False)
+    hf_cache = tmp_path / "hf_cache"
+    hf_cache.mkdir()
+    calls = []
+
+    def hf_hub_download(repo_id, filename, revision=None, force_download=False, local_files_only=False):
+        calls.append({"repo_id": repo_id, "filename": filename, "revision": revision,
+                      "local_files_only": local_files_only})
+        content = f"{repo_id}/{filename}".encode()
+        blob = hf_cache / hashlib.sha256(content).hexdigest()
+        if local_files_only and not blob.exists():
+            msg = "Not in the local cache"
+            raise OSError(msg)
+        blob.write_bytes(content)
+        snapshot = hf_cache / "snapshots" / repo_id / filename
+        snapshot.parent.mkdir(parents=True, exist_ok=True)
+        snapshot.unlink(missing_ok=True)
+        snapshot.symlink_to(blob)
+        return str(snapshot)
+
+    monkeypatch.setattr(weights_cache, "hf_hub_download", hf_hub_download)
+    return calls
+
+
+def test_cached_hf_hub_download(hub, tmp_path):
+    path = cached_hf_hub_download("org/model", "weights.pt")
+    assert path.endswith(os.path.join("org", "model", "main", "weights.pt"))
+    with open(path, "rb") as f:
+        assert f.read() == b"org/model/weights.pt"
+    # The file is stored once under its checksum
+    assert os.path.basename(os.path.realpath(path)) == hashlib.sha256(b"org/model/weights.pt").hexdigest()
+
+    assert cached_hf_hub_download("org/model", "weights.pt") == path
+    assert len(hub) == 1
+    cached_hf_hub_download("org/model", "weights.pt", force_download=True)
+    assert len(hub) == 2
+
+
+def test_offline_mode(hub, monkeypatch):
+    path = cached_hf_hub_download("org/model", "weights.pt")
+    monkeypatch.setenv("TERRATORCH_OFFLINE", "1")
+    assert cached_hf_hub_download("org/model", "weights.pt") == path
+    assert len(hub) == 1
+
+    with pytest.raises(FileNotFoundError, match="terratorch weights prefetch"):
+        cached_hf_hub_download("org/other", "weights.pt")
+    assert hub[-1]["local_files_only"]
+
+
+def test_checksum_is_verified(hub, monkeypatch, tmp_path):
+    corrupted = tmp_path / ("0" * 64)
+    corrupted.write_bytes(b"corrupted")
+    monkeypatch.setattr(weights_cache, "hf_hub_download", lambda **kwargs: str(corrupted))
+    with pytest.raises(OSError, match="Checksum mismatch"):
+        cached_hf_hub_download("org/model", "weights.pt")
+
+
+def test_cached_hf_url_download(hub):
+    path = cached_hf_url_download("https://hf.co/org/model/resolve/abc123/sub/weights.pth")
+    assert hub[-1] == {"repo_id": "org/model", "filename": "sub/weights.pth", "revision": "abc123",
+                       "local_files_only": False}
+    assert path.endswith(os.path.join("abc123", "sub", "weights.pth"))
+    with pytest.raises(ValueError, match="not a Hugging Face URL"):
+        cached_hf_url_download("https://example.com/weights.pth")
+
+
+def test_prefetch(hub, capsys):
+    paths = prefetch(["prithvi_eo_v2_300", "terramind_v1_base"])
+    assert [call["repo_id"] for call in hub] == ["ibm-nasa-geospatial/Prithvi-EO-2.0-300M",
+                                                  "ibm-esa-geospatial/TerraMind-1.0-base"]
+    assert paths["terramind_v1_base"].endswith("TerraMind_v1_base.pt")
+    assert "terramind_v1_tokenizer_s2l2a" in PRETRAINED_WEIGHTS
+    from terratorch.models.backbones import multimae_register
+
+    assert multimae_register.pretrained_weights.keys() <= PRETRAINED_WEIGHTS.keys()
+
+    with pytest.raises(ValueError, match="Unknown pre-trained weights"):
+        prefetch(["unknown_model"])
+
+    weights_main(["prefetch", "prithvi_eo_v2_300"])
+    assert capsys.readouterr().out.startswith("prithvi_eo_v2_300: ")
+    assert len(hub) == 2
+
+
+def test_offline_pretrained_prithvi(hub, monkeypatch, tmp_path):
+    import torch
+
+    from terratorch.models.backbones import prithvi_vit
+
+    weights = {"hf_hub_id": "org/prithvi-tiny", "hf_hub_filename": "prithvi_tiny.pt"}
+    monkeypatch.setitem(prithvi_vit.pretrained_weights, "prithvi_eo_tiny", weights)
+    monkeypatch.setitem(PRETRAINED_WEIGHTS, "prithvi_eo_tiny", weights)
+    state_dict = prithvi_vit.prithvi_eo_tiny(pretrained=False).state_dict()
+    torch.save(state_dict, tmp_path / "prithvi_tiny.pt")
+
+    def hf_hub_download(repo_id, filename, revision=None, force_download=False, local_files_only=False):
+        if local_files_only:
+            msg = "Not in the local cache"
+            raise OSError(msg)
+        return str(tmp_path / filename)
+
+    monkeypatch.setattr(weights_cache, "hf_hub_download", hf_hub_download)
+
+    prefetch(["prithvi_eo_tiny"])
+    monkeypatch.setenv("TERRATORCH_OFFLINE", "1")
+    model = prithvi_vit.prithvi_eo_tiny(pretrained=True)
+    assert torch.equal(model.state_dict()["patch_embed.proj.weight"], state_dict["patch_embed.proj.weight"])
+
+
+def test_load_weights_state_dict(hub, monkeypatch, tmp_path):
+    import torch
+    from torchgeo.models import ResNet18_Weights
+
+    from terratorch.models.weights_cache import load_weights_state_dict
+
+    weights = ResNet18_Weights.SENTINEL2_ALL_MOCO
+    state_dict = {"conv1.weight": torch.randn(2, 2)}
+    torch.save(state_dict, tmp_path / "weights.pth")
+    monkeypatch.setattr(weights_cache, "hf_hub_download", lambda **kwargs: str(tmp_path / "weights.pth"))
+    monkeypatch.setattr(type(weights), "get_state_dict", lambda *args, **kwargs: pytest.fail("torch.hub is used"))
+
+    assert torch.equal(load_weights_state_dict(weights)["conv1.weight"], state_dict["conv1.weight"])
+    # The cached file is used offline
+    monkeypatch.setenv("TERRATORCH_OFFLINE", "1")
+    monkeypatch.setattr(weights_cache, "hf_hub_download", lambda **kwargs: pytest.fail("The hub is used"))
+    assert torch.equal(load_weights_state_dict(weights)["conv1.weight"], state_dict["conv1.weight"])